@@ -0,0 +1,162 @@
+"""
+Celery tasks of Studio, which run the course operations too long for a web request.
+
+Course import runs in stages. Its progress is kept in the default cache, where
+`import_status_handler` reads it:
+
+    -X : Import unsuccessful due to some error with X as stage [1-3]
+    0 : No status info found (import done or upload still in progress)
+    1 : Unpacking
+    2 : Verifying
+    3 : Updating
+    4 : Import successful
+"""
+import logging
+import os
+import shutil
+import tarfile
+from path import path
+
+from celery import task
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
+from django.utils.translation import ugettext as _
+
+from extract_tar import safetar_extractall
+from opaque_keys.edx.keys import CourseKey
+from xmodule.contentstore.django import contentstore
+from xmodule.modulestore.django import modulestore
+from xmodule.modulestore.xml_importer import import_from_xml
+
+log = logging.getLogger(__name__)
+
+IMPORT_UNPACKING = 1
+IMPORT_VERIFYING = 2
+IMPORT_UPDATING = 3
+IMPORT_SUCCEEDED = 4
+
+# How long the status of an import is kept, in seconds
+IMPORT_STATUS_TIMEOUT = 24 * 60 * 60
+
+
+class CourseImportError(Exception):
+    """
+    Raised when the uploaded course can't be imported, with the message to show its author.
+    """
+    pass
+
+
+def _import_status_key(user_id, course_key, filename):
+    """
+    Return the cache key of the status of the import of `filename` into the course by the user.
+    """
+    return u'import_status:{}:{}:{}'.format(user_id, course_key, filename)
+
+
+def set_import_status(user_id, course_key, filename, stage, message=None, error=None):
+    """
+    Record the stage the import of `filename` reached, with an optional message describing what it
+    does, or the error which stopped it at that stage.
+    """
+    status = {'ImportStatus': -stage if error is not None else stage}
+    if message is not None:
+        status['Message'] = message
+    if error is not None:
+        status['ErrMsg'] = error
+    cache.set(_import_status_key(user_id, course_key, filename), status, IMPORT_STATUS_TIMEOUT)
+
+
+def get_import_status(user_id, course_key, filename):
+    """
+    Return the status of the import of `filename` into the course by the user, as recorded by
+    `set_import_status`.
+    """
+    return cache.get(_import_status_key(user_id, course_key, filename), {'ImportStatus': 0})
+
+
+def _find_course_xml(course_dir):
+    """
+    Return the directory of the first 'course.xml' file found under `course_dir`, or None.
+    """
+    for dirpath, _dirnames, filenames in os.walk(course_dir):
+        if 'course.xml' in filenames:
+            return path(dirpath)
+    return None
+
+
+@task()
+def import_olx(user_id, course_key_string, archive_path, filename):
+    """
+    Import the course uploaded by the user as the .tar.gz at `archive_path` into the course,
+    recording the stage it reached as the status of the import of `filename`.
+    """
+    course_key = CourseKey.from_string(course_key_string)
+    archive_path = path(archive_path)
+    course_dir = archive_path.dirname()
+    # the stage this import reached, which the callback of import_from_xml updates
+    progress = {'stage': IMPORT_UNPACKING}
+
+    def set_status(stage, message=None, error=None):
+        """
+        Record the status of this import.
+        """
+        progress['stage'] = stage
+        set_import_status(user_id, course_key, filename, stage, message, error)
+
+    def updating(import_stage):
+        """
+        Record the stage import_from_xml reached.
+        """
+        messages = {
+            'static': _('Importing static assets'),
+            'modules': _('Importing modules'),
+            'drafts': _('Importing draft modules'),
+        }
+        set_status(IMPORT_UPDATING, messages.get(import_stage))
+
+    try:
+        set_status(IMPORT_UNPACKING)
+        with tarfile.open(archive_path) as tar_file:
+            try:
+                safetar_extractall(tar_file, (course_dir + '/').encode('utf-8'))
+            except SuspiciousOperation as exc:
+                raise CourseImportError(
+                    u'Unsafe tar file. Aborting import. SuspiciousFileOperation: {}'.format(exc.args[0])
+                )
+        archive_path.remove()
+
+        set_status(IMPORT_VERIFYING)
+        dirpath = _find_course_xml(course_dir)
+        if not dirpath:
+            raise CourseImportError(_('Could not find the course.xml file in the package.'))
+
+        log.debug('found course.xml at %s', dirpath)
+        if dirpath != course_dir:
+            for fname in os.listdir(dirpath):
+                shutil.move(dirpath / fname, course_dir)
+
+        # parsing the course is part of verifying it, import_from_xml then reports when it updates
+        # the course
+        __, course_items = import_from_xml(
+            modulestore(),
+            user_id,
+            settings.GITHUB_REPO_ROOT,
+            [course_dir.name],
+            load_error_modules=False,
+            static_content_store=contentstore(),
+            target_course_id=course_key,
+            progress_callback=updating,
+        )
+        log.debug('new course at %s', course_items[0].location)
+        set_status(IMPORT_SUCCEEDED)
+
+    except CourseImportError as exc:
+        set_status(progress['stage'], error=unicode(exc))
+    # Send errors to the author with the stage at which they occurred.
+    except Exception as exc:  # pylint: disable=broad-except
+        log.exception("error importing course")
+        set_status(progress['stage'], error=unicode(exc))
+
+    finally:
+        shutil.rmtree(course_dir, ignore_errors=True)
@@ -11,6 +11,7 @@ import tempfile
 from path import path
 from pymongo import MongoClient
 from uuid import uuid4
+from mock import patch
 
 from django.test.utils import override_settings
 from django.conf import settings
@@ -20,6 +21,7 @@ from xmodule.contentstore.django import _CONTENTSTORE
 from xmodule.modulestore.django import loc_mapper
 from xmodule.modulestore.tests.factories import ItemFactory
 
+from contentstore.tasks import set_import_status
 from contentstore.tests.utils import CourseTestCase
 from student import auth
 from student.roles import CourseInstructorRole, CourseStaffRole
@@ -73,6 +75,19 @@ class ImportTestCase(CourseTestCase):
         MongoClient().drop_database(TEST_DATA_CONTENTSTORE['DOC_STORE_CONFIG']['db'])
         _CONTENTSTORE.clear()
 
+    def get_import_status(self, tarpath):
+        """
+        Return the import status of the tar.gz file at `tarpath`.
+        """
+        resp_status = self.client.get(
+            reverse_course_url(
+                'import_status_handler',
+                self.course.id,
+                kwargs={'filename': os.path.split(tarpath)[1]}
+            )
+        )
+        return json.loads(resp_status.content)
+
     def test_no_coursexml(self):
         """
         Check that the response for a tar.gz import without a course.xml is
@@ -85,18 +100,12 @@ class ImportTestCase(CourseTestCase):
                     "name": self.bad_tar,
                     "course-data": [btar]
                 })
-        self.assertEquals(resp.status_code, 415)
+        self.assertEquals(resp.status_code, 200)
         # Check that `import_status` returns the appropriate stage (i.e., the
         # stage at which import failed).
-        resp_status = self.client.get(
-            reverse_course_url(
-                'import_status_handler',
-                self.course.id,
-                kwargs={'filename': os.path.split(self.bad_tar)[1]}
-            )
-        )
-
-        self.assertEquals(json.loads(resp_status.content)["ImportStatus"], 2)
+        status = self.get_import_status(self.bad_tar)
+        self.assertEquals(status["ImportStatus"], -2)
+        self.assertIn("course.xml", status["ErrMsg"])
 
     def test_with_coursexml(self):
         """
@@ -108,6 +117,27 @@ class ImportTestCase(CourseTestCase):
             resp = self.client.post(self.url, args)
 
         self.assertEquals(resp.status_code, 200)
+        self.assertEquals(self.get_import_status(self.good_tar)["ImportStatus"], 4)
+
+    def test_import_stages(self):
+        """
+        Check that the import reports every stage it goes through.
+        """
+        with patch('contentstore.tasks.set_import_status', wraps=set_import_status) as mock_set_status:
+            with open(self.good_tar) as gtar:
+                args = {"name": self.good_tar, "course-data": [gtar]}
+                self.client.post(self.url, args)
+
+        # each call records the stage and message of the import
+        stages = [call_args[0][3:5] for call_args in mock_set_status.call_args_list]
+        self.assertEquals(stages, [
+            (1, None),
+            (2, None),
+            (3, 'Importing static assets'),
+            (3, 'Importing modules'),
+            (3, 'Importing draft modules'),
+            (4, None),
+        ])
 
     def test_import_in_existing_course(self):
         """
@@ -223,8 +253,10 @@ class ImportTestCase(CourseTestCase):
             with open(tarpath) as tar:
                 args = {"name": tarpath, "course-data": [tar]}
                 resp = self.client.post(self.url, args)
-            self.assertEquals(resp.status_code, 400)
-            self.assertTrue("SuspiciousFileOperation" in resp.content)
+            self.assertEquals(resp.status_code, 200)
+            status = self.get_import_status(tarpath)
+            self.assertEquals(status["ImportStatus"], -1)
+            self.assertIn("SuspiciousFileOperation", status["ErrMsg"])
 
         try_tar(self._fifo_tar())
         try_tar(self._symlink_tar())
@@ -233,14 +265,7 @@ class ImportTestCase(CourseTestCase):
         # Check that `import_status` returns the appropriate stage (i.e.,
         # either 3, indicating all previous steps are completed, or 0,
         # indicating no upload in progress)
-        resp_status = self.client.get(
-            reverse_course_url(
-                'import_status_handler',
-                self.course.id,
-                kwargs={'filename': os.path.split(self.good_tar)[1]}
-            )
-        )
-        import_status = json.loads(resp_status.content)["ImportStatus"]
+        import_status = self.get_import_status(self.good_tar)["ImportStatus"]
         self.assertIn(import_status, (0, 3))
 
 
@@ -129,6 +129,14 @@ if 'loc_cache' not in CACHES:
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'edx_location_mem_cache',
     }
+# Cache of the published blocks of courses. It must be shared by the LMS and Studio, like the cache
+# holding the structure versions of the courses, whose backend it uses unless configured on its own.
+if 'course_structure_cache' not in CACHES:
+    CACHES['course_structure_cache'] = dict(
+        CACHES.get('mongo_metadata_inheritance', CACHES['default']),
+        KEY_PREFIX=ENV_TOKENS.get('COURSE_STRUCTURE_CACHE_KEY_PREFIX', COURSE_STRUCTURE_CACHE_KEY_PREFIX),
+        TIMEOUT=ENV_TOKENS.get('COURSE_STRUCTURE_CACHE_TIMEOUT', COURSE_STRUCTURE_CACHE_TIMEOUT),
+    )
 
 SESSION_COOKIE_DOMAIN = ENV_TOKENS.get('SESSION_COOKIE_DOMAIN')
 SESSION_ENGINE = ENV_TOKENS.get('SESSION_ENGINE', SESSION_ENGINE)
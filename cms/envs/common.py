@@ -249,6 +249,13 @@ XBLOCK_SELECT_FUNCTION = prefer_xmodules
 ############################ Modulestore Configuration ################################
 MODULESTORE_BRANCH = 'draft-preferred'
 
+# The cache of the published blocks of courses, one entry per block, which Studio fills when
+# publishing, for the LMS to serve its modulestore reads from. Deployments which don't configure a
+# 'course_structure_cache' in CACHES get one on the backend of the 'mongo_metadata_inheritance'
+# cache, with these settings (see aws.py).
+COURSE_STRUCTURE_CACHE_KEY_PREFIX = 'course_structure'
+COURSE_STRUCTURE_CACHE_TIMEOUT = 24 * 60 * 60
+
 ############################ DJANGO_BUILTINS ################################
 # Change DEBUG/TEMPLATE_DEBUG in your environment settings files, not here
 DEBUG = False
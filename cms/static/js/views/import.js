@@ -23,8 +23,9 @@ define(
         /**
          * Manipulate the DOM to reflect current status of upload.
          * @param {int} stageNo Current stage.
+         * @param {string} message What the current stage is doing, if known.
          */
-        var updateStage = function (stageNo){
+        var updateStage = function (stageNo, message){
             var all = $('ol.status-progress').children();
             var prevList = all.slice(0, stageNo);
             _.map(prevList, function (elem){
@@ -34,8 +35,12 @@ define(
                     addClass("is-complete");
                 updateCog($(elem), false);
             });
+            all.find('p.detail').remove();
             var curList = all.eq(stageNo);
             curList.removeClass("is-not-started").addClass("is-started");
+            if (message) {
+                curList.find('div.status-detail').append($("<p class='copy detail'></p>").text(message));
+            }
             updateCog(curList, true);
         };
 
@@ -45,18 +50,30 @@ define(
          * @param {string} url Url to call for status updates.
          * @param {int} timeout Number of milliseconds to wait in between ajax calls
          *     for new updates.
-         * @param {int} stage Starting stage.
+         * @param {int} stage Starting stage. A negative stage is the stage at
+         *     which the import failed.
+         * @param {string} message What the current stage is doing, if known.
+         * @param {string} errMsg Why the import failed.
          */
-        var getStatus = function (url, timeout, stage) {
+        var getStatus = function (url, timeout, stage, message, errMsg) {
             var currentStage = stage || 0;
             if (CourseImport.stopGetStatus) { return ;}
-            updateStage(currentStage);
-            if (currentStage == 3 ) { return ;}
+            if (currentStage == 4) {
+                CourseImport.displayFinishedImport();
+                return;
+            }
+            if (currentStage < 0) {
+                CourseImport.stopGetStatus = true;
+                CourseImport.stageError(-currentStage, errMsg);
+                CourseImport.onImportError();
+                return;
+            }
+            updateStage(currentStage, message);
             var time = timeout || 1000;
             $.getJSON(url,
                 function (data) {
                     setTimeout(function () {
-                        getStatus(url, time, data.ImportStatus);
+                        getStatus(url, time, data.ImportStatus, data.Message, data.ErrMsg);
                     }, time);
                 }
             );
@@ -74,6 +91,12 @@ define(
              */
             stopGetStatus: false,
 
+            /**
+             * Called once the import failed on the server, after the failed stage
+             * was displayed.
+             */
+            onImportError: function () {},
+
             /**
              * Update DOM to set all stages as not-started (for retrying an upload that
              * failed).
@@ -86,6 +109,7 @@ define(
                         removeClass("has-error").
                         addClass("is-not-started");
                     $(elem).find('p.error').remove(); // remove error messages
+                    $(elem).find('p.detail').remove();
                     $(elem).find('p.copy').show();
                     updateCog($(elem), false);
                 });
@@ -104,6 +128,7 @@ define(
                         removeClass("is-not-started").
                         removeClass("is-started").
                         addClass("is-complete");
+                    $(elem).find('p.detail').remove();
                     updateCog($(elem), false);
                 });
             },
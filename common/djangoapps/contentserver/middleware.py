@@ -1,9 +1,14 @@
+import calendar
+import re
+from functools import partial
+
 from django.http import (HttpResponse, HttpResponseNotModified,
     HttpResponseForbidden)
+from django.utils.http import http_date, parse_http_date_safe
 from student.models import CourseEnrollment
 
 from xmodule.contentstore.django import contentstore
-from xmodule.contentstore.content import StaticContent, XASSET_LOCATION_TAG
+from xmodule.contentstore.content import StaticContent, StaticContentStream, XASSET_LOCATION_TAG
 from xmodule.modulestore import InvalidLocationError
 from opaque_keys import InvalidKeyError
 from cache_toolbox.core import get_cached_content, set_cached_content
@@ -12,6 +17,51 @@ from xmodule.exceptions import NotFoundError
 # TODO: Soon as we have a reasonable way to serialize/deserialize AssetKeys, we need
 # to change this file so instead of using course_id_partial, we're just using asset keys
 
+# a single byte range, e.g. 'bytes=0-499', 'bytes=500-' or 'bytes=-500'
+BYTE_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(header, length):
+    """
+    Parses the value of a Range header against content of the given length.
+
+    Returns a (first_byte, last_byte) tuple of the inclusive range to serve, None
+    if the header should be ignored (it's malformed or asks for several ranges, in
+    which case the whole content is served), or raises ValueError if the range
+    can't be satisfied.
+    """
+    match = BYTE_RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if length == 0:
+        # no range of empty content is satisfiable
+        raise ValueError(header)
+    if first == '':
+        # a suffix range: the last N bytes of the content
+        suffix_length = int(last)
+        if suffix_length == 0:
+            raise ValueError(header)
+        return max(length - suffix_length, 0), length - 1
+    first_byte = int(first)
+    last_byte = int(last) if last != '' else length - 1
+    if last_byte < first_byte:
+        return None
+    if first_byte >= length:
+        raise ValueError(header)
+    return first_byte, min(last_byte, length - 1)
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Returns whether the value of an If-None-Match header matches the etag.
+    """
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
 class StaticContentServer(object):
     def process_request(self, request):
         # look to see if the request is prefixed with 'c4x' tag
@@ -55,18 +105,87 @@ class StaticContentServer(object):
                 ):
                     return HttpResponseForbidden('Unauthorized')
 
-            # convert over the DB persistent last modified timestamp to a HTTP compatible
-            # timestamp, so we can simply compare the strings
-            last_modified_at_str = content.last_modified_at.strftime("%a, %d-%b-%Y %H:%M:%S GMT")
+            # convert over the DB persistent last modified timestamp to a HTTP compatible timestamp
+            last_modified_at = calendar.timegm(content.last_modified_at.utctimetuple())
+            # GridFS computes the md5 of every asset on upload, which makes a strong validator
+            content_digest = getattr(content, 'content_digest', None)
+            etag = '"{}"'.format(content_digest) if content_digest else None
+
+            # see if the client has cached this content, if so then check that it's still
+            # current and return a 304 (Not Modified). If-None-Match takes precedence.
+            if etag is not None and 'HTTP_IF_NONE_MATCH' in request.META:
+                if etag_matches(request.META['HTTP_IF_NONE_MATCH'], etag):
+                    return self._add_validators(HttpResponseNotModified(), last_modified_at, etag)
+            elif 'HTTP_IF_MODIFIED_SINCE' in request.META:
+                if_modified_since = parse_http_date_safe(request.META['HTTP_IF_MODIFIED_SINCE'])
+                if if_modified_since is not None and last_modified_at <= if_modified_since:
+                    return self._add_validators(HttpResponseNotModified(), last_modified_at, etag)
+
+            # large assets aren't cached in memcache, serve them from a local copy if there's one
+            disk_cache = contentstore().disk_cache
+            if disk_cache is not None and isinstance(content, StaticContentStream):
+                # on a miss, this request streams the asset from the database while
+                # the cache copies it from a stream of its own
+                cached_path = disk_cache.get(
+                    content, reload_content=partial(contentstore().find, content.location, as_stream=True)
+                )
+                if cached_path is not None and disk_cache.sendfile_header:
+                    # the web server takes care of the byte ranges
+                    response = HttpResponse(content_type=content.content_type)
+                    response[disk_cache.sendfile_header] = disk_cache.sendfile_url(cached_path)
+                    return self._add_validators(response, last_modified_at, etag)
+                if cached_path is not None:
+                    try:
+                        content = content.with_stream(open(cached_path, 'rb'))
+                    except IOError:
+                        # evicted in the meantime, keep streaming it from the database
+                        pass
+
+            byte_range = None
+            if content.length is not None and 'HTTP_RANGE' in request.META and \
+                    self._if_range_matches(request, last_modified_at, etag):
+                try:
+                    byte_range = parse_byte_range(request.META['HTTP_RANGE'], content.length)
+                except ValueError:
+                    response = HttpResponse(status=416)
+                    response['Content-Range'] = 'bytes */{}'.format(content.length)
+                    return response
+
+            if byte_range is not None:
+                first_byte, last_byte = byte_range
+                response = HttpResponse(
+                    content.stream_data_in_range(first_byte, last_byte), content_type=content.content_type, status=206
+                )
+                response['Content-Range'] = 'bytes {}-{}/{}'.format(first_byte, last_byte, content.length)
+                response['Content-Length'] = str(last_byte - first_byte + 1)
+            else:
+                response = HttpResponse(content.stream_data(), content_type=content.content_type)
+                if content.length is not None:
+                    response['Content-Length'] = str(content.length)
+            if content.length is not None:
+                response['Accept-Ranges'] = 'bytes'
 
-            # see if the client has cached this content, if so then compare the
-            # timestamps, if they are the same then just return a 304 (Not Modified)
-            if 'HTTP_IF_MODIFIED_SINCE' in request.META:
-                if_modified_since = request.META['HTTP_IF_MODIFIED_SINCE']
-                if if_modified_since == last_modified_at_str:
-                    return HttpResponseNotModified()
+            return self._add_validators(response, last_modified_at, etag)
 
-            response = HttpResponse(content.stream_data(), content_type=content.content_type)
-            response['Last-Modified'] = last_modified_at_str
+    @staticmethod
+    def _add_validators(response, last_modified_at, etag):
+        """
+        Sets the Last-Modified and ETag headers of the response.
+        """
+        response['Last-Modified'] = http_date(last_modified_at)
+        if etag is not None:
+            response['ETag'] = etag
+        return response
 
-            return response
+    @staticmethod
+    def _if_range_matches(request, last_modified_at, etag):
+        """
+        Returns whether the Range header of the request should be honored: a client
+        sending If-Range only wants a part of the content if it's unchanged.
+        """
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag
+        return parse_http_date_safe(if_range) == last_modified_at
@@ -1,8 +1,10 @@
 """
 Tests for StaticContentServer
 """
+import calendar
 import copy
 import logging
+from unittest import TestCase
 from uuid import uuid4
 from path import path
 from pymongo import MongoClient
@@ -11,6 +13,7 @@ from django.contrib.auth.models import User
 from django.conf import settings
 from django.test.client import Client
 from django.test.utils import override_settings
+from django.utils.http import http_date
 
 from student.models import CourseEnrollment
 
@@ -20,6 +23,8 @@ from opaque_keys.edx.locations import SlashSeparatedCourseKey
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
 from xmodule.modulestore.xml_importer import import_from_xml
 
+from contentserver.middleware import parse_byte_range
+
 log = logging.getLogger(__name__)
 
 TEST_DATA_CONTENTSTORE = copy.deepcopy(settings.CONTENTSTORE)
@@ -123,3 +128,102 @@ class ContentStoreToyCourseTest(ModuleStoreTestCase):
         resp = self.client.get(self.url_locked)
         self.assertEqual(resp.status_code, 200) # pylint: disable=E1103
 
+    def test_range_request(self):
+        """
+        Test that a byte range of an asset is served as partial content.
+        """
+        length = self.contentstore.find(self.unlocked_asset).length
+        data = ''.join(self.client.get(self.url_unlocked))
+        resp = self.client.get(self.url_unlocked, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(resp.status_code, 206)  # pylint: disable=E1103
+        self.assertEqual(resp['Content-Range'], 'bytes 10-19/{}'.format(length))
+        self.assertEqual(resp['Content-Length'], '10')
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+        self.assertEqual(''.join(resp), data[10:20])
+
+    def test_unsatisfiable_range_request(self):
+        """
+        Test that a byte range starting past the end of an asset is rejected.
+        """
+        length = self.contentstore.find(self.unlocked_asset).length
+        resp = self.client.get(self.url_unlocked, HTTP_RANGE='bytes={}-'.format(length))
+        self.assertEqual(resp.status_code, 416)  # pylint: disable=E1103
+        self.assertEqual(resp['Content-Range'], 'bytes */{}'.format(length))
+
+    def test_if_range_mismatch(self):
+        """
+        Test that the whole asset is served if it changed since the client got its etag.
+        """
+        resp = self.client.get(self.url_unlocked, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(resp.status_code, 200)  # pylint: disable=E1103
+
+    def test_etag(self):
+        """
+        Test that assets carry a strong etag, honored by If-None-Match.
+        """
+        resp = self.client.get(self.url_unlocked)
+        etag = resp['ETag']
+        self.assertEqual(etag, '"{}"'.format(self.contentstore.find(self.unlocked_asset).content_digest))
+
+        resp = self.client.get(self.url_unlocked, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)  # pylint: disable=E1103
+        self.assertEqual(resp['ETag'], etag)
+
+        # a stale etag takes precedence over an up to date If-Modified-Since
+        resp = self.client.get(
+            self.url_unlocked, HTTP_IF_NONE_MATCH='"stale"', HTTP_IF_MODIFIED_SINCE=resp['Last-Modified']
+        )
+        self.assertEqual(resp.status_code, 200)  # pylint: disable=E1103
+
+    def test_if_modified_since(self):
+        """
+        Test that If-Modified-Since is compared as a date rather than a string.
+        """
+        resp = self.client.get(self.url_unlocked)
+        self.assertEqual(resp['Last-Modified'], http_date(self._last_modified_at()))
+
+        resp = self.client.get(self.url_unlocked, HTTP_IF_MODIFIED_SINCE=http_date(self._last_modified_at() + 60))
+        self.assertEqual(resp.status_code, 304)  # pylint: disable=E1103
+
+        resp = self.client.get(self.url_unlocked, HTTP_IF_MODIFIED_SINCE=http_date(self._last_modified_at() - 60))
+        self.assertEqual(resp.status_code, 200)  # pylint: disable=E1103
+
+    def _last_modified_at(self):
+        """
+        Returns the upload timestamp of the unlocked asset, in seconds since the epoch.
+        """
+        return calendar.timegm(self.contentstore.find(self.unlocked_asset).last_modified_at.utctimetuple())
+
+
+class ParseByteRangeTest(TestCase):
+    """
+    Tests for parsing Range headers.
+    """
+    def test_ranges(self):
+        """Satisfiable ranges are clamped to the content."""
+        self.assertEqual(parse_byte_range('bytes=0-499', 1000), (0, 499))
+        self.assertEqual(parse_byte_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(parse_byte_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_byte_range('bytes=-2000', 1000), (0, 999))
+        self.assertEqual(parse_byte_range('bytes=900-2000', 1000), (900, 999))
+
+    def test_ignored_ranges(self):
+        """Malformed and multiple ranges are ignored."""
+        self.assertIsNone(parse_byte_range('bytes=0-10,20-30', 1000))
+        self.assertIsNone(parse_byte_range('bytes=10-5', 1000))
+        self.assertIsNone(parse_byte_range('items=0-10', 1000))
+        self.assertIsNone(parse_byte_range('bytes=-', 1000))
+
+    def test_unsatisfiable_ranges(self):
+        """Ranges starting past the end of the content can't be satisfied."""
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=-0', 1000)
+
+    def test_empty_content(self):
+        """No range of empty content can be satisfied, not even a suffix range."""
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=-100', 0)
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=0-', 0)
@@ -0,0 +1,205 @@
+"""
+Event tracker backend that buffers events in process, and sends them in
+batches to another backend from a background thread.
+
+This keeps the latency of the wrapped backend off the requests that emit
+events. Buffering is configured with the `BUFFER` key of a backend in
+`TRACKING_BACKENDS`::
+
+  TRACKING_BACKENDS = {
+      'mongo': {
+          'ENGINE': 'track.backends.mongodb.MongoBackend',
+          'OPTIONS': {...},
+          'BUFFER': {
+              'max_queue_size': 10000,
+              'batch_size': 100,
+              'flush_interval': 1.0,
+              'overflow_policy': 'drop_newest',
+          }
+      }
+  }
+
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import logging
+import os
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+from dogapi import dog_stats_api
+
+from track.backends import BaseBackend
+
+
+log = logging.getLogger(__name__)
+
+
+# What to do with an event sent while the queue is full
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+
+class BufferedBackend(BaseBackend):
+    """
+    Event tracker backend queueing events for a background thread, which
+    sends them with `send_batch` to the wrapped backend.
+
+    """
+    def __init__(self, backend, max_queue_size=10000, batch_size=100, flush_interval=1.0,
+                 overflow_policy=DROP_NEWEST, name='buffered', **kwargs):
+        """
+        :Parameters:
+
+          - `backend`: the backend the events are sent to
+          - `max_queue_size`: the number of events buffered before the
+            overflow policy kicks in
+          - `batch_size`: the number of events sent to the backend at once
+          - `flush_interval`: the maximum number of seconds an event is
+            buffered for
+          - `overflow_policy`: one of 'drop_newest' (discard the event being
+            sent), 'drop_oldest' (discard the oldest buffered event) or
+            'block' (wait for the background thread to free some space)
+          - `name`: the name of the backend, tagging its metrics
+
+        """
+        super(BufferedBackend, self).__init__(**kwargs)
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('Invalid overflow policy {0}'.format(overflow_policy))
+
+        self.backend = backend
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.tags = [u'backend:{0}'.format(name)]
+
+        self.dropped = 0
+        self.sent = 0
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        """
+        Start the background thread, unless it's already running in this
+        process. Forked processes (e.g. gunicorn workers) don't inherit the
+        threads of their parent, so each of them starts its own.
+
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = Queue(self.max_queue_size)
+            self._thread = threading.Thread(target=self._run, name='track-buffered-backend')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def send(self, event):
+        """Queue the event for the background thread."""
+        self._ensure_thread()
+
+        if self.overflow_policy == BLOCK:
+            if self._queue.full():
+                dog_stats_api.increment('track.buffered.blocked', tags=self.tags)
+            self._queue.put(event)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except Full:
+                if self.overflow_policy == DROP_NEWEST:
+                    self._record_drop()
+                    return
+            try:
+                self._queue.get_nowait()
+                self._record_drop()
+            except Empty:
+                pass
+
+    def _record_drop(self):
+        """Count an event lost to the overflow policy."""
+        with self._lock:
+            self.dropped += 1
+        dog_stats_api.increment('track.buffered.dropped', tags=self.tags)
+
+    def _run(self):
+        """Send the queued events in batches, forever."""
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._send_batch(batch)
+
+    def _next_batch(self):
+        """
+        Wait for the next batch of events, which is complete once it has
+        `batch_size` events or its first event waited `flush_interval`
+        seconds.
+
+        """
+        batch = [self._queue.get()]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _send_batch(self, batch):
+        """Send a batch of events to the backend, reporting how backed up the queue is."""
+        dog_stats_api.histogram('track.buffered.queue_size', self._queue.qsize(), tags=self.tags)
+        dog_stats_api.histogram('track.buffered.batch_size', len(batch), tags=self.tags)
+        try:
+            with dog_stats_api.timer('track.buffered.send_batch', tags=self.tags):
+                self.backend.send_batch(batch)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Error sending a batch of %d events', len(batch))
+        else:
+            with self._lock:
+                self.sent += len(batch)
+
+    def flush(self):
+        """
+        Send all the queued events from the calling thread, e.g. when the
+        process exits.
+
+        """
+        if self._pid != os.getpid():
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+            if len(batch) == self.batch_size:
+                self._send_batch(batch)
+                batch = []
+        if batch:
+            self._send_batch(batch)
+
+    def stats(self):
+        """Return the number of events queued, sent and dropped by this process."""
+        with self._lock:
+            return {
+                'queued': self._queue.qsize() if self._pid == os.getpid() else 0,
+                'sent': self.sent,
+                'dropped': self.dropped,
+            }
@@ -33,11 +33,19 @@ class LoggerBackend(BaseBackend):
         self.event_logger = logging.getLogger(name)
 
     def send(self, event):
+        self.event_logger.info(self._serialize(event))
+
+    def send_batch(self, events):
+        """Log the events in a single record, one JSON string per line."""
+        if not events:
+            return
+        self.event_logger.info('\n'.join(self._serialize(event) for event in events))
+
+    def _serialize(self, event):
+        """Return the event as a JSON string, truncated to TRACK_MAX_EVENT."""
         event_str = json.dumps(event, cls=DateTimeJSONEncoder)
 
         # TODO: remove trucation of the serialized event, either at a
         # higher level during the emittion of the event, or by
         # providing warnings when the events exceed certain size.
-        event_str = event_str[:settings.TRACK_MAX_EVENT]
-
-        self.event_logger.info(event_str)
+        return event_str[:settings.TRACK_MAX_EVENT]
@@ -5,6 +5,7 @@ from __future__ import absolute_import
 import logging
 
 import pymongo
+from bson.errors import InvalidDocument
 from pymongo import MongoClient
 from pymongo.errors import PyMongoError
 
@@ -89,9 +90,26 @@ class MongoBackend(BaseBackend):
         """Insert the event in to the Mongo collection"""
         try:
             self.collection.insert(event, manipulate=False)
-        except PyMongoError:
+        except (PyMongoError, InvalidDocument):
             # The event will be lost in case of a connection error.
             # pymongo will re-connect/re-authenticate automatically
             # during the next event.
             msg = 'Error inserting to MongoDB event tracker backend'
             log.exception(msg)
+
+    def send_batch(self, events):
+        """
+        Insert the events in to the Mongo collection, in a single bulk insert.
+
+        If the bulk insert fails, e.g. because one of the events can't be
+        encoded, the events are inserted one at a time, so that only the
+        ones which fail are lost.
+
+        """
+        if not events:
+            return
+        try:
+            self.collection.insert(events, manipulate=False)
+        except (PyMongoError, InvalidDocument):
+            for event in events:
+                self.send(event)
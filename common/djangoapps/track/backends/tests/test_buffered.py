@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+
+import threading
+
+from mock import patch
+
+from django.test import TestCase
+
+from track.backends import BaseBackend
+from track.backends.buffered import BufferedBackend
+
+
+class RecordingBackend(BaseBackend):
+    """Backend keeping the batches it was sent."""
+    def __init__(self, **options):
+        super(RecordingBackend, self).__init__(**options)
+        self.batches = []
+        self.received = threading.Event()
+
+    def send(self, event):
+        self.send_batch([event])
+
+    def send_batch(self, events):
+        self.batches.append(list(events))
+        self.received.set()
+
+
+class TestBufferedBackend(TestCase):
+    def setUp(self):
+        self.backend = RecordingBackend()
+
+    def _buffered(self, **options):
+        buffered = BufferedBackend(self.backend, **options)
+        # Keep the background thread from draining the queue, so that the
+        # tests control when events are sent
+        patcher = patch.object(BufferedBackend, '_run')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return buffered
+
+    def test_flush_in_batches(self):
+        """Queued events are sent in batches of at most batch_size when flushed."""
+        buffered = self._buffered(batch_size=2)
+        for index in range(5):
+            buffered.send({'test': index})
+        self.assertEqual(self.backend.batches, [])
+
+        buffered.flush()
+
+        self.assertEqual([len(batch) for batch in self.backend.batches], [2, 2, 1])
+        self.assertEqual(buffered.stats(), {'queued': 0, 'sent': 5, 'dropped': 0})
+
+    def test_drop_newest(self):
+        """New events are dropped when the queue is full."""
+        buffered = self._buffered(max_queue_size=2)
+        for index in range(3):
+            buffered.send({'test': index})
+        buffered.flush()
+
+        self.assertEqual(self.backend.batches, [[{'test': 0}, {'test': 1}]])
+        self.assertEqual(buffered.dropped, 1)
+
+    def test_drop_oldest(self):
+        """The oldest queued events are dropped for new ones when the queue is full."""
+        buffered = self._buffered(max_queue_size=2, overflow_policy='drop_oldest')
+        for index in range(3):
+            buffered.send({'test': index})
+        buffered.flush()
+
+        self.assertEqual(self.backend.batches, [[{'test': 1}, {'test': 2}]])
+        self.assertEqual(buffered.dropped, 1)
+
+    def test_invalid_overflow_policy(self):
+        """An unknown overflow policy is rejected."""
+        with self.assertRaises(ValueError):
+            BufferedBackend(self.backend, overflow_policy='ignore')
+
+    def test_background_thread(self):
+        """The background thread sends queued events on its own."""
+        buffered = BufferedBackend(self.backend, flush_interval=0.01)
+        buffered.send({'test': 1})
+
+        self.assertTrue(self.backend.received.wait(5))
+        self.assertEqual(self.backend.batches, [[{'test': 1}]])
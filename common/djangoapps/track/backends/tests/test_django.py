@@ -23,3 +23,15 @@ class TestDjangoBackend(TestCase):
 
         # Check if time is stored in UTC
         self.assertEqual(str(results[0].time), '2013-01-01 17:01:00+00:00')
+
+    def test_django_backend_batch(self):
+        """A batch of events is saved with a single query."""
+        events = [
+            {'username': 'test{0}'.format(index), 'time': '2013-01-01T12:01:00-05:00'}
+            for index in range(3)
+        ]
+        with self.assertNumQueries(1):
+            self.backend.send_batch(events)
+
+        usernames = TrackingLog.objects.values_list('username', flat=True)
+        self.assertItemsEqual(usernames, ['test0', 'test1', 'test2'])
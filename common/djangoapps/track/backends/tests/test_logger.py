@@ -47,6 +47,16 @@ class TestLoggerBackend(TestCase):
         self.assertEqual(saved_events[0], unpacked_event)
         self.assertEqual(saved_events[1], unpacked_event)
 
+    def test_logger_backend_batch(self):
+        """A batch of events is logged in a single record, one event per line."""
+        self.handler.reset()
+
+        self.backend.send_batch([{'test': 1}, {'test': 2}])
+
+        self.assertEqual(len(self.handler.messages['info']), 1)
+        saved_events = [json.loads(e) for e in self.handler.messages['info'][0].split('\n')]
+        self.assertEqual(saved_events, [{'test': 1}, {'test': 2}])
+
 
 class MockLoggingHandler(logging.Handler):
     """
@@ -2,7 +2,8 @@ from __future__ import absolute_import
 
 from uuid import uuid4
 
-from mock import patch
+from bson.errors import InvalidDocument
+from mock import call, patch
 
 from django.test import TestCase
 
@@ -38,3 +39,32 @@ class TestMongoBackend(TestCase):
 
         self.assertEqual(events[0], first_argument(calls[0]))
         self.assertEqual(events[1], first_argument(calls[1]))
+
+    def test_mongo_backend_batch(self):
+        """A batch of events is inserted with a single call."""
+        events = [{'test': 1}, {'test': 2}]
+
+        self.backend.send_batch(events)
+
+        self.backend.collection.insert.assert_called_once_with(events, manipulate=False)
+
+    def test_mongo_backend_batch_invalid_event(self):
+        """An event which can't be inserted doesn't lose the rest of its batch."""
+        events = [{'test': 1}, {'test': 2}, {'test': 3}]
+        invalid_event = events[1]
+
+        def insert(docs, manipulate):  # pylint: disable=unused-argument
+            if docs is invalid_event or docs is events:
+                raise InvalidDocument()
+        self.backend.collection.insert.side_effect = insert
+
+        with patch('track.backends.mongodb.log') as mock_log:
+            self.backend.send_batch(events)
+
+        self.assertEqual(self.backend.collection.insert.mock_calls, [
+            call(events, manipulate=False),
+            call(events[0], manipulate=False),
+            call(events[1], manipulate=False),
+            call(events[2], manipulate=False),
+        ])
+        self.assertEqual(mock_log.exception.call_count, 1)
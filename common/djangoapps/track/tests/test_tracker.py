@@ -1,9 +1,11 @@
 from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
+from mock import patch
 
 import track.tracker as tracker
 from track.backends import BaseBackend
+from track.backends.buffered import BufferedBackend
 
 
 SIMPLE_SETTINGS = {
@@ -24,6 +26,15 @@ MULTI_SETTINGS = {
     }
 }
 
+BUFFERED_SETTINGS = {
+    'default': {
+        'ENGINE': 'track.tests.test_tracker.DummyBackend',
+        'BUFFER': {
+            'batch_size': 5,
+        }
+    }
+}
+
 
 class TestTrackerInstantiation(TestCase):
     """Test that a helper function can instantiate backends from their name."""
@@ -97,6 +108,20 @@ class TestTrackerDjangoInstantiation(TestCase):
 
         self.assertEqual(len(backends), 1)
 
+    @override_settings(TRACKING_BACKENDS=BUFFERED_SETTINGS)
+    @patch.object(BufferedBackend, '_run')
+    def test_django_buffered_settings(self, _mock_run):
+        """Test if a backend can be sent events from a background thread."""
+
+        backend = self._reload_backends()['default']
+        self.assertIsInstance(backend, BufferedBackend)
+        self.assertEqual(backend.batch_size, 5)
+
+        tracker.send({})
+        backend.flush()
+
+        self.assertEqual(backend.backend.count, 1)
+
     def _reload_backends(self):
         # pylint: disable=protected-access
 
@@ -12,10 +12,17 @@ below::
               'host': ... ,
               'port': ... ,
               ...
+          },
+          'BUFFER': {
+              'batch_size': ... ,
+              ...
           }
       }
   }
 
+Backends with a `BUFFER` key are sent the events in batches from a
+background thread, see `track.backends.buffered`.
+
 """
 
 import inspect
@@ -26,6 +33,7 @@ from dogapi import dog_stats_api
 from django.conf import settings
 
 from track.backends import BaseBackend
+from track.backends.buffered import BufferedBackend
 
 
 __all__ = ['send']
@@ -49,7 +57,10 @@ def _initialize_backends_from_django_settings():
         if values:
             engine = values['ENGINE']
             options = values.get('OPTIONS', {})
-            backends[name] = _instantiate_backend_from_name(engine, options)
+            backend = _instantiate_backend_from_name(engine, options)
+            if values.get('BUFFER') is not None:
+                backend = BufferedBackend(backend, name=name, **values['BUFFER'])
+            backends[name] = backend
 
 
 def _instantiate_backend_from_name(name, options):
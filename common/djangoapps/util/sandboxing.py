@@ -1,5 +1,10 @@
 import re
 from django.conf import settings
+from django.core.cache import get_cache
+
+from capa.safe_exec import SafeExecCache
+
+_safe_exec_cache = None  # pylint: disable=invalid-name
 
 
 def can_execute_unsafe_code(course_id):
@@ -25,3 +30,21 @@ def can_execute_unsafe_code(course_id):
         if re.match(regex, course_id.to_deprecated_string()):
             return True
     return False
+
+
+def get_safe_exec_cache():
+    """
+    Return the cache of safe_exec results shared by the problems run in this process.
+
+    It keeps `SAFE_EXEC_CACHE['LOCAL_SIZE']` results in process, in front of the
+    Django cache named `SAFE_EXEC_CACHE['CACHE_NAME']`.
+
+    """
+    global _safe_exec_cache  # pylint: disable=global-statement, invalid-name
+    if _safe_exec_cache is None:
+        config = getattr(settings, 'SAFE_EXEC_CACHE', {})
+        _safe_exec_cache = SafeExecCache(
+            get_cache(config.get('CACHE_NAME', 'default')),
+            max_size=config.get('LOCAL_SIZE', 1000),
+        )
+    return _safe_exec_cache
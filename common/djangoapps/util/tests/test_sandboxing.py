@@ -3,7 +3,9 @@ Tests for sandboxing.py in util app
 """
 
 from django.test import TestCase
-from util.sandboxing import can_execute_unsafe_code
+from mock import patch
+from util import sandboxing
+from util.sandboxing import can_execute_unsafe_code, get_safe_exec_cache
 from django.test.utils import override_settings
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
 
@@ -33,3 +35,14 @@ class SandboxingTest(TestCase):
         """
         self.assertFalse(can_execute_unsafe_code(SlashSeparatedCourseKey('edX', 'full', '2012_Fall')))
         self.assertFalse(can_execute_unsafe_code(SlashSeparatedCourseKey('edX', 'full', '2013_Spring')))
+
+    @patch.object(sandboxing, '_safe_exec_cache', None)
+    @override_settings(SAFE_EXEC_CACHE={'CACHE_NAME': 'default', 'LOCAL_SIZE': 5})
+    def test_safe_exec_cache(self):
+        """
+        Test that the safe_exec cache is built from the settings, once per process
+        """
+        cache = get_safe_exec_cache()
+        self.assertEqual(cache.max_size, 5)
+        self.assertIsNotNone(cache.shared_cache)
+        self.assertIs(get_safe_exec_cache(), cache)
@@ -2,11 +2,17 @@
 Parser and evaluator for FormulaResponse and NumericalResponse
 
 Uses pyparsing to parse. Main function as of now is evaluator().
+
+Parsing is the expensive part, so parsed expressions are compiled into nested
+closures, and kept in an LRU cache to be evaluated again with other variables.
 """
 
 import math
 import operator
 import numbers
+import threading
+from collections import OrderedDict
+
 import numpy
 import scipy.constants
 import functions
@@ -61,6 +67,15 @@ DEFAULT_VARIABLES = {
     'q': scipy.constants.e  # Fund. Charge: 1.602176565e-19 (Coulombs)
 }
 
+# The default functions which accept numpy arrays, allowing to evaluate an
+# expression for many samples of its variables at once.
+VECTORIZABLE_FUNCTIONS = set(
+    func for name, func in DEFAULT_FUNCTIONS.iteritems() if name not in ('fact', 'factorial')
+)
+
+# The number of compiled expressions kept by `get_compiled_expression`.
+PARSE_CACHE_SIZE = 1024
+
 # We eliminated the following extreme suffixes:
 #   P (1e15), E (1e18), Z (1e21), Y (1e24),
 #   f (1e-15), a (1e-18), z (1e-21), y (1e-24)
@@ -228,34 +243,224 @@ def evaluator(variables, functions, math_expr, case_sensitive=False):
     if math_expr.strip() == "":
         return float('nan')
 
-    # Parse the tree.
-    math_interpreter = ParseAugmenter(math_expr, case_sensitive)
-    math_interpreter.parse_algebra()
+    return get_compiled_expression(math_expr, case_sensitive).evaluate(variables, functions)
 
-    # Get our variables together.
-    all_variables, all_functions = add_defaults(variables, functions, case_sensitive)
 
-    # ...and check them
-    math_interpreter.check_variables(all_variables, all_functions)
+def evaluate_samples(samples, functions, math_expr, case_sensitive=False):
+    """
+    Evaluate an expression for each of the variable dictionaries in `samples`.
 
-    # Create a recursion to evaluate the tree.
-    if case_sensitive:
-        casify = lambda x: x
-    else:
-        casify = lambda x: x.lower()  # Lowercase for case insens.
-
-    evaluate_actions = {
-        'number': eval_number,
-        'variable': lambda x: all_variables[casify(x[0])],
-        'function': lambda x: all_functions[casify(x[0])](x[1]),
-        'atom': eval_atom,
-        'power': eval_power,
-        'parallel': eval_parallel,
-        'product': eval_product,
-        'sum': eval_sum
-    }
-
-    return math_interpreter.reduce_tree(evaluate_actions)
+    Return the list of the results, the same as calling `evaluator` for each
+    sample would. When all the functions used by the expression accept numpy
+    arrays, the expression is evaluated for all the samples at once.
+    """
+    if not samples:
+        return []
+    if math_expr.strip() == "":
+        return [float('nan')] * len(samples)
+
+    return get_compiled_expression(math_expr, case_sensitive).evaluate_samples(samples, functions)
+
+
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+
+def get_compiled_expression(math_expr, case_sensitive=False):
+    """
+    Return the `CompiledExpression` of `math_expr`, parsing it only if it isn't
+    among the `PARSE_CACHE_SIZE` most recently used expressions.
+    """
+    key = (math_expr, case_sensitive)
+    with _parse_cache_lock:
+        expression = _parse_cache.pop(key, None)
+        if expression is not None:
+            _parse_cache[key] = expression
+            return expression
+
+    expression = CompiledExpression(math_expr, case_sensitive)
+    with _parse_cache_lock:
+        _parse_cache[key] = expression
+        while len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return expression
+
+
+class CompiledExpression(object):
+    """
+    A parsed math expression, compiled into nested closures so that it can be
+    evaluated again and again without going through pyparsing.
+
+    Each closure computes the value of a node of the parse tree from the
+    `variables` and `functions` dictionaries, in the same way as the actions of
+    `evaluator` reduce the tree. Unlike those actions, they only rely on the
+    shape of the tree to tell operators from operands, so they also work when
+    the variables are numpy arrays.
+    """
+    def __init__(self, math_expr, case_sensitive=False):
+        """
+        Parse `math_expr` and compile its tree.
+
+        Raise a `pyparsing.ParseException` if the expression is malformed.
+        """
+        self.math_expr = math_expr
+        self.case_sensitive = case_sensitive
+        self.math_interpreter = ParseAugmenter(math_expr, case_sensitive)
+        self.math_interpreter.parse_algebra()
+        self._evaluate = self._compile(self.math_interpreter.tree)
+
+    def casify(self, name):
+        """
+        Lowercase `name` unless the expression is case sensitive.
+        """
+        return name if self.case_sensitive else name.lower()
+
+    def evaluate(self, variables, functions):
+        """
+        Evaluate the expression with the given variables and functions.
+        """
+        all_variables, all_functions = add_defaults(variables, functions, self.case_sensitive)
+        self.math_interpreter.check_variables(all_variables, all_functions)
+        return self._evaluate(all_variables, all_functions)
+
+    def evaluate_samples(self, samples, functions):
+        """
+        Evaluate the expression for each of the variable dictionaries in `samples`.
+
+        Try evaluating all the samples at once as numpy arrays, and fall back on
+        evaluating them one by one if the expression can't be vectorized, or if
+        any sample would not evaluate cleanly. This way errors, infinities and
+        NaNs are exactly the ones `evaluate` gives.
+        """
+        if len(samples) > 1 and self._is_vectorizable(samples, functions):
+            try:
+                return self._evaluate_vectorized(samples, functions)
+            except Exception:  # pylint: disable=broad-except
+                pass
+        return [self.evaluate(variables, functions) for variables in samples]
+
+    def _is_vectorizable(self, samples, functions):
+        """
+        Return whether the samples share the same variables, and all the
+        functions of the expression accept numpy arrays.
+        """
+        names = set(samples[0])
+        if any(set(variables) != names for variables in samples):
+            return False
+        __, all_functions = add_defaults({}, functions, self.case_sensitive)
+        return all(
+            all_functions.get(self.casify(name)) in VECTORIZABLE_FUNCTIONS
+            for name in self.math_interpreter.functions_used
+        )
+
+    def _evaluate_vectorized(self, samples, functions):
+        """
+        Evaluate the expression once, with each variable holding the array of its values in `samples`.
+
+        Raise a `FloatingPointError` rather than computing infinities or NaNs.
+        """
+        variables = dict(
+            (name, numpy.array([sample[name] for sample in samples]))
+            for name in samples[0]
+        )
+        all_variables, all_functions = add_defaults(variables, functions, self.case_sensitive)
+        self.math_interpreter.check_variables(all_variables, all_functions)
+        with numpy.errstate(divide='raise', over='raise', invalid='raise'):
+            result = self._evaluate(all_variables, all_functions)
+
+        if not isinstance(result, numpy.ndarray):
+            # The expression doesn't depend on the samples
+            return [result] * len(samples)
+        if result.shape != (len(samples),):
+            raise ValueError(u"Unexpected result shape {}".format(result.shape))
+        return result.tolist()
+
+    def _compile(self, node):
+        """
+        Return a function of (variables, functions) computing the value of `node`.
+        """
+        node_name = node.getName()
+        if node_name == 'number':
+            value = eval_number(node)
+            return lambda variables, functions: value
+        elif node_name == 'variable':
+            variable_name = self.casify(node[0])
+            return lambda variables, functions: variables[variable_name]
+        elif node_name == 'function':
+            function_name = self.casify(node[0])
+            argument = self._compile(node[1])
+            return lambda variables, functions: functions[function_name](argument(variables, functions))
+
+        # The remaining nodes mix operands with the strings of their operators
+        # (or parentheses)
+        operands = [self._compile(kid) for kid in node if isinstance(kid, ParseResults)]
+        if node_name == 'atom':
+            return operands[0]
+        elif node_name == 'power':
+            return self._compile_power(operands)
+        elif node_name == 'parallel':
+            return self._compile_parallel(operands)
+        elif node_name == 'product':
+            return self._compile_operations(node, 1.0, operator.mul, {'*': operator.mul, '/': operator.truediv})
+        elif node_name == 'sum':
+            return self._compile_operations(node, 0.0, operator.add, {'+': operator.add, '-': operator.sub})
+        else:  # pragma: no cover
+            raise Exception(u"Unknown branch name '{}'".format(node_name))
+
+    @staticmethod
+    def _compile_power(operands):
+        """
+        Exponentiate the operands right to left, like `eval_power`.
+        """
+        def evaluate_power(variables, functions):
+            """
+            Raise each operand to the power of the following ones.
+            """
+            values = [operand(variables, functions) for operand in reversed(operands)]
+            return reduce(lambda a, b: b ** a, values)
+        return evaluate_power
+
+    @staticmethod
+    def _compile_parallel(operands):
+        """
+        Apply the parallel resistors operator to the operands, like `eval_parallel`.
+        """
+        def evaluate_parallel(variables, functions):
+            """
+            Return 1 / (1/in1 + 1/in2 + ...), or NaN if there is a zero among the (scalar) inputs.
+            """
+            values = [operand(variables, functions) for operand in operands]
+            if len(values) == 1:
+                return values[0]
+            if not any(isinstance(value, numpy.ndarray) for value in values) and 0 in values:
+                return float('nan')
+            return 1. / sum(1. / value for value in values)
+        return evaluate_parallel
+
+    def _compile_operations(self, node, initial_value, initial_op, operators):
+        """
+        Combine the operands of `node` from left to right, like `eval_sum` and `eval_product`.
+
+        `operators` maps the operator strings found in the node to their functions.
+        Operands without an operator before them are combined with `initial_op`.
+        """
+        steps = []
+        current_op = initial_op
+        for kid in node:
+            if isinstance(kid, ParseResults):
+                steps.append((current_op, self._compile(kid)))
+            else:
+                current_op = operators[kid]
+
+        def evaluate_operations(variables, functions):
+            """
+            Apply each step's operator to the running total and its operand.
+            """
+            total = initial_value
+            for operation, operand in steps:
+                total = operation(total, operand(variables, functions))
+            return total
+        return evaluate_operations
 
 
 class ParseAugmenter(object):
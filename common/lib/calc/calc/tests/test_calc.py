@@ -5,6 +5,7 @@ Unit tests for calc.py
 import unittest
 import numpy
 import calc
+from mock import patch
 from pyparsing import ParseException
 
 # numpy's default behavior when it evaluates a function outside its domain
@@ -558,3 +559,85 @@ class EvaluatorTest(unittest.TestCase):
             calc.evaluator({'r1': 5}, {}, "r1+r2")
         with self.assertRaisesRegexp(calc.UndefinedVariable, 'r1 r3'):
             calc.evaluator(variables, {}, "r1*r3", case_sensitive=True)
+
+
+class CompiledExpressionTest(unittest.TestCase):
+    """
+    Test the cache of compiled expressions, and evaluating an expression for
+    many samples of its variables at once.
+    """
+    def setUp(self):
+        calc._parse_cache.clear()  # pylint: disable=protected-access
+
+    def test_parsed_once(self):
+        """
+        Expressions are only parsed the first time they are evaluated
+        """
+        with patch.object(calc.ParseAugmenter, 'parse_algebra', autospec=True,
+                          side_effect=calc.ParseAugmenter.parse_algebra) as mock_parse:
+            self.assertEqual(calc.evaluator({'x': 1.0}, {}, 'x+1'), 2.0)
+            self.assertEqual(calc.evaluator({'x': 2.0}, {}, 'x+1'), 3.0)
+            self.assertEqual(mock_parse.call_count, 1)
+
+            # case sensitivity is part of the key
+            self.assertEqual(calc.evaluator({'x': 2.0}, {}, 'x+1', case_sensitive=True), 3.0)
+            self.assertEqual(mock_parse.call_count, 2)
+
+    def test_cache_size(self):
+        """
+        The least recently used expressions are dropped from the cache
+        """
+        with patch.object(calc, 'PARSE_CACHE_SIZE', 2):
+            calc.evaluator({}, {}, '1+1')
+            calc.evaluator({}, {}, '1+2')
+            calc.evaluator({}, {}, '1+1')
+            calc.evaluator({}, {}, '1+3')
+        self.assertEqual(
+            calc._parse_cache.keys(),  # pylint: disable=protected-access
+            [('1+1', False), ('1+3', False)]
+        )
+
+    def test_samples_match_evaluator(self):
+        """
+        Evaluating samples at once gives the results of evaluating them one by one
+        """
+        samples = [{'x': value, 'y': 2 * value + 1} for value in numpy.linspace(-3, 3, 20)]
+        expressions = [
+            'x^2 + 3*x*y - y/2', '-x + 4', 'sin(x)*cos(y) + sec(y)', '2^x^2',
+            'x || y', '(x+i)*y', 'sqrt(y)', '1/x', 'fact(3) * x', '5k * x + 10%',
+        ]
+        for expression in expressions:
+            expected = [calc.evaluator(variables, {}, expression) for variables in samples]
+            results = calc.evaluate_samples(samples, {}, expression)
+            self.assertEqual(len(results), len(samples))
+            for result, expected_result in zip(results, expected):
+                if numpy.isnan(expected_result):
+                    self.assertTrue(numpy.isnan(result), expression)
+                else:
+                    self.assertAlmostEqual(result, expected_result, msg=expression)
+
+    def test_samples_vectorized(self):
+        """
+        Expressions using only numpy functions are evaluated once for all the samples
+        """
+        samples = [{'x': float(value)} for value in range(1, 6)]
+        with patch.object(calc.CompiledExpression, 'evaluate') as mock_evaluate:
+            self.assertEqual(calc.evaluate_samples(samples, {}, 'sqrt(x^2) + 1'), [2.0, 3.0, 4.0, 5.0, 6.0])
+        self.assertFalse(mock_evaluate.called)
+
+        # user defined functions may not accept arrays
+        functions = {'f': lambda x: x + 1}
+        self.assertEqual(calc.evaluate_samples(samples, functions, 'f(x)'), [2.0, 3.0, 4.0, 5.0, 6.0])
+
+    def test_samples_errors(self):
+        """
+        Evaluating samples at once raises the errors of evaluating them one by one
+        """
+        samples = [{'x': 1.0}, {'x': 0.0}]
+        with self.assertRaises(ZeroDivisionError):
+            calc.evaluate_samples(samples, {}, '1/x')
+        with self.assertRaisesRegexp(calc.UndefinedVariable, 'y'):
+            calc.evaluate_samples(samples, {}, 'x+y')
+        with self.assertRaises(ValueError):
+            calc.evaluate_samples([{'x': -1.0}, {'x': 2.0}], {}, 'fact(x)')
+        self.assertTrue(all(numpy.isnan(calc.evaluate_samples(samples, {}, ''))))
@@ -13,10 +13,13 @@ Main module which shows problems (of "capa" type).
 This is used by capa_module.
 """
 
+from collections import OrderedDict
 from datetime import datetime
+import hashlib
 import logging
 import os.path
 import re
+import threading
 
 from lxml import etree
 from xml.sax.saxutils import unescape
@@ -29,8 +32,9 @@ import capa.responsetypes as responsetypes
 from capa.util import contextualize_text, convert_files_to_filenames
 import capa.xqueue_interface as xqueue_interface
 
-from capa.safe_exec import safe_exec
+from capa.safe_exec import safe_exec, looks_up_globals_dynamically
 
+from dogapi import dog_stats_api
 from pytz import UTC
 
 # extra things displayed after "show answers" is pressed
@@ -74,6 +78,8 @@ class LoncapaSystem(object):
     Attributes:
         i18n: an object implementing the `gettext.Translations` interface so
             that we can use `.ugettext` to localize strings.
+        problem_cache: a `ProblemTemplateCache` sharing the parsed problems
+            between `LoncapaProblem` instances, or None.
 
     See :class:`ModuleSystem` for documentation of other attributes.
 
@@ -92,7 +98,8 @@ class LoncapaSystem(object):
         seed,      # Why do we do this if we have self.seed?
         STATIC_URL,                                     # pylint: disable=invalid-name
         xqueue,
-        matlab_api_key=None
+        matlab_api_key=None,
+        problem_cache=None,
     ):
         self.ajax_url = ajax_url
         self.anonymous_student_id = anonymous_student_id
@@ -107,6 +114,66 @@ class LoncapaSystem(object):
         self.STATIC_URL = STATIC_URL                    # pylint: disable=invalid-name
         self.xqueue = xqueue
         self.matlab_api_key = matlab_api_key
+        self.problem_cache = problem_cache
+
+
+class ProblemTemplate(object):
+    """
+    What building a problem from its XML yields before any student state is
+    bound to it: the tree with its includes, and the context set up by its
+    scripts.  Problems built from a template copy both, since they change them.
+    """
+    def __init__(self, tree, context):
+        self.tree = tree
+        self.context = context
+        # the answers of the responders, in document order, once computed
+        self.responder_answers = None
+
+
+class ProblemTemplateCache(object):
+    """
+    A thread-safe LRU cache of `ProblemTemplate`s, holding at most `max_size` of them.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the template cached for key, or None.
+        """
+        with self._lock:
+            template = self._templates.pop(key, None)
+            if template is not None:
+                self._templates[key] = template
+                self.hits += 1
+            else:
+                self.misses += 1
+        dog_stats_api.increment(
+            'capa.problem_template_cache',
+            tags=[u'result:{}'.format('hit' if template is not None else 'miss')]
+        )
+        return template
+
+    def set(self, key, template):
+        """
+        Caches the template for key, evicting the least recently used templates.
+        """
+        with self._lock:
+            self._templates.pop(key, None)
+            self._templates[key] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the hit and miss counts of this process, and the number of templates cached.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._templates)}
 
 
 class LoncapaProblem(object):
@@ -158,20 +225,35 @@ class LoncapaProblem(object):
         problem_text = re.sub(r"endouttext\s*/", "/text", problem_text)
         self.problem_text = problem_text
 
-        # parse problem XML file into an element tree
-        self.tree = etree.XML(problem_text)
+        problem_cache = getattr(capa_system, 'problem_cache', None)
+        template = None
+        if problem_cache is not None:
+            template_key = self._template_key(problem_text)
+            template = problem_cache.get(template_key)
+
+        if template is None:
+            # parse problem XML file into an element tree
+            self.tree = etree.XML(problem_text)
 
-        # handle any <include file="foo"> tags
-        self._process_includes()
+            # handle any <include file="foo"> tags
+            self._process_includes()
 
-        # construct script processor context (eg for customresponse problems)
-        self.context = self._extract_context(self.tree)
+            # construct script processor context (eg for customresponse problems)
+            self.context = self._extract_context(self.tree)
+
+            if problem_cache is not None:
+                template = ProblemTemplate(deepcopy(self.tree), deepcopy(self.context))
+                problem_cache.set(template_key, template)
+        else:
+            self.tree = deepcopy(template.tree)
+            self.context = deepcopy(template.context)
+            self.context['anonymous_student_id'] = capa_system.anonymous_student_id
 
         # Pre-parse the XML tree: modifies it to add ID's and perform some in-place
         # transformations.  This also creates the dict (self.responders) of Response
         # instances for each question in the problem. The dict has keys = xml subtree of
         # Response, values = Response instance
-        self._preprocess_problem(self.tree)
+        self._preprocess_problem(self.tree, template)
 
         if not self.student_answers:  # True when student_answers is an empty dict
             self.set_initial_display()
@@ -190,6 +272,28 @@ class LoncapaProblem(object):
 
         self.extracted_tree = self._extract_html(self.tree)
 
+    def _template_key(self, problem_text):
+        """
+        Returns the key of the template of this problem in the problem cache,
+        covering everything building the template depends on.
+        """
+        if isinstance(problem_text, unicode):
+            problem_text = problem_text.encode('utf-8')
+        key = (
+            self.problem_id,
+            self.seed,
+            hashlib.sha1(problem_text).hexdigest(),
+            self.capa_system.DEBUG,
+            getattr(self.capa_system.filestore, 'root_path', None),
+            self.capa_system.can_execute_unsafe_code(),
+        )
+        # Only scripts mentioning the student's id depend on it, but scripts
+        # can also be included from files, or look it up without naming it.
+        if 'anonymous_student_id' in problem_text or '<include' in problem_text or \
+                looks_up_globals_dynamically(problem_text):
+            key += (self.capa_system.anonymous_student_id,)
+        return key
+
     def do_reset(self):
         """
         Reset internal state to unfinished, with no answers
@@ -764,7 +868,7 @@ class LoncapaProblem(object):
 
         return tree
 
-    def _preprocess_problem(self, tree):  # private
+    def _preprocess_problem(self, tree, template=None):  # private
         """
         Assign IDs to all the responses
         Assign sub-IDs to all entries (textline, schematic, etc.)
@@ -773,10 +877,12 @@ class LoncapaProblem(object):
 
         Also create capa Response instances for each responsetype and save as self.responders
 
-        Obtain all responder answers and save as self.responder_answers dict (key = response)
+        Obtain all responder answers and save as self.responder_answers dict (key = response),
+        or take them from the template the tree was copied from, once they are known
         """
         response_id = 1
         self.responders = {}
+        responses = []
         for response in tree.xpath('//' + "|//".join(responsetypes.registry.registered_tags())):
             response_id_str = self.problem_id + "_" + str(response_id)
             # create and save ID for this response
@@ -802,17 +908,25 @@ class LoncapaProblem(object):
             responder = responsetype_cls(response, inputfields, self.context, self.capa_system)
             # save in list in self
             self.responders[response] = responder
+            responses.append(response)
 
         # get responder answers (do this only once, since there may be a performance cost,
         # eg with externalresponse)
         self.responder_answers = {}
-        for response in self.responders.keys():
-            try:
-                self.responder_answers[response] = self.responders[response].get_answers()
-            except:
-                log.debug('responder %s failed to properly return get_answers()',
-                          self.responders[response])  # FIXME
-                raise
+        if template is not None and template.responder_answers is not None:
+            self.responder_answers = dict(zip(responses, deepcopy(template.responder_answers)))
+        else:
+            for response in responses:
+                try:
+                    self.responder_answers[response] = self.responders[response].get_answers()
+                except:
+                    log.debug('responder %s failed to properly return get_answers()',
+                              self.responders[response])  # FIXME
+                    raise
+            if template is not None:
+                template.responder_answers = deepcopy(
+                    [self.responder_answers[response] for response in responses]
+                )
 
         # <solution>...</solution> may not be associated with any specific response; give
         # IDs for those separately
@@ -0,0 +1,115 @@
+"""
+A two-tier cache of safe_exec results.
+
+Every safe_exec cache miss runs the code in a codejail subprocess, which is by
+far the slowest part of rendering a randomized problem.  `SafeExecCache` keeps
+the most recently used results in process, in front of a cache shared by all the
+processes (e.g. memcache), so that popular problems rarely leave the process.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+
+from dogapi import dog_stats_api
+
+
+class SafeExecCache(object):
+    """
+    A cache of safe_exec results, with the .get(key) and .set(key, value) methods
+    safe_exec expects of its `cache`.
+
+    `shared_cache` is the cache behind this one, another object with .get(key)
+    and .set(key, value) methods, or None.  `max_size` is the number of results
+    kept in process; 0 disables the in-process tier.
+
+    """
+    def __init__(self, shared_cache=None, max_size=1000):
+        self.shared_cache = shared_cache
+        self.max_size = max_size
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the result cached for key, or None.
+        """
+        with self._lock:
+            value = self._local.pop(key, None)
+            if value is not None:
+                # move the result to the most recently used end
+                self._local[key] = value
+        if value is not None:
+            self._record('local_hit')
+            # callers update their globals with the result, which mustn't be shared
+            return copy.deepcopy(value)
+
+        if self.shared_cache is not None:
+            value = self.shared_cache.get(key)
+        if value is None:
+            self._record('miss')
+            return None
+
+        self._set_local(key, value)
+        self._record('shared_hit')
+        return value
+
+    def set(self, key, value):
+        """
+        Caches value for key, in both tiers.
+        """
+        self._set_local(key, value)
+        if self.shared_cache is not None:
+            self.shared_cache.set(key, value)
+
+    def _set_local(self, key, value):
+        """
+        Caches value for key in process, evicting the least recently used results.
+        """
+        if self.max_size <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = value
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the in-process tier, and resets the statistics.
+        """
+        with self._lock:
+            self._local.clear()
+            self.local_hits = self.shared_hits = self.misses = 0
+
+    def _record(self, result):
+        """
+        Counts a hit of either tier or a miss, both in process and in datadog.
+        """
+        with self._lock:
+            if result == 'local_hit':
+                self.local_hits += 1
+            elif result == 'shared_hit':
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+        dog_stats_api.increment('capa.safe_exec.cache', tags=[u'result:{}'.format(result)])
+
+    def stats(self):
+        """
+        Returns the hit counts of both tiers and the miss count of this process,
+        along with the resulting hit rate and the size of the in-process tier.
+        """
+        with self._lock:
+            lookups = self.local_hits + self.shared_hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': float(self.local_hits + self.shared_hits) / lookups if lookups else None,
+                'local_size': len(self._local),
+            }
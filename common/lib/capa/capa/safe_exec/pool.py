@@ -0,0 +1,374 @@
+"""
+A pool of long-lived sandboxed Python processes to run safe_exec code in.
+
+codejail starts a new sandboxed Python for every execution, which then imports
+numpy and friends again: for script-heavy problems that is most of the time it
+takes to render or check them.  A pool worker pays for both once, and then forks
+a fresh child per execution, so that executions stay isolated from each other as
+with codejail.  Workers are recycled after `max_executions` executions, or when
+they stop responding.
+"""
+
+import json
+import logging
+import os
+import re
+import resource
+import select
+import subprocess
+import sys
+import threading
+import time
+
+from codejail import jail_code
+from codejail.safe_exec import safe_exec as codejail_safe_exec
+from codejail.safe_exec import json_safe, SafeExecException
+from dogapi import dog_stats_api
+
+from . import pool_worker
+
+log = logging.getLogger(__name__)
+
+# The modules workers import before running any code, the ones problems use most.
+PRELOAD_MODULES = [
+    'numpy', 'math', 'scipy', 'calc', 'eia',
+    'chem.chemcalc', 'chem.chemtools', 'chem.miller', 'verifiers.draganddrop',
+]
+
+# How long a new worker may take to import the preloaded modules.
+STARTUP_TIMEOUT = 30
+
+# How long past the timeout of an execution a worker may take to respond,
+# having killed the execution at the timeout.
+RESPONSE_GRACE = 5
+
+READ_SIZE = 64 * 1024
+
+# The workers run the source of pool_worker.py, which they can't import.
+pool_worker_py_file = pool_worker.__file__
+if pool_worker_py_file.endswith("c"):
+    pool_worker_py_file = pool_worker_py_file[:-1]
+
+WORKER_PY = open(pool_worker_py_file).read()
+
+
+class WorkerTimeout(Exception):
+    """
+    Raised when a worker doesn't respond in time.
+    """
+    pass
+
+
+class WorkerDied(Exception):
+    """
+    Raised when a worker exits without responding.
+    """
+    pass
+
+
+class PoolWorker(object):
+    """
+    A Python process running pool_worker.py.
+    """
+    def __init__(self, command, preexec_fn=None):
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=devnull,
+                preexec_fn=preexec_fn,
+                close_fds=True,
+            )
+        self.pid = os.getpid()
+        self.executions = 0
+        self.ready = False
+        self._buffer = ''
+
+    def execute(self, code, globals_dict, timeout, cpu_limit=None):
+        """
+        Runs code with the JSON-safe `globals_dict`, for at most `timeout`
+        seconds, and `cpu_limit` seconds of CPU time if given.  Returns the
+        response of the worker, a dict with either the resulting `globals` or
+        the traceback of an `error`, and `timed_out` if the code timed out.
+        """
+        if not self.ready:
+            # the worker imported the preloaded modules in the meantime, if it
+            # has been idle for long enough
+            self._read_response(time.time() + STARTUP_TIMEOUT)
+            self.ready = True
+
+        try:
+            self.process.stdin.write(json.dumps({
+                'code': code, 'globals': globals_dict, 'timeout': timeout, 'cpu_limit': cpu_limit,
+            }) + '\n')
+            self.process.stdin.flush()
+        except IOError:
+            raise WorkerDied()
+        self.executions += 1
+        return self._read_response(time.time() + timeout + RESPONSE_GRACE)
+
+    def _read_response(self, deadline):
+        """
+        Reads the next response of the worker, which must be complete by the deadline.
+        """
+        stdout = self.process.stdout.fileno()
+        while '\n' not in self._buffer:
+            timeout = deadline - time.time()
+            if timeout <= 0 or not select.select([stdout], [], [], timeout)[0]:
+                raise WorkerTimeout()
+            chunk = os.read(stdout, READ_SIZE)
+            if not chunk:
+                raise WorkerDied()
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split('\n', 1)
+        return json.loads(line)
+
+    def stop(self):
+        """
+        Stops the worker, without waiting for it.
+        """
+        if self.pid != os.getpid():
+            # the worker of the process this one was forked from
+            return
+        try:
+            self.process.stdin.close()
+            # sudo relays SIGTERM to the sandboxed Python, but not SIGKILL
+            self.process.terminate()
+        except (IOError, OSError):
+            pass
+        reaper = threading.Thread(target=self.process.wait, name='safe-exec-pool-reaper')
+        reaper.daemon = True
+        reaper.start()
+
+
+class SafeExecPool(object):
+    """
+    Runs code like `codejail.safe_exec.safe_exec`, in a pool of up to `size`
+    workers, each recycled after `max_executions` executions.
+
+    Executions time out after `timeout` seconds, or the largest number of
+    seconds `slug_timeouts` maps a regex matching their slug to.  If `sandboxed` is
+    false, the workers are unsandboxed Pythons, as with `unsafely`.
+
+    Code needing files from its `python_path` is run by codejail, since the
+    workers can't read them.
+
+    """
+    def __init__(self, size=4, max_executions=100, timeout=5, slug_timeouts=None,
+                 preload=PRELOAD_MODULES, sandboxed=True):
+        self.size = size
+        self.max_executions = max_executions
+        self.timeout = timeout
+        self.slug_timeouts = [
+            (re.compile(pattern), seconds) for pattern, seconds in (slug_timeouts or {}).items()
+        ]
+        self.preload = list(preload)
+        self.sandboxed = sandboxed
+
+        self.executions = 0
+        self.spawned = 0
+        self.recycled = 0
+        self.timeouts = 0
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []
+        self._count = 0
+        self._pid = os.getpid()
+
+    def is_usable(self):
+        """
+        Sandboxed workers need codejail to be configured for python.
+        """
+        return not self.sandboxed or jail_code.is_configured("python")
+
+    def timeout_for(self, slug):
+        """
+        Returns the number of seconds the execution with this slug may take.
+        """
+        matching = [seconds for regex, seconds in self.slug_timeouts if slug and regex.search(slug)]
+        return max(matching) if matching else self.timeout
+
+    def safe_exec(self, code, globals_dict, python_path=None, slug=None):
+        """
+        Executes code in a worker.  Any changes it makes to the globals are
+        visible in `globals_dict` when this function returns.
+
+        Raises SafeExecException if the code raised an exception or timed out.
+
+        """
+        if python_path or not self.is_usable():
+            return codejail_safe_exec(code, globals_dict, python_path=python_path, slug=slug)
+
+        timeout = self.timeout_for(slug)
+        cpu_limit = jail_code.LIMITS.get("CPU") if self.sandboxed else None
+        worker = self._acquire()
+        healthy = False
+        try:
+            response = worker.execute(code, json_safe(globals_dict), timeout, cpu_limit)
+            healthy = True
+        except WorkerTimeout:
+            log.error("safe_exec pool worker stopped responding running %s", slug)
+            response = {'timed_out': True}
+        except (WorkerDied, ValueError):
+            log.error("safe_exec pool worker died running %s", slug)
+            self._record('died')
+            raise SafeExecException("Couldn't execute jailed code: the sandbox exited")
+        finally:
+            self._release(worker, healthy)
+
+        if response.get('timed_out'):
+            self._record('timeout')
+            raise SafeExecException(
+                "Couldn't execute jailed code: timed out after {0} seconds".format(timeout)
+            )
+        self._record('executed')
+        if 'error' in response:
+            raise SafeExecException("Couldn't execute jailed code: {0}".format(response['error']))
+        globals_dict.update(response['globals'])
+
+    def warm(self):
+        """
+        Starts all the workers, so that the first executions don't wait for them.
+        """
+        with self._lock:
+            self._check_pid()
+            missing = self.size - self._count
+            self._count += missing
+        for __ in range(missing):
+            worker = self._spawn()
+            with self._available:
+                self._idle.append(worker)
+                self._available.notify()
+
+    def stop(self):
+        """
+        Stops the idle workers.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for worker in idle:
+            worker.stop()
+
+    def _check_pid(self):
+        """
+        Forgets the workers of the process this one was forked from.  Must be
+        called holding the lock.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._count = 0
+
+    def _command(self):
+        """
+        Returns the command line starting a worker.
+        """
+        if self.sandboxed:
+            python = jail_code.COMMANDS["python"]
+            command = []
+            if python['user']:
+                command.extend(['sudo', '-u', python['user']])
+            command.extend(python['cmdline_start'])
+        else:
+            command = [sys.executable, '-E', '-B']
+        return command + ['-c', WORKER_PY] + self.preload
+
+    def _set_limits(self):
+        """
+        Limits the resources of a sandboxed worker, in the worker process.
+
+        The children running the code get the CPU limit of codejail each.  The
+        worker's own CPU time, spent starting and forking them, adds up over all
+        its executions, so it's allowed that limit for each of them, plus the
+        time to start.
+        """
+        cpu_limit = jail_code.LIMITS.get("CPU")
+        if cpu_limit:
+            cpu_limit *= self.max_executions + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+        vmem_limit = jail_code.LIMITS.get("VMEM")
+        if vmem_limit:
+            resource.setrlimit(resource.RLIMIT_AS, (vmem_limit, vmem_limit))
+
+    def _spawn(self):
+        """
+        Starts a worker.
+        """
+        worker = PoolWorker(self._command(), preexec_fn=self._set_limits if self.sandboxed else None)
+        self._record('spawned')
+        return worker
+
+    def _acquire(self):
+        """
+        Returns an idle worker, starting one if the pool isn't full, or waiting
+        for one to be released.
+        """
+        with self._available:
+            self._check_pid()
+            while not self._idle and self._count >= self.size:
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+
+        try:
+            return self._spawn()
+        except:
+            with self._available:
+                self._count -= 1
+                self._available.notify()
+            raise
+
+    def _release(self, worker, healthy):
+        """
+        Makes the worker available again, or replaces it by a new one if it's
+        broken or has run `max_executions` executions.
+        """
+        if not healthy or worker.executions >= self.max_executions:
+            worker.stop()
+            self._record('recycled')
+            try:
+                # the new worker imports the preloaded modules while it's idle
+                worker = self._spawn()
+            except OSError:
+                log.exception("Couldn't start a safe_exec pool worker")
+                worker = None
+
+        with self._available:
+            if worker is None or worker.pid != os.getpid():
+                self._count -= 1
+            else:
+                self._idle.append(worker)
+            self._available.notify()
+
+    def _record(self, event):
+        """
+        Counts a pool event, both in process and in datadog.
+        """
+        with self._lock:
+            if event == 'executed':
+                self.executions += 1
+            elif event == 'spawned':
+                self.spawned += 1
+            elif event == 'recycled':
+                self.recycled += 1
+            elif event == 'timeout':
+                self.timeouts += 1
+        dog_stats_api.increment('capa.safe_exec.pool', tags=[u'event:{}'.format(event)])
+
+    def stats(self):
+        """
+        Returns the number of executions, and of workers spawned, recycled and
+        timed out in this process.
+        """
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'spawned': self.spawned,
+                'recycled': self.recycled,
+                'timeouts': self.timeouts,
+                'idle': len(self._idle),
+            }
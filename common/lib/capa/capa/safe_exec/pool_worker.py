@@ -0,0 +1,142 @@
+"""
+The main loop of a safe_exec pool worker.
+
+This file isn't imported: its source is run by the sandboxed Python, which
+can't import capa.  The worker imports the modules problems use once, then
+reads requests from stdin and writes responses to stdout, both JSON documents,
+one per line.
+
+The worker never runs code itself: it forks a child per request, which closes
+the request and response streams before running the code, and reports back
+through a pipe of its own.  Each piece of code thus starts from the pristine
+worker, whatever the code before it did to its modules, and can't reach the
+requests or responses of other executions.
+"""
+# pylint: disable=broad-except, exec-used
+
+import json
+import os
+import resource
+import select
+import signal
+import sys
+import time
+import traceback
+from StringIO import StringIO
+
+READ_SIZE = 64 * 1024
+
+
+def main(preload):
+    """
+    Serve execution requests until stdin is closed.
+    """
+    # The code being run mustn't be able to garble the requests and responses.
+    requests = os.fdopen(os.dup(0), 'r')
+    responses = os.fdopen(os.dup(1), 'w')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+    for module_name in preload:
+        try:
+            __import__(module_name)
+        except Exception:
+            pass
+
+    respond(responses, {'ready': True})
+
+    while True:
+        line = requests.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        respond(responses, fork_and_run(request, [requests, responses]))
+
+
+def fork_and_run(request, protocol_files):
+    """
+    Runs the code of request in a forked child, which closes `protocol_files`
+    first, and returns its response.
+    """
+    result_fd, child_result_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            for protocol_file in protocol_files:
+                protocol_file.close()
+            os.close(result_fd)
+            if request.get('cpu_limit'):
+                # a forked child starts with no CPU time used
+                resource.setrlimit(resource.RLIMIT_CPU, (request['cpu_limit'], request['cpu_limit']))
+            result = json.dumps(run(request['code'], request['globals']))
+            while result:
+                result = result[os.write(child_result_fd, result):]
+        except BaseException:
+            status = 1
+        os._exit(status)  # pylint: disable=protected-access
+
+    os.close(child_result_fd)
+    try:
+        return read_result(pid, result_fd, time.time() + request['timeout'])
+    finally:
+        os.close(result_fd)
+        os.waitpid(pid, 0)
+
+
+def read_result(pid, result_fd, deadline):
+    """
+    Reads the result the child `pid` writes to `result_fd` before exiting,
+    killing it if it's still running at the deadline.
+    """
+    chunks = []
+    while True:
+        timeout = deadline - time.time()
+        if timeout <= 0 or not select.select([result_fd], [], [], timeout)[0]:
+            os.kill(pid, signal.SIGKILL)
+            return {'error': 'timed out', 'timed_out': True}
+        chunk = os.read(result_fd, READ_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    try:
+        return json.loads(''.join(chunks))
+    except ValueError:
+        return {'error': 'the jailed code exited without a result'}
+
+
+def run(code, globals_dict):
+    """
+    Run code with the given globals, returning the JSON-safe globals it leaves
+    behind, or the traceback of the exception it raised.
+    """
+    sys.stdout = StringIO()
+    try:
+        exec compile(code, "<jailed code>", "exec", 0, True) in globals_dict
+    except (Exception, SystemExit):
+        return {'error': traceback.format_exc()}
+
+    output = {}
+    for name, value in globals_dict.iteritems():
+        if name == '__builtins__':
+            continue
+        try:
+            json.dumps(value)
+        except Exception:
+            continue
+        output[name] = value
+    return {'globals': output}
+
+
+def respond(responses, response):
+    """
+    Writes a response as a line of JSON.
+    """
+    responses.write(json.dumps(response) + '\n')
+    responses.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
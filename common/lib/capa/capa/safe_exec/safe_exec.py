@@ -7,6 +7,7 @@ from . import lazymod
 from dogapi import dog_stats_api
 
 import hashlib
+import re
 
 # Establish the Python environment for Capa.
 # Capa assumes float-friendly division always.
@@ -46,6 +47,19 @@ for name, modname in ASSUMED_IMPORTS:
 
 LAZY_IMPORTS = "".join(LAZY_IMPORTS)
 
+# The `SafeExecPool` running sandboxed code, if any.  See `configure_pool`.
+POOL = None
+
+# Anything the code could use to refer to a global by name
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Names through which code can reach globals without spelling out their names,
+# e.g. globals()['anonymous_' + 'student_id']
+DYNAMIC_ACCESS_NAMES = frozenset([
+    'globals', 'vars', 'locals', 'eval', 'exec', 'execfile', 'compile', 'getattr',
+    '__import__', '__main__', '__dict__', 'f_globals',
+])
+
 
 def update_hash(hasher, obj):
     """
@@ -70,6 +84,55 @@ def update_hash(hasher, obj):
         hasher.update(repr(obj))
 
 
+def configure_pool(pool):
+    """
+    Run the sandboxed code in the workers of `pool`, a `SafeExecPool`, instead
+    of a new sandboxed process each time.  None goes back to new processes.
+    """
+    global POOL  # pylint: disable=global-statement
+    POOL = pool
+
+
+def looks_up_globals_dynamically(code):
+    """
+    Returns whether `code` could read globals without spelling out their names.
+    """
+    return not DYNAMIC_ACCESS_NAMES.isdisjoint(IDENTIFIER_RE.findall(code))
+
+
+def unreferenced_globals(code, globals_dict):
+    """
+    Returns the names of the globals in `globals_dict` that `code` never mentions.
+
+    The code can't read or change these globals, so they are left out of the
+    cache key and the cached result: e.g. problems which don't use
+    `anonymous_student_id` share their cached results between students.
+
+    Code which could look up globals dynamically is considered to reference
+    all of them.
+
+    """
+    if looks_up_globals_dynamically(code):
+        return set()
+    mentioned = set(IDENTIFIER_RE.findall(code))
+    return set(name for name in globals_dict if name not in mentioned)
+
+
+def cache_key(code, globals_dict, random_seed):
+    """
+    Returns the key of the cached result of running `code` with `globals_dict`
+    and `random_seed`, canonicalizing the globals at every level.
+    """
+    ignored = unreferenced_globals(code, globals_dict)
+    safe_globals = json_safe(dict(
+        (name, value) for name, value in globals_dict.iteritems() if name not in ignored
+    ))
+    md5er = hashlib.md5()
+    md5er.update(repr(code))
+    update_hash(md5er, safe_globals)
+    return "safe_exec.%r.%s" % (random_seed, md5er.hexdigest())
+
+
 @dog_stats_api.timed('capa.safe_exec.time')
 def safe_exec(code, globals_dict, random_seed=None, python_path=None, cache=None, slug=None, unsafely=False):
     """
@@ -83,9 +146,9 @@ def safe_exec(code, globals_dict, random_seed=None, python_path=None, cache=None
 
     `python_path` is a list of directories to add to the Python path before execution.
 
-    `cache` is an object with .get(key) and .set(key, value) methods.  It will be used
-    to cache the execution, taking into account the code, the values of the globals,
-    and the random seed.
+    `cache` is an object with .get(key) and .set(key, value) methods, e.g. a
+    `SafeExecCache`.  It will be used to cache the execution, taking into account
+    the code, the values of the globals it mentions, and the random seed.
 
     `slug` is an arbitrary string, a description that's meaningful to the
     caller, that will be used in log messages.
@@ -95,11 +158,8 @@ def safe_exec(code, globals_dict, random_seed=None, python_path=None, cache=None
     """
     # Check the cache for a previous result.
     if cache:
-        safe_globals = json_safe(globals_dict)
-        md5er = hashlib.md5()
-        md5er.update(repr(code))
-        update_hash(md5er, safe_globals)
-        key = "safe_exec.%r.%s" % (random_seed, md5er.hexdigest())
+        ignored = unreferenced_globals(code, globals_dict)
+        key = cache_key(code, globals_dict, random_seed)
         cached = cache.get(key)
         if cached is not None:
             # We have a cached result.  The result is a pair: the exception
@@ -116,24 +176,31 @@ def safe_exec(code, globals_dict, random_seed=None, python_path=None, cache=None
     # Decide which code executor to use.
     if unsafely:
         exec_fn = codejail_not_safe_exec
+    elif POOL is not None:
+        exec_fn = POOL.safe_exec
     else:
         exec_fn = codejail_safe_exec
 
     # Run the code!  Results are side effects in globals_dict.
     try:
-        exec_fn(
-            code_prolog + LAZY_IMPORTS + code, globals_dict,
-            python_path=python_path, slug=slug,
-        )
+        with dog_stats_api.timer('capa.safe_exec.exec_time', tags=[u'unsafely:{}'.format(bool(unsafely))]):
+            exec_fn(
+                code_prolog + LAZY_IMPORTS + code, globals_dict,
+                python_path=python_path, slug=slug,
+            )
     except SafeExecException as e:
         emsg = e.message
     else:
         emsg = None
 
     # Put the result back in the cache.  This is complicated by the fact that
-    # the globals dict might not be entirely serializable.
+    # the globals dict might not be entirely serializable.  The globals the code
+    # doesn't mention are left out, so that a cache hit doesn't overwrite them
+    # with the values of whoever ran the code first.
     if cache:
-        cleaned_results = json_safe(globals_dict)
+        cleaned_results = json_safe(dict(
+            (name, value) for name, value in globals_dict.iteritems() if name not in ignored
+        ))
         cache.set(key, (emsg, cleaned_results))
 
     # If an exception happened, raise it now.
@@ -0,0 +1,116 @@
+"""Test pool.py"""
+
+import math
+import random
+import unittest
+
+from capa.safe_exec import safe_exec, configure_pool, SafeExecPool
+from codejail.safe_exec import SafeExecException
+
+
+class TestSafeExecPool(unittest.TestCase):
+    """Test running safe_exec code in a pool of unsandboxed workers."""
+
+    def setUp(self):
+        self.pool = SafeExecPool(
+            size=2, max_executions=3, timeout=10, slug_timeouts={'slow': 0.5},
+            preload=['math'], sandboxed=False,
+        )
+        configure_pool(self.pool)
+        self.addCleanup(configure_pool, None)
+        self.addCleanup(self.pool.stop)
+
+    def test_set_values(self):
+        g = {'a': 17}
+        safe_exec("b = a + 1\nc = 1/2", g)
+        self.assertEqual(g, {'a': 17, 'b': 18, 'c': 0.5})
+
+    def test_random_seeding(self):
+        r = random.Random(17)
+        rnums = [r.randint(0, 999) for _ in xrange(100)]
+
+        # Each execution gets its own seeded random, even in the same worker.
+        for _ in xrange(2):
+            g = {}
+            safe_exec("rnums = [random.randint(0, 999) for _ in xrange(100)]", g, random_seed=17)
+            self.assertEqual(g['rnums'], rnums)
+
+    def test_raising_exceptions(self):
+        with self.assertRaises(SafeExecException) as cm:
+            safe_exec("1/0", {})
+        self.assertIn("ZeroDivisionError", cm.exception.message)
+
+        # The worker survives exceptions, even SystemExit.
+        with self.assertRaises(SafeExecException):
+            safe_exec("import sys\nsys.exit(1)", {})
+        g = {}
+        safe_exec("a = int(math.pi)", g)
+        self.assertEqual(g['a'], 3)
+
+    def test_printing(self):
+        g = {}
+        safe_exec("print 'hello'\na = 1", g)
+        self.assertEqual(g['a'], 1)
+
+    def test_slug_timeout(self):
+        with self.assertRaisesRegexp(SafeExecException, "timed out after 0.5 seconds"):
+            safe_exec("while True: pass", {}, slug="slow_problem")
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+
+        # The worker killed the stuck execution, and runs the next one.
+        g = {}
+        safe_exec("a = 1", g, slug="slow_problem")
+        self.assertEqual(g['a'], 1)
+        self.assertEqual(self.pool.stats()['spawned'], 1)
+
+    def test_isolation(self):
+        # Changes the code makes to modules don't outlive its execution.
+        safe_exec("math.pi = 3\nimport fractions\nfractions.gcd = None", {})
+        g = {}
+        safe_exec("a = math.pi\nimport fractions\nb = fractions.gcd(4, 6)", g)
+        self.assertEqual(g['a'], math.pi)
+        self.assertEqual(g['b'], 2)
+        self.assertEqual(self.pool.stats()['spawned'], 1)
+
+    def test_protocol_unreachable(self):
+        # The code can't forge the responses of the worker.
+        forge = (
+            "import os\n"
+            "for fd in range(3, 256):\n"
+            "    try:\n"
+            "        os.write(fd, '{\"globals\": {\"a\": \"forged\"}}\\n')\n"
+            "    except OSError:\n"
+            "        pass\n"
+        )
+        try:
+            safe_exec(forge, {})
+        except SafeExecException:
+            pass
+        g = {}
+        safe_exec("a = 1", g)
+        self.assertEqual(g['a'], 1)
+
+    def test_recycling(self):
+        for i in xrange(7):
+            g = {}
+            safe_exec("a = {0}".format(i), g)
+            self.assertEqual(g['a'], i)
+        stats = self.pool.stats()
+        self.assertEqual(stats['executions'], 7)
+        self.assertEqual(stats['recycled'], 2)
+        self.assertEqual(stats['spawned'], 3)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_warm(self):
+        self.pool.warm()
+        self.assertEqual(self.pool.stats()['idle'], 2)
+        self.assertEqual(self.pool.stats()['spawned'], 2)
+        safe_exec("a = 1", {})
+        self.assertEqual(self.pool.stats()['spawned'], 2)
+
+    def test_timeout_for(self):
+        pool = SafeExecPool(timeout=5, slug_timeouts={'^i4x://MITx/': 10, 'big': 20})
+        self.assertEqual(pool.timeout_for(None), 5)
+        self.assertEqual(pool.timeout_for('i4x://edX/'), 5)
+        self.assertEqual(pool.timeout_for('i4x://MITx/'), 10)
+        self.assertEqual(pool.timeout_for('i4x://MITx/big'), 20)
@@ -9,7 +9,7 @@ import unittest
 
 from nose.plugins.skip import SkipTest
 
-from capa.safe_exec import safe_exec, update_hash
+from capa.safe_exec import safe_exec, update_hash, SafeExecCache
 from codejail.safe_exec import SafeExecException
 from codejail.jail_code import is_configured
 
@@ -176,6 +176,93 @@ class TestSafeExecCaching(unittest.TestCase):
             except UnicodeEncodeError:
                 self.fail("Tried executing code with non-ASCII unicode: {0}".format(code))
 
+    def test_unmentioned_globals(self):
+        # Globals the code doesn't mention don't change the key, and aren't
+        # overwritten by the cached result.
+        cache = {}
+        g = {'a': 1, 'anonymous_student_id': 'student1'}
+        safe_exec("b = a + 1", g, cache=DictCache(cache))
+        self.assertEqual(cache.values()[0], (None, {'a': 1, 'b': 2}))
+
+        cache[cache.keys()[0]] = (None, {'a': 1, 'b': 17})
+        g = {'a': 1, 'anonymous_student_id': 'student2'}
+        safe_exec("b = a + 1", g, cache=DictCache(cache))
+        self.assertEqual(g, {'a': 1, 'b': 17, 'anonymous_student_id': 'student2'})
+
+        # A mentioned global is part of the key.
+        g = {'a': 2, 'anonymous_student_id': 'student2'}
+        safe_exec("b = a + 1", g, cache=DictCache(cache))
+        self.assertEqual(g['b'], 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_dynamically_accessed_globals(self):
+        # Code which can look up globals without naming them is keyed on all of them.
+        cache = {}
+        code = "b = globals()['anonymous_' + 'student_id']"
+        g = {'anonymous_student_id': 'student1'}
+        safe_exec(code, g, cache=DictCache(cache))
+        self.assertEqual(g['b'], 'student1')
+
+        g = {'anonymous_student_id': 'student2'}
+        safe_exec(code, g, cache=DictCache(cache))
+        self.assertEqual(g['b'], 'student2')
+        self.assertEqual(len(cache), 2)
+
+
+class TestSafeExecCache(unittest.TestCase):
+    """Test the two tiers of SafeExecCache."""
+
+    def test_local_then_shared(self):
+        shared = {}
+        cache = SafeExecCache(DictCache(shared), max_size=10)
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', (None, {'a': [1]}))
+        self.assertEqual(shared['key'], (None, {'a': [1]}))
+
+        # The in-process copy isn't changed by changes to the results.
+        result = cache.get('key')
+        result[1]['a'].append(2)
+        self.assertEqual(cache.get('key'), (None, {'a': [1]}))
+
+        # Another process only has the shared tier.
+        other = SafeExecCache(DictCache(shared), max_size=10)
+        self.assertEqual(other.get('key'), (None, {'a': [1]}))
+        self.assertEqual(other.get('key'), (None, {'a': [1]}))
+
+        self.assertEqual(cache.stats(), {
+            'local_hits': 2, 'shared_hits': 0, 'misses': 1, 'hit_rate': 2.0 / 3, 'local_size': 1,
+        })
+        self.assertEqual(other.stats(), {
+            'local_hits': 1, 'shared_hits': 1, 'misses': 0, 'hit_rate': 1.0, 'local_size': 1,
+        })
+
+    def test_lru_eviction(self):
+        cache = SafeExecCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_no_local_tier(self):
+        shared = {}
+        cache = SafeExecCache(DictCache(shared), max_size=0)
+        cache.set('key', 1)
+        self.assertEqual(cache.get('key'), 1)
+        self.assertEqual(cache.stats()['local_size'], 0)
+        self.assertEqual(cache.stats()['shared_hits'], 1)
+
+    def test_safe_exec(self):
+        cache = SafeExecCache(max_size=10)
+        g = {}
+        safe_exec("a = int(math.pi)", g, cache=cache)
+        safe_exec("a = int(math.pi)", g, cache=cache)
+        self.assertEqual(g['a'], 3)
+        self.assertEqual(cache.stats()['local_hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
 
 class TestUpdateHash(unittest.TestCase):
     """Test the safe_exec.update_hash function to be sure it canonicalizes properly."""
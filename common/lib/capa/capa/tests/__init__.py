@@ -45,6 +45,7 @@ def test_capa_system():
         filestore=fs.osfs.OSFS(os.path.join(TEST_DIR, "test_files")),
         i18n=gettext.NullTranslations(),
         node_path=os.environ.get("NODE_PATH", "/usr/local/lib/node_modules"),
+        problem_cache=None,
         render_template=tst_render_template,
         seed=0,
         STATIC_URL='/dummy-static/',
@@ -0,0 +1,108 @@
+"""
+Tests of sharing the parsed problems between LoncapaProblem instances.
+"""
+import textwrap
+import unittest
+
+import mock
+
+from capa.capa_problem import ProblemTemplateCache
+from capa.correctmap import CorrectMap
+from . import test_capa_system, new_loncapa_problem
+
+
+class ProblemTemplateCacheTest(unittest.TestCase):
+    """
+    Test building problems from the problem cache.
+    """
+    xml = textwrap.dedent("""
+        <problem>
+            <script type="loncapa/python">
+        x = random.randint(1, 100)
+        words = ['one', 'two']
+            </script>
+            <p>What is $x + 1?</p>
+            <customresponse cfn="check">
+                <textline size="10"/>
+            </customresponse>
+            <script type="loncapa/python">
+        def check(expect, ans):
+            return int(ans) == x + 1
+            </script>
+            <numericalresponse answer="$x">
+                <textline/>
+            </numericalresponse>
+        </problem>
+    """)
+
+    def setUp(self):
+        super(ProblemTemplateCacheTest, self).setUp()
+        self.problem_cache = ProblemTemplateCache()
+
+    def new_problem(self, xml=None, seed=723, anonymous_student_id='student'):
+        """
+        Returns a new problem built with the problem cache.
+        """
+        capa_system = test_capa_system()
+        capa_system.problem_cache = self.problem_cache
+        capa_system.anonymous_student_id = anonymous_student_id
+        return new_loncapa_problem(xml or self.xml, capa_system=capa_system, seed=seed)
+
+    def test_template_reused(self):
+        uncached = new_loncapa_problem(self.xml)
+        first = self.new_problem()
+        with mock.patch('capa.capa_problem.safe_exec') as mock_safe_exec:
+            second = self.new_problem()
+        self.assertFalse(mock_safe_exec.called)
+        self.assertEqual(self.problem_cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+        for problem in (first, second):
+            self.assertEqual(problem.context['x'], uncached.context['x'])
+            self.assertEqual(problem.get_html(), uncached.get_html())
+            self.assertEqual(problem.get_question_answers(), uncached.get_question_answers())
+
+    def test_problems_independent(self):
+        first = self.new_problem()
+        second = self.new_problem(anonymous_student_id='other')
+        self.assertEqual(second.context['anonymous_student_id'], 'other')
+
+        first.context['words'].append('three')
+        self.assertEqual(second.context['words'], ['one', 'two'])
+        self.assertIsNot(first.tree, second.tree)
+
+        # Grading one student doesn't affect the other.
+        answer = str(first.context['x'] + 1)
+        first.grade_answers({'1_2_1': answer, '1_3_1': answer})
+        self.assertTrue(first.correct_map.is_correct('1_2_1'))
+        self.assertEqual(second.correct_map.get_dict(), CorrectMap().get_dict())
+
+    def test_key(self):
+        self.new_problem()
+        self.new_problem(seed=724)
+        self.new_problem(xml=self.xml.replace('$x + 1', '$x + 2'))
+        self.assertEqual(self.problem_cache.stats()['misses'], 3)
+
+        # The anonymous student id only matters to scripts using it.
+        self.new_problem(anonymous_student_id='other')
+        self.assertEqual(self.problem_cache.stats()['hits'], 1)
+
+        xml = self.xml.replace("words = ['one', 'two']", "words = [anonymous_student_id]")
+        first = self.new_problem(xml=xml)
+        second = self.new_problem(xml=xml, anonymous_student_id='other')
+        self.assertEqual(first.context['words'], ['student'])
+        self.assertEqual(second.context['words'], ['other'])
+
+        # Nor can scripts looking it up without naming it share templates.
+        xml = self.xml.replace("words = ['one', 'two']", "words = [globals()['anonymous_' + 'student_id']]")
+        first = self.new_problem(xml=xml)
+        second = self.new_problem(xml=xml, anonymous_student_id='other')
+        self.assertEqual(first.context['words'], ['student'])
+        self.assertEqual(second.context['words'], ['other'])
+
+    def test_lru_eviction(self):
+        self.problem_cache = ProblemTemplateCache(max_size=2)
+        for seed in (1, 2, 1, 3):
+            self.new_problem(seed=seed)
+        self.assertEqual(self.problem_cache.stats(), {'hits': 1, 'misses': 3, 'size': 2})
+        self.new_problem(seed=2)
+        self.assertEqual(self.problem_cache.stats()['misses'], 4)
@@ -19,7 +19,7 @@ except ImportError:
 
 from pkg_resources import resource_string
 
-from capa.capa_problem import LoncapaProblem, LoncapaSystem
+from capa.capa_problem import LoncapaProblem, LoncapaSystem, ProblemTemplateCache
 from capa.responsetypes import StudentInputError, \
     ResponseError, LoncapaProblemError
 from capa.util import convert_files_to_filenames
@@ -41,6 +41,9 @@ NUM_RANDOMIZATION_BINS = 20
 # Never produce more than this many different seeds, no matter what.
 MAX_RANDOMIZATION_BINS = 1000
 
+# Problems parsed by this process, shared by the students getting the same random seed.
+PROBLEM_TEMPLATE_CACHE = ProblemTemplateCache()
+
 
 def randomization_bin(seed, problem_id):
     """
@@ -57,6 +60,48 @@ def randomization_bin(seed, problem_id):
     return int(r_hash.hexdigest()[:7], 16) % NUM_RANDOMIZATION_BINS
 
 
+def unmask_event(lcp, event_info):
+    """
+    Translates in-place the event_info of a problem `lcp` to account for
+    masking and adds information about permutation options in force.
+    """
+    # answers is like: {u'i4x-Stanford-CS99-problem-dada976e76f34c24bc8415039dee1300_2_1': u'mask_0'}
+    # Each response values has an answer_id which matches the key in answers.
+    for response in lcp.responders.values():
+        # Un-mask choice names in event_info for masked responses.
+        if response.has_mask():
+            # We don't assume much about the structure of event_info,
+            # but check for the existence of the things we need to un-mask.
+
+            # Look for answers/id
+            answer = event_info.get('answers', {}).get(response.answer_id)
+            if answer is not None:
+                event_info['answers'][response.answer_id] = response.unmask_name(answer)
+
+            # Look for state/student_answers/id
+            answer = event_info.get('state', {}).get('student_answers', {}).get(response.answer_id)
+            if answer is not None:
+                event_info['state']['student_answers'][response.answer_id] = response.unmask_name(answer)
+
+            # Look for old_state/student_answers/id  -- parallel to the above case, happens on reset
+            answer = event_info.get('old_state', {}).get('student_answers', {}).get(response.answer_id)
+            if answer is not None:
+                event_info['old_state']['student_answers'][response.answer_id] = response.unmask_name(answer)
+
+        # Add 'permutation' to event_info for permuted responses.
+        permutation_option = None
+        if response.has_shuffle():
+            permutation_option = 'shuffle'
+        elif response.has_answerpool():
+            permutation_option = 'answerpool'
+
+        if permutation_option is not None:
+            # Add permutation record tuple: (one of:'shuffle'/'answerpool', [as-displayed list])
+            if not 'permutation' in event_info:
+                event_info['permutation'] = {}
+            event_info['permutation'][response.answer_id] = (permutation_option, response.unmask_order())
+
+
 class Randomization(String):
     """
     Define a field to store how to randomize a problem.
@@ -305,7 +350,8 @@ class CapaMixin(CapaFields):
             seed=self.runtime.seed,      # Why do we do this if we have self.seed?
             STATIC_URL=self.runtime.STATIC_URL,
             xqueue=self.runtime.xqueue,
-            matlab_api_key=self.matlab_api_key
+            matlab_api_key=self.matlab_api_key,
+            problem_cache=PROBLEM_TEMPLATE_CACHE,
         )
 
         return LoncapaProblem(
@@ -1075,41 +1121,7 @@ class CapaMixin(CapaFields):
         Translates in-place the event_info to account for masking
         and adds information about permutation options in force.
         """
-        # answers is like: {u'i4x-Stanford-CS99-problem-dada976e76f34c24bc8415039dee1300_2_1': u'mask_0'}
-        # Each response values has an answer_id which matches the key in answers.
-        for response in self.lcp.responders.values():
-            # Un-mask choice names in event_info for masked responses.
-            if response.has_mask():
-                # We don't assume much about the structure of event_info,
-                # but check for the existence of the things we need to un-mask.
-
-                # Look for answers/id
-                answer = event_info.get('answers', {}).get(response.answer_id)
-                if answer is not None:
-                    event_info['answers'][response.answer_id] = response.unmask_name(answer)
-
-                # Look for state/student_answers/id
-                answer = event_info.get('state', {}).get('student_answers', {}).get(response.answer_id)
-                if answer is not None:
-                    event_info['state']['student_answers'][response.answer_id] = response.unmask_name(answer)
-
-                # Look for old_state/student_answers/id  -- parallel to the above case, happens on reset
-                answer = event_info.get('old_state', {}).get('student_answers', {}).get(response.answer_id)
-                if answer is not None:
-                    event_info['old_state']['student_answers'][response.answer_id] = response.unmask_name(answer)
-
-            # Add 'permutation' to event_info for permuted responses.
-            permutation_option = None
-            if response.has_shuffle():
-                permutation_option = 'shuffle'
-            elif response.has_answerpool():
-                permutation_option = 'answerpool'
-
-            if permutation_option is not None:
-                # Add permutation record tuple: (one of:'shuffle'/'answerpool', [as-displayed list])
-                if not 'permutation' in event_info:
-                    event_info['permutation'] = {}
-                event_info['permutation'][response.answer_id] = (permutation_option, response.unmask_order())
+        unmask_event(self.lcp, event_info)
 
     def pretty_print_seconds(self, num_seconds):
         """
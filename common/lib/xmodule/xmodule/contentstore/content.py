@@ -4,6 +4,10 @@ XASSET_SRCREF_PREFIX = 'xasset:'
 
 XASSET_THUMBNAIL_TAIL_NAME = '.jpg'
 
+# Read streamed content in GridFS sized chunks, so that serving a large asset
+# only ever holds one chunk in memory
+STREAM_DATA_CHUNK_SIZE = 256 * 1024
+
 import os
 import logging
 import StringIO
@@ -17,7 +21,7 @@ from PIL import Image
 
 class StaticContent(object):
     def __init__(self, loc, name, content_type, data, last_modified_at=None, thumbnail_location=None, import_path=None,
-                 length=None, locked=False):
+                 length=None, locked=False, content_digest=None):
         self.location = loc
         self.name = name  # a display string which can be edited, and thus not part of the location which needs to be fixed
         self.content_type = content_type
@@ -29,6 +33,8 @@ class StaticContent(object):
         # cycles
         self.import_path = import_path
         self.locked = locked
+        # md5 hex digest of the content, as computed by GridFS on upload
+        self.content_digest = content_digest
 
     @property
     def is_thumbnail(self):
@@ -144,30 +150,64 @@ class StaticContent(object):
     def stream_data(self):
         yield self._data
 
+    def stream_data_in_range(self, first_byte, last_byte):
+        """
+        Yields the bytes from first_byte through last_byte (inclusive) of the content.
+        """
+        yield self._data[first_byte:last_byte + 1]
+
 
 class StaticContentStream(StaticContent):
     def __init__(self, loc, name, content_type, stream, last_modified_at=None, thumbnail_location=None, import_path=None,
-                 length=None, locked=False):
+                 length=None, locked=False, content_digest=None):
         super(StaticContentStream, self).__init__(loc, name, content_type, None, last_modified_at=last_modified_at,
                                                   thumbnail_location=thumbnail_location, import_path=import_path,
-                                                  length=length, locked=locked)
+                                                  length=length, locked=locked, content_digest=content_digest)
         self._stream = stream
 
     def stream_data(self):
+        self._stream.seek(0)
         while True:
-            chunk = self._stream.read(1024)
+            chunk = self._stream.read(STREAM_DATA_CHUNK_SIZE)
             if len(chunk) == 0:
                 break
             yield chunk
 
+    def stream_data_in_range(self, first_byte, last_byte):
+        """
+        Yields the bytes from first_byte through last_byte (inclusive) of the content.
+
+        Seeking a GridFS file only loads the chunk holding the new position, so
+        the bytes before the range are never read from the database.
+        """
+        self._stream.seek(first_byte)
+        remaining = last_byte - first_byte + 1
+        while remaining > 0:
+            chunk = self._stream.read(min(STREAM_DATA_CHUNK_SIZE, remaining))
+            if len(chunk) == 0:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
     def close(self):
         self._stream.close()
 
+    def with_stream(self, stream):
+        """
+        Returns a copy of this content which reads its data from the given stream.
+        """
+        return StaticContentStream(
+            self.location, self.name, self.content_type, stream, last_modified_at=self.last_modified_at,
+            thumbnail_location=self.thumbnail_location, import_path=self.import_path, length=self.length,
+            locked=self.locked, content_digest=self.content_digest
+        )
+
     def copy_to_in_mem(self):
         self._stream.seek(0)
         content = StaticContent(self.location, self.name, self.content_type, self._stream.read(),
                                 last_modified_at=self.last_modified_at, thumbnail_location=self.thumbnail_location,
-                                import_path=self.import_path, length=self.length, locked=self.locked)
+                                import_path=self.import_path, length=self.length, locked=self.locked,
+                                content_digest=self.content_digest)
         return content
 
 
@@ -175,6 +215,9 @@ class ContentStore(object):
     '''
     Abstraction for all ContentStore providers (e.g. MongoDB)
     '''
+    # an optional AssetDiskCache keeping local copies of large assets
+    disk_cache = None
+
     def save(self, content):
         raise NotImplementedError
 
@@ -0,0 +1,324 @@
+"""
+A size-bounded, least recently used cache of static assets on local disk.
+
+Memcache only holds small assets, so without this tier every request for a large
+asset streams it out of GridFS. Each cached file is named after the md5 digest
+GridFS computed for the asset, inside a directory named after the asset, so a
+re-uploaded asset can never be served from a stale file; the content store still
+invalidates the asset's directory on save and delete to reclaim the space.
+
+A cache miss doesn't hold up the request: it's served from GridFS while the asset
+is copied to disk in a background thread, once per asset across threads and
+processes, so later requests are served from disk.
+"""
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+# We don't want to force a dependency on datadog, so make the import conditional
+try:
+    from dogapi import dog_stats_api
+except ImportError:
+    # pylint: disable=invalid-name
+    dog_stats_api = None
+
+log = logging.getLogger(__name__)
+
+# the fields identifying an asset, both in its location and its GridFS id
+ASSET_KEY_FIELDS = ['category', 'name', 'course', 'tag', 'org', 'revision']
+
+PARTIAL_PREFIX = '.partial-'
+
+# a partial file older than this many seconds was left behind by a copy that died
+PARTIAL_TIMEOUT = 10 * 60
+
+# files served in the last this many seconds are never evicted, so that a path
+# returned by `get` is still there when the caller (or the web server) opens it
+EVICTION_GRACE = 60
+
+# the cache is rescanned at least this often, to account for the files other
+# processes added since the last scan
+EVICTION_INTERVAL = 60
+
+# eviction frees space down to this fraction of `max_size`, so that it runs once
+# per many copies rather than on every one
+EVICTION_TARGET = 0.9
+
+
+class AssetDiskCache(object):
+    """
+    Caches the content of static assets as files under `root`, evicting the least
+    recently served files once they take more than `max_size` bytes.
+
+    If `sendfile_header` is set (e.g. 'X-Accel-Redirect' for nginx or 'X-Sendfile'
+    for Apache), cached files should be handed over to the web server by setting
+    that header to `sendfile_url(path)`, which replaces `root` by `sendfile_root`.
+    """
+    def __init__(self, root, max_size=1024 * 1024 * 1024, sendfile_header=None, sendfile_root=None):
+        self.root = root
+        self.max_size = max_size
+        self.sendfile_header = sendfile_header
+        self.sendfile_root = sendfile_root if sendfile_root is not None else root
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # the paths this process is copying to
+        self._filling = set()
+        # the size of the cache as of the last scan, plus what this process copied since
+        self._size = None
+        self._scanned_at = None
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _asset_dir(self, asset_key):
+        """
+        Returns the directory holding the cached files of an asset, given its location or GridFS id.
+        """
+        if isinstance(asset_key, dict):
+            fields = [asset_key.get(field) for field in ASSET_KEY_FIELDS]
+        else:
+            fields = [getattr(asset_key, field) for field in ASSET_KEY_FIELDS]
+        key = u'/'.join(unicode(field) for field in fields)
+        return os.path.join(self.root, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def path_to(self, asset_key, content_digest):
+        """
+        Returns the path of the cached file of the given version of an asset.
+        """
+        return os.path.join(self._asset_dir(asset_key), content_digest)
+
+    def sendfile_url(self, path):
+        """
+        Returns the value of `sendfile_header` which has the web server serve the cached file at path.
+        """
+        return self.sendfile_root.rstrip('/') + '/' + os.path.relpath(path, self.root)
+
+    def _cacheable(self, content):
+        """
+        Returns whether content can be cached on disk.
+        """
+        return content.content_digest is not None and content.length is not None and content.length <= self.max_size
+
+    def get(self, content, reload_content=None):
+        """
+        Returns the path of the cached copy of content (a `StaticContentStream`),
+        or None if it isn't cached (yet).
+
+        On a cache miss, if `reload_content` is given, the content is copied to
+        disk in the background from the fresh `StaticContentStream` it returns,
+        since the caller keeps reading its own stream.
+        """
+        if not self._cacheable(content):
+            return None
+
+        path = self.path_to(content.location, content.content_digest)
+        try:
+            # the modification time is the clock of the LRU eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        else:
+            self._record('hit')
+            return path
+
+        self._record('miss')
+        if reload_content is not None:
+            self._start_fill(path, reload_content)
+        return None
+
+    def _start_fill(self, path, reload_content):
+        """
+        Starts copying the content returned by `reload_content` to path in a
+        background thread, unless this process is already copying it.
+        """
+        with self._lock:
+            if path in self._filling:
+                return
+            self._filling.add(path)
+
+        def fill():
+            """
+            Copies the content to path.
+            """
+            try:
+                content = reload_content()
+                try:
+                    self.fill(content)
+                finally:
+                    content.close()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Couldn't cache %s on disk", path)
+            finally:
+                with self._lock:
+                    self._filling.discard(path)
+
+        thread = threading.Thread(target=fill, name='asset-disk-cache-fill')
+        thread.daemon = True
+        thread.start()
+
+    def fill(self, content):
+        """
+        Copies content (a `StaticContentStream`) to disk, and returns the path of
+        its cached copy. Returns None if the content can't be cached, or another
+        process is copying it already.
+        """
+        if not self._cacheable(content):
+            return None
+
+        path = self.path_to(content.location, content.content_digest)
+        if os.path.exists(path):
+            return path
+        try:
+            copied = self._copy_to_disk(content, path)
+        except (IOError, OSError):
+            log.exception("Couldn't cache %s on disk", content.location)
+            return None
+        if not copied:
+            return None
+        self._added(content.length)
+        return path
+
+    def _copy_to_disk(self, content, path):
+        """
+        Writes the content to path, making it visible only once it's complete.
+
+        The partial file is named after the version of the asset and created
+        exclusively, so that concurrent misses copy the asset only once. Returns
+        whether the content was copied.
+        """
+        asset_dir = os.path.dirname(path)
+        if not os.path.isdir(asset_dir):
+            try:
+                os.makedirs(asset_dir)
+            except OSError:
+                # another process may have created it in the meantime
+                if not os.path.isdir(asset_dir):
+                    raise
+        partial_path = os.path.join(asset_dir, PARTIAL_PREFIX + os.path.basename(path))
+        try:
+            partial_fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+            # another process is copying it, unless it died doing so
+            try:
+                if os.stat(partial_path).st_mtime < time.time() - PARTIAL_TIMEOUT:
+                    os.remove(partial_path)
+            except OSError:
+                pass
+            return False
+        try:
+            with os.fdopen(partial_fd, 'wb') as partial_file:
+                # the content is streamed in chunks, so copying a large asset has bounded memory
+                for chunk in content.stream_data():
+                    partial_file.write(chunk)
+            os.rename(partial_path, path)
+        except:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return True
+
+    def _added(self, size):
+        """
+        Accounts for a file of the given size added to the cache, and evicts
+        files if the cache may no longer fit in `max_size`.
+        """
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            must_evict = self._size is None or self._size > self.max_size or \
+                self._scanned_at < time.time() - EVICTION_INTERVAL
+        if must_evict:
+            self.evict()
+
+    def invalidate(self, asset_key):
+        """
+        Removes all the cached versions of an asset, given its location or GridFS id.
+        """
+        asset_dir = self._asset_dir(asset_key)
+        removed_size = 0
+        for __, size, __ in self._scan_dir(asset_dir):
+            removed_size += size
+        shutil.rmtree(asset_dir, ignore_errors=True)
+        with self._lock:
+            if self._size is not None:
+                self._size = max(self._size - removed_size, 0)
+
+    def _scan_dir(self, asset_dir):
+        """
+        Yields (modification time, size, path) of the complete cached files in an asset directory.
+        """
+        try:
+            filenames = os.listdir(asset_dir)
+        except OSError:
+            return
+        for filename in filenames:
+            if filename.startswith(PARTIAL_PREFIX):
+                continue
+            path = os.path.join(asset_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """
+        Scans the cache, and if it takes more than `max_size`, removes the least
+        recently served files until it takes at most `EVICTION_TARGET` of it.
+        Files served in the last `EVICTION_GRACE` seconds are kept.
+        """
+        scanned_at = time.time()
+        entries = []
+        for asset_dir in os.listdir(self.root):
+            entries.extend(self._scan_dir(os.path.join(self.root, asset_dir)))
+
+        total_size = sum(size for __, size, __ in entries)
+        if total_size > self.max_size:
+            target_size = self.max_size * EVICTION_TARGET
+            for __, size, path in sorted(entries):
+                if total_size <= target_size:
+                    break
+                try:
+                    # it may have been served since the scan
+                    if os.stat(path).st_mtime >= time.time() - EVICTION_GRACE:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    # evicted by another process
+                    pass
+                total_size -= size
+                self._record('eviction')
+
+        with self._lock:
+            self._size = total_size
+            self._scanned_at = scanned_at
+
+    def _record(self, result):
+        """
+        Counts a cache hit, miss or eviction, both in process and in datadog.
+        """
+        with self._lock:
+            if result == 'hit':
+                self.hits += 1
+            elif result == 'miss':
+                self.misses += 1
+        if dog_stats_api:
+            dog_stats_api.increment('contentstore.disk_cache', tags=[u'result:{}'.format(result)])
+
+    def stats(self):
+        """
+        Returns the hit and miss counts of this process, and the resulting hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else None,
+            }
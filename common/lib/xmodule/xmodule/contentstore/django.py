@@ -3,6 +3,8 @@ from importlib import import_module
 
 from django.conf import settings
 
+from xmodule.contentstore.disk_cache import AssetDiskCache
+
 _CONTENTSTORE = {}
 
 
@@ -25,6 +27,8 @@ def contentstore(name='default'):
         if 'ADDITIONAL_OPTIONS' in settings.CONTENTSTORE:
             if name in settings.CONTENTSTORE['ADDITIONAL_OPTIONS']:
                 options.update(settings.CONTENTSTORE['ADDITIONAL_OPTIONS'][name])
+        if 'DISK_CACHE' in settings.CONTENTSTORE:
+            options['disk_cache'] = AssetDiskCache(**settings.CONTENTSTORE['DISK_CACHE'])
         _CONTENTSTORE[name] = class_(**options)
 
     return _CONTENTSTORE[name]
@@ -18,11 +18,13 @@ from opaque_keys.edx.locations import AssetLocation
 
 class MongoContentStore(ContentStore):
     # pylint: disable=W0613
-    def __init__(self, host, db, port=27017, user=None, password=None, bucket='fs', collection=None, **kwargs):
+    def __init__(self, host, db, port=27017, user=None, password=None, bucket='fs', collection=None,
+                 disk_cache=None, **kwargs):
         """
         Establish the connection with the mongo backend and connect to the collections
 
         :param collection: ignores but provided for consistency w/ other doc_store_config patterns
+        :param disk_cache: an optional AssetDiskCache keeping local copies of large assets
         """
         logging.debug('Using MongoDB for static content serving at host={0} db={1}'.format(host, db))
         _db = pymongo.database.Database(
@@ -42,6 +44,8 @@ class MongoContentStore(ContentStore):
 
         self.fs_files = _db[bucket + ".files"]  # the underlying collection GridFS uses
 
+        self.disk_cache = disk_cache
+
     def save(self, content):
         content_id = self.asset_db_key(content.location)
 
@@ -68,6 +72,8 @@ class MongoContentStore(ContentStore):
             location_or_id = self.asset_db_key(location_or_id)
         # Deletes of non-existent files are considered successful
         self.fs.delete(location_or_id)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(location_or_id)
 
     def find(self, location, throw_on_not_found=True, as_stream=False):
         content_id = self.asset_db_key(location)
@@ -82,7 +88,8 @@ class MongoContentStore(ContentStore):
                     location, fp.displayname, fp.content_type, fp, last_modified_at=fp.uploadDate,
                     thumbnail_location=thumbnail_location,
                     import_path=getattr(fp, 'import_path', None),
-                    length=fp.length, locked=getattr(fp, 'locked', False)
+                    length=fp.length, locked=getattr(fp, 'locked', False),
+                    content_digest=getattr(fp, 'md5', None),
                 )
             else:
                 with self.fs.get(content_id) as fp:
@@ -93,7 +100,8 @@ class MongoContentStore(ContentStore):
                         location, fp.displayname, fp.content_type, fp.read(), last_modified_at=fp.uploadDate,
                         thumbnail_location=thumbnail_location,
                         import_path=getattr(fp, 'import_path', None),
-                        length=fp.length, locked=getattr(fp, 'locked', False)
+                        length=fp.length, locked=getattr(fp, 'locked', False),
+                        content_digest=getattr(fp, 'md5', None),
                     )
         except NoFile:
             if throw_on_not_found:
@@ -116,21 +124,33 @@ class MongoContentStore(ContentStore):
         except Exception:  # pylint: disable=broad-except
             pass
 
-    def export(self, location, output_directory):
-        content = self.find(location)
+    def export(self, location, output_directory, output_fs=None):
+        """
+        Export the asset under `output_directory`, which is a directory of `output_fs` if given. The
+        asset is streamed from GridFS, so it's never held in memory whole.
+        """
+        content = self.find(location, as_stream=True)
 
         if content.import_path is not None:
             output_directory = output_directory + '/' + os.path.dirname(content.import_path)
 
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-
-        disk_fs = OSFS(output_directory)
+        if output_fs is None:
+            if not os.path.exists(output_directory):
+                os.makedirs(output_directory)
+            output_fs = OSFS(output_directory)
+            filepath = content.name
+        else:
+            output_fs.makedir(output_directory, recursive=True, allow_recreate=True)
+            filepath = output_directory + '/' + content.name
 
-        with disk_fs.open(content.name, 'wb') as asset_file:
-            asset_file.write(content.data)
+        try:
+            with output_fs.open(filepath, 'wb') as asset_file:
+                for chunk in content.stream_data():
+                    asset_file.write(chunk)
+        finally:
+            content.close()
 
-    def export_all_for_course(self, course_key, output_directory, assets_policy_file):
+    def export_all_for_course(self, course_key, output_directory, assets_policy_file, output_fs=None):
         """
         Export all of this course's assets to the output_directory. Export all of the assets'
         attributes to the policy file.
@@ -140,6 +160,7 @@ class MongoContentStore(ContentStore):
             output_directory: the directory under which to put all the asset files
             assets_policy_file: the filename for the policy file which should be in the same
                 directory as the other policy files.
+            output_fs: if given, the filesystem both paths are in. Otherwise, they are paths on disk.
         """
         policy = {}
         assets, __ = self.get_all_content_for_course(course_key)
@@ -154,13 +175,17 @@ class MongoContentStore(ContentStore):
             #
             # When debugging course exports, this might be a good place
             # to look. -- pmitros
-            self.export(asset_location, output_directory) 
+            self.export(asset_location, output_directory, output_fs)
             for attr, value in asset.iteritems():
                 if attr not in ['_id', 'md5', 'uploadDate', 'length', 'chunkSize']:
                     policy.setdefault(asset_location.name, {})[attr] = value
 
-        with open(assets_policy_file, 'w') as f:
-            json.dump(policy, f)
+        if output_fs is None:
+            with open(assets_policy_file, 'w') as f:
+                json.dump(policy, f)
+        else:
+            with output_fs.open(assets_policy_file, 'w') as f:
+                json.dump(policy, f)
 
     def get_all_content_thumbnails_for_course(self, course_key):
         return self._get_all_content_for_course(course_key, get_thumbnails=True)[0]
@@ -274,7 +299,7 @@ class MongoContentStore(ContentStore):
         course_query = MongoModuleStore._course_key_to_son(course_key, tag=XASSET_LOCATION_TAG)  # pylint: disable=protected-access
         matching_assets = self.fs_files.find(course_query)
         for asset in matching_assets:
-            self.fs.delete(asset['_id'])
+            self.delete(asset['_id'])
 
     @staticmethod
     def asset_db_key(location):
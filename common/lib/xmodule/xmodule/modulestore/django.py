@@ -61,8 +61,15 @@ def create_modulestore_instance(engine, doc_store_config, options, i18n_service=
     except InvalidCacheBackendError:
         metadata_inheritance_cache = get_cache('default')
 
+    # the published blocks of courses are only cached if a cache is configured for them
+    try:
+        course_structure_cache = get_cache('course_structure_cache')
+    except InvalidCacheBackendError:
+        course_structure_cache = None
+
     return class_(
         metadata_inheritance_cache_subsystem=metadata_inheritance_cache,
+        course_structure_cache=course_structure_cache,
         request_cache=request_cache,
         xblock_mixins=getattr(settings, 'XBLOCK_MIXINS', ()),
         xblock_select=getattr(settings, 'XBLOCK_SELECT_FUNCTION', None),
@@ -480,12 +480,18 @@ def store_branch_setting(store, branch_setting):
 
 
 @contextmanager
-def store_bulk_write_operations_on_course(store, course_id):
+def store_bulk_write_operations_on_course(store, course_id, buffer_writes=False):
     """
     A context manager for notifying the store of bulk write events.
 
     In the case of Mongo, it temporarily disables refreshing the metadata inheritance tree
-    until the bulk operation is completed.
+    until the bulk operation is completed. If buffer_writes, the items written are also only
+    saved in batches: when the operation completes, when the course is read, or when
+    `flush_bulk_writes_on_course` is called. In the case of Split, the writes all go into a
+    single new version of the course, saved when the operation completes.
+
+    Given the Mixed modulestore, the operation runs on the store of the course; cloning and
+    deleting courses through it therefore also run as bulk operations.
 
     The store can be either the Mixed modulestore or a direct pointer to the underlying store.
     """
@@ -497,13 +503,30 @@ def store_bulk_write_operations_on_course(store, course_id):
     # request comes in for the same course.
 
     # if the caller passed in the mixed modulestore, get a direct pointer to the underlying store
-    if hasattr(store, '_get_modulestore_by_course_id'):
-        store = store._get_modulestore_by_course_id(course_id)
+    if hasattr(store, '_get_modulestore_for_courseid'):
+        store = store._get_modulestore_for_courseid(course_id)
 
     try:
         if hasattr(store, 'begin_bulk_write_operation_on_course'):
-            store.begin_bulk_write_operation_on_course(course_id)
+            if buffer_writes:
+                store.begin_bulk_write_operation_on_course(course_id, buffer_writes=True)
+            else:
+                store.begin_bulk_write_operation_on_course(course_id)
         yield
     finally:
         if hasattr(store, 'begin_bulk_write_operation_on_course'):
             store.end_bulk_write_operation_on_course(course_id)
+
+
+def flush_bulk_writes_on_course(store, course_id):
+    """
+    Save the items written so far by the bulk write operation on the course, if the store
+    buffers them.
+
+    The store can be either the Mixed modulestore or a direct pointer to the underlying store.
+    """
+    if hasattr(store, '_get_modulestore_for_courseid'):
+        store = store._get_modulestore_for_courseid(course_id)
+
+    if hasattr(store, 'flush_bulk_writes_on_course'):
+        store.flush_bulk_writes_on_course(course_id)
@@ -12,17 +12,20 @@ structure:
 }
 """
 
+import hashlib
 import pymongo
 import sys
 import logging
-import copy
 import re
+import time
 
+from bson import BSON
 from bson.son import SON
 from fs.osfs import OSFS
 from path import path
 from datetime import datetime
 from pytz import UTC
+from uuid import uuid4
 
 from importlib import import_module
 from xmodule.errortracker import null_error_tracker, exc_info_to_str
@@ -53,6 +56,20 @@ SORT_REVISION_FAVOR_DRAFT = ('_id.revision', pymongo.DESCENDING)
 # sort order that returns PUBLISHED items first
 SORT_REVISION_FAVOR_PUBLISHED = ('_id.revision', pymongo.ASCENDING)
 
+# how many new items the buffered writes of a bulk write operation insert per batch
+BULK_WRITE_INSERT_BATCH_SIZE = 1000
+
+# how long, in seconds, patching the cached metadata inheritance tree of a course may hold its lock
+INHERITANCE_TREE_LOCK_TIMEOUT = 10
+# how many times, and how many seconds apart, patching the tree tries to take its lock before
+# invalidating the tree instead
+INHERITANCE_TREE_LOCK_RETRIES = 3
+INHERITANCE_TREE_LOCK_WAIT = 0.05
+
+# the largest BSON-encoded block, in bytes, stored in the course structure cache: memcached refuses
+# values over 1MB, so bigger blocks are always read from mongo
+COURSE_STRUCTURE_CACHE_MAX_ENTRY_SIZE = 1000 * 1000
+
 
 class MongoRevisionKey(object):
     """
@@ -130,6 +147,25 @@ class MongoKeyValueStore(InheritanceKeyValueStore):
             return False
 
 
+class LazyMetadataInheritanceTree(object):
+    """
+    The metadata inheritance tree of a course, only fetched on its first lookup, for runtimes whose
+    blocks may all come with their inherited metadata.
+    """
+    def __init__(self, modulestore, course_key):
+        self.modulestore = modulestore
+        self.course_key = course_key
+        self._tree = None
+
+    def get(self, url, default=None):
+        """
+        Return the metadata inherited by the block at location `url`.
+        """
+        if self._tree is None:
+            self._tree = self.modulestore._get_cached_metadata_inheritance_tree(self.course_key)
+        return self._tree.get(url, default)
+
+
 class CachingDescriptorSystem(MakoDescriptorSystem):
     """
     A system that has a cache of module json that it will use to load modules
@@ -216,7 +252,10 @@ class CachingDescriptorSystem(MakoDescriptorSystem):
                 field_data = KvsFieldData(kvs)
                 scope_ids = ScopeIds(None, category, location, location)
                 module = self.construct_xblock_from_class(class_, scope_ids, field_data)
-                if self.cached_metadata is not None:
+                if 'inherited_metadata' in json_data:
+                    # blocks from the course structure cache come with their inherited metadata
+                    inherit_metadata(module, json_data['inherited_metadata'])
+                elif self.cached_metadata is not None:
                     # parent container pointers don't differentiate between draft and non-draft
                     # so when we do the lookup, we should do so with a non-draft location
                     non_draft_loc = as_published(location)
@@ -242,6 +281,9 @@ class CachingDescriptorSystem(MakoDescriptorSystem):
                     module.published_date = edit_info.get('published_date')
                     module.published_by = edit_info.get('published_by')
 
+                # the children as stored, so that updates can tell which ones they remove
+                module.stored_children = list(definition.get('children', []))
+
                 # decache any computed pending field settings
                 module.save()
                 return module
@@ -331,9 +373,12 @@ class MongoModuleStore(ModuleStoreWriteBase):
                  default_class=None,
                  error_tracker=null_error_tracker,
                  i18n_service=None,
+                 course_structure_cache=None,
                  **kwargs):
         """
         :param doc_store_config: must have a host, db, and collection entries. Other common entries: port, tz_aware.
+        :param course_structure_cache: optional cache holding the published blocks of courses, with their
+            inherited metadata, from which published reads are served (see `cache_course_structure`).
         """
 
         super(MongoModuleStore, self).__init__(**kwargs)
@@ -374,16 +419,26 @@ class MongoModuleStore(ModuleStoreWriteBase):
         self.error_tracker = error_tracker
         self.render_template = render_template
         self.i18n_service = i18n_service
+        self.course_structure_cache = course_structure_cache
 
         # performance optimization to prevent updating the meta-data inheritance tree during
         # bulk write operations
         self.ignore_write_events_on_courses = set()
+        # course_id -> {location: update} of the items written during the bulk write operations
+        # which buffer their writes
+        self._bulk_write_buffers = {}
 
-    def begin_bulk_write_operation_on_course(self, course_id):
+    def begin_bulk_write_operation_on_course(self, course_id, buffer_writes=False):
         """
         Prevent updating the meta-data inheritance cache for the given course
+
+        If buffer_writes, the items written to the course are also only saved by
+        `flush_bulk_writes_on_course` or at the end of the operation. Reads of the course, and
+        writes which don't go through the buffer, save them first (see `_flush_buffered_writes`).
         """
         self.ignore_write_events_on_courses.add(course_id)
+        if buffer_writes:
+            self._bulk_write_buffers.setdefault(course_id, {})
 
     def end_bulk_write_operation_on_course(self, course_id):
         """
@@ -392,41 +447,300 @@ class MongoModuleStore(ModuleStoreWriteBase):
         """
         if course_id in self.ignore_write_events_on_courses:
             self.ignore_write_events_on_courses.remove(course_id)
+            try:
+                self.flush_bulk_writes_on_course(course_id)
+            finally:
+                self._bulk_write_buffers.pop(course_id, None)
             self.refresh_cached_metadata_inheritance_tree(course_id)
+            self.invalidate_course_structure_cache(course_id)
+            self.cache_course_structure(course_id)
 
-    def _compute_metadata_inheritance_tree(self, course_id):
-        '''
-        TODO (cdodge) This method can be deleted when the 'split module store' work has been completed
-        '''
-        # get all collections in the course, this query should not return any leaf nodes
-        # note this is a bit ugly as when we add new categories of containers, we have to add it here
+    def flush_bulk_writes_on_course(self, course_id):
+        """
+        Save the items written to the course since the bulk write operation on it began, or
+        since its last flush, if the operation buffers its writes.
+
+        The new items are inserted in batches, so only the items which already existed cost
+        an update each.
+        """
+        buffered_writes = self._bulk_write_buffers.get(course_id)
+        if not buffered_writes:
+            return
+        self._bulk_write_buffers[course_id] = {}
+
+        def son_key(id_dict):
+            """
+            Return a hashable key for the id of an item, whatever the order of its fields.
+            """
+            return tuple(self._id_dict_to_son(id_dict).iteritems())
+
+        ids = dict((son_key(location.to_deprecated_son()), location) for location in buffered_writes)
+        existing = set(
+            son_key(item['_id'])
+            for item in self.collection.find({'_id': {'$in': [SON(key) for key in ids]}}, {'_id': True})
+        )
+
+        new_items = []
+        for key, location in ids.iteritems():
+            update = buffered_writes[location]
+            if key in existing:
+                self.collection.update(
+                    {'_id': SON(key)},
+                    {'$set': update},
+                    multi=False,
+                    upsert=True,
+                    safe=self.collection.safe
+                )
+                continue
+
+            # the document the update would upsert
+            item = {'_id': SON(key)}
+            for field, value in update.iteritems():
+                document = item
+                path = field.split('.')
+                for name in path[:-1]:
+                    document = document.setdefault(name, {})
+                document[path[-1]] = value
+            new_items.append(item)
+
+        for start in xrange(0, len(new_items), BULK_WRITE_INSERT_BATCH_SIZE):
+            self.collection.insert(
+                new_items[start:start + BULK_WRITE_INSERT_BATCH_SIZE], safe=self.collection.safe
+            )
+
+    def _flush_buffered_writes(self, course_id=None, location=None):
+        """
+        Save the writes buffered by the bulk write operation on the course before the collection is
+        queried or written to directly. Given a location, only save them if that item was written.
+        Without a course, save the writes buffered on every course.
+        """
+        if course_id is None:
+            for buffered_course_id in self._bulk_write_buffers.keys():
+                self._flush_buffered_writes(buffered_course_id)
+            return
+
+        buffered_writes = self._bulk_write_buffers.get(course_id)
+        if buffered_writes and (location is None or location in buffered_writes):
+            self.flush_bulk_writes_on_course(course_id)
+
+    @staticmethod
+    def _course_structure_version_key(course_id):
+        """
+        Return the key of the current structure version of the course in the metadata inheritance
+        caching subsystem.
+        """
+        return u'course_structure_version:{}'.format(course_id)
+
+    def _course_structure_version(self, course_id):
+        """
+        Return the current structure version of the course, starting a new one if it was dropped.
+        """
+        version_key = self._course_structure_version_key(course_id)
+        version = self.metadata_inheritance_cache_subsystem.get(version_key)
+        if version is None:
+            version = uuid4().hex
+            self.metadata_inheritance_cache_subsystem.set(version_key, version)
+        return version
+
+    def invalidate_course_structure_cache(self, course_id):
+        """
+        Drop the structure version of the course after one of its blocks was written, so every
+        process stops reading the cached blocks of the course and its parent index.
 
-        block_types_with_children = set(
+        The version lives in the metadata inheritance caching subsystem (e.g. memcached), which is
+        shared by the processes writing (Studio) and reading (LMS) the course, even when they don't
+        share their course structure caches.
+        """
+        if self.metadata_inheritance_cache_subsystem is not None:
+            self.metadata_inheritance_cache_subsystem.delete(self._course_structure_version_key(course_id))
+        if self.request_cache is not None:
+            for name in ('course_structure_blocks', 'course_parent_indexes'):
+                self.request_cache.data.get(name, {}).pop(course_id, None)
+
+    def _use_course_structure_cache(self, course_id):
+        """
+        Return whether published reads of the course can be served from the course structure cache.
+        """
+        return (
+            self.course_structure_cache is not None and
+            self.metadata_inheritance_cache_subsystem is not None and
+            course_id not in self.ignore_write_events_on_courses
+        )
+
+    @staticmethod
+    def _course_structure_cache_key(version, url):
+        """
+        Return the key of the block at location `url` in the course structure cache, for the given
+        structure version of its course. Urls are hashed to keep keys within memcached's limits.
+        """
+        return u'course_structure_block:{}:{}'.format(version, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _course_structure_entries(self, course_id, items):
+        """
+        Return the course structure cache entries of the published blocks `items` of the course by
+        location url: their BSON-encoded documents, with the metadata they inherit under
+        'inherited_metadata', so reads of them need neither mongo nor the inheritance tree.
+        """
+        tree = self._get_cached_metadata_inheritance_tree(course_id)
+        entries = {}
+        for item in items:
+            url = Location._from_deprecated_son(item['_id'], course_id.run).to_deprecated_string()
+            item['inherited_metadata'] = tree.get(url, {})
+            entries[url] = BSON.encode(item)
+        return entries
+
+    def _set_course_structure_entries(self, version, entries):
+        """
+        Store the course structure cache `entries` by location url under the given structure version,
+        leaving out the blocks too big for the cache.
+        """
+        self.course_structure_cache.set_many({
+            self._course_structure_cache_key(version, url): entry
+            for url, entry in entries.iteritems()
+            if len(entry) <= COURSE_STRUCTURE_CACHE_MAX_ENTRY_SIZE
+        })
+
+    def cache_course_structure(self, course_id):
+        """
+        Store all the published blocks of the course in the course structure cache, under its current
+        structure version, from a single query. Publishing and bulk writes (e.g. imports) call this once
+        they are done, so the LMS finds the blocks they changed already cached.
+
+        Blocks written otherwise are cached by the reads which miss them (see
+        `_find_in_course_structure_cache`).
+        """
+        # the published blocks are cached whatever the branch the writer is on
+        if not MongoModuleStore._use_course_structure_cache(self, course_id):
+            return
+
+        self._flush_buffered_writes(course_id)
+        version = self._course_structure_version(course_id)
+        query = self._course_key_to_son(course_id)
+        query['_id.revision'] = MongoRevisionKey.published
+        items = []
+        for item in self.collection.find(query):
+            items.append(item)
+            if len(items) == BULK_WRITE_INSERT_BATCH_SIZE:
+                self._set_course_structure_entries(version, self._course_structure_entries(course_id, items))
+                items = []
+        if items:
+            self._set_course_structure_entries(version, self._course_structure_entries(course_id, items))
+
+    def _find_in_course_structure_cache(self, course_id, urls):
+        """
+        Return the documents of the published blocks at location `urls` of the course, with the metadata
+        they inherit under 'inherited_metadata'. Documents are decoded afresh, so callers are free to
+        modify them.
+
+        Blocks missing from the course structure cache are fetched from mongo in a single query, then
+        cached. Within a request, every block is only looked up once.
+        """
+        blocks = None
+        if self.request_cache is not None:
+            blocks = self.request_cache.data.setdefault('course_structure_blocks', {}).get(course_id)
+        if blocks is None:
+            # blocks by location url, with '' for the blocks which aren't published
+            blocks = {'version': self._course_structure_version(course_id), 'entries': {}}
+            if self.request_cache is not None:
+                self.request_cache.data['course_structure_blocks'][course_id] = blocks
+        version, entries = blocks['version'], blocks['entries']
+
+        urls = [course_id.make_usage_key_from_deprecated_string(url).to_deprecated_string() for url in urls]
+        missing = set(url for url in urls if url not in entries)
+        if missing:
+            keys = {self._course_structure_cache_key(version, url): url for url in missing}
+            for key, entry in self.course_structure_cache.get_many(keys.keys()).iteritems():
+                entries[keys[key]] = entry
+            missing = set(url for url in missing if url not in entries)
+        if missing:
+            query = {'_id': {'$in': [
+                course_id.make_usage_key_from_deprecated_string(url).to_deprecated_son() for url in missing
+            ]}}
+            found = self._course_structure_entries(course_id, self.collection.find(query))
+            found.update((url, '') for url in missing if url not in found)
+            self._set_course_structure_entries(version, found)
+            entries.update(found)
+
+        return [BSON(entries[url]).decode(tz_aware=True) for url in urls if entries[url]]
+
+    def _use_course_parent_index(self, course_id):
+        """
+        Return whether lookups of the published parents of the blocks of the course can be served
+        from its parent index. Unlike the cached blocks, the index only holds published parents
+        whatever the branch setting, so it can serve them on any branch.
+        """
+        return MongoModuleStore._use_course_structure_cache(self, course_id)
+
+    def _get_course_parent_index(self, course_id):
+        """
+        Return the parent index of the course: a dict mapping the url of every child of a published
+        container of the course to the urls of its published parents.
+
+        Like the blocks, indexes are stored in the `course_structure_cache` under the current structure
+        version of the course, so any write to the course rebuilds it, from a single query of its
+        containers. Within a request, the index is only looked up once.
+
+        The index only covers published parents: lookups which prefer draft parents, e.g. of items
+        whose only parent is a draft, still query the collection.
+        """
+        if self.request_cache is not None:
+            indexes = self.request_cache.data.setdefault('course_parent_indexes', {})
+            if course_id in indexes:
+                return indexes[course_id]
+
+        self._flush_buffered_writes(course_id)
+        version = self._course_structure_version(course_id)
+        index_key = u'course_parent_index:{}:{}'.format(course_id, version)
+        index = self.course_structure_cache.get(index_key)
+        if index is None:
+            query = self._course_key_to_son(course_id)
+            query['_id.revision'] = MongoRevisionKey.published
+            query['_id.category'] = {'$in': list(self._block_types_with_children())}
+            index = {}
+            for item in self.collection.find(query, {'_id': 1, 'definition.children': 1}):
+                parent_url = Location._from_deprecated_son(item['_id'], course_id.run).to_deprecated_string()
+                for child in item.get('definition', {}).get('children', []):
+                    index.setdefault(child, []).append(parent_url)
+            self.course_structure_cache.set(index_key, index)
+
+        if self.request_cache is not None:
+            indexes[course_id] = index
+        return index
+
+    @staticmethod
+    def _block_types_with_children():
+        """
+        Return the set of block types which can have children, i.e. the containers of the
+        metadata inheritance tree.
+        """
+        return set(
             name for name, class_ in XBlock.load_classes() if getattr(class_, 'has_children', False)
         )
-        query = SON([
-            ('_id.tag', 'i4x'),
-            ('_id.org', course_id.org),
-            ('_id.course', course_id.course),
-            ('_id.category', {'$in': list(block_types_with_children)})
-        ])
-        # we just want the Location, children, and inheritable metadata
-        record_filter = {'_id': 1, 'definition.children': 1}
 
-        # just get the inheritable metadata since that is all we need for the computation
+    @staticmethod
+    def _inheritance_record_filter():
+        """
+        Return the record filter which only fetches the Location, children, and inheritable
+        metadata of the containers, since that is all the inheritance computation needs.
+        """
         # this minimizes both data pushed over the wire
+        record_filter = {'_id': 1, 'definition.children': 1}
         for field_name in InheritanceMixin.fields:
             record_filter['metadata.{0}'.format(field_name)] = 1
+        return record_filter
 
-        # call out to the DB
-        resultset = self.collection.find(query, record_filter)
-
+    @staticmethod
+    def _index_inheritance_records(course_id, resultset):
+        """
+        Order the container records of `resultset` by location url, merging the children of the
+        draft and published revisions of a same container. Returns the dict of records by url and
+        the url of the course root, if it's among them.
+        """
         # it's ok to keep these as deprecated strings b/c the overall cache is indexed by course_key and this
         # is a dictionary relative to that course
         results_by_url = {}
         root = None
 
-        # now go through the results and order them by the location url
         for result in resultset:
             # manually pick it apart b/c the db has tag and we want as_published revision regardless
             location = as_published(Location._from_deprecated_son(result['_id'], course_id.run))
@@ -443,33 +757,82 @@ class MongoModuleStore(ModuleStoreWriteBase):
             if location.category == 'course':
                 root = location_url
 
-        # now traverse the tree and compute down the inherited metadata
-        metadata_to_inherit = {}
+        return results_by_url, root
 
-        def _compute_inherited_metadata(url):
-            """
-            Helper method for computing inherited metadata for a specific location url
-            """
-            my_metadata = results_by_url[url].get('metadata', {})
-
-            # go through all the children and recurse, but only if we have
-            # in the result set. Remember results will not contain leaf nodes
-            for child in results_by_url[url].get('definition', {}).get('children', []):
-                if child in results_by_url:
-                    new_child_metadata = copy.deepcopy(my_metadata)
-                    new_child_metadata.update(results_by_url[child].get('metadata', {}))
-                    results_by_url[child]['metadata'] = new_child_metadata
-                    metadata_to_inherit[child] = new_child_metadata
-                    _compute_inherited_metadata(child)
+    @classmethod
+    def _inherit_metadata_down(cls, url, my_metadata, results_by_url, metadata_to_inherit):
+        """
+        Record in `metadata_to_inherit` the metadata inherited by every descendant of the container
+        `url` whose own metadata (including what it inherits) is `my_metadata`.
+
+        Metadata dicts are shared down the tree, and only copied where a container sets inheritable
+        metadata of its own: they must never be modified in place.
+        """
+        # go through all the children and recurse, but only if we have
+        # in the result set. Remember results will not contain leaf nodes
+        for child in results_by_url[url].get('definition', {}).get('children', []):
+            if child in results_by_url:
+                child_own_metadata = results_by_url[child].get('metadata', {})
+                if child_own_metadata:
+                    new_child_metadata = dict(my_metadata)
+                    new_child_metadata.update(child_own_metadata)
                 else:
-                    # this is likely a leaf node, so let's record what metadata we need to inherit
-                    metadata_to_inherit[child] = my_metadata
+                    new_child_metadata = my_metadata
+                metadata_to_inherit[child] = new_child_metadata
+                cls._inherit_metadata_down(child, new_child_metadata, results_by_url, metadata_to_inherit)
+            else:
+                # this is likely a leaf node, so let's record what metadata we need to inherit
+                metadata_to_inherit[child] = my_metadata
+
+    def _compute_metadata_inheritance_tree(self, course_id):
+        '''
+        TODO (cdodge) This method can be deleted when the 'split module store' work has been completed
+        '''
+        # get all collections in the course, this query should not return any leaf nodes
+        query = SON([
+            ('_id.tag', 'i4x'),
+            ('_id.org', course_id.org),
+            ('_id.course', course_id.course),
+            ('_id.category', {'$in': list(self._block_types_with_children())})
+        ])
 
+        # call out to the DB
+        self._flush_buffered_writes(course_id)
+        resultset = self.collection.find(query, self._inheritance_record_filter())
+        results_by_url, root = self._index_inheritance_records(course_id, resultset)
+
+        # now traverse the tree and compute down the inherited metadata
+        metadata_to_inherit = {}
         if root is not None:
-            _compute_inherited_metadata(root)
+            self._inherit_metadata_down(
+                root, results_by_url[root].get('metadata', {}), results_by_url, metadata_to_inherit
+            )
 
         return metadata_to_inherit
 
+    def _find_inheritance_records(self, course_id, urls):
+        """
+        Return the container records among the blocks at location `urls` by location url, as
+        indexed by `_index_inheritance_records`.
+        """
+        block_types_with_children = self._block_types_with_children()
+        locations = [course_id.make_usage_key_from_deprecated_string(url) for url in urls]
+        containers = [location for location in locations if location.category in block_types_with_children]
+        if not containers:
+            return {}
+
+        # match both the draft and published revisions of the containers
+        query = self._course_key_to_son(course_id)
+        query['_id.category'] = {'$in': list(set(location.category for location in containers))}
+        query['_id.name'] = {'$in': list(set(location.name for location in containers))}
+        self._flush_buffered_writes(course_id)
+        resultset = self.collection.find(query, self._inheritance_record_filter())
+
+        results_by_url, __ = self._index_inheritance_records(course_id, resultset)
+        # the query can match blocks sharing a name with a container, but of another category
+        wanted_urls = set(location.to_deprecated_string() for location in containers)
+        return {url: result for url, result in results_by_url.iteritems() if url in wanted_urls}
+
     def _get_cached_metadata_inheritance_tree(self, course_id, force_refresh=False):
         '''
         Compute the metadata inheritance for the course.
@@ -524,6 +887,159 @@ class MongoModuleStore(ModuleStoreWriteBase):
             if runtime:
                 runtime.cached_metadata = cached_metadata
 
+    def _find_inheritance_subtree(self, course_id, urls):
+        """
+        Return the container records of the blocks at location `urls` and of all their container
+        descendants by location url, fetched one query per level.
+        """
+        results_by_url = {}
+        while urls:
+            records = self._find_inheritance_records(course_id, urls)
+            results_by_url.update(records)
+            urls = [
+                child
+                for record in records.itervalues()
+                for child in record.get('definition', {}).get('children', [])
+                if child not in results_by_url
+            ]
+        return results_by_url
+
+    def update_cached_metadata_inheritance_subtree(self, location, runtime=None, removed_children=()):
+        """
+        Patch the cached metadata inheritance tree of the course after the inheritable metadata or
+        the children of the container at `location` changed. Only the containers under `location`
+        are fetched and recomputed, instead of every container in the course as
+        `refresh_cached_metadata_inheritance_tree` does.
+
+        `removed_children` are the location urls of the children the container no longer has. Those
+        which no other container has as a child leave the tree, along with their descendants.
+
+        The caching subsystem is shared between processes, so its tree is read, patched and written
+        back under a lock taken with the subsystem's atomic `add`. If the lock can't be taken, the
+        cached tree is invalidated instead, and recomputed on its next read.
+
+        If given a runtime, it replaces the cached_metadata in that runtime.
+        """
+        course_id = location.course_key
+        if course_id in self.ignore_write_events_on_courses:
+            return
+
+        if location.category == 'course' or (
+            self.request_cache is None and self.metadata_inheritance_cache_subsystem is None
+        ):
+            # the whole tree hangs from the course, and without any cache there is no tree to patch
+            self.refresh_cached_metadata_inheritance_tree(course_id, runtime)
+            return
+
+        location_url = as_published(location).to_deprecated_string()
+        record_filter = self._inheritance_record_filter()
+
+        # find what the container inherits from its parent
+        query = self._course_key_to_son(course_id)
+        query['definition.children'] = location_url
+        parent = self.collection.find_one(query, record_filter)
+        if parent is None and not removed_children:
+            # orphans aren't part of the tree, their parent will patch it once they are attached
+            return
+
+        results_by_url = self._find_inheritance_subtree(course_id, [location_url])
+        if location_url not in results_by_url:
+            # not a container, so nothing inherits from it
+            return
+
+        # children moved to another container, or kept by the other revision of this one, stay
+        detached_urls = []
+        for child_url in removed_children:
+            query = self._course_key_to_son(course_id)
+            query['definition.children'] = child_url
+            if self.collection.find_one(query, {'_id': 1}) is None:
+                detached_urls.append(child_url)
+        detached_subtree = self._find_inheritance_subtree(course_id, detached_urls)
+        detached_urls.extend(detached_subtree)
+        detached_urls.extend(
+            child
+            for record in detached_subtree.itervalues()
+            for child in record.get('definition', {}).get('children', [])
+        )
+
+        def patch(tree):
+            """
+            Patch `tree` in place with the metadata inherited under the container. Returns False
+            if the tree turns out to be inconsistent, and has to be recomputed instead.
+            """
+            for url in detached_urls:
+                tree.pop(url, None)
+            if parent is None:
+                # the container itself is an orphan now
+                return True
+            parent_location = as_published(Location._from_deprecated_son(parent['_id'], course_id.run))
+            if parent_location.category == 'course':
+                # the course is the root of the tree, and has no entry of its own
+                parent_metadata = parent.get('metadata', {})
+            else:
+                parent_metadata = tree.get(parent_location.to_deprecated_string())
+                if parent_metadata is None:
+                    log.warning(
+                        "The metadata inheritance tree of %s has no entry for %s, the parent of %s",
+                        course_id, parent_location, location
+                    )
+                    return False
+
+            my_metadata = dict(parent_metadata)
+            my_metadata.update(results_by_url[location_url].get('metadata', {}))
+            tree[location_url] = my_metadata
+            self._inherit_metadata_down(location_url, my_metadata, results_by_url, tree)
+            return True
+
+        cache = self.metadata_inheritance_cache_subsystem
+        if cache is None:
+            # the tree only lives in the request cache, which no one else writes to
+            tree = self._get_cached_metadata_inheritance_tree(course_id)
+            if not patch(tree):
+                self.request_cache.data.get('metadata_inheritance', {}).pop(course_id, None)
+                return
+        else:
+            tree = self._patch_shared_metadata_inheritance_tree(course_id, patch)
+            if tree is None:
+                # there was no tree to patch, so recompute it on the next read
+                if self.request_cache is not None:
+                    self.request_cache.data.get('metadata_inheritance', {}).pop(course_id, None)
+                return
+            if self.request_cache is not None:
+                self.request_cache.data.setdefault('metadata_inheritance', {})[course_id] = tree
+
+        if runtime:
+            runtime.cached_metadata = tree
+
+    def _patch_shared_metadata_inheritance_tree(self, course_id, patch):
+        """
+        Call `patch` on the metadata inheritance tree of the course held by the caching subsystem,
+        then write it back, under a lock. Returns the patched tree, or None if the subsystem had
+        no tree for the course or it was invalidated because the lock couldn't be taken or `patch`
+        returned False.
+        """
+        cache = self.metadata_inheritance_cache_subsystem
+        key = unicode(course_id)
+        lock_key = u'{}.lock'.format(key)
+        for __ in xrange(INHERITANCE_TREE_LOCK_RETRIES):
+            if cache.add(lock_key, True, INHERITANCE_TREE_LOCK_TIMEOUT):
+                try:
+                    tree = cache.get(key)
+                    if not tree:
+                        return None
+                    if not patch(tree):
+                        cache.delete(key)
+                        return None
+                    cache.set(key, tree)
+                    return tree
+                finally:
+                    cache.delete(lock_key)
+            time.sleep(INHERITANCE_TREE_LOCK_WAIT)
+
+        log.warning("Could not lock the metadata inheritance tree of %s, invalidating it", course_id)
+        cache.delete(key)
+        return None
+
     def _clean_item_data(self, item):
         """
         Renames the '_id' field in item to 'location'
@@ -535,6 +1051,10 @@ class MongoModuleStore(ModuleStoreWriteBase):
         """
         Generate a pymongo in query for finding the items and return the payloads
         """
+        self._flush_buffered_writes(course_key)
+        if self._use_course_structure_cache(course_key):
+            return self._find_in_course_structure_cache(course_key, items)
+
         # first get non-draft in a round-trip
         query = {
             '_id': {'$in': [
@@ -591,7 +1111,9 @@ class MongoModuleStore(ModuleStoreWriteBase):
 
         cached_metadata = {}
         if apply_cached_metadata:
-            cached_metadata = self._get_cached_metadata_inheritance_tree(course_key)
+            # blocks from the course structure cache carry their inherited metadata, so the tree is
+            # only fetched if some block doesn't
+            cached_metadata = LazyMetadataInheritanceTree(self, course_key)
 
         services = {}
         if self.i18n_service:
@@ -633,6 +1155,7 @@ class MongoModuleStore(ModuleStoreWriteBase):
         '''
         Returns a list of course descriptors.
         '''
+        self._flush_buffered_writes()
         base_list = sum(
             [
                 self._load_items(
@@ -657,9 +1180,14 @@ class MongoModuleStore(ModuleStoreWriteBase):
         ItemNotFoundError.
         '''
         assert isinstance(location, Location)
-        item = self.collection.find_one(
-            {'_id': location.to_deprecated_son()}
-        )
+        self._flush_buffered_writes(location.course_key, location)
+        if location.revision == MongoRevisionKey.published and self._use_course_structure_cache(location.course_key):
+            items = self._find_in_course_structure_cache(location.course_key, [location.to_deprecated_string()])
+            item = items[0] if items else None
+        else:
+            item = self.collection.find_one(
+                {'_id': location.to_deprecated_son()}
+            )
         if item is None:
             raise ItemNotFoundError(location)
         return item
@@ -693,6 +1221,7 @@ class MongoModuleStore(ModuleStoreWriteBase):
                     course_query[key] = re.compile(r"(?i)^{}$".format(course_query[key]))
         else:
             course_query = {'_id': location.to_deprecated_son()}
+        self._flush_buffered_writes()
         course = self.collection.find_one(course_query, fields={'_id': True})
         if course:
             return SlashSeparatedCourseKey(course['_id']['org'], course['_id']['course'], course['_id']['name'])
@@ -794,6 +1323,7 @@ class MongoModuleStore(ModuleStoreWriteBase):
             query['definition.children'] = kwargs.pop('children')
 
         query.update(kwargs)
+        self._flush_buffered_writes(course_id)
         items = self.collection.find(
             query,
             sort=[SORT_REVISION_FAVOR_DRAFT],
@@ -829,6 +1359,7 @@ class MongoModuleStore(ModuleStoreWriteBase):
             ('_id.course', re.compile(u'^{}$'.format(course_id.course), re.IGNORECASE)),
             ('_id.category', 'course'),
         ])
+        self._flush_buffered_writes()
         courses = self.collection.find(course_search_location, fields=('_id'))
         if courses.count() > 0:
             raise InvalidLocationError(
@@ -861,7 +1392,9 @@ class MongoModuleStore(ModuleStoreWriteBase):
         :param user_id:
         """
         course_query = self._course_key_to_son(course_key)
+        self._flush_buffered_writes(course_key)
         self.collection.remove(course_query, multi=True)
+        self.invalidate_course_structure_cache(course_key)
 
     def create_xmodule(self, location, definition_data=None, metadata=None, runtime=None, fields={}):
         """
@@ -928,7 +1461,13 @@ class MongoModuleStore(ModuleStoreWriteBase):
         """
         Set update on the specified item, and raises ItemNotFoundError
         if the location doesn't exist
+
+        During a bulk write operation which buffers its writes, the update is only buffered.
         """
+        buffered_writes = self._bulk_write_buffers.get(location.course_key)
+        if buffered_writes is not None:
+            buffered_writes.setdefault(location, {}).update(update)
+            return
 
         # See http://www.mongodb.org/display/DOCS/Updating for
         # atomic update syntax
@@ -941,6 +1480,9 @@ class MongoModuleStore(ModuleStoreWriteBase):
             # from overriding our default value set in the init method.
             safe=self.collection.safe
         )
+        # bulk write operations invalidate the course structure cache once they end
+        if location.course_key not in self.ignore_write_events_on_courses:
+            self.invalidate_course_structure_cache(location.course_key)
         if result['n'] == 0:
             raise ItemNotFoundError(location)
 
@@ -973,13 +1515,27 @@ class MongoModuleStore(ModuleStoreWriteBase):
                 payload['edit_info']['published_date'] = datetime.now(UTC)
                 payload['edit_info']['published_by'] = user_id
 
+            removed_children = []
             if xblock.has_children:
                 children = self._convert_reference_fields_to_strings(xblock, {'children': xblock.children})
                 payload.update({'definition.children': children['children']})
+                # children dropped from the block since it was loaded may have to leave the cached
+                # inheritance tree. Blocks which weren't loaded from the store had none stored.
+                removed_children = list(
+                    set(getattr(xblock, 'stored_children', [])) - set(children['children'])
+                )
             self._update_single_item(xblock.scope_ids.usage_id, payload)
 
-            # recompute (and update) the metadata inheritance tree which is cached
-            self.refresh_cached_metadata_inheritance_tree(xblock.scope_ids.usage_id.course_key, xblock.runtime)
+            # patch the cached metadata inheritance tree under this block. Leaves have no entry
+            # of their own in the tree, so their changes can't affect it.
+            if xblock.has_children:
+                xblock.stored_children = children['children']
+                self.update_cached_metadata_inheritance_subtree(
+                    xblock.scope_ids.usage_id, xblock.runtime, removed_children
+                )
+                # reads between the write and the patch may have cached blocks with the old inheritance
+                if xblock.location.course_key not in self.ignore_write_events_on_courses:
+                    self.invalidate_course_structure_cache(xblock.location.course_key)
             # fire signal that we've written to DB
         except ItemNotFoundError:
             if not allow_not_found:
@@ -1027,6 +1583,19 @@ class MongoModuleStore(ModuleStoreWriteBase):
         assert revision == ModuleStoreEnum.RevisionOption.published_only \
             or revision == ModuleStoreEnum.RevisionOption.draft_preferred
 
+        self._flush_buffered_writes(location.course_key)
+        if revision == ModuleStoreEnum.RevisionOption.published_only and \
+                self._use_course_parent_index(location.course_key):
+            parent_urls = self._get_course_parent_index(location.course_key).get(location.to_deprecated_string(), [])
+            if len(parent_urls) > 1:
+                # should never have multiple PUBLISHED parents
+                raise ReferentialIntegrityError(
+                    u"{} parents claim {}".format(len(parent_urls), location)
+                )
+            if parent_urls:
+                return location.course_key.make_usage_key_from_deprecated_string(parent_urls[0])
+            return None
+
         # create a query with tag, org, course, and the children field set to the given location
         query = self._course_key_to_son(location.course_key)
         query['definition.children'] = location.to_deprecated_string()
@@ -1076,6 +1645,7 @@ class MongoModuleStore(ModuleStoreWriteBase):
         detached_categories = [name for name, __ in XBlock.load_tagged_classes("detached")]
         query = self._course_key_to_son(course_key)
         query['_id.category'] = {'$nin': detached_categories}
+        self._flush_buffered_writes(course_key)
         all_items = self.collection.find(query)
         all_reachable = set()
         item_locs = set()
@@ -1095,6 +1665,7 @@ class MongoModuleStore(ModuleStoreWriteBase):
         :param wiki_slug: the course wiki root slug
         :return: list of course locations
         """
+        self._flush_buffered_writes()
         courses = self.collection.find({'_id.category': 'course', 'definition.data.wiki_slug': wiki_slug})
         # the course's run == its name. It's the only xblock for which that's necessarily true.
         return [Location._from_deprecated_son(course['_id'], course['_id']['name']) for course in courses]
@@ -136,6 +136,7 @@ class DraftModuleStore(MongoModuleStore):
         else:
             key = usage_key.to_deprecated_son(prefix='_id.')
             del key['_id.revision']
+            self._flush_buffered_writes(usage_key.course_key)
             return self.collection.find(key).count() > 0
 
     def _get_raw_parent_locations(self, location, key_revision):
@@ -158,6 +159,7 @@ class DraftModuleStore(MongoModuleStore):
         query['definition.children'] = location.to_deprecated_string()
 
         # find all the items that satisfy the query
+        self._flush_buffered_writes(location.course_key)
         parents = self.collection.find(query, {'_id': True}, sort=[SORT_REVISION_FAVOR_DRAFT])
 
         # return only the parent(s) that satisfy the request
@@ -475,6 +477,7 @@ class DraftModuleStore(MongoModuleStore):
         """
         if len(root_usages) == 0:
             return
+        self._flush_buffered_writes(root_usages[0].course_key)
         to_be_deleted = []
 
         def _internal(tier):
@@ -490,6 +493,7 @@ class DraftModuleStore(MongoModuleStore):
         self.collection.remove({'_id': {'$in': to_be_deleted}}, safe=self.collection.safe)
         # recompute (and update) the metadata inheritance tree which is cached
         self.refresh_cached_metadata_inheritance_tree(root_usages[0].course_key)
+        self.invalidate_course_structure_cache(root_usages[0].course_key)
 
     def has_changes(self, location):
         """
@@ -581,7 +585,11 @@ class DraftModuleStore(MongoModuleStore):
 
         _internal_depth_first(location)
         if len(to_be_deleted) > 0:
+            # the published versions must be saved before their drafts are removed
+            self._flush_buffered_writes(location.course_key)
             self.collection.remove({'_id': {'$in': to_be_deleted}})
+        # have the LMS find the newly published blocks already cached
+        self.cache_course_structure(location.course_key)
         return self.get_item(as_published(location))
 
     def unpublish(self, location, user_id):
@@ -594,6 +602,16 @@ class DraftModuleStore(MongoModuleStore):
         self._verify_branch_setting(ModuleStoreEnum.Branch.draft_preferred)
         return self._convert_to_draft(location, user_id, delete_published=True)
 
+    def _use_course_structure_cache(self, course_id):
+        """
+        The course structure cache only holds published blocks, so it can only serve reads of the
+        published branch.
+        """
+        return (
+            self.branch_setting_func() == ModuleStoreEnum.Branch.published_only and
+            super(DraftModuleStore, self)._use_course_structure_cache(course_id)
+        )
+
     def _query_children_for_cache_children(self, course_key, items):
         # first get non-draft in a round-trip
         to_process_non_drafts = super(DraftModuleStore, self)._query_children_for_cache_children(course_key, items)
@@ -642,6 +660,7 @@ class DraftModuleStore(MongoModuleStore):
         """
         if getattr(xblock, 'is_draft', False):
             published_xblock_location = as_published(xblock.location)
+            self._flush_buffered_writes(published_xblock_location.course_key, published_xblock_location)
             published_item = self.collection.find_one(
                 {'_id': published_xblock_location.to_deprecated_son()}
             )
@@ -8,6 +8,7 @@ manipulate storage but use existing api's.
 '''
 from xblock.fields import Reference, ReferenceList, ReferenceValueDict
 from xmodule.modulestore import ModuleStoreEnum
+from xmodule.modulestore.mixed import store_bulk_write_operations_on_course
 
 
 class SplitMigrator(object):
@@ -96,60 +97,63 @@ class SplitMigrator(object):
         """
         update each draft. Create any which don't exist in published and attach to their parents.
         """
-        # each true update below will trigger a new version of the structure. We may want to just have one new version
-        # but that's for a later date.
         new_draft_course_loc = published_course_key.for_branch(ModuleStoreEnum.BranchName.draft)
-        # to prevent race conditions of grandchilden being added before their parents and thus having no parent to
-        # add to
-        awaiting_adoption = {}
-        for module in self.draft_modulestore.get_items(course_key, revision=ModuleStoreEnum.RevisionOption.draft_only):
-            new_locator = self.loc_mapper.translate_location(
-                module.location, False, add_entry_if_missing=True
+        # the updates below all go into a single new version of the structure
+        with store_bulk_write_operations_on_course(self.split_modulestore, new_draft_course_loc):
+            # to prevent race conditions of grandchilden being added before their parents and thus having no parent to
+            # add to
+            awaiting_adoption = {}
+            draft_modules = self.draft_modulestore.get_items(
+                course_key, revision=ModuleStoreEnum.RevisionOption.draft_only
             )
-            if self.split_modulestore.has_item(new_locator):
-                # was in 'direct' so draft is a new version
-                split_module = self.split_modulestore.get_item(new_locator)
-                # need to remove any no-longer-explicitly-set values and add/update any now set values.
-                for name, field in split_module.fields.iteritems():
-                    if field.is_set_on(split_module) and not module.fields[name].is_set_on(module):
-                        field.delete_from(split_module)
-                for field, value in self._get_fields_translate_references(module, course_key, True).iteritems():
-                    # draft children will insert themselves and the others are here already; so, don't do it 2x
-                    if field.name != 'children':
-                        field.write_to(split_module, value)
-
-                _new_module = self.split_modulestore.update_item(split_module, user.id)
-            else:
-                # only a draft version (aka, 'private'). parent needs updated too.
-                # create a new course version just in case the current head is also the prod head
-                _new_module = self.split_modulestore.create_item(
-                    new_draft_course_loc, module.category, user.id,
-                    block_id=new_locator.block_id,
-                    fields=self._get_json_fields_translate_references(module, course_key, True)
+            for module in draft_modules:
+                new_locator = self.loc_mapper.translate_location(
+                    module.location, False, add_entry_if_missing=True
                 )
-                awaiting_adoption[module.location] = new_locator
-        for draft_location, new_locator in awaiting_adoption.iteritems():
-            parent_loc = self.draft_modulestore.get_parent_location(draft_location)
-            old_parent = self.draft_modulestore.get_item(parent_loc)
-            new_parent = self.split_modulestore.get_item(
-                self.loc_mapper.translate_location(old_parent.location, False)
-            )
-            # this only occurs if the parent was also awaiting adoption: skip this one, go to next
-            if any(new_locator == child.version_agnostic() for child in new_parent.children):
-                continue
-            # find index for module: new_parent may be missing quite a few of old_parent's children
-            new_parent_cursor = 0
-            for old_child_loc in old_parent.children:
-                if old_child_loc == draft_location:
-                    break  # moved cursor enough, insert it here
-                sibling_loc = self.loc_mapper.translate_location(old_child_loc, False)
-                # sibling may move cursor
-                for idx in range(new_parent_cursor, len(new_parent.children)):
-                    if new_parent.children[idx].version_agnostic() == sibling_loc:
-                        new_parent_cursor = idx + 1
-                        break  # skipped sibs enough, pick back up scan
-            new_parent.children.insert(new_parent_cursor, new_locator)
-            new_parent = self.split_modulestore.update_item(new_parent, user.id)
+                if self.split_modulestore.has_item(new_locator):
+                    # was in 'direct' so draft is a new version
+                    split_module = self.split_modulestore.get_item(new_locator)
+                    # need to remove any no-longer-explicitly-set values and add/update any now set values.
+                    for name, field in split_module.fields.iteritems():
+                        if field.is_set_on(split_module) and not module.fields[name].is_set_on(module):
+                            field.delete_from(split_module)
+                    for field, value in self._get_fields_translate_references(module, course_key, True).iteritems():
+                        # draft children will insert themselves and the others are here already; so, don't do it 2x
+                        if field.name != 'children':
+                            field.write_to(split_module, value)
+
+                    _new_module = self.split_modulestore.update_item(split_module, user.id)
+                else:
+                    # only a draft version (aka, 'private'). parent needs updated too.
+                    # create a new course version just in case the current head is also the prod head
+                    _new_module = self.split_modulestore.create_item(
+                        new_draft_course_loc, module.category, user.id,
+                        block_id=new_locator.block_id,
+                        fields=self._get_json_fields_translate_references(module, course_key, True)
+                    )
+                    awaiting_adoption[module.location] = new_locator
+            for draft_location, new_locator in awaiting_adoption.iteritems():
+                parent_loc = self.draft_modulestore.get_parent_location(draft_location)
+                old_parent = self.draft_modulestore.get_item(parent_loc)
+                new_parent = self.split_modulestore.get_item(
+                    self.loc_mapper.translate_location(old_parent.location, False)
+                )
+                # this only occurs if the parent was also awaiting adoption: skip this one, go to next
+                if any(new_locator == child.version_agnostic() for child in new_parent.children):
+                    continue
+                # find index for module: new_parent may be missing quite a few of old_parent's children
+                new_parent_cursor = 0
+                for old_child_loc in old_parent.children:
+                    if old_child_loc == draft_location:
+                        break  # moved cursor enough, insert it here
+                    sibling_loc = self.loc_mapper.translate_location(old_child_loc, False)
+                    # sibling may move cursor
+                    for idx in range(new_parent_cursor, len(new_parent.children)):
+                        if new_parent.children[idx].version_agnostic() == sibling_loc:
+                            new_parent_cursor = idx + 1
+                            break  # skipped sibs enough, pick back up scan
+                new_parent.children.insert(new_parent_cursor, new_locator)
+                new_parent = self.split_modulestore.update_item(new_parent, user.id)
 
     def _get_json_fields_translate_references(self, xblock, old_course_id, published):
         """
@@ -40,6 +40,11 @@ class CachingDescriptorSystem(MakoDescriptorSystem):
             **kwargs
         )
         self.modulestore = modulestore
+        # the structure may be shared with other requests, so loading only changes this system's copy
+        # of its blocks
+        structure = course_entry['structure']
+        blocks = dict((block_id, dict(block)) for block_id, block in structure.get('blocks', {}).iteritems())
+        course_entry = dict(course_entry, structure=dict(structure, blocks=blocks))
         self.course_entry = course_entry
         self.lazy = lazy
         self.module_data = module_data
@@ -8,19 +8,51 @@ class DefinitionLazyLoader(object):
     object doesn't force access during init but waits until client wants the
     definition. Only works if the modulestore is a split mongo store.
     """
-    def __init__(self, modulestore, block_type, definition_id, field_converter):
+    def __init__(self, modulestore, block_type, definition_id, field_converter, batch=None):
         """
         Simple placeholder for yet-to-be-fetched data
         :param modulestore: the pymongo db connection with the definitions
         :param definition_locator: the id of the record in the above to fetch
+        :param batch: optional DefinitionBatch to fetch the definition along with the others in it
         """
         self.modulestore = modulestore
         self.definition_locator = DefinitionLocator(block_type, definition_id)
         self.field_converter = field_converter
+        self.batch = batch
 
     def fetch(self):
         """
         Fetch the definition. Note, the caller should replace this lazy
         loader pointer with the result so as not to fetch more than once
         """
+        if self.batch is not None:
+            return self.batch.fetch(self.definition_locator.definition_id)
         return self.modulestore.db_connection.get_definition(self.definition_locator.definition_id)
+
+
+class DefinitionBatch(object):
+    """
+    The definitions of a set of blocks loaded together (e.g., a subtree), which are all fetched in
+    a single query the first time any one of them is needed.
+    """
+    def __init__(self, modulestore, definition_ids):
+        """
+        :param modulestore: the split mongo store holding the definitions
+        :param definition_ids: the ids of the definitions to fetch together
+        """
+        self.modulestore = modulestore
+        self.definition_ids = definition_ids
+        self.definitions = None
+
+    def fetch(self, definition_id):
+        """
+        Fetch the definition whose id is definition_id, fetching the whole batch if not done yet.
+        """
+        if self.definitions is None:
+            self.definitions = self.modulestore.db_connection.get_definitions(self.definition_ids)
+        # hand out each fetched definition once, as the caller may modify it
+        definition = self.definitions.pop(definition_id, None)
+        if definition is None:
+            # not in the batch, or already handed out to another block sharing the definition
+            definition = self.modulestore.db_connection.get_definition(definition_id)
+        return definition
@@ -2,19 +2,130 @@
 Segregation of pymongo functions from the data modeling mechanisms for split modulestore.
 """
 import re
+import threading
+from collections import OrderedDict
+
 import pymongo
-from bson import son
+from bson import son, BSON
 from xmodule.exceptions import HeartbeatFailure
 
+# Default bounds of the caches of structures and definitions, which are kept for the life of the process
+STRUCTURE_CACHE_MAX_ENTRIES = 100
+STRUCTURE_CACHE_MAX_SIZE = 64 * 1024 * 1024
+DEFINITION_CACHE_MAX_ENTRIES = 10000
+DEFINITION_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+
+class DocumentCache(object):
+    """
+    Thread-safe LRU cache of documents keyed by their `_id`, bounded both in number of entries and in
+    total size (in bytes, as BSON). It is only meant for documents which never change once written, or
+    whose users check that a cached copy is still current before using it.
+
+    By default, documents are kept BSON encoded, and every hit decodes a fresh copy of the document,
+    which callers are free to modify. If read_only, documents are kept decoded and every hit returns
+    the cached document itself, which callers must copy before making any change to it.
+    """
+    def __init__(self, max_entries, max_size, tz_aware=True, read_only=False):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.tz_aware = tz_aware
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the document whose `_id` is key (a copy of it unless read_only), or None if it isn't cached.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            # re-insert it as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+        size, data = entry
+        if self.read_only:
+            return data
+        return BSON(data).decode(as_class=son.SON, tz_aware=self.tz_aware)
+
+    def set(self, document):
+        """
+        Cache the document, evicting the least recently used ones to stay within bounds.
+        """
+        data = BSON.encode(document)
+        size = len(data)
+        if size > self.max_size:
+            return
+        if self.read_only:
+            data = document
+        with self._lock:
+            self._discard(document['_id'])
+            self._entries[document['_id']] = (size, data)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_size:
+                __, (evicted_size, __) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def delete(self, key):
+        """
+        Remove the document whose `_id` is key from the cache, if present.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """
+        Empty the cache, and reset its counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return a dict of the hit and miss counters, and of the number of entries and size of the cache.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'size': self._size,
+        }
+
+    def _discard(self, key):
+        """
+        Remove key from the cache. The lock must be held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[0]
+
+
 class MongoConnection(object):
     """
     Segregation of pymongo functions from the data modeling mechanisms for split modulestore.
     """
     def __init__(
-        self, db, collection, host, port=27017, tz_aware=True, user=None, password=None, **kwargs
+        self, db, collection, host, port=27017, tz_aware=True, user=None, password=None,
+        structure_cache_max_entries=STRUCTURE_CACHE_MAX_ENTRIES, structure_cache_max_size=STRUCTURE_CACHE_MAX_SIZE,
+        definition_cache_max_entries=DEFINITION_CACHE_MAX_ENTRIES, definition_cache_max_size=DEFINITION_CACHE_MAX_SIZE,
+        **kwargs
     ):
         """
         Create & open the connection, authenticate, and provide pointers to the collections
+
+        The structures and definitions read are kept in bounded caches shared by all the requests
+        (and threads) using this connection. Definitions are immutable once inserted. Structures can
+        be updated in place (see `update_structure`), so lookups may give the revision the structure
+        must have. Cached structures are shared rather than copied: callers must not modify them.
         """
         self.database = pymongo.database.Database(
             pymongo.MongoClient(
@@ -42,6 +153,11 @@ class MongoConnection(object):
         self.structures.write_concern = {'w': 1}
         self.definitions.write_concern = {'w': 1}
 
+        self.structure_cache = DocumentCache(
+            structure_cache_max_entries, structure_cache_max_size, tz_aware, read_only=True
+        )
+        self.definition_cache = DocumentCache(definition_cache_max_entries, definition_cache_max_size, tz_aware)
+
     def heartbeat(self):
         """
         Check that the db is reachable.
@@ -51,11 +167,24 @@ class MongoConnection(object):
         else:
             raise HeartbeatFailure("Can't connect to {}".format(self.database.name))
 
-    def get_structure(self, key):
+    def get_structure(self, key, revision=None):
         """
-        Get the structure from the persistence mechanism whose id is the given key
+        Get the structure from the persistence mechanism whose id is the given key. The structure may
+        be shared with other callers, so it must be copied before any change.
+
+        :param revision: the revision of the structure recorded in the index of its course, if any.
+            Structures are only updated in place while they are the head of a course, which records
+            their new revision (see `update_structure`), so a cached copy of another revision is
+            refetched. Without it, any cached copy is served.
         """
-        return self.structures.find_one({'_id': key})
+        structure = self.structure_cache.get(key)
+        if structure is not None and (revision is None or structure.get('revision') == revision):
+            return structure
+
+        structure = self.structures.find_one({'_id': key})
+        if structure is not None:
+            self.structure_cache.set(structure)
+        return structure
 
     def find_matching_structures(self, query):
         """
@@ -72,9 +201,13 @@ class MongoConnection(object):
 
     def update_structure(self, structure):
         """
-        Update the db record for structure
+        Update the db record for structure, bumping its revision. The caller must record the new
+        revision in the index of the course whose head the structure is, so that other processes stop
+        serving their cached copy of the previous one.
         """
+        structure['revision'] = structure.get('revision', 0) + 1
         self.structures.update({'_id': structure['_id']}, structure)
+        self.structure_cache.delete(structure['_id'])
 
     def get_course_index(self, key, ignore_case=False):
         """
@@ -120,7 +253,32 @@ class MongoConnection(object):
         """
         Get the definition from the persistence mechanism whose id is the given key
         """
-        return self.definitions.find_one({'_id': key})
+        definition = self.definition_cache.get(key)
+        if definition is None:
+            definition = self.definitions.find_one({'_id': key})
+            if definition is not None:
+                self.definition_cache.set(definition)
+        return definition
+
+    def get_definitions(self, keys):
+        """
+        Get the definitions whose ids are the given keys, fetching the ones which aren't cached in a
+        single query. Returns a dict of the definitions found, keyed by id.
+        """
+        definitions = {}
+        missing_keys = []
+        for key in set(keys):
+            definition = self.definition_cache.get(key)
+            if definition is None:
+                missing_keys.append(key)
+            else:
+                definitions[key] = definition
+
+        if missing_keys:
+            for definition in self.definitions.find({'_id': {'$in': missing_keys}}):
+                self.definition_cache.set(definition)
+                definitions[definition['_id']] = definition
+        return definitions
 
     def find_matching_definitions(self, query):
         """
@@ -135,4 +293,13 @@ class MongoConnection(object):
         """
         self.definitions.insert(definition)
 
+    def cache_stats(self):
+        """
+        Return the statistics of the structure and definition caches
+        """
+        return {
+            'structures': self.structure_cache.stats(),
+            'definitions': self.definition_cache.stats(),
+        }
+
 
@@ -65,7 +65,7 @@ from xmodule.modulestore import (
 )
 
 from ..exceptions import ItemNotFoundError
-from .definition_lazy_loader import DefinitionLazyLoader
+from .definition_lazy_loader import DefinitionLazyLoader, DefinitionBatch
 from .caching_descriptor_system import CachingDescriptorSystem
 from xblock.fields import Scope, Reference, ReferenceList, ReferenceValueDict
 from bson.objectid import ObjectId
@@ -136,6 +136,112 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         self.render_template = render_template
         self.i18n_service = i18n_service
 
+        # (org, offering) -> the course index entry and the new structure versions of the course, by
+        # id, which are kept in memory until the end of the bulk write operation on the course
+        self._bulk_writes = {}
+
+    def begin_bulk_write_operation_on_course(self, course_id, buffer_writes=False):
+        """
+        Batch the writes to the course until the end of the operation: instead of a new version of the
+        course structure per write, they all go into a single new version of each branch, which is only
+        saved, and made the head of its branch, at the end of the operation.
+
+        The reads of the course see the writes, so they are always batched, whether or not the
+        operation buffers its writes.
+        """
+        self._bulk_writes.setdefault((course_id.org, course_id.offering), {'index': None, 'structures': {}})
+
+    def end_bulk_write_operation_on_course(self, course_id):
+        """
+        Save the structures the writes to the course went into, and update the course index to them.
+        """
+        bulk_write = self._bulk_writes.pop((course_id.org, course_id.offering), None)
+        if bulk_write is None:
+            return
+        for structure_id, structure in bulk_write['structures'].iteritems():
+            self.db_connection.insert_structure(structure)
+            self._clear_cache(structure_id)
+        if bulk_write['structures'] and bulk_write['index'] is not None:
+            self.db_connection.update_course_index(bulk_write['index'])
+
+    def _get_bulk_write(self, org, offering):
+        """
+        Return the bulk write operation on the course, if any.
+        """
+        return self._bulk_writes.get((org, offering))
+
+    def _get_course_index(self, course_locator):
+        """
+        Return the index entry of the course, which is kept in memory during a bulk write
+        operation on the course.
+        """
+        bulk_write = self._get_bulk_write(course_locator.org, course_locator.offering)
+        if bulk_write is None:
+            return self.db_connection.get_course_index(course_locator)
+        if bulk_write['index'] is None:
+            bulk_write['index'] = self.db_connection.get_course_index(course_locator)
+        return bulk_write['index']
+
+    def _get_bulk_write_of_structure(self, version_guid):
+        """
+        Return the bulk write operation which will save the structure with this id, if any.
+        """
+        for bulk_write in self._bulk_writes.itervalues():
+            if version_guid in bulk_write['structures']:
+                return bulk_write
+        return None
+
+    def _get_structure(self, version_guid, revision=None):
+        """
+        Return the structure with this id, which may not be saved yet by a bulk write operation.
+        Saved structures may be shared with other requests, so they must be copied before any change.
+
+        :param revision: the revision of the structure recorded in the course index, if any
+        """
+        bulk_write = self._get_bulk_write_of_structure(version_guid)
+        if bulk_write is not None:
+            return bulk_write['structures'][version_guid]
+        return self.db_connection.get_structure(version_guid, revision)
+
+    def _save_structure(self, structure, course_locator, continue_version=False):
+        """
+        Save the new version of the course structure, or the changes to the existing one if
+        continue_version. During a bulk write operation on the course, the new versions are only saved
+        at its end.
+        """
+        bulk_write = self._get_bulk_write_of_structure(structure['_id'])
+        if bulk_write is None and not continue_version:
+            bulk_write = self._get_bulk_write(course_locator.org, course_locator.offering)
+        if bulk_write is not None:
+            bulk_write['structures'][structure['_id']] = structure
+            # the items of the structure may have changed since they were cached
+            self._clear_cache(structure['_id'])
+        elif continue_version:
+            self._update_structure_in_place(structure, course_locator)
+        else:
+            self.db_connection.insert_structure(structure)
+
+    def _update_structure_in_place(self, structure, course_locator):
+        """
+        Save the changes to the structure, which is the head of the course, and record its new revision
+        in the course index, so the processes which cached the previous one refetch it.
+        """
+        self.db_connection.update_structure(structure)
+        index_entry = self.db_connection.get_course_index(course_locator)
+        if index_entry is not None:
+            # only the heads of the course can still be updated in place
+            heads = set(str(version_guid) for version_guid in index_entry['versions'].itervalues())
+            revisions = {
+                version_guid: revision
+                for version_guid, revision in index_entry.get('structure_revisions', {}).iteritems()
+                if version_guid in heads
+            }
+            revisions[str(structure['_id'])] = structure['revision']
+            index_entry['structure_revisions'] = revisions
+            self.db_connection.update_course_index(index_entry)
+        # clear cache so things get refetched and inheritance recomputed
+        self._clear_cache(structure['_id'])
+
     def cache_items(self, system, base_block_ids, course_key, depth=0, lazy=True):
         '''
         Handles caching of items once inheritance and any other one time
@@ -155,30 +261,41 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
                 new_module_data
             )
 
+        # loading converts the fields of the blocks in place, and the xblocks share their values, so
+        # the blocks first loaded here get their own copy of the fields of the cached structure
+        for block_id, block in new_module_data.iteritems():
+            if block_id not in system.module_data:
+                block['fields'] = copy.deepcopy(block.get('fields', {}))
+
+        # blocks loaded earlier in this system already have their definitions (or lazy loaders for them)
+        definition_ids = [
+            block['definition'] for block in new_module_data.itervalues()
+            if not isinstance(block['definition'], DefinitionLazyLoader)
+        ]
+
+        def field_converter(category):
+            """
+            Return the function converting the references in the definition fields of a block of category
+            """
+            return lambda fields: self.convert_references_to_keys(
+                course_key, system.load_block_type(category), fields, system.course_entry['structure']['blocks'],
+            )
+
         if lazy:
+            # the definitions of all these blocks are fetched in a single query, when any of them is first needed
+            batch = DefinitionBatch(self, definition_ids)
             for block in new_module_data.itervalues():
-                block['definition'] = DefinitionLazyLoader(
-                    self, block['category'], block['definition'],
-                    lambda fields: self.convert_references_to_keys(
-                        course_key, system.load_block_type(block['category']),
-                        fields, system.course_entry['structure']['blocks'],
+                if not isinstance(block['definition'], DefinitionLazyLoader):
+                    block['definition'] = DefinitionLazyLoader(
+                        self, block['category'], block['definition'], field_converter(block['category']), batch
                     )
-                )
         else:
             # Load all descendants by id
-            descendent_definitions = self.db_connection.find_matching_definitions({
-                '_id': {'$in': [block['definition']
-                                for block in new_module_data.itervalues()]}})
-            # turn into a map
-            definitions = {definition['_id']: definition
-                           for definition in descendent_definitions}
-
+            definitions = self.db_connection.get_definitions(definition_ids)
             for block in new_module_data.itervalues():
                 if block['definition'] in definitions:
-                    converted_fields = self.convert_references_to_keys(
-                        course_key, system.load_block_type(block['category']),
-                        definitions[block['definition']].get('fields'),
-                        system.course_entry['structure']['blocks'],
+                    converted_fields = field_converter(block['category'])(
+                        definitions[block['definition']].get('fields')
                     )
                     block['fields'].update(converted_fields)
 
@@ -247,9 +364,13 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         :param course_version_guid: if provided, clear only this entry
         """
         if course_version_guid:
-            del self.thread_cache.course_cache[course_version_guid]
+            if hasattr(self.thread_cache, 'course_cache'):
+                self.thread_cache.course_cache.pop(course_version_guid, None)
+            self.db_connection.structure_cache.delete(course_version_guid)
         else:
             self.thread_cache.course_cache = {}
+            self.db_connection.structure_cache.clear()
+            self.db_connection.definition_cache.clear()
 
     def _lookup_course(self, course_locator):
         '''
@@ -264,14 +385,16 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
 
         :param course_locator: any subclass of CourseLocator
         '''
+        revision = None
         if course_locator.org and course_locator.offering and course_locator.branch:
             # use the course id
-            index = self.db_connection.get_course_index(course_locator)
+            index = self._get_course_index(course_locator)
             if index is None:
                 raise ItemNotFoundError(course_locator)
             if course_locator.branch not in index['versions']:
                 raise ItemNotFoundError(course_locator)
             version_guid = index['versions'][course_locator.branch]
+            revision = index.get('structure_revisions', {}).get(str(version_guid))
             if course_locator.version_guid is not None and version_guid != course_locator.version_guid:
                 # This may be a bit too touchy but it's hard to infer intent
                 raise VersionConflictError(course_locator, version_guid)
@@ -283,7 +406,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
 
         # cast string to ObjectId if necessary
         version_guid = course_locator.as_object_id(version_guid)
-        entry = self.db_connection.get_structure(version_guid)
+        entry = self._get_structure(version_guid, revision)
 
         # b/c more than one course can use same structure, the 'org', 'offering', and 'branch' are not intrinsic to structure
         # and the one assoc'd w/ it by another fetch may not be the one relevant to this fetch; so,
@@ -433,22 +556,31 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
                 you can search by ``edited_by``, ``edited_on`` providing a function testing limits.
         """
         course = self._lookup_course(course_locator)
-        items = []
 
-        def _block_matches_all(block_json):
+        def _block_matches_settings(block_json):
             """
-            Check that the block matches all the criteria
+            Check that the block matches the criteria which don't require loading any additional data
             """
-            # do the checks which don't require loading any additional data
-            if (
+            return (
                 self._block_matches(block_json, kwargs) and
                 self._block_matches(block_json.get('fields', {}), settings)
-            ):
-                if content:
-                    definition_block = self.db_connection.get_definition(block_json['definition'])
-                    return self._block_matches(definition_block.get('fields', {}), content)
-                else:
-                    return True
+            )
+
+        def _blocks_matching_all(blocks):
+            """
+            Return the ids of the blocks in the `blocks` dict which match all the criteria. The
+            definitions of the blocks which need their content checked are fetched in a single query.
+            """
+            block_ids = [block_id for block_id, block_json in blocks.iteritems() if _block_matches_settings(block_json)]
+            if not content:
+                return block_ids
+            definitions = self.db_connection.get_definitions([blocks[block_id]['definition'] for block_id in block_ids])
+            return [
+                block_id for block_id in block_ids
+                if self._block_matches(
+                    definitions.get(blocks[block_id]['definition'], {}).get('fields', {}), content
+                )
+            ]
 
         if settings is None:
             settings = {}
@@ -456,16 +588,14 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
             # odd case where we don't search just confirm
             block_id = kwargs.pop('name')
             block = course['structure']['blocks'].get(block_id)
-            if _block_matches_all(block):
+            if _blocks_matching_all({block_id: block}):
                 return self._load_items(course, [block_id], lazy=True)
             else:
                 return []
         # don't expect caller to know that children are in fields
         if 'children' in kwargs:
             settings['children'] = kwargs.pop('children')
-        for block_id, value in course['structure']['blocks'].iteritems():
-            if _block_matches_all(value):
-                items.append(block_id)
+        items = _blocks_matching_all(course['structure']['blocks'])
 
         if len(items) > 0:
             return self._load_items(course, items, 0, lazy=True)
@@ -802,7 +932,8 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
 
         # copy the structure and modify the new one
         if continue_version:
-            new_structure = structure
+            # the structure keeps its id, but the looked up one may be shared
+            new_structure = copy.deepcopy(structure)
         else:
             new_structure = self._version_structure(structure, user_id)
 
@@ -838,18 +969,12 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
             encoded_block_id = LocMapperStore.encode_key_for_mongo(course_or_parent_locator.block_id)
             parent = new_structure['blocks'][encoded_block_id]
             parent['fields'].setdefault('children', []).append(new_block_id)
-            if not continue_version or parent['edit_info']['update_version'] != structure['_id']:
+            if parent['edit_info']['update_version'] != new_id:
                 parent['edit_info']['edited_on'] = datetime.datetime.now(UTC)
                 parent['edit_info']['edited_by'] = user_id
                 parent['edit_info']['previous_version'] = parent['edit_info']['update_version']
                 parent['edit_info']['update_version'] = new_id
-        if continue_version:
-            # db update
-            self.db_connection.update_structure(new_structure)
-            # clear cache so things get refetched and inheritance recomputed
-            self._clear_cache(new_id)
-        else:
-            self.db_connection.insert_structure(new_structure)
+        self._save_structure(new_structure, course_or_parent_locator, continue_version)
 
         # update the index entry if appropriate
         if index_entry is not None:
@@ -1044,10 +1169,10 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
             block_data['edit_info'] = {
                 'edited_on': datetime.datetime.now(UTC),
                 'edited_by': user_id,
-                'previous_version': block_data['edit_info']['update_version'],
+                'previous_version': self._previous_version(block_data, new_id),
                 'update_version': new_id,
             }
-            self.db_connection.insert_structure(new_structure)
+            self._save_structure(new_structure, descriptor.location)
             # update the index entry if appropriate
             if index_entry is not None:
                 self._update_head(index_entry, descriptor.location.branch, new_id)
@@ -1125,7 +1250,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         is_updated = self._persist_subdag(xblock, user_id, new_structure['blocks'], new_id)
 
         if is_updated:
-            self.db_connection.insert_structure(new_structure)
+            self._save_structure(new_structure, xblock.location)
 
             # update the index entry if appropriate
             if index_entry is not None:
@@ -1181,7 +1306,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
             block_fields['children'] = children
 
         if is_updated:
-            previous_version = None if is_new else structure_blocks[encoded_block_id]['edit_info'].get('update_version')
+            previous_version = None if is_new else self._previous_version(structure_blocks[encoded_block_id], new_id)
             structure_blocks[encoded_block_id] = {
                 "category": xblock.category,
                 "definition": xblock.definition_locator.definition_id,
@@ -1249,7 +1374,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         """
         # get the destination's index, and source and destination structures.
         source_structure = self._lookup_course(source_course)['structure']
-        index_entry = self.db_connection.get_course_index(destination_course)
+        index_entry = self._get_course_index(destination_course)
         if index_entry is None:
             # brand new course
             raise ItemNotFoundError(destination_course)
@@ -1294,7 +1419,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
             self._delete_if_true_orphan(orphan, destination_structure)
 
         # update the db
-        self.db_connection.insert_structure(destination_structure)
+        self._save_structure(destination_structure, destination_course)
         self._update_head(index_entry, destination_course.branch, destination_structure['_id'])
 
     def unpublish(self, location, user_id):
@@ -1339,7 +1464,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         parent_block['fields']['children'].remove(usage_locator.block_id)
         parent_block['edit_info']['edited_on'] = datetime.datetime.now(UTC)
         parent_block['edit_info']['edited_by'] = user_id
-        parent_block['edit_info']['previous_version'] = parent_block['edit_info']['update_version']
+        parent_block['edit_info']['previous_version'] = self._previous_version(parent_block, new_id)
         parent_block['edit_info']['update_version'] = new_id
 
         def remove_subtree(block_id):
@@ -1354,7 +1479,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         remove_subtree(usage_locator.block_id)
 
         # update index if appropriate and structures
-        self.db_connection.insert_structure(new_structure)
+        self._save_structure(new_structure, usage_locator.course_key)
 
         if index_entry is not None:
             # update the index entry if appropriate
@@ -1471,16 +1596,15 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
 
         :param course_locator: the course to clean
         """
-        original_structure = self._lookup_course(course_locator)['structure']
+        original_structure = copy.deepcopy(self._lookup_course(course_locator)['structure'])
         for block in original_structure['blocks'].itervalues():
             if 'fields' in block and 'children' in block['fields']:
                 block['fields']["children"] = [
                     block_id for block_id in block['fields']["children"]
                     if LocMapperStore.encode_key_for_mongo(block_id) in original_structure['blocks']
                 ]
-        self.db_connection.update_structure(original_structure)
-        # clear cache again b/c inheritance may be wrong over orphans
-        self._clear_cache(original_structure['_id'])
+        # clears the cache again b/c inheritance may be wrong over orphans
+        self._update_structure_in_place(original_structure, course_locator)
 
     def convert_references_to_keys(self, course_key, xblock_class, jsonfields, blocks):
         """
@@ -1544,7 +1668,7 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
             else:
                 return None
         else:
-            index_entry = self.db_connection.get_course_index(locator)
+            index_entry = self._get_course_index(locator)
             is_head = (
                 locator.version_guid is None or
                 index_entry['versions'][locator.branch] == locator.version_guid
@@ -1560,15 +1684,24 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
     def _version_structure(self, structure, user_id):
         """
         Copy the structure and update the history info (edited_by, edited_on, previous_version)
+
+        The new version of the structure a bulk write operation saves at its end is updated in place instead.
         :param structure:
         :param user_id:
         """
+        if self._get_bulk_write_of_structure(structure['_id']) is not None:
+            structure['edited_by'] = user_id
+            structure['edited_on'] = datetime.datetime.now(UTC)
+            return structure
+
         new_structure = copy.deepcopy(structure)
         new_structure['_id'] = ObjectId()
         new_structure['previous_version'] = structure['_id']
         new_structure['edited_by'] = user_id
         new_structure['edited_on'] = datetime.datetime.now(UTC)
         new_structure['schema_version'] = self.SCHEMA_VERSION
+        # the new version hasn't been updated in place
+        new_structure.pop('revision', None)
         return new_structure
 
     def _find_local_root(self, element_to_find, possibility, tree):
@@ -1591,7 +1724,21 @@ class SplitMongoModuleStore(ModuleStoreWriteBase):
         :param new_id:
         """
         index_entry['versions'][branch] = new_id
-        self.db_connection.update_course_index(index_entry)
+        bulk_write = self._get_bulk_write(index_entry['org'], index_entry['offering'])
+        if bulk_write is None:
+            self.db_connection.update_course_index(index_entry)
+        else:
+            # saved at the end of the bulk write operation
+            bulk_write['index'] = index_entry
+
+    def _previous_version(self, block, new_id):
+        """
+        Return the previous version of the block once changed in the structure version new_id. A block changed
+        again in the same version, by a bulk write operation, keeps its previous version.
+        """
+        if block['edit_info']['update_version'] == new_id:
+            return block['edit_info'].get('previous_version')
+        return block['edit_info']['update_version']
 
     def _serialize_fields(self, category, fields):
         """
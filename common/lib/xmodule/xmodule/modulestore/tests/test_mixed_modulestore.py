@@ -18,7 +18,7 @@ from django.conf import settings
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
 if not settings.configured:
     settings.configure()
-from xmodule.modulestore.mixed import MixedModuleStore
+from xmodule.modulestore.mixed import MixedModuleStore, store_bulk_write_operations_on_course
 
 
 @ddt.ddt
@@ -500,6 +500,26 @@ class TestMixedModuleStore(LocMapperSetupSansDjango):
         self.assertEqual(len(self.store.get_courses_for_wiki('edX.simple.2012_Fall')), 0)
         self.assertEqual(len(self.store.get_courses_for_wiki('no_such_wiki')), 0)
 
+    @ddt.data('draft')
+    def test_bulk_write_operations(self, default_ms):
+        """
+        Test that bulk write operations begun through the mixed store run on the course's store,
+        and that the writes they buffer are read back without flushing them
+        """
+        self.initdb(default_ms)
+        course_key = self.course_locations[self.MONGO_COURSEID].course_key
+        mongo_store = self.store._get_modulestore_for_courseid(course_key)  # pylint: disable=protected-access
+
+        with store_bulk_write_operations_on_course(self.store, course_key, buffer_writes=True):
+            self.assertIn(course_key, mongo_store.ignore_write_events_on_courses)
+            course = self.store.get_course(course_key)
+            course.show_calculator = True
+            self.store.update_item(course, self.user_id)
+            self.assertTrue(self.store.get_course(course_key).show_calculator)
+
+        self.assertNotIn(course_key, mongo_store.ignore_write_events_on_courses)
+        self.assertTrue(self.store.get_course(course_key).show_calculator)
+
 
 #=============================================================================================================
 # General utils for not using django settings
@@ -5,12 +5,15 @@ from nose.tools import assert_equals, assert_raises, \
 from path import path
 import pymongo
 import logging
+import os
 import shutil
+import tarfile
 from tempfile import mkdtemp
 from uuid import uuid4
 from datetime import datetime
 from pytz import UTC
 import unittest
+from mock import Mock, patch
 from xblock.core import XBlock
 
 from xblock.fields import Scope, Reference, ReferenceList, ReferenceValueDict
@@ -24,8 +27,9 @@ from xmodule.modulestore import ModuleStoreEnum
 from xmodule.modulestore.mongo import MongoModuleStore, MongoKeyValueStore
 from xmodule.modulestore.draft import DraftModuleStore
 from opaque_keys.edx.locations import SlashSeparatedCourseKey, AssetLocation
-from xmodule.modulestore.xml_exporter import export_to_xml
+from xmodule.modulestore.xml_exporter import export_to_xml, export_to_tarball
 from xmodule.modulestore.xml_importer import import_from_xml, perform_xlint
+from xmodule.modulestore.mixed import store_bulk_write_operations_on_course, flush_bulk_writes_on_course
 from xmodule.contentstore.mongo import MongoContentStore
 
 from xmodule.modulestore.tests.test_modulestore import check_path_to_location
@@ -58,6 +62,29 @@ class ReferenceTestXBlock(XBlock, XModuleMixin):
     reference_dict = ReferenceValueDict(scope=Scope.settings)
 
 
+class DictCache(dict):
+    """
+    In-memory stand-in for a django cache
+    """
+    def set(self, key, value):
+        self[key] = value
+
+    def add(self, key, value, timeout=None):  # pylint: disable=unused-argument
+        if key in self:
+            return False
+        self[key] = value
+        return True
+
+    def get_many(self, keys):
+        return {key: self[key] for key in keys if key in self}
+
+    def set_many(self, data):
+        self.update(data)
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
 class TestMongoModuleStore(unittest.TestCase):
     '''Tests!'''
     # Explicitly list the courses to load (don't want the big one)
@@ -471,6 +498,31 @@ class TestMongoModuleStore(unittest.TestCase):
         finally:
             shutil.rmtree(root_dir)
 
+    def test_export_to_tarball(self):
+        """
+        Test that exporting straight into a tar.gz produces the same files as exporting to a directory
+        """
+        course_key = SlashSeparatedCourseKey('edX', 'toy', '2012_Fall')
+        root_dir = path(mkdtemp())
+        try:
+            export_to_xml(self.draft_store, self.content_store, course_key, root_dir, 'test_export')
+            with open(root_dir / 'test_export.tar.gz', 'wb') as tar_gz:
+                export_to_tarball(self.draft_store, self.content_store, course_key, tar_gz, 'test_export')
+
+            exported_files = set(
+                os.path.join(os.path.relpath(dirpath, root_dir), filename)
+                for dirpath, __, filenames in os.walk(root_dir / 'test_export')
+                for filename in filenames
+            )
+            with tarfile.open(root_dir / 'test_export.tar.gz') as tar_file:
+                members = dict((member.name, member) for member in tar_file.getmembers() if member.isfile())
+                assert_equals(set(members), exported_files)
+                for name in ('test_export/course.xml', 'test_export/static/just_a_test.jpg'):
+                    with open(root_dir / name, 'rb') as exported_file:
+                        assert_equals(tar_file.extractfile(members[name]).read(), exported_file.read())
+        finally:
+            shutil.rmtree(root_dir)
+
     def test_course_without_image(self):
         """
         Make sure we elegantly passover our code when there isn't a static
@@ -598,6 +650,324 @@ class TestMongoModuleStore(unittest.TestCase):
         self.assertEqual(component.published_date, published_date)
         self.assertEqual(component.published_by, published_by)
 
+    def test_update_inheritance_subtree(self):
+        """
+        Tests that updating a container patches the cached metadata inheritance tree the same way
+        recomputing the whole tree would
+        """
+        request_cache_patch = patch.object(self.draft_store, 'request_cache', Mock(data={}))
+        request_cache_patch.start()
+        self.addCleanup(request_cache_patch.stop)
+
+        course_key = SlashSeparatedCourseKey('edX', 'inheritance', '2012_Fall')
+        categories = ['course', 'chapter', 'sequential', 'vertical', 'problem']
+        locations = [course_key.make_usage_key(category, 'test_' + category) for category in categories]
+        dummy_user = 123
+
+        # Create the course structure, attaching each block to its parent
+        for location in locations:
+            self.draft_store.create_and_save_xmodule(location, user_id=dummy_user)
+        for parent_location, child_location in zip(locations, locations[1:]):
+            parent = self.draft_store.get_item(parent_location)
+            parent.children.append(child_location)
+            self.draft_store.update_item(parent, dummy_user)
+
+        def assert_patched_tree():
+            """The cached tree matches a full recomputation"""
+            self.assertEqual(
+                self.draft_store._get_cached_metadata_inheritance_tree(course_key),
+                self.draft_store._compute_metadata_inheritance_tree(course_key)
+            )
+
+        assert_patched_tree()
+
+        chapter = self.draft_store.get_item(locations[1])
+        chapter.showanswer = 'never'
+        self.draft_store.update_item(chapter, dummy_user)
+        assert_patched_tree()
+        self.assertEqual(self.draft_store.get_item(locations[-1]).showanswer, 'never')
+
+        vertical = self.draft_store.get_item(locations[3])
+        vertical.showanswer = 'always'
+        self.draft_store.update_item(vertical, dummy_user)
+        assert_patched_tree()
+        self.assertEqual(self.draft_store.get_item(locations[-1]).showanswer, 'always')
+
+        # Detaching the vertical takes it and its problem out of the tree
+        sequential = self.draft_store.get_item(locations[2])
+        sequential.children = []
+        self.draft_store.update_item(sequential, dummy_user)
+        assert_patched_tree()
+        tree = self.draft_store._get_cached_metadata_inheritance_tree(course_key)
+        self.assertNotIn(locations[3].to_deprecated_string(), tree)
+        self.assertNotIn(locations[4].to_deprecated_string(), tree)
+
+    def test_update_inheritance_subtree_locked(self):
+        """
+        Tests that the shared metadata inheritance tree is invalidated rather than patched while
+        another update holds its lock
+        """
+        inheritance_cache = DictCache()
+        store = DraftModuleStore(
+            {'host': HOST, 'db': DB, 'collection': COLLECTION},
+            FS_ROOT, RENDER_TEMPLATE,
+            default_class=DEFAULT_CLASS,
+            branch_setting_func=lambda: ModuleStoreEnum.Branch.draft_preferred,
+            metadata_inheritance_cache_subsystem=inheritance_cache,
+        )
+        course_key = SlashSeparatedCourseKey('edX', 'inheritance_lock', '2012_Fall')
+        course_location = course_key.make_usage_key('course', '2012_Fall')
+        chapter_location = course_key.make_usage_key('chapter', 'test_chapter')
+        dummy_user = 123
+
+        store.create_and_save_xmodule(course_location, user_id=dummy_user)
+        store.create_and_save_xmodule(chapter_location, user_id=dummy_user)
+        course = store.get_item(course_location)
+        course.children.append(chapter_location)
+        store.update_item(course, dummy_user)
+        self.assertIn(unicode(course_key), inheritance_cache)
+
+        inheritance_cache.add(u'{}.lock'.format(course_key), True)
+        chapter = store.get_item(chapter_location)
+        chapter.showanswer = 'never'
+        store.update_item(chapter, dummy_user)
+        self.assertNotIn(unicode(course_key), inheritance_cache)
+        tree = store._get_cached_metadata_inheritance_tree(course_key)
+        self.assertEqual(tree[chapter_location.to_deprecated_string()]['showanswer'], 'never')
+
+    def test_update_inheritance_subtree_missing_parent(self):
+        """
+        Tests that the shared metadata inheritance tree is invalidated rather than patched when it
+        has no entry for the parent of the updated container
+        """
+        inheritance_cache = DictCache()
+        store = DraftModuleStore(
+            {'host': HOST, 'db': DB, 'collection': COLLECTION},
+            FS_ROOT, RENDER_TEMPLATE,
+            default_class=DEFAULT_CLASS,
+            branch_setting_func=lambda: ModuleStoreEnum.Branch.draft_preferred,
+            metadata_inheritance_cache_subsystem=inheritance_cache,
+        )
+        course_key = SlashSeparatedCourseKey('edX', 'inheritance_missing', '2012_Fall')
+        categories = ['course', 'chapter', 'sequential']
+        locations = [course_key.make_usage_key(category, 'test_' + category) for category in categories]
+        dummy_user = 123
+
+        for location in locations:
+            store.create_and_save_xmodule(location, user_id=dummy_user)
+        for parent_location, child_location in zip(locations, locations[1:]):
+            parent = store.get_item(parent_location)
+            parent.children.append(child_location)
+            store.update_item(parent, dummy_user)
+
+        tree = inheritance_cache[unicode(course_key)]
+        del tree[locations[1].to_deprecated_string()]
+        inheritance_cache[unicode(course_key)] = tree
+
+        sequential = store.get_item(locations[2])
+        sequential.showanswer = 'never'
+        store.update_item(sequential, dummy_user)
+        self.assertNotIn(unicode(course_key), inheritance_cache)
+        tree = store._get_cached_metadata_inheritance_tree(course_key)
+        self.assertEqual(tree[locations[2].to_deprecated_string()]['showanswer'], 'never')
+
+
+    def _structure_cache_store(self, branch_setting):
+        """
+        Return a draft store with a course structure cache, on the branch held by `branch_setting`
+        """
+        return DraftModuleStore(
+            {'host': HOST, 'db': DB, 'collection': COLLECTION},
+            FS_ROOT, RENDER_TEMPLATE,
+            default_class=DEFAULT_CLASS,
+            branch_setting_func=lambda: branch_setting[0],
+            metadata_inheritance_cache_subsystem=DictCache(),
+            course_structure_cache=DictCache(),
+        )
+
+    def test_structure_cache_reads(self):
+        """
+        Tests that published reads are served from the per block entries of the course structure
+        cache, with their inherited metadata, and that writes to the course invalidate them
+        """
+        branch_setting = [ModuleStoreEnum.Branch.draft_preferred]
+        store = self._structure_cache_store(branch_setting)
+        course_location = Location('edX', 'snapshot', '2012_Fall', 'course', '2012_Fall')
+        chapter_location = Location('edX', 'snapshot', '2012_Fall', 'chapter', 'test_chapter')
+        dummy_user = 123
+
+        store.create_and_save_xmodule(course_location, user_id=dummy_user)
+        store.create_and_save_xmodule(chapter_location, user_id=dummy_user)
+        course = store.get_item(course_location)
+        course.children.append(chapter_location)
+        course.showanswer = 'never'
+        store.update_item(course, dummy_user)
+
+        # The first published read caches the blocks, and later ones query neither the blocks nor
+        # the inheritance tree
+        branch_setting[0] = ModuleStoreEnum.Branch.published_only
+        store.get_course(course_location.course_key, depth=None)
+        store.metadata_inheritance_cache_subsystem.pop(unicode(course_location.course_key))
+        with check_mongo_calls(store, 0):
+            course = store.get_course(course_location.course_key, depth=None)
+            chapter = course.get_children()[0]
+            self.assertEqual(chapter.location, chapter_location)
+            self.assertEqual(chapter.showanswer, 'never')
+            self.assertTrue(store.has_item(chapter_location))
+        self.assertEqual(len(store.course_structure_cache), 2)
+
+        # Change the chapter, then check that published reads see the change
+        branch_setting[0] = ModuleStoreEnum.Branch.draft_preferred
+        chapter = store.get_item(chapter_location)
+        chapter.display_name = 'Changed Display Name'
+        store.update_item(chapter, dummy_user)
+
+        branch_setting[0] = ModuleStoreEnum.Branch.published_only
+        self.assertEqual(store.get_item(chapter_location).display_name, 'Changed Display Name')
+
+    def test_cache_course_structure(self):
+        """
+        Tests that caching the structure of a course stores all its published blocks, but the ones too
+        big for the cache
+        """
+        branch_setting = [ModuleStoreEnum.Branch.draft_preferred]
+        store = self._structure_cache_store(branch_setting)
+        course_location = Location('edX', 'structure', '2012_Fall', 'course', '2012_Fall')
+        chapter_location = Location('edX', 'structure', '2012_Fall', 'chapter', 'test_chapter')
+        dummy_user = 123
+
+        store.create_and_save_xmodule(course_location, user_id=dummy_user)
+        store.create_and_save_xmodule(chapter_location, user_id=dummy_user)
+        course = store.get_item(course_location)
+        course.children.append(chapter_location)
+        store.update_item(course, dummy_user)
+
+        with patch('xmodule.modulestore.mongo.base.COURSE_STRUCTURE_CACHE_MAX_ENTRY_SIZE', 0):
+            store.cache_course_structure(course_location.course_key)
+        self.assertEqual(len(store.course_structure_cache), 0)
+
+        store.cache_course_structure(course_location.course_key)
+        self.assertEqual(len(store.course_structure_cache), 2)
+        branch_setting[0] = ModuleStoreEnum.Branch.published_only
+        with check_mongo_calls(store, 0):
+            course = store.get_course(course_location.course_key, depth=None)
+            self.assertEqual(course.get_children()[0].location, chapter_location)
+
+    def test_parent_index_reads(self):
+        """
+        Tests that published parents are looked up in the course parent index, and that moving a
+        block rebuilds it
+        """
+        store = DraftModuleStore(
+            {'host': HOST, 'db': DB, 'collection': COLLECTION},
+            FS_ROOT, RENDER_TEMPLATE,
+            default_class=DEFAULT_CLASS,
+            branch_setting_func=lambda: ModuleStoreEnum.Branch.draft_preferred,
+            metadata_inheritance_cache_subsystem=DictCache(),
+            course_structure_cache=DictCache(),
+        )
+        course_location = Location('edX', 'parents', '2012_Fall', 'course', '2012_Fall')
+        chapter_locations = [
+            Location('edX', 'parents', '2012_Fall', 'chapter', name) for name in ('chapter_a', 'chapter_b')
+        ]
+        sequential_location = Location('edX', 'parents', '2012_Fall', 'sequential', 'test_sequential')
+        dummy_user = 123
+
+        for location in [course_location, sequential_location] + chapter_locations:
+            store.create_and_save_xmodule(location, user_id=dummy_user)
+        course = store.get_item(course_location)
+        course.children.extend(chapter_locations)
+        store.update_item(course, dummy_user)
+        chapter = store.get_item(chapter_locations[0])
+        chapter.children.append(sequential_location)
+        store.update_item(chapter, dummy_user)
+
+        # The first lookup builds the index, and later ones don't query mongo
+        published_only = ModuleStoreEnum.RevisionOption.published_only
+        self.assertEqual(store.get_parent_location(sequential_location, published_only), chapter_locations[0])
+        with check_mongo_calls(store, 0):
+            self.assertEqual(store.get_parent_location(chapter_locations[0], published_only), course_location)
+            self.assertIsNone(store.get_parent_location(course_location, published_only))
+
+        # Move the sequential to the other chapter
+        chapter.children = []
+        store.update_item(chapter, dummy_user)
+        chapter = store.get_item(chapter_locations[1])
+        chapter.children.append(sequential_location)
+        store.update_item(chapter, dummy_user)
+        self.assertEqual(store.get_parent_location(sequential_location, published_only), chapter_locations[1])
+
+    def test_buffered_bulk_writes(self):
+        """
+        Tests that the writes of a bulk write operation which buffers them are only saved when
+        read back or when the operation ends, with the new items inserted in a single batch
+        """
+        store = DraftModuleStore(
+            {'host': HOST, 'db': DB, 'collection': COLLECTION},
+            FS_ROOT, RENDER_TEMPLATE,
+            default_class=DEFAULT_CLASS,
+            branch_setting_func=lambda: ModuleStoreEnum.Branch.draft_preferred,
+        )
+        course_key = SlashSeparatedCourseKey('edX', 'buffered', '2012_Fall')
+        course_location = course_key.make_usage_key('course', '2012_Fall')
+        chapter_locations = [course_key.make_usage_key('chapter', 'chapter_{}'.format(i)) for i in range(3)]
+        dummy_user = 123
+        store.create_and_save_xmodule(course_location, user_id=dummy_user)
+
+        insert_wrap = Mock(wraps=store.collection.insert)
+        with patch.object(store.collection, 'insert', insert_wrap):
+            with store_bulk_write_operations_on_course(store, course_key, buffer_writes=True):
+                course = store.get_item(course_location)
+                course.display_name = u'Buffered'
+                course.children.extend(chapter_locations)
+                store.update_item(course, dummy_user)
+                for location in chapter_locations:
+                    chapter = store.create_xmodule(location)
+                    chapter.display_name = location.name
+                    store.update_item(chapter, dummy_user, allow_not_found=True)
+                self.assertEqual(insert_wrap.call_count, 0)
+
+                # reading the course back saves the buffered writes
+                self.assertTrue(store.has_item(chapter_locations[0]))
+                self.assertEqual(insert_wrap.call_count, 1)
+                self.assertEqual(store.get_item(course_location).children, chapter_locations)
+
+                chapter = store.get_item(chapter_locations[0])
+                chapter.display_name = u'Renamed'
+                store.update_item(chapter, dummy_user)
+            self.assertEqual(insert_wrap.call_count, 1)
+
+        self.assertEqual(store.get_item(course_location).display_name, u'Buffered')
+        self.assertEqual(
+            [store.get_item(location).display_name for location in chapter_locations],
+            [u'Renamed', u'chapter_1', u'chapter_2']
+        )
+
+    def test_buffered_bulk_writes_flush(self):
+        """
+        Tests that `flush_bulk_writes_on_course` saves the buffered writes, and that reading an item
+        which wasn't written leaves them buffered
+        """
+        store = DraftModuleStore(
+            {'host': HOST, 'db': DB, 'collection': COLLECTION},
+            FS_ROOT, RENDER_TEMPLATE,
+            default_class=DEFAULT_CLASS,
+            branch_setting_func=lambda: ModuleStoreEnum.Branch.draft_preferred,
+        )
+        course_key = SlashSeparatedCourseKey('edX', 'buffered_flush', '2012_Fall')
+        course_location = course_key.make_usage_key('course', '2012_Fall')
+        chapter_location = course_key.make_usage_key('chapter', 'chapter')
+        dummy_user = 123
+        store.create_and_save_xmodule(course_location, user_id=dummy_user)
+
+        with store_bulk_write_operations_on_course(store, course_key, buffer_writes=True):
+            chapter = store.create_xmodule(chapter_location)
+            store.update_item(chapter, dummy_user, allow_not_found=True)
+            store.get_item(course_location)
+            self.assertIsNone(store.collection.find_one({'_id': chapter_location.to_deprecated_son()}))
+
+            flush_bulk_writes_on_course(store, course_key)
+            self.assertIsNotNone(store.collection.find_one({'_id': chapter_location.to_deprecated_son()}))
 
 
 class TestMongoKeyValueStore(object):
@@ -1,6 +1,7 @@
 """
     Test split modulestore w/o using any django stuff.
 """
+import copy
 import datetime
 import unittest
 import uuid
@@ -8,6 +9,7 @@ from importlib import import_module
 from path import path
 import re
 import random
+from mock import patch
 
 from xblock.fields import Scope
 from xmodule.course_module import CourseDescriptor
@@ -16,9 +18,11 @@ from xmodule.modulestore.exceptions import (InsufficientSpecificationError, Item
             DuplicateItemError, DuplicateCourseError)
 from opaque_keys.edx.locator import CourseLocator, BlockUsageLocator, VersionTree, LocalId
 from xmodule.modulestore.inheritance import InheritanceMixin
+from xmodule.modulestore.mixed import store_bulk_write_operations_on_course
 from xmodule.x_module import XModuleMixin
 from xmodule.fields import Date, Timedelta
 from xmodule.modulestore.split_mongo.split import SplitMongoModuleStore
+from xmodule.modulestore.split_mongo.mongo_connection import DocumentCache
 from xmodule.modulestore.tests.test_modulestore import check_has_course_method
 
 
@@ -675,6 +679,28 @@ class SplitModuleCourseTests(SplitModuleTest):
         self.assertIn('chapter1', block_map)
         self.assertIn('problem3_2', block_map)
 
+    def test_definitions_fetched_in_bulk(self):
+        """
+        Test that the definitions of the blocks of a prefetched subtree are fetched in a single query
+        """
+        locator = BlockUsageLocator(
+            CourseLocator(org='testx', offering='GreekHero', branch=BRANCH_NAME_DRAFT),
+            block_type='course', block_id='head12345'
+        )
+        # start from an empty descriptor cache, as a new request would
+        modulestore()._clear_cache()
+        course = modulestore().get_item(locator, depth=None)
+        loaders = [block['definition'] for block in course.system.module_data.itervalues()]
+        self.assertGreater(len(loaders), 1)
+
+        db_connection = modulestore().db_connection
+        with patch.object(db_connection.definitions, 'find', wraps=db_connection.definitions.find) as find:
+            with patch.object(db_connection.definitions, 'find_one') as find_one:
+                definitions = [loader.fetch() for loader in loaders]
+        self.assertEqual(find.call_count, 1)
+        self.assertFalse(find_one.called)
+        self.assertNotIn(None, definitions)
+
     def test_course_successors(self):
         """
         get_course_successors(course_locator, version_history_depth=1)
@@ -1386,6 +1412,37 @@ class TestItemCrud(SplitModuleTest):
         for _ in range(4):
             self.create_subtree_for_deletion(node_loc, category_queue[1:])
 
+    def test_bulk_write_operation(self):
+        """
+        Test that the writes of a bulk write operation all go into a single new version of the course,
+        which is only saved at its end
+        """
+        user = random.getrandbits(32)
+        new_course = modulestore().create_course('test_org', 'test_bulk', user)
+        original_version = new_course.location.version_guid
+        course_key = new_course.id.version_agnostic()
+        root = new_course.location.version_agnostic()
+
+        with store_bulk_write_operations_on_course(modulestore(), course_key):
+            chapter = modulestore().create_item(root, 'chapter', user, fields={'display_name': 'chapter 1'})
+            new_version = chapter.location.version_guid
+            self.assertNotEqual(new_version, original_version)
+            modulestore().create_item(root, 'chapter', user, fields={'display_name': 'chapter 2'})
+            chapter.display_name = 'chapter one'
+            chapter = modulestore().update_item(chapter, user)
+            self.assertEqual(chapter.location.version_guid, new_version)
+            self.assertEqual(len(modulestore().get_course(course_key).children), 2)
+            self.assertEqual(
+                modulestore().get_course_index_info(course_key)['versions'][course_key.branch], original_version
+            )
+
+        self.assertEqual(modulestore().get_course_index_info(course_key)['versions'][course_key.branch], new_version)
+        course = modulestore().get_course(course_key)
+        self.assertEqual(len(course.children), 2)
+        self.assertEqual(course.update_version, new_version)
+        self.assertEqual(course.previous_version, original_version)
+        self.assertEqual(modulestore().get_item(chapter.location.version_agnostic()).display_name, 'chapter one')
+
 
 class TestCourseCreation(SplitModuleTest):
     """
@@ -1737,6 +1794,87 @@ class TestSchema(SplitModuleTest):
                 "{0.name} has records with wrong schema_version".format(collection)
             )
 
+
+class TestDocumentCache(SplitModuleTest):
+    """
+    Test the process-wide caches of structures and definitions
+    """
+    def test_structure_cache(self):
+        """
+        Test that structures are only read from the db once across requests
+        """
+        locator = CourseLocator(org='testx', offering='GreekHero', branch=BRANCH_NAME_DRAFT)
+        modulestore().get_course(locator)
+        stats = modulestore().db_connection.cache_stats()['structures']
+
+        # a new request starts with an empty descriptor cache
+        modulestore().thread_cache.course_cache = {}
+        modulestore().get_course(locator)
+        new_stats = modulestore().db_connection.cache_stats()['structures']
+        self.assertEqual(new_stats['hits'], stats['hits'] + 1)
+        self.assertEqual(new_stats['misses'], stats['misses'])
+
+    def test_cached_structure_not_requeried(self):
+        """
+        Test that a cached structure is served as is, without querying the db
+        """
+        locator = CourseLocator(org='testx', offering='GreekHero', branch=BRANCH_NAME_DRAFT)
+        structure = modulestore()._lookup_course(locator)['structure']
+        with patch.object(modulestore().db_connection.structures, 'find_one') as find_one:
+            self.assertIs(modulestore()._lookup_course(locator)['structure'], structure)
+        self.assertFalse(find_one.called)
+
+    def test_structure_updated_in_place(self):
+        """
+        Test that a cached structure isn't served once another process updated it in place
+        """
+        locator = CourseLocator(org='testx', offering='GreekHero', branch=BRANCH_NAME_DRAFT)
+        modulestore()._lookup_course(locator)
+
+        options = dict(SplitModuleTest.MODULESTORE['OPTIONS'], render_template=render_to_template_mock)
+        other_store = SplitMongoModuleStore(SplitModuleTest.MODULESTORE['DOC_STORE_CONFIG'], **options)
+        structure = copy.deepcopy(other_store._lookup_course(locator)['structure'])
+        structure['edited_by'] = 'other@edx.org'
+        other_store._update_structure_in_place(structure, locator)
+
+        self.assertEqual(modulestore()._lookup_course(locator)['structure']['edited_by'], 'other@edx.org')
+
+    def test_cache_bounds(self):
+        """
+        Test that the least recently used documents are evicted once the cache is full
+        """
+        cache = DocumentCache(max_entries=2, max_size=1024)
+        for key in ('a', 'b', 'c'):
+            cache.set({'_id': key, 'fields': {}})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), {'_id': 'c', 'fields': {}})
+
+        # documents which don't fit are not cached
+        cache.set({'_id': 'd', 'fields': {'data': 'x' * 1024}})
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertLessEqual(cache.stats()['size'], 1024)
+
+    def test_cache_returns_copies(self):
+        """
+        Test that modifying a document read from the cache doesn't modify the cached one
+        """
+        cache = DocumentCache(max_entries=2, max_size=1024)
+        cache.set({'_id': 'a', 'fields': {'display_name': 'A'}})
+        cache.get('a')['fields']['display_name'] = 'B'
+        self.assertEqual(cache.get('a')['fields']['display_name'], 'A')
+
+    def test_read_only_cache_shares_documents(self):
+        """
+        Test that a read only cache returns the cached documents themselves, and still accounts for
+        their size
+        """
+        cache = DocumentCache(max_entries=2, max_size=1024, read_only=True)
+        document = {'_id': 'a', 'fields': {'display_name': 'A'}}
+        cache.set(document)
+        self.assertIs(cache.get('a'), document)
+        self.assertGreater(cache.stats()['size'], 0)
+
 #===========================================
 def modulestore():
     """
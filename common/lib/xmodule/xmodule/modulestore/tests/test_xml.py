@@ -3,6 +3,8 @@ Tests around our XML modulestore, including importing
 well-formed and not-well-formed XML.
 """
 import os.path
+import shutil
+import tempfile
 import unittest
 from glob import glob
 from mock import patch
@@ -28,6 +30,19 @@ def glob_tildes_at_end(path):
     return no_tildes + with_tildes
 
 
+class PopCheckingDict(dict):
+    """
+    A dict calling `check(key)` before any key is popped from it.
+    """
+    def __init__(self, items, check):
+        super(PopCheckingDict, self).__init__(items)
+        self.check = check
+
+    def pop(self, key, *args):
+        self.check(key)
+        return super(PopCheckingDict, self).pop(key, *args)
+
+
 class TestXMLModuleStore(unittest.TestCase):
     """
     Test around the XML modulestore
@@ -107,3 +122,81 @@ class TestXMLModuleStore(unittest.TestCase):
             SlashSeparatedCourseKey('edX', 'toy', '2012_Fall'),
             locator_key_fields=SlashSeparatedCourseKey.KEY_FIELDS
         )
+
+    def test_lazy_loading(self):
+        """
+        Test that courses only load on their first access with lazy, and that their load times are reported
+        """
+        store = XMLModuleStore(DATA_DIR, course_dirs=['toy', 'simple'], lazy=True)
+        self.assertEqual(store.course_load_times, {})
+
+        toy_id = SlashSeparatedCourseKey('edX', 'toy', '2012_Fall')
+        self.assertEqual(store.get_course(toy_id).id, toy_id)
+        self.assertEqual(store.course_load_times.keys(), ['toy'])
+        self.assertTrue(store.has_item(toy_id.make_usage_key('chapter', 'Overview')))
+        self.assertEqual(store.course_load_times.keys(), ['toy'])
+
+        self.assertEqual(len(store.get_courses()), 2)
+        self.assertItemsEqual(store.course_load_times.keys(), ['toy', 'simple'])
+
+    def test_lazy_loading_in_progress(self):
+        """
+        Test that a course is marked as loading before it's taken out of the courses left to load
+        """
+        store = XMLModuleStore(DATA_DIR, course_dirs=['toy'], lazy=True)
+        toy_id = SlashSeparatedCourseKey('edX', 'toy', '2012_Fall')
+        # pylint: disable=protected-access
+        store._unloaded_courses = PopCheckingDict(
+            store._unloaded_courses, lambda course_id: self.assertIn(course_id, store._loading_courses)
+        )
+        self.assertEqual(store.get_course(toy_id).id, toy_id)
+        self.assertEqual(store._unloaded_courses, {})
+        self.assertEqual(store._loading_courses, set())
+
+    def test_course_cache(self):
+        """
+        Test that a course loads from its cache the same as from its files, until they change
+        """
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        parsed = XMLModuleStore(DATA_DIR, course_dirs=['toy'], cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        with patch.object(XMLModuleStore, 'load_course') as mock_load_course:
+            cached = XMLModuleStore(DATA_DIR, course_dirs=['toy'], cache_dir=cache_dir)
+        self.assertFalse(mock_load_course.called)
+
+        course_id = SlashSeparatedCourseKey('edX', 'toy', '2012_Fall')
+        parsed_items = dict((item.location, item) for item in parsed.get_items(course_id))
+        cached_items = dict((item.location, item) for item in cached.get_items(course_id))
+        self.assertEqual(set(cached_items), set(parsed_items))
+        for location, item in parsed_items.iteritems():
+            cached_item = cached_items[location]
+            self.assertEqual(cached_item.display_name, item.display_name)
+            self.assertEqual(cached_item.children, item.children)
+            self.assertEqual(cached.get_parent_location(location), parsed.get_parent_location(location))
+        self.assertEqual(cached.get_course(course_id).grade_cutoffs, parsed.get_course(course_id).grade_cutoffs)
+
+        # A changed file misses the cache
+        course_xml = os.path.join(DATA_DIR, 'toy', 'course.xml')
+        stat = os.stat(course_xml)
+        self.addCleanup(os.utime, course_xml, (stat.st_atime, stat.st_mtime))
+        os.utime(course_xml, (stat.st_atime, stat.st_mtime + 1))
+        with patch.object(XMLModuleStore, 'load_course', return_value=None) as mock_load_course:
+            XMLModuleStore(DATA_DIR, course_dirs=['toy'], cache_dir=cache_dir)
+        self.assertTrue(mock_load_course.called)
+
+    def test_course_cache_writable_by_others(self):
+        """
+        Test that a course isn't loaded from a cache that other users can write to
+        """
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        XMLModuleStore(DATA_DIR, course_dirs=['toy'], cache_dir=cache_dir)
+        cache_path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        self.assertFalse(os.stat(cache_path).st_mode & 0077)
+
+        os.chmod(cache_path, 0666)
+        with patch.object(XMLModuleStore, 'load_course', return_value=None) as mock_load_course:
+            XMLModuleStore(DATA_DIR, course_dirs=['toy'], cache_dir=cache_dir)
+        self.assertTrue(mock_load_course.called)
@@ -1,18 +1,24 @@
+import cPickle as pickle
 import hashlib
 import itertools
 import json
 import logging
 import os
 import re
+import stat
 import sys
 import glob
+import threading
+import time
 
 from collections import defaultdict
 from cStringIO import StringIO
+from dogapi import dog_stats_api
 from fs.osfs import OSFS
 from importlib import import_module
 from lxml import etree
 from path import path
+from uuid import uuid4
 
 from xmodule.error_module import ErrorDescriptor
 from xmodule.errortracker import make_error_tracker, exc_info_to_str
@@ -21,16 +27,17 @@ from xmodule.x_module import XMLParsingSystem, policy_key
 from xmodule.modulestore.xml_exporter import DEFAULT_CONTENT_FIELDS
 from xmodule.modulestore import ModuleStoreEnum
 from xmodule.tabs import CourseTabList
+from opaque_keys import InvalidKeyError
 from opaque_keys.edx.keys import UsageKey
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
 
 from xblock.field_data import DictFieldData
-from xblock.runtime import DictKeyValueStore, IdGenerator
+from xblock.runtime import DictKeyValueStore, IdGenerator, KvsFieldData
 
 from . import ModuleStoreReadBase, Location, ModuleStoreEnum
 
 from .exceptions import ItemNotFoundError
-from .inheritance import compute_inherited_metadata, inheriting_field_data
+from .inheritance import compute_inherited_metadata, inheriting_field_data, InheritanceKeyValueStore
 
 from xblock.fields import ScopeIds, Reference, ReferenceList, ReferenceValueDict
 
@@ -41,6 +48,12 @@ etree.set_default_parser(edx_xml_parser)
 
 log = logging.getLogger(__name__)
 
+# Bump whenever the format of the cached courses changes, so the old caches are ignored
+COURSE_CACHE_VERSION = 1
+
+# prefix of the cache files being written
+PARTIAL_PREFIX = '.partial-'
+
 
 # VS[compat]
 # TODO (cpennington): Remove this once all fall 2012 courses have been imported
@@ -369,7 +382,7 @@ class XMLModuleStore(ModuleStoreReadBase):
     """
     def __init__(
         self, data_dir, default_class=None, course_dirs=None, course_ids=None,
-        load_error_modules=True, i18n_service=None, **kwargs
+        load_error_modules=True, i18n_service=None, lazy=False, cache_dir=None, **kwargs
     ):
         """
         Initialize an XMLModuleStore from data_dir
@@ -382,16 +395,32 @@ class XMLModuleStore(ModuleStoreReadBase):
 
             course_dirs or course_ids (list of str): If specified, the list of course_dirs or course_ids to load. Otherwise,
                 load all courses. Note, providing both
+
+            lazy (bool): If True, only read the ids of the courses from their course.xml, and load
+                each course on its first access instead of all of them up front. Listing the
+                courses loads all of them.
+
+            cache_dir (str): If specified, the directory where the parsed courses are cached, for the
+                processes which load the same courses (e.g. the workers of a server) to parse each one only
+                once. A course is parsed again whenever any file of its directory changes.
         """
         super(XMLModuleStore, self).__init__(**kwargs)
 
         self.data_dir = path(data_dir)
+        self.cache_dir = path(cache_dir) if cache_dir is not None else None
         self.modules = defaultdict(dict)  # course_id -> dict(location -> XBlock)
         self.courses = {}  # course_dir -> XBlock for the course
         self.errored_courses = {}  # course_dir -> errorlog, for dirs that failed to load
+        self.course_load_times = {}  # course_dir -> how many seconds loading the course took
+
+        # course_id -> course_dir, for the courses which will be loaded on their first access
+        self._unloaded_courses = {}
+        self._loading_courses = set()
+        self._load_lock = threading.RLock()
 
         if course_ids is not None:
             course_ids = [SlashSeparatedCourseKey.from_deprecated_string(course_id) for course_id in course_ids]
+        self._course_ids = course_ids
 
         self.load_error_modules = load_error_modules
 
@@ -422,7 +451,62 @@ class XMLModuleStore(ModuleStoreReadBase):
             course_dirs = sorted([d for d in os.listdir(self.data_dir) if
                                   os.path.exists(self.data_dir / d / "course.xml")])
         for course_dir in course_dirs:
-            self.try_load_course(course_dir, course_ids)
+            course_id = self._read_course_id(course_dir) if lazy else None
+            if course_id is None:
+                self.try_load_course(course_dir, course_ids)
+            elif course_ids is None or course_id in course_ids:
+                self._unloaded_courses[course_id] = course_dir
+
+    def _read_course_id(self, course_dir):
+        """
+        Return the id of the course in course_dir, as `load_course` computes it, reading only its
+        course.xml. Returns None if it can't be read that way, for the course to be loaded right away,
+        which reports the problem.
+        """
+        try:
+            with open(self.data_dir / course_dir / "course.xml") as course_file:
+                course_data = etree.parse(
+                    StringIO(clean_out_mako_templating(course_file.read())), parser=edx_xml_parser
+                ).getroot()
+        except (IOError, etree.XMLSyntaxError):
+            return None
+
+        url_name = course_data.get('url_name', course_data.get('slug'))
+        if not url_name:
+            return None
+        try:
+            return SlashSeparatedCourseKey(
+                course_data.get('org', 'edx'), course_data.get('course', course_dir), url_name
+            )
+        except InvalidKeyError:
+            return None
+
+    def _load_course_lazily(self, course_id):
+        """
+        Load the course if it's one of those left to load on their first access.
+        """
+        # Unlocked fast path: a course is added to the loading courses before it's taken out of the
+        # unloaded ones, so a course found in neither (in this order) is done loading
+        if course_id not in self._unloaded_courses and course_id not in self._loading_courses:
+            return
+        with self._load_lock:
+            # Another thread may have loaded it while this one waited for the lock, or this thread
+            # may be loading it already, as loading a course gets its items
+            if course_id not in self._unloaded_courses:
+                return
+            self._loading_courses.add(course_id)
+            course_dir = self._unloaded_courses.pop(course_id)
+            try:
+                self.try_load_course(course_dir, self._course_ids)
+            finally:
+                self._loading_courses.discard(course_id)
+
+    def _load_all_courses(self):
+        """
+        Load all the courses left to load on their first access.
+        """
+        for course_id in self._unloaded_courses.keys():
+            self._load_course_lazily(course_id)
 
     def try_load_course(self, course_dir, course_ids=None):
         '''
@@ -435,8 +519,16 @@ class XMLModuleStore(ModuleStoreReadBase):
         # place after the course loads and we have its location
         errorlog = make_error_tracker()
         course_descriptor = None
+        start = time.time()
         try:
-            course_descriptor = self.load_course(course_dir, course_ids, errorlog.tracker)
+            cache_path = self._course_cache_path(course_dir) if self.cache_dir is not None else None
+            if cache_path is not None:
+                course_descriptor = self._load_cached_course(cache_path, course_dir, course_ids, errorlog.tracker)
+            if course_descriptor is None:
+                course_descriptor = self.load_course(course_dir, course_ids, errorlog.tracker)
+                # only cache the courses which loaded cleanly, so that their errors are reported on every load
+                if cache_path is not None and course_descriptor is not None and not errorlog.errors:
+                    self._cache_course(cache_path, course_dir, course_descriptor)
         except Exception as exc:  # pylint: disable=broad-except
             msg = "ERROR: Failed to load course '{0}': {1}".format(
                 course_dir.encode("utf-8"), unicode(exc)
@@ -445,6 +537,13 @@ class XMLModuleStore(ModuleStoreReadBase):
             errorlog.tracker(msg)
             self.errored_courses[course_dir] = errorlog
 
+        load_time = time.time() - start
+        self.course_load_times[course_dir] = load_time
+        log.info(u"Loaded course from %s in %.2f seconds", course_dir, load_time)
+        dog_stats_api.histogram(
+            'xmodule.xml_modulestore.course_load_time', load_time, tags=[u'course_dir:{}'.format(course_dir)]
+        )
+
         if course_descriptor is None:
             pass
         elif isinstance(course_descriptor, ErrorDescriptor):
@@ -459,6 +558,7 @@ class XMLModuleStore(ModuleStoreReadBase):
         '''
         String representation - for debugging
         '''
+        self._load_all_courses()
         return '<XMLModuleStore data_dir=%r, %d courses, %d modules>' % (
             self.data_dir, len(self.courses), len(self.modules)
         )
@@ -553,24 +653,7 @@ class XMLModuleStore(ModuleStoreReadBase):
                 """
                 return policy.get(policy_key(usage_id), {})
 
-            services = {}
-            if self.i18n_service:
-                services['i18n'] = self.i18n_service
-
-            system = ImportSystem(
-                xmlstore=self,
-                course_id=course_id,
-                course_dir=course_dir,
-                error_tracker=tracker,
-                parent_tracker=self.parent_trackers[course_id],
-                load_error_modules=self.load_error_modules,
-                get_policy=get_policy,
-                mixins=self.xblock_mixins,
-                default_class=self.default_class,
-                select=self.xblock_select,
-                field_data=self.field_data,
-                services=services,
-            )
+            system = self._import_system(course_id, course_dir, tracker, get_policy)
 
             course_descriptor = system.process_xml(etree.tostring(course_data, encoding='unicode'))
 
@@ -599,6 +682,150 @@ class XMLModuleStore(ModuleStoreReadBase):
             log.debug('========> Done with course import from {0}'.format(course_dir))
             return course_descriptor
 
+    def _import_system(self, course_id, course_dir, tracker, get_policy):
+        """
+        Return the ImportSystem to load the blocks of the course with.
+        """
+        services = {}
+        if self.i18n_service:
+            services['i18n'] = self.i18n_service
+
+        return ImportSystem(
+            xmlstore=self,
+            course_id=course_id,
+            course_dir=course_dir,
+            error_tracker=tracker,
+            parent_tracker=self.parent_trackers[course_id],
+            load_error_modules=self.load_error_modules,
+            get_policy=get_policy,
+            mixins=self.xblock_mixins,
+            default_class=self.default_class,
+            select=self.xblock_select,
+            field_data=self.field_data,
+            services=services,
+        )
+
+    def _course_cache_path(self, course_dir):
+        """
+        Return the path of the cached course in course_dir. It's named after a hash of the path, size and
+        modification time of every file in course_dir, so a change to any of them misses the cache.
+        """
+        manifest = hashlib.sha1(repr((COURSE_CACHE_VERSION, self.default_class, self.xblock_mixins)))
+        root = self.data_dir / course_dir
+        for dirpath, dirnames, filenames in os.walk(root):
+            # walk in the same order in every process
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filepath = os.path.join(dirpath, filename)
+                file_stat = os.stat(filepath)
+                manifest.update(repr((os.path.relpath(filepath, root), file_stat.st_size, file_stat.st_mtime)))
+        return self.cache_dir / u'{0}-{1}.pickle'.format(course_dir, manifest.hexdigest())
+
+    def _cache_course(self, cache_path, course_dir, course_descriptor):
+        """
+        Cache the field values of all the blocks of the course, and its parent tracker, at cache_path.
+        Courses which can't be cached are only logged.
+        """
+        course_id = course_descriptor.id
+        blocks = []
+        for block in self.modules[course_id].itervalues():
+            # pylint: disable=protected-access
+            field_data = block._field_data
+            values = dict(
+                (name, field_data.get(block, name)) for name in block.fields if field_data.has(block, name)
+            )
+            blocks.append((block.scope_ids, field_data is self.field_data, values))
+        cached_course = {
+            'course_id': course_id,
+            'course_usage_id': course_descriptor.scope_ids.usage_id,
+            'blocks': blocks,
+            'parent_tracker': self.parent_trackers[course_id],
+        }
+
+        partial_path = self.cache_dir / (PARTIAL_PREFIX + uuid4().hex)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                try:
+                    os.makedirs(self.cache_dir, 0700)
+                except OSError:
+                    # another process may have created it in the meantime
+                    if not os.path.isdir(self.cache_dir):
+                        raise
+            # only writable by this user, whatever the umask, for `_load_cached_course` to trust it
+            partial_fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+            with os.fdopen(partial_fd, 'wb') as partial_file:
+                pickle.dump(cached_course, partial_file, pickle.HIGHEST_PROTOCOL)
+            # other processes only ever see complete caches
+            os.rename(partial_path, cache_path)
+        except Exception:  # pylint: disable=broad-except
+            log.warning("Couldn't cache the course from %s", course_dir, exc_info=True)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return
+
+        # remove the caches of the previous versions of the course
+        stale_cache_re = re.compile(re.escape(course_dir) + r'-[0-9a-f]{40}\.pickle$')
+        for filename in os.listdir(self.cache_dir):
+            if stale_cache_re.match(filename) and self.cache_dir / filename != cache_path:
+                try:
+                    os.remove(self.cache_dir / filename)
+                except OSError:
+                    pass
+
+    def _load_cached_course(self, cache_path, course_dir, course_ids, tracker):
+        """
+        Load the course from its cache at cache_path, like `load_course` does from course_dir, without
+        parsing any of its files. Returns None if it isn't cached.
+
+        Unpickling runs arbitrary code, so the cache is only loaded from a file that this user owns and
+        that no one else can write to.
+        """
+        try:
+            cache_fd = os.open(cache_path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except OSError:
+            return None
+        try:
+            with os.fdopen(cache_fd, 'rb') as cache_file:
+                cache_stat = os.fstat(cache_fd)
+                if cache_stat.st_uid != os.getuid() or cache_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    log.warning("Not loading the cached course from %s, which others can write to", cache_path)
+                    return None
+                cached_course = pickle.load(cache_file)
+        except Exception:  # pylint: disable=broad-except
+            log.warning("Couldn't read the cached course from %s", cache_path, exc_info=True)
+            return None
+
+        course_id = cached_course['course_id']
+        if course_ids is not None and course_id not in course_ids:
+            return None
+
+        log.debug('========> Loading course %s from its cache', course_dir)
+        self.parent_trackers[course_id] = cached_course['parent_tracker']
+        # the policies were already applied to the cached fields
+        system = self._import_system(course_id, course_dir, tracker, lambda usage_id: {})
+        try:
+            for scope_ids, shared_field_data, values in cached_course['blocks']:
+                if shared_field_data:
+                    field_data = self.field_data
+                else:
+                    field_data = KvsFieldData(InheritanceKeyValueStore(initial_values=values))
+                block = system.construct_xblock(scope_ids.block_type, scope_ids, field_data)
+                if shared_field_data:
+                    for name, value in values.iteritems():
+                        field_data.set(block, name, value)
+                block.data_dir = course_dir
+                self.modules[course_id][scope_ids.usage_id] = block
+
+            course_descriptor = self.modules[course_id][cached_course['course_usage_id']]
+            compute_inherited_metadata(course_descriptor)
+        except Exception:  # pylint: disable=broad-except
+            # e.g. the class of a block changed since it was cached: parse the course instead
+            log.warning("Couldn't load the cached course from %s", cache_path, exc_info=True)
+            self.modules.pop(course_id, None)
+            self.parent_trackers.pop(course_id, None)
+            return None
+        return course_descriptor
+
     def load_extra_content(self, system, course_descriptor, category, base_dir, course_dir, url_name):
         self._load_extra_content(system, course_descriptor, category, base_dir, course_dir)
 
@@ -701,6 +928,7 @@ class XMLModuleStore(ModuleStoreReadBase):
         """
         Returns True if location exists in this ModuleStore.
         """
+        self._load_course_lazily(usage_key.course_key)
         return usage_key in self.modules[usage_key.course_key]
 
     def get_item(self, usage_key, depth=0):
@@ -715,6 +943,7 @@ class XMLModuleStore(ModuleStoreReadBase):
 
         usage_key: a UsageKey that matches the module we are looking for.
         """
+        self._load_course_lazily(usage_key.course_key)
         try:
             return self.modules[usage_key.course_key][usage_key]
         except KeyError:
@@ -745,6 +974,7 @@ class XMLModuleStore(ModuleStoreReadBase):
                 you can search dates by providing either a datetime for == (probably
                 useless) or a tuple (">"|"<" datetime) for after or before, etc.
         """
+        self._load_course_lazily(course_id)
         items = []
 
         category = kwargs.pop('category', None)
@@ -771,13 +1001,42 @@ class XMLModuleStore(ModuleStoreReadBase):
         Returns a list of course descriptors.  If there were errors on loading,
         some of these may be ErrorDescriptors instead.
         """
+        self._load_all_courses()
         return self.courses.values()
 
+    def get_course(self, course_id, depth=0):
+        """
+        Returns the course with this id, or None. Only this course is loaded, if it's still to load.
+        """
+        self._load_course_lazily(course_id)
+        for course in self.courses.itervalues():
+            if course.id == course_id:
+                return course
+        return None
+
+    def has_course(self, course_id, ignore_case=False):
+        """
+        Returns the course_id of the course if it was found, else None. Courses are only all loaded
+        to ignore the case of their ids.
+        """
+        if ignore_case:
+            return super(XMLModuleStore, self).has_course(course_id, ignore_case)
+        course = self.get_course(course_id)
+        return course.id if course is not None else None
+
+    def get_course_errors(self, course_key):
+        """
+        Return list of errors for this :class:`.CourseKey`, if any.
+        """
+        self._load_course_lazily(course_key)
+        return super(XMLModuleStore, self).get_course_errors(course_key)
+
     def get_errored_courses(self):
         """
         Return a dictionary of course_dir -> [(msg, exception_str)], for each
         course_dir where course loading failed.
         """
+        self._load_all_courses()
         return dict((k, self.errored_courses[k].errors) for k in self.errored_courses)
 
     def get_orphans(self, course_key):
@@ -793,6 +1052,7 @@ class XMLModuleStore(ModuleStoreReadBase):
         '''Find the location that is the parent of this location in this
         course.  Needed for path_to_location().
         '''
+        self._load_course_lazily(location.course_key)
         if not self.parent_trackers[location.course_key].is_known(location):
             raise ItemNotFoundError("{0} not in {1}".format(location, location.course_key))
 
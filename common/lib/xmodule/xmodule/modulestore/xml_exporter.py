@@ -4,12 +4,17 @@ Methods for exporting course data to XML
 
 import logging
 import lxml.etree
+import posixpath
+import tarfile
+import time
+from tempfile import SpooledTemporaryFile
 from xblock.fields import Scope
 from xmodule.contentstore.content import StaticContent
 from xmodule.exceptions import NotFoundError
 from xmodule.modulestore import EdxJSONEncoder, ModuleStoreEnum
 from xmodule.modulestore.inheritance import own_metadata
 from xmodule.modulestore.mixed import store_branch_setting
+from fs.errors import DestinationExistsError, ParentDirectoryMissingError, UnsupportedError
 from fs.osfs import OSFS
 from json import dumps
 import json
@@ -26,6 +31,104 @@ EXPORT_VERSION_KEY = "export_format"
 DEFAULT_CONTENT_FIELDS = ['metadata', 'data']
 
 
+# How much of an exported file TarExportFS buffers in memory before spilling it to disk
+TAR_EXPORT_SPOOL_SIZE = 1024 * 1024
+
+
+class TarExportFile(object):
+    """
+    A file being written into a tar by `TarExportFS`. It's buffered until it's closed, since tar
+    members must start with their size, in memory or on disk past TAR_EXPORT_SPOOL_SIZE bytes.
+    """
+    def __init__(self, tar_file, name):
+        self.tar_file = tar_file
+        self.name = name
+        self._buffer = SpooledTemporaryFile(max_size=TAR_EXPORT_SPOOL_SIZE)
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._buffer.write(data)
+
+    def close(self):
+        """
+        Add the file to the tar.
+        """
+        if self._buffer is None:
+            return
+        info = tarfile.TarInfo(self.name)
+        info.size = self._buffer.tell()
+        info.mtime = time.time()
+        self._buffer.seek(0)
+        self.tar_file.addfile(info, self._buffer)
+        self._buffer.close()
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TarExportFS(object):
+    """
+    The part of the pyfilesystem API `export_to_xml` and the xblocks use to write an export, which
+    writes its files into a tar file, under `root`, instead of a directory tree.
+
+    Only the file being written is buffered, so exporting to a stream (e.g. in 'w|gz' mode) never
+    holds more than one file of the export.
+    """
+    def __init__(self, tar_file, root, written=None):
+        self.tar_file = tar_file
+        self.root = root.strip('/')
+        # the paths of the files and directories already in the tar, shared by the sub-directories
+        self._written = written if written is not None else set()
+
+    def _member_name(self, path):
+        """
+        Return the name of the tar member at `path` of this filesystem.
+        """
+        name = posixpath.normpath(posixpath.join(self.root, path.lstrip('/')))
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return name
+
+    def exists(self, path):
+        return self._member_name(path) in self._written
+
+    def open(self, path, mode='r', **kwargs):
+        if 'w' not in mode:
+            raise UnsupportedError('read files of a tar export')
+        # files written twice end up twice in the tar, where the last one wins on extraction, as
+        # it would on disk
+        name = self._member_name(path)
+        self._written.add(name)
+        return TarExportFile(self.tar_file, name)
+
+    def makedir(self, path, recursive=False, allow_recreate=False):
+        name = self._member_name(path)
+        if name in self._written:
+            if not allow_recreate:
+                raise DestinationExistsError(path)
+            return
+        parent = posixpath.dirname(name)
+        if parent and parent not in self._written:
+            if not recursive:
+                raise ParentDirectoryMissingError(path)
+            TarExportFS(self.tar_file, '', self._written).makedir(parent, recursive=True)
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0755
+        info.mtime = time.time()
+        self.tar_file.addfile(info)
+        self._written.add(name)
+
+    def makeopendir(self, path, recursive=False):
+        self.makedir(path, recursive=recursive, allow_recreate=True)
+        return TarExportFS(self.tar_file, self._member_name(path), self._written)
+
+
 def export_to_xml(modulestore, contentstore, course_key, root_dir, course_dir):
     """
     Export all modules from `modulestore` and content from `contentstore` as xml to `root_dir`.
@@ -36,11 +139,30 @@ def export_to_xml(modulestore, contentstore, course_key, root_dir, course_dir):
     `root_dir`: The directory to write the exported xml to
     `course_dir`: The name of the directory inside `root_dir` to write the course content to
     """
+    fsm = OSFS(root_dir)
+    _export_course(modulestore, contentstore, course_key, fsm.makeopendir(course_dir))
 
+
+def export_to_tarball(modulestore, contentstore, course_key, fileobj, course_dir):
+    """
+    Export the course like `export_to_xml`, but straight into a .tar.gz written to `fileobj`, with
+    the course content in its `course_dir` directory.
+
+    The tar.gz is written as a stream, so `fileobj` needn't be seekable, and no directory tree is
+    ever written to disk.
+    """
+    with tarfile.open(fileobj=fileobj, mode='w|gz') as tar_file:
+        export_fs = TarExportFS(tar_file, '')
+        _export_course(modulestore, contentstore, course_key, export_fs.makeopendir(course_dir))
+
+
+def _export_course(modulestore, contentstore, course_key, export_fs):
+    """
+    Export the course like `export_to_xml`, into the filesystem `export_fs`.
+    """
     course = modulestore.get_course(course_key)
 
-    fsm = OSFS(root_dir)
-    export_fs = course.runtime.export_fs = fsm.makeopendir(course_dir)
+    course.runtime.export_fs = export_fs
 
     root = lxml.etree.Element('unknown')
 
@@ -56,8 +178,9 @@ def export_to_xml(modulestore, contentstore, course_key, root_dir, course_dir):
     if contentstore:
         contentstore.export_all_for_course(
             course_key,
-            root_dir + '/' + course_dir + '/static/',
-            root_dir + '/' + course_dir + '/policies/assets.json',
+            'static',
+            'policies/assets.json',
+            output_fs=export_fs,
         )
 
         # If we are using the default course image, export it to the
@@ -73,10 +196,8 @@ def export_to_xml(modulestore, contentstore, course_key, root_dir, course_dir):
             except NotFoundError:
                 pass
             else:
-                output_dir = root_dir + '/' + course_dir + '/static/images/'
-                if not os.path.isdir(output_dir):
-                    os.makedirs(output_dir)
-                with OSFS(output_dir).open('course_image.jpg', 'wb') as course_image_file:
+                export_fs.makedir('static/images', recursive=True, allow_recreate=True)
+                with export_fs.open('static/images/course_image.jpg', 'wb') as course_image_file:
                     course_image_file.write(course_image.data)
 
     # export the static tabs
@@ -1,6 +1,7 @@
 import logging
 import os
 import mimetypes
+from multiprocessing.pool import ThreadPool
 from path import path
 import json
 
@@ -22,12 +23,18 @@ from xmodule.modulestore.mongo.base import MongoRevisionKey
 log = logging.getLogger(__name__)
 
 
-def import_static_content(
-        course_data_path, static_content_store,
-        target_course_id, subpath='static', verbose=False):
+# How many static files import_static_content uploads at once
+STATIC_CONTENT_IMPORT_WORKERS = 8
 
-    remap_dict = {}
 
+def import_static_content(
+        course_data_path, static_content_store,
+        target_course_id, subpath='static', verbose=False,
+        workers=STATIC_CONTENT_IMPORT_WORKERS):
+    """
+    Import the files under `subpath` of the course into the static content store, uploading up to
+    `workers` of them at once. Returns the dict mapping the path of every file to its asset key.
+    """
     # now import all static assets
     static_dir = course_data_path / subpath
     try:
@@ -44,65 +51,94 @@ def import_static_content(
     mimetypes.add_type('application/octet-stream', '.srt')
     mimetypes_list = mimetypes.types_map.values()
 
-    for dirname, _, filenames in os.walk(static_dir):
-        for filename in filenames:
+    def content_paths():
+        """
+        Yield the (file name, path) of every file to import.
+        """
+        for dirname, _, filenames in os.walk(static_dir):
+            for filename in filenames:
+                content_path = os.path.join(dirname, filename)
 
-            content_path = os.path.join(dirname, filename)
+                if filename.endswith('~'):
+                    if verbose:
+                        log.debug('skipping static content %s...', content_path)
+                    continue
 
-            if filename.endswith('~'):
-                if verbose:
-                    log.debug('skipping static content %s...', content_path)
-                continue
+                yield filename, content_path
 
-            if verbose:
-                log.debug('importing static content %s...', content_path)
+    def import_file(content_file):
+        """
+        Save the (file name, path) file to the static content store, with its thumbnail. Returns its
+        path relative to the static directory and its asset key, or None if it's skipped.
+        """
+        filename, content_path = content_file
+        if verbose:
+            log.debug('importing static content %s...', content_path)
+
+        try:
+            with open(content_path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            if filename.startswith('._'):
+                # OS X "companion files". See
+                # http://www.diigo.com/annotated/0c936fda5da4aa1159c189cea227e174
+                return None
+            # Not a 'hidden file', then re-raise exception
+            raise
+
+        # strip away leading path from the name
+        fullname_with_subpath = content_path.replace(static_dir, '')
+        if fullname_with_subpath.startswith('/'):
+            fullname_with_subpath = fullname_with_subpath[1:]
+        asset_key = StaticContent.compute_location(target_course_id, fullname_with_subpath)
+
+        policy_ele = policy.get(asset_key.path, {})
+        displayname = policy_ele.get('displayname', filename)
+        locked = policy_ele.get('locked', False)
+        mime_type = policy_ele.get('contentType')
+
+        # Check extracted contentType in list of all valid mimetypes
+        if not mime_type or mime_type not in mimetypes_list:
+            mime_type = mimetypes.guess_type(filename)[0]   # Assign guessed mimetype
+        content = StaticContent(
+            asset_key, displayname, mime_type, data,
+            import_path=fullname_with_subpath, locked=locked
+        )
 
-            try:
-                with open(content_path, 'rb') as f:
-                    data = f.read()
-            except IOError:
-                if filename.startswith('._'):
-                    # OS X "companion files". See
-                    # http://www.diigo.com/annotated/0c936fda5da4aa1159c189cea227e174
-                    continue
-                # Not a 'hidden file', then re-raise exception
-                raise
-
-            # strip away leading path from the name
-            fullname_with_subpath = content_path.replace(static_dir, '')
-            if fullname_with_subpath.startswith('/'):
-                fullname_with_subpath = fullname_with_subpath[1:]
-            asset_key = StaticContent.compute_location(target_course_id, fullname_with_subpath)
-
-            policy_ele = policy.get(asset_key.path, {})
-            displayname = policy_ele.get('displayname', filename)
-            locked = policy_ele.get('locked', False)
-            mime_type = policy_ele.get('contentType')
-
-            # Check extracted contentType in list of all valid mimetypes
-            if not mime_type or mime_type not in mimetypes_list:
-                mime_type = mimetypes.guess_type(filename)[0]   # Assign guessed mimetype
-            content = StaticContent(
-                asset_key, displayname, mime_type, data,
-                import_path=fullname_with_subpath, locked=locked
-            )
+        # first let's save a thumbnail so we can get back a thumbnail location
+        thumbnail_content, thumbnail_location = static_content_store.generate_thumbnail(content)
 
-            # first let's save a thumbnail so we can get back a thumbnail location
-            thumbnail_content, thumbnail_location = static_content_store.generate_thumbnail(content)
+        if thumbnail_content is not None:
+            content.thumbnail_location = thumbnail_location
 
-            if thumbnail_content is not None:
-                content.thumbnail_location = thumbnail_location
+        # then commit the content
+        try:
+            static_content_store.save(content)
+        except Exception as err:
+            log.exception('Error importing {0}, error={1}'.format(
+                fullname_with_subpath, err
+            ))
 
-            # then commit the content
-            try:
-                static_content_store.save(content)
-            except Exception as err:
-                log.exception('Error importing {0}, error={1}'.format(
-                    fullname_with_subpath, err
-                ))
-
-            # store the remapping information which will be needed
-            # to subsitute in the module data
+        return fullname_with_subpath, asset_key
+
+    # store the remapping information which will be needed
+    # to subsitute in the module data
+    remap_dict = {}
+    if workers > 1:
+        # uploads mostly wait on the content store, so threads are enough to overlap them; each
+        # worker only holds the file it's uploading
+        pool = ThreadPool(workers)
+        try:
+            results = list(pool.imap_unordered(import_file, content_paths()))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [import_file(content_file) for content_file in content_paths()]
+
+    for result in results:
+        if result is not None:
+            fullname_with_subpath, asset_key = result
             remap_dict[fullname_with_subpath] = asset_key
 
     return remap_dict
@@ -113,7 +149,8 @@ def import_from_xml(
         default_class='xmodule.raw_module.RawDescriptor',
         load_error_modules=True, static_content_store=None,
         target_course_id=None, verbose=False,
-        do_import_static=True, create_new_course_if_not_present=False):
+        do_import_static=True, create_new_course_if_not_present=False,
+        progress_callback=None):
     """
     Import the specified xml data_dir into the "store" modulestore,
     using org and course as the location org and course.
@@ -138,6 +175,11 @@ def import_from_xml(
     : create_new_course_if_not_present:
         If True, then a new course is created if it doesn't already exist.
         The check for existing courses is case-insensitive.
+
+    : progress_callback:
+        If given, it's called with 'static', 'modules' and then 'drafts' as the
+        import of each course starts importing its static content, its modules
+        and its draft modules, after the courses were parsed.
     """
 
     xml_module_store = XMLModuleStore(
@@ -179,7 +221,8 @@ def import_from_xml(
                 )
                 continue
 
-        with store_bulk_write_operations_on_course(store, dest_course_id):
+        # the modules are saved in batches; reading one back saves the writes buffered so far
+        with store_bulk_write_operations_on_course(store, dest_course_id, buffer_writes=True):
             course_data_path = None
 
             if verbose:
@@ -253,6 +296,9 @@ def import_from_xml(
 
             # TODO: shouldn't this raise an exception if course wasn't found?
 
+            if progress_callback is not None:
+                progress_callback('static')
+
             # then import all the static content
             if static_content_store is not None and do_import_static:
                 # first pass to find everything in /static/
@@ -284,6 +330,9 @@ def import_from_xml(
                     dest_course_id, subpath=simport, verbose=verbose
                 )
 
+            if progress_callback is not None:
+                progress_callback('modules')
+
             # now loop through all the modules
             for module in xml_module_store.modules[course_key].itervalues():
                 if module.scope_ids.block_type == 'course':
@@ -308,6 +357,9 @@ def import_from_xml(
             # finally, publish the course
             store.publish(course.location, user_id)
 
+            if progress_callback is not None:
+                progress_callback('drafts')
+
             # now import any DRAFT items
             _import_course_draft(
                 xml_module_store,
@@ -0,0 +1,145 @@
+"""
+Tests for the on-disk cache of static assets.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from mock import patch
+
+from opaque_keys.edx.locations import AssetLocation
+from xmodule.contentstore.content import StaticContentStream
+from xmodule.contentstore.disk_cache import AssetDiskCache, PARTIAL_PREFIX
+from xmodule.contentstore.mongo import MongoContentStore
+
+
+class AssetDiskCacheTest(unittest.TestCase):
+    """
+    Tests for AssetDiskCache.
+    """
+    def setUp(self):
+        super(AssetDiskCacheTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.disk_cache = AssetDiskCache(self.root, max_size=100)
+
+    def _content(self, name, data, digest=None):
+        """
+        Returns a StaticContentStream of the given data.
+        """
+        location = AssetLocation(u'edX', u'disk_cache', u'run', u'asset', name)
+        return StaticContentStream(
+            location, name, 'text/plain', StringIO(data), length=len(data), content_digest=digest or name + '-md5'
+        )
+
+    def test_get(self):
+        """
+        Test that a cached asset is served from disk.
+        """
+        self.assertIsNone(self.disk_cache.get(self._content('a.txt', 'a' * 10)))
+        path = self.disk_cache.fill(self._content('a.txt', 'a' * 10))
+        with open(path) as cached_file:
+            self.assertEqual(cached_file.read(), 'a' * 10)
+
+        self.assertEqual(self.disk_cache.get(self._content('a.txt', 'a' * 10)), path)
+        self.assertEqual(self.disk_cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_fill_in_background(self):
+        """
+        Test that a miss copies the asset from a fresh stream in the background.
+        """
+        content = self._content('a.txt', 'a' * 10)
+        with patch('xmodule.contentstore.disk_cache.threading.Thread') as thread:
+            self.assertIsNone(self.disk_cache.get(content, reload_content=lambda: self._content('a.txt', 'a' * 10)))
+            # misses while the copy is running don't start another one
+            self.assertIsNone(self.disk_cache.get(content, reload_content=lambda: self._content('a.txt', 'a' * 10)))
+        self.assertEqual(thread.call_count, 1)
+
+        thread.call_args[1]['target']()
+        path = self.disk_cache.get(content)
+        with open(path) as cached_file:
+            self.assertEqual(cached_file.read(), 'a' * 10)
+
+    def test_concurrent_fill(self):
+        """
+        Test that an asset another process is copying isn't copied again.
+        """
+        content = self._content('a.txt', 'a' * 10)
+        path = self.disk_cache.path_to(content.location, content.content_digest)
+        os.makedirs(os.path.dirname(path))
+        partial_path = os.path.join(os.path.dirname(path), PARTIAL_PREFIX + content.content_digest)
+        open(partial_path, 'w').close()
+
+        self.assertIsNone(self.disk_cache.fill(content))
+        self.assertFalse(os.path.exists(path))
+
+        # a partial file left behind by a copy that died is cleaned up
+        os.utime(partial_path, (0, 0))
+        self.assertIsNone(self.disk_cache.fill(content))
+        self.assertIsNotNone(self.disk_cache.fill(content))
+
+    def test_new_version(self):
+        """
+        Test that a re-uploaded asset gets a new cached file.
+        """
+        path = self.disk_cache.fill(self._content('a.txt', 'a' * 10, digest='v1'))
+        new_path = self.disk_cache.fill(self._content('a.txt', 'b' * 10, digest='v2'))
+        self.assertNotEqual(new_path, path)
+        with open(new_path) as cached_file:
+            self.assertEqual(cached_file.read(), 'b' * 10)
+
+    def test_uncacheable(self):
+        """
+        Test that assets without a digest or larger than the cache aren't cached.
+        """
+        self.assertIsNone(self.disk_cache.fill(self._content('big.txt', 'a' * 101)))
+        content = self._content('a.txt', 'a' * 10)
+        content.content_digest = None
+        self.assertIsNone(self.disk_cache.fill(content))
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently served assets are evicted once the cache is full.
+        """
+        first_path = self.disk_cache.fill(self._content('a.txt', 'a' * 40))
+        second_path = self.disk_cache.fill(self._content('b.txt', 'b' * 40))
+        # serving the first asset again makes the second one the least recently used
+        os.utime(first_path, (0, 0))
+        os.utime(second_path, (0, 0))
+        self.disk_cache.get(self._content('a.txt', 'a' * 40))
+
+        self.disk_cache.fill(self._content('c.txt', 'c' * 40))
+        self.assertTrue(os.path.exists(first_path))
+        self.assertFalse(os.path.exists(second_path))
+
+    def test_eviction_grace(self):
+        """
+        Test that recently served assets aren't evicted, even if the cache is full.
+        """
+        first_path = self.disk_cache.fill(self._content('a.txt', 'a' * 60))
+        second_path = self.disk_cache.fill(self._content('b.txt', 'b' * 60))
+        self.assertTrue(os.path.exists(first_path))
+        self.assertTrue(os.path.exists(second_path))
+
+    def test_size_tracking(self):
+        """
+        Test that the cache is only rescanned when it may have outgrown its size.
+        """
+        self.disk_cache.fill(self._content('a.txt', 'a' * 10))
+        with patch.object(self.disk_cache, 'evict') as evict:
+            self.disk_cache.fill(self._content('b.txt', 'b' * 10))
+            self.assertFalse(evict.called)
+            self.disk_cache.fill(self._content('c.txt', 'c' * 90))
+            self.assertTrue(evict.called)
+
+    def test_invalidate(self):
+        """
+        Test that invalidating an asset removes its cached files.
+        """
+        content = self._content('a.txt', 'a' * 10)
+        path = self.disk_cache.fill(content)
+        # the content store invalidates by GridFS id
+        self.disk_cache.invalidate(MongoContentStore.asset_db_key(content.location))
+        self.assertFalse(os.path.exists(path))
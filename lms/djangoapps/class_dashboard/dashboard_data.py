@@ -17,6 +17,39 @@ from opaque_keys.edx.locations import Location
 # Used to limit the length of list displayed to the screen.
 MAX_SCREEN_LIST_LENGTH = 250
 
+def _grade_distribution_rows(course_id, problem_set=None):
+    """
+    Returns a query for the number of students with each grade on the problems
+    of the course (or only those in `problem_set`), as dicts with the keys
+    'module_state_key', 'grade', 'max_grade' and 'count_grade'.
+
+    Once the distributions of the course have been materialized (see
+    `courseware.models.ClassDashboardRefresh`), they are read from there,
+    rather than aggregated over the studentmodule table. They account for the
+    changes to it up to their last refresh.
+    """
+    if models.ClassDashboardRefresh.is_refreshed(course_id):
+        db_query = models.ProblemGradeDistribution.objects.filter(
+            course_id__exact=course_id,
+            student_count__gt=0,
+        )
+        if problem_set is not None:
+            db_query = db_query.filter(module_state_key__in=problem_set)
+        return db_query.extra(select={'count_grade': 'student_count'}).values(
+            'module_state_key', 'grade', 'max_grade', 'count_grade',
+        )
+
+    # Aggregate query on studentmodule table for grade data for all problems in course
+    db_query = models.StudentModule.objects.filter(
+        course_id__exact=course_id,
+        grade__isnull=False,
+        module_type__exact="problem",
+    )
+    if problem_set is not None:
+        db_query = db_query.filter(module_state_key__in=problem_set)
+    return db_query.values('module_state_key', 'grade', 'max_grade').annotate(count_grade=Count('grade'))
+
+
 def get_problem_grade_distribution(course_id):
     """
     Returns the grade distribution per problem for the course
@@ -31,12 +64,7 @@ def get_problem_grade_distribution(course_id):
         attempting the problem
     """
 
-    # Aggregate query on studentmodule table for grade data for all problems in course
-    db_query = models.StudentModule.objects.filter(
-        course_id__exact=course_id,
-        grade__isnull=False,
-        module_type__exact="problem",
-    ).values('module_state_key', 'grade', 'max_grade').annotate(count_grade=Count('grade'))
+    db_query = _grade_distribution_rows(course_id)
 
     prob_grade_distrib = {}
     total_student_count = {}
@@ -74,11 +102,18 @@ def get_sequential_open_distrib(course_id):
     Outputs a dict mapping the 'module_id' to the number of students that have opened that subsection/sequential.
     """
 
-    # Aggregate query on studentmodule table for "opening a subsection" data
-    db_query = models.StudentModule.objects.filter(
-        course_id__exact=course_id,
-        module_type__exact="sequential",
-    ).values('module_state_key').annotate(count_sequential=Count('module_state_key'))
+    if models.ClassDashboardRefresh.is_refreshed(course_id):
+        # Materialized "opening a subsection" data
+        db_query = models.SequentialOpenDistribution.objects.filter(
+            course_id__exact=course_id,
+            student_count__gt=0,
+        ).extra(select={'count_sequential': 'student_count'}).values('module_state_key', 'count_sequential')
+    else:
+        # Aggregate query on studentmodule table for "opening a subsection" data
+        db_query = models.StudentModule.objects.filter(
+            course_id__exact=course_id,
+            module_type__exact="sequential",
+        ).values('module_state_key').annotate(count_sequential=Count('module_state_key'))
 
     # Build set of "opened" data for each subsection that has "opened" data
     sequential_open_distrib = {}
@@ -104,17 +139,7 @@ def get_problem_set_grade_distrib(course_id, problem_set):
       'grade_distrib' - array of tuples (`grade`,`count`) ordered by `grade`
     """
 
-    # Aggregate query on studentmodule table for grade data for set of problems in course
-    db_query = models.StudentModule.objects.filter(
-        course_id__exact=course_id,
-        grade__isnull=False,
-        module_type__exact="problem",
-        module_state_key__in=problem_set,
-    ).values(
-        'module_state_key',
-        'grade',
-        'max_grade',
-    ).annotate(count_grade=Count('grade')).order_by('module_state_key', 'grade')
+    db_query = _grade_distribution_rows(course_id, problem_set).order_by('module_state_key', 'grade')
 
     prob_grade_distrib = {}
 
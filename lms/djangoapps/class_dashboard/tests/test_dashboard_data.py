@@ -11,6 +11,7 @@ from django.test.client import RequestFactory
 from xmodule.modulestore.tests.factories import CourseFactory, ItemFactory
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
 from courseware.tests.tests import TEST_DATA_MONGO_MODULESTORE
+from courseware.models import ClassDashboardRefresh, StudentModule
 from courseware.tests.factories import StudentModuleFactory
 from student.tests.factories import UserFactory, CourseEnrollmentFactory, AdminFactory
 from capa.tests.response_xml_factory import StringResponseXMLFactory
@@ -126,6 +127,69 @@ class TestGetProblemGradeDistribution(ModuleStoreTestCase):
                 sum_attempts += item[1]
             self.assertEquals(USER_COUNT, sum_attempts)
 
+    def test_materialized_distributions(self):
+        """The materialized distributions are the ones aggregated from StudentModule"""
+        def distributions():
+            """Returns the distributions of the course, with their grades in order."""
+            prob_grade_distrib, total_student_count = get_problem_grade_distribution(self.course.id)
+            for problem_info in prob_grade_distrib.values():
+                problem_info['grade_distrib'].sort()
+            probset_grade_distrib = get_problem_set_grade_distrib(self.course.id, prob_grade_distrib.keys())
+            return prob_grade_distrib, total_student_count, probset_grade_distrib, \
+                get_sequential_open_distrib(self.course.id)
+
+        aggregated = distributions()
+        ClassDashboardRefresh.refresh(self.course.id)
+        self.assertTrue(ClassDashboardRefresh.is_refreshed(self.course.id))
+        self.assertEqual(distributions(), aggregated)
+
+        # They are read without aggregating StudentModule again
+        StudentModule.objects.filter(course_id=self.course.id).update(module_type='html')
+        self.assertEqual(distributions(), aggregated)
+
+    def test_refresh_materialized_distributions(self):
+        """Only a refresh accounts for new and deleted submissions"""
+        ClassDashboardRefresh.refresh(self.course.id)
+        student_module = StudentModuleFactory.create(
+            grade=1,
+            max_grade=1,
+            course_id=self.course.id,
+            module_state_key=self.item.location,
+        )
+        __, total_student_count = get_problem_grade_distribution(self.course.id)
+        self.assertEquals(USER_COUNT, total_student_count[self.item.location])
+
+        ClassDashboardRefresh.refresh(self.course.id)
+        __, total_student_count = get_problem_grade_distribution(self.course.id)
+        self.assertEquals(USER_COUNT + 1, total_student_count[self.item.location])
+
+        student_module.delete()
+        __, total_student_count = get_problem_grade_distribution(self.course.id)
+        self.assertEquals(USER_COUNT + 1, total_student_count[self.item.location])
+
+        ClassDashboardRefresh.refresh(self.course.id)
+        __, total_student_count = get_problem_grade_distribution(self.course.id)
+        self.assertEquals(USER_COUNT, total_student_count[self.item.location])
+
+    def test_delete_regraded_module(self):
+        """Deleting a submission regraded since the last refresh takes it out of the right grade"""
+        ClassDashboardRefresh.refresh(self.course.id)
+        student_module = StudentModule.objects.get(
+            student=self.users[0], course_id=self.course.id, module_state_key=self.item.location,
+        )
+        student_module.grade = 1
+        student_module.max_grade = 1
+        student_module.save()
+        student_module.delete()
+
+        ClassDashboardRefresh.refresh(self.course.id)
+        prob_grade_distrib, total_student_count = get_problem_grade_distribution(self.course.id)
+        self.assertEquals(USER_COUNT - 1, total_student_count[self.item.location])
+        self.assertEquals(
+            [(0, USER_COUNT - 2), (1, 1)],
+            sorted(prob_grade_distrib[self.item.location]['grade_distrib'])
+        )
+
     def test_get_d3_problem_grade_distrib(self):
 
         d3_data = get_d3_problem_grade_distrib(self.course.id)
@@ -1,11 +1,13 @@
 # Compute grades using real division, with no integer truncation
 from __future__ import division
 from collections import defaultdict
+import hashlib
 import json
 import random
 import logging
 
 from contextlib import contextmanager
+from itertools import islice
 from django.conf import settings
 from django.db import transaction
 from django.test.client import RequestFactory
@@ -20,13 +22,16 @@ from xmodule.graders import Score
 from xmodule.modulestore.django import modulestore
 from xmodule.modulestore.exceptions import ItemNotFoundError
 from xmodule.util.duedate import get_extended_due_date
-from .models import StudentModule
+from .models import StudentModule, StudentSubsectionGrade
 from .module_render import get_module_for_descriptor
 from submissions import api as sub_api  # installed from the edx-submissions repository
 from opaque_keys import InvalidKeyError
 
 log = logging.getLogger("edx.courseware")
 
+# Number of students whose StudentModules iterate_grades_for fetches at once
+GRADING_CHUNK_SIZE = 500
+
 
 def yield_dynamic_descriptor_descendents(descriptor, module_creator):
     """
@@ -141,16 +146,16 @@ def answer_distributions(course_key):
     return answer_counts
 
 @transaction.commit_manually
-def grade(student, request, course, keep_raw_scores=False):
+def grade(student, request, course, keep_raw_scores=False, student_module_cache=None, persisted_grades=None):
     """
     Wraps "_grade" with the manual_transaction context manager just in case
     there are unanticipated errors.
     """
     with manual_transaction():
-        return _grade(student, request, course, keep_raw_scores)
+        return _grade(student, request, course, keep_raw_scores, student_module_cache, persisted_grades)
 
 
-def _grade(student, request, course, keep_raw_scores):
+def _grade(student, request, course, keep_raw_scores, student_module_cache, persisted_grades):
     """
     Unwrapped version of "grade"
 
@@ -169,6 +174,17 @@ def _grade(student, request, course, keep_raw_scores):
     - keep_raw_scores : if True, then value for key 'raw_scores' contains scores
       for every graded module
 
+    student_module_cache, if not None, is a dict of usage_key -> StudentModule
+    holding every StudentModule of `student` for the graded modules in the course,
+    as built by `prefetch_student_modules`. It is used instead of querying
+    StudentModule for each problem.
+
+    persisted_grades, if not None, is a dict of usage_key -> StudentSubsectionGrade
+    of `student`, as returned by `StudentSubsectionGrade.grades_for`. If
+    student_module_cache is given along with persistent grades, it must have
+    been fetched after persisted_grades, as scores computed from it are
+    persisted under the state versions of persisted_grades.
+
     More information on the format is in the docstring for CourseGrader.
     """
     grading_context = course.grading_context
@@ -181,6 +197,16 @@ def _grade(student, request, course, keep_raw_scores):
         course.id.to_deprecated_string(), anonymous_id_for_user(student, course.id)
     )
 
+    use_persisted_grades = persisted_grades_enabled(student)
+    if not use_persisted_grades:
+        persisted_grades = {}
+    elif persisted_grades is None:
+        if student_module_cache is not None:
+            raise ValueError("persisted_grades must be fetched before student_module_cache")
+        # Read before any student state, so that state changed since is
+        # caught by the state versions of the rows when saving scores
+        persisted_grades = StudentSubsectionGrade.grades_for(student, course.id)
+
     totaled_scores = {}
     # This next complicated loop is just to collect the totaled_scores, which is
     # passed to the grader
@@ -190,35 +216,22 @@ def _grade(student, request, course, keep_raw_scores):
             section_descriptor = section['section_descriptor']
             section_name = section_descriptor.display_name_with_default
 
-            # some problems have state that is updated independently of interaction
-            # with the LMS, so they need to always be scored. (E.g. foldit.,
-            # combinedopenended)
-            should_grade_section = any(
-                descriptor.always_recalculate_grades for descriptor in section['xmoduledescriptors']
+            persistable = use_persisted_grades and is_persistable_section(
+                section['xmoduledescriptors'], submissions_scores
             )
-
-            # If there are no problems that always have to be regraded, check to
-            # see if any of our locations are in the scores from the submissions
-            # API. If scores exist, we have to calculate grades for this section.
-            if not should_grade_section:
-                should_grade_section = any(
-                    descriptor.location.to_deprecated_string() in submissions_scores
-                    for descriptor in section['xmoduledescriptors']
+            scores = None
+            if persistable:
+                version = subsection_grading_version(section_descriptor, section['xmoduledescriptors'])
+                persisted_grade = persisted_grades.get(section_descriptor.location)
+                scores = _scores_from_persisted_grade(
+                    persisted_grade, version, section['xmoduledescriptors'], _graded_score
                 )
 
-            if not should_grade_section:
-                with manual_transaction():
-                    should_grade_section = StudentModule.objects.filter(
-                        student=student,
-                        module_state_key__in=[
-                            descriptor.location for descriptor in section['xmoduledescriptors']
-                        ]
-                    ).exists()
-
             # If we haven't seen a single problem in the section, we don't have
             # to grade it at all! We can assume 0%
-            if should_grade_section:
+            if scores is None and _should_grade_section(student, section, submissions_scores, student_module_cache):
                 scores = []
+                persisted_scores = []
 
                 def create_module(descriptor):
                     '''creates an XModule instance given a descriptor'''
@@ -231,7 +244,8 @@ def _grade(student, request, course, keep_raw_scores):
                 for module_descriptor in yield_dynamic_descriptor_descendents(section_descriptor, create_module):
 
                     (correct, total) = get_score(
-                        course.id, student, module_descriptor, create_module, scores_cache=submissions_scores
+                        course.id, student, module_descriptor, create_module, scores_cache=submissions_scores,
+                        student_module_cache=student_module_cache
                     )
                     if correct is None and total is None:
                         continue
@@ -242,13 +256,17 @@ def _grade(student, request, course, keep_raw_scores):
                         else:
                             correct = total
 
-                    graded = module_descriptor.graded
-                    if not total > 0:
-                        #We simply cannot grade a problem that is 12/0, because we might need it as a percentage
-                        graded = False
+                    persisted_scores.append([unicode(module_descriptor.location), correct, total])
+                    scores.append(_graded_score(module_descriptor, correct, total))
 
-                    scores.append(Score(correct, total, graded, module_descriptor.display_name_with_default))
+                if persistable:
+                    with manual_transaction():
+                        StudentSubsectionGrade.save_scores(
+                            student, course.id, section_descriptor.location, version, persisted_scores,
+                            _state_version(persisted_grade)
+                        )
 
+            if scores is not None:
                 _, graded_total = graders.aggregate_scores(scores, section_name)
                 if keep_raw_scores:
                     raw_scores += scores
@@ -279,6 +297,169 @@ def _grade(student, request, course, keep_raw_scores):
     return grade_summary
 
 
+def _should_grade_section(student, section, submissions_scores, student_module_cache=None):
+    """
+    Return True if any module in the graded `section` (an entry of the
+    course's grading_context) may have earned `student` some points.
+    """
+    # some problems have state that is updated independently of interaction
+    # with the LMS, so they need to always be scored. (E.g. foldit.,
+    # combinedopenended)
+    should_grade_section = any(
+        descriptor.always_recalculate_grades for descriptor in section['xmoduledescriptors']
+    )
+
+    # If there are no problems that always have to be regraded, check to
+    # see if any of our locations are in the scores from the submissions
+    # API. If scores exist, we have to calculate grades for this section.
+    if not should_grade_section:
+        should_grade_section = any(
+            descriptor.location.to_deprecated_string() in submissions_scores
+            for descriptor in section['xmoduledescriptors']
+        )
+
+    if not should_grade_section and student_module_cache is not None:
+        should_grade_section = any(
+            descriptor.location in student_module_cache for descriptor in section['xmoduledescriptors']
+        )
+    elif not should_grade_section:
+        with manual_transaction():
+            should_grade_section = StudentModule.objects.filter(
+                student=student,
+                module_state_key__in=[
+                    descriptor.location for descriptor in section['xmoduledescriptors']
+                ]
+            ).exists()
+
+    return should_grade_section
+
+
+def _graded_score(descriptor, correct, total):
+    """
+    Return the Score the course grader should see for `descriptor` when the
+    student earned `correct` out of `total` points.
+    """
+    graded = descriptor.graded
+    if not total > 0:
+        #We simply cannot grade a problem that is 12/0, because we might need it as a percentage
+        graded = False
+
+    return Score(correct, total, graded, descriptor.display_name_with_default)
+
+
+def persisted_grades_enabled(student):
+    """
+    Return True if subsection scores for `student` should be read from and
+    written to the StudentSubsectionGrade table.
+    """
+    return (
+        settings.FEATURES.get('ENABLE_PERSISTENT_GRADES', False) and
+        not settings.GENERATE_PROFILE_SCORES and
+        student.is_authenticated()
+    )
+
+
+def is_persistable_section(scored_descriptors, submissions_scores):
+    """
+    Return True if the scores of a subsection containing `scored_descriptors`
+    only change through events we observe, and so can safely be persisted.
+
+    Modules that always recalculate their grades (e.g. foldit) and scores kept
+    by the submissions API (e.g. ORA2) can change behind our back.
+    """
+    return not any(
+        descriptor.always_recalculate_grades or descriptor.location.to_deprecated_string() in submissions_scores
+        for descriptor in scored_descriptors
+    )
+
+
+def subsection_grading_version(section_descriptor, scored_descriptors):
+    """
+    Return a digest of the content that can change the scores persisted for
+    a subsection: which scored descendants it has, their weights and when
+    each of them was last edited.
+
+    Persisted scores carrying a different version are stale. Changes to the
+    student state are tracked by the state versions of the persisted rows
+    instead (see `StudentSubsectionGrade.invalidate_many`). Changes to the
+    course grading policy need no invalidation, since the policy is applied
+    when the persisted subsection scores are read.
+    """
+    digest = hashlib.sha1()
+    scored_descriptors = sorted(scored_descriptors, key=lambda descriptor: unicode(descriptor.location))
+    for descriptor in [section_descriptor] + scored_descriptors:
+        digest.update(repr((
+            unicode(descriptor.location),
+            getattr(descriptor, 'weight', None),
+            descriptor.edited_on,
+        )))
+    return digest.hexdigest()
+
+
+def _scores_from_persisted_grade(subsection_grade, version, scored_descriptors, make_score):
+    """
+    Rebuild the list of Scores for a subsection from `subsection_grade` (a
+    StudentSubsectionGrade or None), calling `make_score(descriptor, correct,
+    total)` for each persisted entry. Returns None if there is nothing usable
+    persisted for the `version` of the subsection content.
+    """
+    if subsection_grade is None or not subsection_grade.has_scores_for(version):
+        return None
+
+    descriptors = {unicode(descriptor.location): descriptor for descriptor in scored_descriptors}
+    scores = []
+    for location, correct, total in subsection_grade.get_scores():
+        if location not in descriptors:
+            return None
+        scores.append(make_score(descriptors[location], correct, total))
+    return scores
+
+
+def _state_version(subsection_grade):
+    """
+    Return the state version of `subsection_grade` (a StudentSubsectionGrade
+    or None) that scores computed from student state read after it are saved
+    under.
+    """
+    return None if subsection_grade is None else subsection_grade.state_version
+
+
+def invalidate_subsection_grades(student_id, course_key, usage_key):
+    """
+    Make the persisted scores of the subsection of `course_key` that contains
+    `usage_key` stale for the given student.
+    """
+    invalidate_subsection_grades_for_students([student_id], course_key, usage_key)
+
+
+def invalidate_subsection_grades_for_students(student_ids, course_key, usage_key):
+    """
+    Make the persisted scores of the subsection of `course_key` that contains
+    `usage_key` stale for all the students with ids in `student_ids`.
+    """
+    if not settings.FEATURES.get('ENABLE_PERSISTENT_GRADES', False):
+        return
+
+    store = modulestore()
+    ancestors = [usage_key]
+    try:
+        parent = store.get_parent_location(usage_key)
+        while parent is not None:
+            ancestors.append(parent)
+            parent = store.get_parent_location(parent)
+    except ItemNotFoundError:
+        # We can't tell which subsection this is in, so invalidate them all
+        StudentSubsectionGrade.invalidate_many(student_ids, course_key)
+        return
+
+    if len(ancestors) >= 3 and ancestors[-1].category == 'course':
+        # Graded subsections are the children of the chapters of the course
+        # (see CourseDescriptor.grading_context)
+        StudentSubsectionGrade.invalidate_many(student_ids, course_key, [ancestors[-3]], create_missing=True)
+    else:
+        StudentSubsectionGrade.invalidate_many(student_ids, course_key, ancestors)
+
+
 def grade_for_percentage(grade_cutoffs, percentage):
     """
     Returns a letter grade as defined in grading_policy (e.g. 'A' 'B' 'C' for 6.002x) or None.
@@ -348,6 +529,16 @@ def _progress_summary(student, request, course):
 
     submissions_scores = sub_api.get_scores(course.id.to_deprecated_string(), anonymous_id_for_user(student, course.id))
 
+    graded_sections = {}
+    persisted_grades = {}
+    if persisted_grades_enabled(student):
+        graded_sections = {
+            section['section_descriptor'].location: section
+            for sections in course.grading_context['graded_sections'].itervalues()
+            for section in sections
+        }
+        persisted_grades = StudentSubsectionGrade.grades_for(student, course.id)
+
     chapters = []
     # Don't include chapters that aren't displayable (e.g. due to error)
     for chapter_module in course_module.get_display_items():
@@ -364,19 +555,47 @@ def _progress_summary(student, request, course):
                     continue
 
                 graded = section_module.graded
-                scores = []
 
-                module_creator = section_module.xmodule_runtime.get_module
+                def make_score(descriptor, correct, total):
+                    """Return the Score shown on the progress page for `descriptor`."""
+                    return Score(correct, total, graded, descriptor.display_name_with_default)
 
-                for module_descriptor in yield_dynamic_descriptor_descendents(section_module, module_creator):
-                    course_id = course.id
-                    (correct, total) = get_score(
-                        course_id, student, module_descriptor, module_creator, scores_cache=submissions_scores
+                graded_section = graded_sections.get(section_module.location)
+                persistable = graded_section is not None and is_persistable_section(
+                    graded_section['xmoduledescriptors'], submissions_scores
+                )
+                scores = None
+                if persistable:
+                    version = subsection_grading_version(
+                        graded_section['section_descriptor'], graded_section['xmoduledescriptors']
                     )
-                    if correct is None and total is None:
-                        continue
+                    persisted_grade = persisted_grades.get(section_module.location)
+                    scores = _scores_from_persisted_grade(
+                        persisted_grade, version, graded_section['xmoduledescriptors'], make_score
+                    )
+
+                if scores is None:
+                    scores = []
+                    persisted_scores = []
+
+                    module_creator = section_module.xmodule_runtime.get_module
 
-                    scores.append(Score(correct, total, graded, module_descriptor.display_name_with_default))
+                    for module_descriptor in yield_dynamic_descriptor_descendents(section_module, module_creator):
+                        course_id = course.id
+                        (correct, total) = get_score(
+                            course_id, student, module_descriptor, module_creator, scores_cache=submissions_scores
+                        )
+                        if correct is None and total is None:
+                            continue
+
+                        persisted_scores.append([unicode(module_descriptor.location), correct, total])
+                        scores.append(make_score(module_descriptor, correct, total))
+
+                    if persistable:
+                        StudentSubsectionGrade.save_scores(
+                            student, course.id, section_module.location, version, persisted_scores,
+                            _state_version(persisted_grade)
+                        )
 
                 scores.reverse()
                 section_total, _ = graders.aggregate_scores(
@@ -403,7 +622,7 @@ def _progress_summary(student, request, course):
     return chapters
 
 
-def get_score(course_id, user, problem_descriptor, module_creator, scores_cache=None):
+def get_score(course_id, user, problem_descriptor, module_creator, scores_cache=None, student_module_cache=None):
     """
     Return the score for a user on a problem, as a tuple (correct, total).
     e.g. (5,7) if you got 5 out of 7 points.
@@ -417,6 +636,8 @@ def get_score(course_id, user, problem_descriptor, module_creator, scores_cache=
            Can return None if user doesn't have access, or if something else went wrong.
     scores_cache: A dict of location names to (earned, possible) point tuples.
            If an entry is found in this cache, it takes precedence.
+    student_module_cache: A dict of usage_keys to the user's StudentModules, as built by
+           `prefetch_student_modules`. If given, StudentModule isn't queried.
     """
     scores_cache = scores_cache or {}
 
@@ -443,14 +664,17 @@ def get_score(course_id, user, problem_descriptor, module_creator, scores_cache=
         # These are not problems, and do not have a score
         return (None, None)
 
-    try:
-        student_module = StudentModule.objects.get(
-            student=user,
-            course_id=course_id,
-            module_state_key=problem_descriptor.location
-        )
-    except StudentModule.DoesNotExist:
-        student_module = None
+    if student_module_cache is not None:
+        student_module = student_module_cache.get(problem_descriptor.location)
+    else:
+        try:
+            student_module = StudentModule.objects.get(
+                student=user,
+                course_id=course_id,
+                module_state_key=problem_descriptor.location
+            )
+        except StudentModule.DoesNotExist:
+            student_module = None
 
     if student_module is not None and student_module.max_grade is not None:
         correct = student_module.grade if student_module.grade is not None else 0
@@ -496,11 +720,45 @@ def manual_transaction():
         transaction.commit()
 
 
-def iterate_grades_for(course_id, students):
+def prefetch_student_modules(course, students):
+    """
+    Return a dict of student id -> {usage_key: StudentModule} holding the
+    StudentModules of every one of `students` for the scored modules of the
+    graded sections in `course`, fetched with a single query.
+
+    Only the columns needed for scoring are loaded.
+    """
+    usage_keys = set(
+        descriptor.location
+        for sections in course.grading_context['graded_sections'].itervalues()
+        for section in sections
+        for descriptor in section['xmoduledescriptors']
+    )
+    student_module_caches = {student.id: {} for student in students}
+    if not usage_keys or not student_module_caches:
+        return student_module_caches
+
+    student_modules = StudentModule.objects.filter(
+        course_id=course.id,
+        student__in=student_module_caches.keys(),
+        module_state_key__in=usage_keys,
+    ).only('student', 'module_state_key', 'grade', 'max_grade')
+
+    for student_module in student_modules:
+        usage_key = student_module.module_state_key.map_into_course(course.id)
+        student_module_caches[student_module.student_id][usage_key] = student_module
+
+    return student_module_caches
+
+
+def iterate_grades_for(course_id, students, chunk_size=GRADING_CHUNK_SIZE):
     """Given a course_id and an iterable of students (User), yield a tuple of:
 
     (student, gradeset, err_msg) for every student enrolled in the course.
 
+    Students are graded in chunks of `chunk_size`, with the StudentModules of
+    each chunk fetched in one query (see `prefetch_student_modules`).
+
     If an error occurred, gradeset will be an empty dict and err_msg will be an
     exception message. If there was no error, err_msg is an empty string.
 
@@ -521,25 +779,41 @@ def iterate_grades_for(course_id, students):
     # grading that student.
     request = RequestFactory().get('/')
 
-    for student in students:
-        with dog_stats_api.timer('lms.grades.iterate_grades_for', tags=['action:{}'.format(course_id)]):
-            try:
-                request.user = student
-                # Grading calls problem rendering, which calls masquerading,
-                # which checks session vars -- thus the empty session dict below.
-                # It's not pretty, but untangling that is currently beyond the
-                # scope of this feature.
-                request.session = {}
-                gradeset = grade(student, request, course)
-                yield student, gradeset, ""
-            except Exception as exc:  # pylint: disable=broad-except
-                # Keep marching on even if this student couldn't be graded for
-                # some reason, but log it for future reference.
-                log.exception(
-                    'Cannot grade student %s (%s) in course %s because of exception: %s',
-                    student.username,
-                    student.id,
-                    course_id,
-                    exc.message
-                )
-                yield student, {}, exc.message
+    students = iter(students)
+    while True:
+        students_chunk = list(islice(students, chunk_size))
+        if not students_chunk:
+            break
+
+        # Persisted scores are read before the student state they may be
+        # recomputed from (see `grade`)
+        persisted_grades = {}
+        if settings.FEATURES.get('ENABLE_PERSISTENT_GRADES', False):
+            persisted_grades = StudentSubsectionGrade.grades_for_students(students_chunk, course.id)
+        student_module_caches = prefetch_student_modules(course, students_chunk)
+
+        for student in students_chunk:
+            with dog_stats_api.timer('lms.grades.iterate_grades_for', tags=['action:{}'.format(course_id)]):
+                try:
+                    request.user = student
+                    # Grading calls problem rendering, which calls masquerading,
+                    # which checks session vars -- thus the empty session dict below.
+                    # It's not pretty, but untangling that is currently beyond the
+                    # scope of this feature.
+                    request.session = {}
+                    gradeset = grade(
+                        student, request, course, student_module_cache=student_module_caches[student.id],
+                        persisted_grades=persisted_grades.get(student.id, {})
+                    )
+                    yield student, gradeset, ""
+                except Exception as exc:  # pylint: disable=broad-except
+                    # Keep marching on even if this student couldn't be graded for
+                    # some reason, but log it for future reference.
+                    log.exception(
+                        'Cannot grade student %s (%s) in course %s because of exception: %s',
+                        student.username,
+                        student.id,
+                        course_id,
+                        exc.message
+                    )
+                    yield student, {}, exc.message
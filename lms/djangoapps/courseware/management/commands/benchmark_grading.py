@@ -0,0 +1,193 @@
+"""
+A Django command that benchmarks grading every student enrolled in a course
+one at a time, as grade reports did before, against grading them in chunks
+with `iterate_grades_for`. It reports the time and number of queries each way
+takes, and checks that both produce byte-identical grade report CSVs.
+
+With --create-students, it first enrolls that many synthetic learners in the
+course, each with a random stored grade on most of its graded problems, to
+simulate a large course in a development database, e.g.:
+
+    ./manage.py lms benchmark_grading edX/Demo/2014 --create-students 50000 --settings devstack
+"""
+
+import csv
+import hashlib
+import random
+import time
+from optparse import make_option
+from textwrap import dedent
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.client import RequestFactory
+
+from courseware.grades import grade, iterate_grades_for, GRADING_CHUNK_SIZE
+from courseware.models import StudentModule
+from instructor_task.tasks_helper import _grade_report_header, _grade_report_row
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.locations import SlashSeparatedCourseKey
+from student.models import CourseEnrollment
+from xmodule.modulestore.django import modulestore
+
+# Synthetic learners are created this many at a time
+CREATE_CHUNK_SIZE = 1000
+
+
+class HashingWriter(object):
+    """
+    A file-like object keeping only the sha1 of what is written to it.
+    """
+    def __init__(self):
+        self.digest = hashlib.sha1()
+
+    def write(self, data):
+        """Add `data` to the digest."""
+        self.digest.update(data)
+
+
+def create_students(course, num_students, seed=0):
+    """
+    Enroll `num_students` new synthetic learners in `course`. Each of them
+    gets a random stored grade on about 70% of the scored problems of the
+    graded sections.
+    """
+    rand = random.Random(seed)
+    problem_locations = [
+        descriptor.location
+        for sections in course.grading_context['graded_sections'].itervalues()
+        for section in sections
+        for descriptor in section['xmoduledescriptors']
+        if descriptor.has_score
+    ]
+    first = User.objects.filter(username__startswith='grading_benchmark_').count()
+    for start in xrange(first, first + num_students, CREATE_CHUNK_SIZE):
+        usernames = [
+            u'grading_benchmark_{0}'.format(index)
+            for index in xrange(start, min(start + CREATE_CHUNK_SIZE, first + num_students))
+        ]
+        User.objects.bulk_create([
+            User(username=username, email=u'{0}@example.com'.format(username)) for username in usernames
+        ])
+        students = list(User.objects.filter(username__in=usernames))
+        CourseEnrollment.objects.bulk_create([
+            CourseEnrollment(user=student, course_id=course.id) for student in students
+        ])
+        StudentModule.objects.bulk_create([
+            StudentModule(
+                student=student,
+                course_id=course.id,
+                module_state_key=location,
+                module_type=location.category,
+                state='{}',
+                grade=rand.randint(0, 2),
+                max_grade=2,
+            )
+            for student in students
+            for location in problem_locations
+            if rand.random() < 0.7
+        ])
+
+
+def report_digest(graded_students):
+    """
+    Return the sha1 of the grade report CSV of `graded_students`, an iterable
+    of (student, gradeset, err_msg), and the number of queries issued while
+    iterating over it. Only the digest is kept, so memory stays flat.
+    """
+    writer = HashingWriter()
+    report_writer = csv.writer(writer)
+    header = None
+    num_queries = 0
+    for student, gradeset, __ in graded_students:
+        num_queries += len(connection.queries)
+        reset_queries()
+        if gradeset:
+            if not header:
+                header = _grade_report_header(gradeset)
+                report_writer.writerow(["id", "email", "username", "grade"] + header)
+            report_writer.writerow(_grade_report_row(student, gradeset, header))
+    num_queries += len(connection.queries)
+    return writer.digest.hexdigest(), num_queries
+
+
+def grade_one_at_a_time(course, students):
+    """
+    Yield (student, gradeset, err_msg) for each of `students`, graded without
+    prefetching their StudentModules.
+    """
+    request = RequestFactory().get('/')
+    for student in students:
+        request.user = student
+        request.session = {}
+        try:
+            yield student, grade(student, request, course), ""
+        except Exception as exc:  # pylint: disable=broad-except
+            yield student, {}, exc.message
+
+
+class Command(BaseCommand):
+    """
+    Benchmark grading the students of a course one at a time against grading
+    them in chunks.
+    """
+    args = "<course_id>"
+    help = dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option('--create-students',
+                    action='store',
+                    type='int',
+                    default=0,
+                    help='How many synthetic learners to enroll in the course first'),
+        make_option('--limit',
+                    action='store',
+                    type='int',
+                    default=None,
+                    help='Only grade this many of the enrolled students'),
+        make_option('--chunk-size',
+                    action='store',
+                    type='int',
+                    default=GRADING_CHUNK_SIZE,
+                    help='How many students to grade at once'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("course_id not specified")
+
+        try:
+            course_key = SlashSeparatedCourseKey.from_deprecated_string(args[0])
+        except InvalidKeyError:
+            raise CommandError("Invalid course_id")
+
+        course = modulestore().get_course(course_key, depth=None)
+        if course is None:
+            raise CommandError("Invalid course_id")
+
+        if options['create_students']:
+            create_students(course, options['create_students'])
+
+        students = CourseEnrollment.users_enrolled_in(course_key).order_by('id')
+        if options['limit'] is not None:
+            students = students[:options['limit']]
+
+        # Count queries without keeping them all
+        connection.use_debug_cursor = True
+        try:
+            digests = []
+            for name, graded_students in [
+                    ('one at a time', grade_one_at_a_time(course, students.iterator())),
+                    ('in chunks', iterate_grades_for(course_key, students.iterator(), options['chunk_size'])),
+            ]:
+                reset_queries()
+                start = time.time()
+                digest, num_queries = report_digest(graded_students)
+                self.stdout.write(u"{0}: {1:.1f}s, {2} queries\n".format(name, time.time() - start, num_queries))
+                digests.append(digest)
+        finally:
+            connection.use_debug_cursor = None
+
+        if digests[0] != digests[1]:
+            raise CommandError("The grade reports differ")
+        self.stdout.write(u"The grade reports are identical\n")
@@ -6,17 +6,13 @@ If <filename> is '-', it pipes the file to stdout
 """
 
 import os
-import shutil
-import tarfile
-from tempfile import mktemp, mkdtemp
+from tempfile import mktemp
 from textwrap import dedent
 
-from path import path
-
 from django.core.management.base import BaseCommand, CommandError
 
 from xmodule.modulestore.django import modulestore
-from xmodule.modulestore.xml_exporter import export_to_xml
+from xmodule.modulestore.xml_exporter import export_to_tarball
 from opaque_keys import InvalidKeyError
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
 
@@ -66,31 +62,11 @@ class Command(BaseCommand):
 
 def export_course_to_tarfile(course_id, filename):
     """Exports a course into a tar.gz file"""
-    tmp_dir = mkdtemp()
-    try:
-        course_dir = export_course_to_directory(course_id, tmp_dir)
-        compress_directory(course_dir, filename)
-    finally:
-        shutil.rmtree(tmp_dir)
-
-
-def export_course_to_directory(course_id, root_dir):
-    """Export course into a directory"""
     store = modulestore()
     course = store.get_course(course_id)
     if course is None:
         raise CommandError("Invalid course_id")
 
     course_name = course.id.to_deprecated_string().replace('/', '-')
-    export_to_xml(store, None, course.id, root_dir, course_name)
-
-    course_dir = path(root_dir) / course_name
-    return course_dir
-
-
-def compress_directory(directory, filename):
-    """Compress a directrory into a tar.gz file"""
-    mode = 'w:gz'
-    name = path(directory).name
-    with tarfile.open(filename, mode) as tar_file:
-        tar_file.add(directory, arcname=name)
+    with open(filename, 'wb') as tar_gz:
+        export_to_tarball(store, None, course.id, tar_gz, course_name)
@@ -0,0 +1,45 @@
+"""
+A Django command that brings the problem grade and subsection open
+distributions shown by the class dashboard up to date with StudentModule.
+
+Run it periodically (e.g. from cron) for every course, or for the courses
+given: each run only recomputes the distributions of the problems and
+subsections students have worked on since the previous one.
+"""
+
+from optparse import make_option
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courseware.models import ClassDashboardRefresh
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.locations import SlashSeparatedCourseKey
+from xmodule.modulestore.django import modulestore
+
+
+class Command(BaseCommand):
+    """
+    Refresh the materialized class dashboard distributions of courses.
+    """
+    args = "[<course_id> ...]"
+    help = dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option('--full',
+                    action='store_true',
+                    default=False,
+                    help='Recompute all the distributions, not only the ones which changed'),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            try:
+                course_keys = [SlashSeparatedCourseKey.from_deprecated_string(arg) for arg in args]
+            except InvalidKeyError:
+                raise CommandError("Invalid course_id")
+        else:
+            course_keys = [course.id for course in modulestore().get_courses()]
+
+        for course_key in course_keys:
+            ClassDashboardRefresh.refresh(course_key, full=options['full'])
+            self.stdout.write(u"Refreshed {0}\n".format(course_key.to_deprecated_string()))
@@ -0,0 +1,96 @@
+"""
+A Django command that fills the safe_exec cache with the results of the scripts
+of every problem in a course, for the random seeds students get.
+
+Run it after importing a course, so that the first students to view its
+randomized problems don't each wait for the sandbox to run the same scripts.
+"""
+
+from optparse import make_option
+from textwrap import dedent
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from capa.capa_problem import LoncapaProblem, LoncapaSystem
+from edxmako.shortcuts import render_to_string
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.locations import SlashSeparatedCourseKey
+from util.sandboxing import can_execute_unsafe_code, get_safe_exec_cache
+from xmodule.capa_base import MAX_RANDOMIZATION_BINS
+from xmodule.modulestore.django import modulestore, ModuleI18nService
+
+
+def problem_seeds(descriptor, num_seeds):
+    """
+    Returns the random seeds students can get for the problem, among the first `num_seeds`.
+    """
+    if descriptor.rerandomize == 'never':
+        return [1]
+    return range(num_seeds)
+
+
+class Command(BaseCommand):
+    """
+    Run the scripts of the problems of a course for each random seed, caching
+    their results.
+    """
+    args = "<course_id>"
+    help = dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option('--seeds',
+                    action='store',
+                    type='int',
+                    default=MAX_RANDOMIZATION_BINS,
+                    help='How many random seeds to run the scripts for, starting from 0'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("course_id not specified")
+
+        try:
+            course_key = SlashSeparatedCourseKey.from_deprecated_string(args[0])
+        except InvalidKeyError:
+            raise CommandError("Invalid course_id")
+
+        store = modulestore()
+        if store.get_course(course_key) is None:
+            raise CommandError("Invalid course_id")
+
+        cache = get_safe_exec_cache()
+        for descriptor in store.get_items(course_key, category='problem'):
+            capa_system = LoncapaSystem(
+                ajax_url=None,
+                # scripts which use it can't share results between students anyway
+                anonymous_student_id=None,
+                cache=cache,
+                can_execute_unsafe_code=lambda: can_execute_unsafe_code(course_key),
+                DEBUG=False,
+                filestore=descriptor.runtime.resources_fs,
+                i18n=ModuleI18nService(),
+                node_path=settings.NODE_PATH,
+                render_template=render_to_string,
+                seed=None,
+                STATIC_URL=settings.STATIC_URL,
+                xqueue=None,
+            )
+            for seed in problem_seeds(descriptor, options['seeds']):
+                try:
+                    LoncapaProblem(
+                        problem_text=descriptor.data,
+                        id=descriptor.location.html_id(),
+                        seed=seed,
+                        capa_system=capa_system,
+                    )
+                except Exception as err:  # pylint: disable=broad-except
+                    # the problem is broken for every seed
+                    self.stderr.write(u"Skipping {0}: {1}\n".format(descriptor.location, err))
+                    break
+
+        stats = cache.stats()
+        self.stdout.write(
+            u"Ran {misses} scripts; {hits} were already cached.\n".format(
+                misses=stats['misses'], hits=stats['local_hits'] + stats['shared_hits'],
+            )
+        )
@@ -2,8 +2,10 @@
 Classes to provide the LMS runtime data storage to XBlocks
 """
 
+import copy
 import json
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 from itertools import chain
 from .models import (
     StudentModule,
@@ -14,7 +16,8 @@ from .models import (
 import logging
 from opaque_keys.edx.locations import SlashSeparatedCourseKey, Location
 
-from django.db import DatabaseError
+from django.db import DatabaseError, router
+from django.db.models.signals import post_save
 from django.contrib.auth.models import User
 
 from xblock.runtime import KeyValueStore
@@ -39,12 +42,72 @@ def chunks(items, chunk_size):
     return (items[i:i + chunk_size] for i in xrange(0, len(items), chunk_size))
 
 
+def get_child_descriptors(descriptor, depth, descriptor_filter):
+    """
+    Return a list of all child descriptors down to the specified depth
+    that match the descriptor filter. Includes `descriptor`
+
+    descriptor: The parent to search inside
+    depth: The number of levels to descend, or None for infinite depth
+    descriptor_filter(descriptor): A function that returns True
+        if descriptor should be included in the results
+    """
+    if descriptor_filter(descriptor):
+        descriptors = [descriptor]
+    else:
+        descriptors = []
+
+    if depth is None or depth > 0:
+        new_depth = depth - 1 if depth is not None else depth
+
+        for child in descriptor.get_children() + descriptor.get_required_module_descriptors():
+            descriptors.extend(get_child_descriptors(child, new_depth, descriptor_filter))
+
+    return descriptors
+
+
+def query_field_objects(model_class, select_for_update=False, **kwargs):
+    """
+    Queries model_class with **kwargs, optionally adding select_for_update
+    """
+    query = model_class.objects
+    if select_for_update:
+        query = query.select_for_update()
+    query = query.filter(**kwargs)
+    return query
+
+
+def chunked_query_field_objects(model_class, chunk_field, items, chunk_size=500, select_for_update=False, **kwargs):
+    """
+    Queries model_class with `chunk_field` set to chunks of size `chunk_size`,
+    and all other parameters from `**kwargs`
+
+    This works around a limitation in sqlite3 on the number of parameters
+    that can be put into a single query
+    """
+    return chain.from_iterable(
+        query_field_objects(model_class, select_for_update, **dict([(chunk_field, chunk)] + kwargs.items()))
+        for chunk in chunks(items, chunk_size)
+    )
+
+
+def fields_to_cache(descriptors):
+    """
+    Returns a map of scopes to the fields of descriptors in that scope that should be cached
+    """
+    scope_map = defaultdict(set)
+    for descriptor in descriptors:
+        for field in descriptor.fields.values():
+            scope_map[field.scope].add(field)
+    return scope_map
+
+
 class FieldDataCache(object):
     """
     A cache of django model objects needed to supply the data
     for a module and its decendants
     """
-    def __init__(self, descriptors, course_id, user, select_for_update=False):
+    def __init__(self, descriptors, course_id, user, select_for_update=False, field_objects=None):
         '''
         Find any courseware.models objects that are needed by any descriptor
         in descriptors. Attempts to minimize the number of queries to the database.
@@ -56,16 +119,27 @@ class FieldDataCache(object):
         course_id: The id of the current course
         user: The user for which to cache data
         select_for_update: True if rows should be locked until end of transaction
+        field_objects: (scope, field object) pairs already fetched from the database, which
+            are cached instead of querying for them (see MultiUserFieldDataCache)
         '''
         self.cache = {}
         self.descriptors = descriptors
         self.select_for_update = select_for_update
 
+        # decoded StudentModule.state of the user_state cache keys
+        self._states = {}
+        # field objects saved within write_behind(), waiting to be written
+        self._dirty = OrderedDict()
+        self._writes_deferred = False
+
         assert isinstance(course_id, SlashSeparatedCourseKey)
         self.course_id = course_id
         self.user = user
 
-        if user.is_authenticated():
+        if field_objects is not None:
+            for scope, field_object in field_objects:
+                self.cache[self._cache_key_from_field_object(scope, field_object)] = field_object
+        elif user.is_authenticated():
             for scope, fields in self._fields_to_cache().items():
                 for field_object in self._retrieve_fields(scope, fields):
                     self.cache[self._cache_key_from_field_object(scope, field_object)] = field_object
@@ -85,29 +159,6 @@ class FieldDataCache(object):
         select_for_update: Flag indicating whether the rows should be locked until end of transaction
         """
 
-        def get_child_descriptors(descriptor, depth, descriptor_filter):
-            """
-            Return a list of all child descriptors down to the specified depth
-            that match the descriptor filter. Includes `descriptor`
-
-            descriptor: The parent to search inside
-            depth: The number of levels to descend, or None for infinite depth
-            descriptor_filter(descriptor): A function that returns True
-                if descriptor should be included in the results
-            """
-            if descriptor_filter(descriptor):
-                descriptors = [descriptor]
-            else:
-                descriptors = []
-
-            if depth is None or depth > 0:
-                new_depth = depth - 1 if depth is not None else depth
-
-                for child in descriptor.get_children() + descriptor.get_required_module_descriptors():
-                    descriptors.extend(get_child_descriptors(child, new_depth, descriptor_filter))
-
-            return descriptors
-
         descriptors = get_child_descriptors(descriptor, depth, descriptor_filter)
 
         return FieldDataCache(descriptors, course_id, user, select_for_update)
@@ -117,25 +168,16 @@ class FieldDataCache(object):
         Queries model_class with **kwargs, optionally adding select_for_update if
         self.select_for_update is set
         """
-        query = model_class.objects
-        if self.select_for_update:
-            query = query.select_for_update()
-        query = query.filter(**kwargs)
-        return query
+        return query_field_objects(model_class, self.select_for_update, **kwargs)
 
     def _chunked_query(self, model_class, chunk_field, items, chunk_size=500, **kwargs):
         """
         Queries model_class with `chunk_field` set to chunks of size `chunk_size`,
         and all other parameters from `**kwargs`
-
-        This works around a limitation in sqlite3 on the number of parameters
-        that can be put into a single query
         """
-        res = chain.from_iterable(
-            self._query(model_class, **dict([(chunk_field, chunk)] + kwargs.items()))
-            for chunk in chunks(items, chunk_size)
+        return chunked_query_field_objects(
+            model_class, chunk_field, items, chunk_size, self.select_for_update, **kwargs
         )
-        return res
 
     def _retrieve_fields(self, scope, fields):
         """
@@ -177,11 +219,7 @@ class FieldDataCache(object):
         """
         Returns a map of scopes to fields in that scope that should be cached
         """
-        scope_map = defaultdict(set)
-        for descriptor in self.descriptors:
-            for field in descriptor.fields.values():
-                scope_map[field.scope].add(field)
-        return scope_map
+        return fields_to_cache(self.descriptors)
 
     def _cache_key_from_kvs_key(self, key):
         """
@@ -269,6 +307,210 @@ class FieldDataCache(object):
         self.cache[cache_key] = field_object
         return field_object
 
+    def get_state(self, key):
+        """
+        Returns the decoded state of the StudentModule holding the user_state `key`,
+        or None if there's no such StudentModule.
+
+        The state of each StudentModule is only decoded once, and the returned dict
+        is shared by all the fields stored in that StudentModule.
+        """
+        cache_key = self._cache_key_from_kvs_key(key)
+        state = self._states.get(cache_key)
+        if state is None:
+            field_object = self.find(key)
+            if field_object is None:
+                return None
+            state = self._states[cache_key] = json.loads(field_object.state)
+        return state
+
+    def save_field_object(self, field_object, columns, field_names):
+        """
+        Saves field_object, whose `columns` changed to store the fields named `field_names`.
+
+        Within write_behind(), the save is deferred until the end of the block, and
+        coalesced with all the other saves of field_object.
+        """
+        if not self._writes_deferred:
+            field_object.save()
+            return
+
+        _field_object, dirty_columns, dirty_field_names = self._dirty.setdefault(
+            id(field_object), (field_object, set(), [])
+        )
+        dirty_columns.update(columns)
+        dirty_field_names.extend(name for name in field_names if name not in dirty_field_names)
+
+    def delete_field_object(self, field_object):
+        """
+        Deletes field_object, dropping any of its pending writes.
+        """
+        self._dirty.pop(id(field_object), None)
+        field_object.delete()
+
+    @contextmanager
+    def write_behind(self):
+        """
+        Defers the saves of field objects until the end of the block, then writes
+        each dirty field object once, updating only the columns that changed.
+        """
+        self._writes_deferred = True
+        try:
+            yield
+        finally:
+            self._writes_deferred = False
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the field objects saved within write_behind().
+
+        Raises a KeyValueMultiSaveError listing the fields that were saved if a
+        write fails, in which case the remaining writes are dropped.
+        """
+        saved_fields = []
+        while self._dirty:
+            __, (field_object, columns, field_names) = self._dirty.popitem(last=False)
+            try:
+                self._update_columns(field_object, columns)
+            except DatabaseError:
+                log.exception('Error saving fields %r', field_names)
+                self._dirty.clear()
+                raise KeyValueMultiSaveError(saved_fields)
+            saved_fields.extend(field_names)
+
+    @staticmethod
+    def _update_columns(field_object, columns):
+        """
+        Writes `columns` of field_object along with its auto_now timestamps, and
+        sends post_save as Model.save would (StudentModuleHistory relies on it).
+        """
+        model_class = type(field_object)
+        values = {}
+        for field in model_class._meta.fields:  # pylint: disable=protected-access
+            if getattr(field, 'auto_now', False):
+                values[field.attname] = field.pre_save(field_object, False)
+        for column in columns:
+            values[column] = getattr(field_object, column)
+
+        using = router.db_for_write(model_class, instance=field_object)
+        model_class.objects.using(using).filter(pk=field_object.pk).update(**values)
+        post_save.send(sender=model_class, instance=field_object, created=False, raw=False, using=using)
+
+
+class MultiUserFieldDataCache(object):
+    """
+    Loads the django model objects needed by a set of descriptors for a set of
+    users at once, with queries chunked across users, and hands out a
+    FieldDataCache for each of those users.
+
+    Processing many students (e.g. rescoring a problem for a whole course) thus
+    costs a few queries per chunk of students, rather than a few per student.
+    Use `for_user` to get the FieldDataCache of one of the users, which reads
+    and writes the field data of that user like any other FieldDataCache.
+    """
+    # the number of users per query, which along with the usage ids of a chunk
+    # stays within the sqlite3 limit on the number of query parameters
+    user_chunk_size = 400
+
+    def __init__(self, descriptors, course_id, users, select_for_update=False):
+        """
+        descriptors: A list of XModuleDescriptors.
+        course_id: The id of the current course
+        users: The users for which to cache data
+        select_for_update: True if rows should be locked until end of transaction
+        """
+        self.descriptors = descriptors
+        self.select_for_update = select_for_update
+
+        assert isinstance(course_id, SlashSeparatedCourseKey)
+        self.course_id = course_id
+        self.users = [user for user in users if user.is_authenticated()]
+
+        # maps user ids to the (scope, field object) pairs of that user,
+        # with the ones shared by all users under None
+        self._field_objects = defaultdict(list)
+        if self.users:
+            for scope, fields in fields_to_cache(self.descriptors).items():
+                for field_object in self._retrieve_fields(scope, fields):
+                    user_id = None if scope == Scope.user_state_summary else field_object.student_id
+                    self._field_objects[user_id].append((scope, field_object))
+
+    @classmethod
+    def cache_for_descriptor_descendents(cls, course_id, users, descriptor, depth=None,
+                                         descriptor_filter=lambda descriptor: True,
+                                         select_for_update=False):
+        """
+        Like FieldDataCache.cache_for_descriptor_descendents, for a set of users.
+        """
+        descriptors = get_child_descriptors(descriptor, depth, descriptor_filter)
+
+        return MultiUserFieldDataCache(descriptors, course_id, users, select_for_update)
+
+    def for_user(self, user):
+        """
+        Returns the FieldDataCache of `user`, who must be one of the users this
+        cache was built for.
+        """
+        return FieldDataCache(
+            self.descriptors, self.course_id, user, self.select_for_update,
+            field_objects=self._field_objects[None] + self._field_objects[user.id],
+        )
+
+    def _chunked_query(self, model_class, chunk_field, items, chunk_size=500, **kwargs):
+        """
+        Queries model_class in chunks, optionally adding select_for_update if
+        self.select_for_update is set
+        """
+        return chunked_query_field_objects(
+            model_class, chunk_field, items, chunk_size, self.select_for_update, **kwargs
+        )
+
+    def _retrieve_fields(self, scope, fields):
+        """
+        Queries the database for all of the fields in the specified scope, for all the users
+        """
+        user_ids = [user.id for user in self.users]
+        usage_ids = [descriptor.scope_ids.usage_id for descriptor in self.descriptors]
+        if scope == Scope.user_state:
+            return chain.from_iterable(
+                self._chunked_query(
+                    StudentModule,
+                    'module_state_key__in',
+                    usage_ids,
+                    chunk_size=self.user_chunk_size,
+                    course_id=self.course_id,
+                    student__in=user_chunk,
+                )
+                for user_chunk in chunks(user_ids, self.user_chunk_size)
+            )
+        elif scope == Scope.user_state_summary:
+            return self._chunked_query(
+                XModuleUserStateSummaryField,
+                'usage_id__in',
+                usage_ids,
+                field_name__in=set(field.name for field in fields),
+            )
+        elif scope == Scope.preferences:
+            return self._chunked_query(
+                XModuleStudentPrefsField,
+                'student__in',
+                user_ids,
+                chunk_size=self.user_chunk_size,
+                module_type__in=set(descriptor.scope_ids.block_type for descriptor in self.descriptors),
+                field_name__in=set(field.name for field in fields),
+            )
+        elif scope == Scope.user_info:
+            return self._chunked_query(
+                XModuleStudentInfoField,
+                'student__in',
+                user_ids,
+                chunk_size=self.user_chunk_size,
+                field_name__in=set(field.name for field in fields),
+            )
+        else:
+            return []
+
 
 class DjangoKeyValueStore(KeyValueStore):
     """
@@ -307,7 +549,11 @@ class DjangoKeyValueStore(KeyValueStore):
             raise KeyError(key.field_name)
 
         if key.scope == Scope.user_state:
-            return json.loads(field_object.state)[key.field_name]
+            value = self._field_data_cache.get_state(key)[key.field_name]
+            # the decoded state is shared, don't let callers mutate it in place
+            if isinstance(value, (list, dict)):
+                value = copy.deepcopy(value)
+            return value
         else:
             return json.loads(field_object.value)
 
@@ -342,23 +588,27 @@ class DjangoKeyValueStore(KeyValueStore):
 
             # Special case when scope is for the user state, because this scope saves fields in a single row
             if field.scope == Scope.user_state:
-                state = json.loads(field_object.state)
-                state[field.field_name] = kv_dict[field]
-                field_object.state = json.dumps(state)
+                self._field_data_cache.get_state(field)[field.field_name] = kv_dict[field]
             else:
             # The remaining scopes save fields on different rows, so
             # we don't have to worry about conflicts
                 field_object.value = json.dumps(kv_dict[field])
 
-        for field_object in field_objects:
+        for field_object, fields in field_objects.iteritems():
+            if fields[0].scope == Scope.user_state:
+                # Encode the state once, however many of its fields changed
+                field_object.state = json.dumps(self._field_data_cache.get_state(fields[0]))
+                column = 'state'
+            else:
+                column = 'value'
             try:
                 # Save the field object that we made above
-                field_object.save()
+                self._field_data_cache.save_field_object(field_object, [column], [field.field_name for field in fields])
                 # If save is successful on this scope, add the saved fields to
                 # the list of successful saves
-                saved_fields.extend([field.field_name for field in field_objects[field_object]])
+                saved_fields.extend([field.field_name for field in fields])
             except DatabaseError:
-                log.exception('Error saving fields %r', field_objects[field_object])
+                log.exception('Error saving fields %r', fields)
                 raise KeyValueMultiSaveError(saved_fields)
 
     def delete(self, key):
@@ -370,12 +620,12 @@ class DjangoKeyValueStore(KeyValueStore):
             raise KeyError(key.field_name)
 
         if key.scope == Scope.user_state:
-            state = json.loads(field_object.state)
+            state = self._field_data_cache.get_state(key)
             del state[key.field_name]
             field_object.state = json.dumps(state)
-            field_object.save()
+            self._field_data_cache.save_field_object(field_object, ['state'], [key.field_name])
         else:
-            field_object.delete()
+            self._field_data_cache.delete_field_object(field_object)
 
     def has(self, key):
         if key.scope not in self._allowed_scopes:
@@ -386,6 +636,6 @@ class DjangoKeyValueStore(KeyValueStore):
             return False
 
         if key.scope == Scope.user_state:
-            return key.field_name in json.loads(field_object.state)
+            return key.field_name in self._field_data_cache.get_state(key)
         else:
             return True
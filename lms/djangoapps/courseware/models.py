@@ -12,11 +12,16 @@ file and check it in at the same time as your model changes. To do that,
 ASSUMPTIONS: modules have unique IDs, even across different module_types
 
 """
+import json
+from datetime import datetime, timedelta
+
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from pytz import UTC
 
 from xmodule_django.models import CourseKeyField, LocationKeyField
 
@@ -129,6 +134,396 @@ class StudentModuleHistory(models.Model):
             history_entry.save()
 
 
+class StudentSubsectionGrade(models.Model):
+    """
+    Persisted scores for one graded subsection (sequential) of a course for a
+    given student, so that grading does not have to instantiate every problem
+    in the subsection on every call.
+
+    `scores` holds a JSON list of [location, earned, possible] entries, one per
+    scored descendant, in the order the grader visits them. `version` is a
+    digest of the subsection's scorable structure (see
+    `courseware.grades.subsection_grading_version`).
+
+    `state_version` is bumped whenever the student state of the subsection
+    changes (see `invalidate_many`), and `scored_state_version` is the
+    `state_version` the scores were computed at. The scores are current if
+    both versions match, so reading them needs no query of StudentModule.
+    """
+    class Meta:
+        unique_together = (('student', 'course_id', 'usage_key'),)
+
+    student = models.ForeignKey(User, db_index=True)
+    course_id = CourseKeyField(max_length=255, db_index=True)
+
+    # The location of the subsection these scores belong to
+    usage_key = LocationKeyField(max_length=255, db_index=True)
+
+    version = models.CharField(max_length=40)
+    scores = models.TextField(default='[]')
+
+    state_version = models.PositiveIntegerField(default=0)
+    # None until scores are saved
+    scored_state_version = models.PositiveIntegerField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def grades_for(cls, student, course_id):
+        """
+        Return a dict of subsection usage_key -> StudentSubsectionGrade for
+        every subsection of `course_id` that has persisted scores for `student`.
+        """
+        return cls.grades_for_students([student], course_id)[student.id]
+
+    @classmethod
+    def grades_for_students(cls, students, course_id):
+        """
+        Like `grades_for`, for all of `students` at once: returns a dict of
+        student id -> subsection usage_key -> StudentSubsectionGrade.
+        """
+        grades = {student.id: {} for student in students}
+        for subsection_grade in cls.objects.filter(student__in=grades.keys(), course_id=course_id):
+            usage_key = subsection_grade.usage_key.map_into_course(course_id)
+            grades[subsection_grade.student_id][usage_key] = subsection_grade
+        return grades
+
+    @classmethod
+    def save_scores(cls, student, course_id, usage_key, version, scores, state_version=None):
+        """
+        Persist `scores` (a list of [location, earned, possible]) for `student`
+        in subsection `usage_key`, computed from student state read after the
+        row of the subsection was found at `state_version` (None if there was
+        no row).
+
+        The scores are not saved if the student state of the subsection was
+        invalidated since, as they may not reflect it.
+        """
+        scores = json.dumps(scores)
+        if state_version is not None:
+            cls.objects.filter(
+                student=student, course_id=course_id, usage_key=usage_key, state_version=state_version
+            ).update(version=version, scores=scores, scored_state_version=state_version)
+            return
+        try:
+            cls.objects.create(
+                student=student, course_id=course_id, usage_key=usage_key, version=version, scores=scores,
+                scored_state_version=0
+            )
+        except IntegrityError:
+            # The subsection was invalidated, or persisted by another request,
+            # since it was found missing. Either way the row is up to date.
+            pass
+
+    @classmethod
+    def invalidate(cls, student_id, course_id, usage_keys=None, create_missing=False):
+        """
+        Make the persisted scores of `student_id` for the subsections in
+        `usage_keys` (or for every subsection in the course if None) stale, so
+        they are recomputed on the next grading pass.
+        """
+        cls.invalidate_many([student_id], course_id, usage_keys, create_missing)
+
+    @classmethod
+    def invalidate_many(cls, student_ids, course_id, usage_keys=None, create_missing=False):
+        """
+        Like `invalidate`, for all the students with ids in `student_ids` at once.
+
+        Scores being computed from student state read before this call are
+        not saved. For students without a row yet, that requires creating one,
+        so if `create_missing` is True, every one of `usage_keys` must be a
+        graded subsection, and rows without scores are created for them.
+        """
+        student_ids = list(student_ids)
+        subsection_grades = cls.objects.filter(student_id__in=student_ids, course_id=course_id)
+        if usage_keys is not None:
+            subsection_grades = subsection_grades.filter(usage_key__in=usage_keys)
+        updated = subsection_grades.update(state_version=F('state_version') + 1)
+        if not create_missing or updated == len(student_ids) * len(usage_keys):
+            return
+
+        existing = set(
+            (student_id, usage_key.map_into_course(course_id))
+            for student_id, usage_key in subsection_grades.values_list('student_id', 'usage_key')
+        )
+        for student_id in student_ids:
+            for usage_key in usage_keys:
+                if (student_id, usage_key) in existing:
+                    continue
+                try:
+                    cls.objects.create(
+                        student_id=student_id, course_id=course_id, usage_key=usage_key, state_version=1
+                    )
+                except IntegrityError:
+                    # Created since it was found missing, by grading which may
+                    # have read the state before this call
+                    cls.objects.filter(
+                        student_id=student_id, course_id=course_id, usage_key=usage_key
+                    ).update(state_version=F('state_version') + 1)
+
+    def has_scores_for(self, version):
+        """
+        Return True if the persisted scores are current, and were computed for
+        the `version` of the subsection content.
+        """
+        return self.scored_state_version == self.state_version and self.version == version
+
+    def get_scores(self):
+        """Return the persisted scores as a list of [location, earned, possible]."""
+        return json.loads(self.scores)
+
+    def __repr__(self):
+        return 'StudentSubsectionGrade<%r>' % ({
+            'course_id': self.course_id,
+            'student': self.student_id,
+            'usage_key': self.usage_key,
+            'version': self.version,
+            'state_version': self.state_version,
+            'scored_state_version': self.scored_state_version,
+        },)
+
+    def __unicode__(self):
+        return unicode(repr(self))
+
+
+@receiver(post_delete, sender=StudentModule)
+def invalidate_deleted_module_grades(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Deleting student state (e.g. instructors resetting a problem) can change
+    the student's score of the subsection holding it, so make it stale.
+    """
+    # Imported here to avoid a circular import: grades imports these models
+    from courseware.grades import invalidate_subsection_grades
+    invalidate_subsection_grades(
+        instance.student_id, instance.course_id, instance.module_state_key.map_into_course(instance.course_id)
+    )
+
+
+class ProblemGradeDistribution(models.Model):
+    """
+    How many students of a course have each (grade, max_grade) on a problem:
+    the grade distribution the class dashboard shows, materialized from
+    StudentModule so that it doesn't have to aggregate the whole course on
+    every load.  Kept up to date by `ClassDashboardRefresh.refresh`.
+    """
+    class Meta:
+        unique_together = (('course_id', 'module_state_key', 'grade', 'max_grade'),)
+
+    course_id = CourseKeyField(max_length=255, db_index=True)
+    module_state_key = LocationKeyField(max_length=255, db_index=True, db_column='module_id')
+    grade = models.FloatField()
+    max_grade = models.FloatField(null=True, blank=True)
+    student_count = models.IntegerField(default=0)
+
+    @classmethod
+    def recompute(cls, course_id, usage_keys=None):
+        """
+        Recompute the distributions of the problems in `usage_keys` (or of
+        every problem in the course if None) from StudentModule.
+
+        Must run in the transaction of `ClassDashboardRefresh.refresh`.
+        """
+        student_modules = StudentModule.objects.filter(
+            course_id=course_id, grade__isnull=False, module_type='problem'
+        )
+        distributions = cls.objects.filter(course_id=course_id)
+        if usage_keys is not None:
+            student_modules = student_modules.filter(module_state_key__in=usage_keys)
+            distributions = distributions.filter(module_state_key__in=usage_keys)
+        rows = student_modules.values('module_state_key', 'grade', 'max_grade').annotate(count_grade=Count('grade'))
+
+        distributions.delete()
+        cls.objects.bulk_create([
+            cls(
+                course_id=course_id,
+                module_state_key=row['module_state_key'],
+                grade=row['grade'],
+                max_grade=row['max_grade'],
+                student_count=row['count_grade'],
+            )
+            for row in rows
+        ])
+
+
+class SequentialOpenDistribution(models.Model):
+    """
+    How many students of a course have opened a subsection (sequential), as
+    shown by the class dashboard.  Materialized from StudentModule like
+    ProblemGradeDistribution.
+    """
+    class Meta:
+        unique_together = (('course_id', 'module_state_key'),)
+
+    course_id = CourseKeyField(max_length=255, db_index=True)
+    module_state_key = LocationKeyField(max_length=255, db_index=True, db_column='module_id')
+    student_count = models.IntegerField(default=0)
+
+    @classmethod
+    def recompute(cls, course_id, usage_keys=None):
+        """
+        Recompute the open counts of the subsections in `usage_keys` (or of
+        every subsection in the course if None) from StudentModule.
+
+        Must run in the transaction of `ClassDashboardRefresh.refresh`.
+        """
+        student_modules = StudentModule.objects.filter(course_id=course_id, module_type='sequential')
+        distributions = cls.objects.filter(course_id=course_id)
+        if usage_keys is not None:
+            student_modules = student_modules.filter(module_state_key__in=usage_keys)
+            distributions = distributions.filter(module_state_key__in=usage_keys)
+        rows = student_modules.values('module_state_key').annotate(count_sequential=Count('module_state_key'))
+
+        distributions.delete()
+        cls.objects.bulk_create([
+            cls(
+                course_id=course_id,
+                module_state_key=row['module_state_key'],
+                student_count=row['count_sequential'],
+            )
+            for row in rows
+        ])
+
+
+class ClassDashboardRefresh(models.Model):
+    """
+    Up to when the materialized class dashboard distributions of a course
+    account for the changes to StudentModule.
+
+    Each refresh only recomputes the distributions of the problems and
+    subsections whose StudentModules were modified since the previous one,
+    which the index on `StudentModule.modified` finds quickly, or deleted
+    (see ClassDashboardStaleModule).
+
+    Refreshes only run from the `refresh_class_dashboard` command, never in
+    dashboard requests, and each holds the lock of its course's row, so
+    concurrent refreshes of a course run one after the other.
+    """
+    course_id = CourseKeyField(max_length=255, unique=True)
+    refreshed_up_to = models.DateTimeField()
+
+    # StudentModules may be saved with a `modified` time a little earlier than
+    # their transaction commits, so each refresh looks back this far.
+    OVERLAP = timedelta(minutes=5)
+
+    # Recompute the distributions of this many modules per query.
+    CHUNK_SIZE = 100
+
+    @classmethod
+    def is_refreshed(cls, course_id):
+        """
+        Whether the distributions of `course_id` have been materialized.
+        """
+        return cls.objects.filter(course_id=course_id).exists()
+
+    @classmethod
+    @transaction.commit_on_success
+    def refresh(cls, course_id, full=False):
+        """
+        Bring the distributions of `course_id` up to date, recomputing all of
+        them the first time or if `full` is true.
+
+        The whole refresh is a single transaction, which locks the row of the
+        course first.
+        """
+        now = datetime.now(UTC)
+        try:
+            course_refresh = cls.objects.select_for_update().get(course_id=course_id)
+        except cls.DoesNotExist:
+            savepoint = transaction.savepoint()
+            try:
+                course_refresh = cls.objects.create(course_id=course_id, refreshed_up_to=now)
+                transaction.savepoint_commit(savepoint)
+                full = True
+            except IntegrityError:
+                # Another first refresh of the course created its row, and
+                # recomputed all the distributions, once it committed
+                transaction.savepoint_rollback(savepoint)
+                course_refresh = cls.objects.select_for_update().get(course_id=course_id)
+
+        if full:
+            ClassDashboardStaleModule.objects.filter(course_id=course_id).delete()
+            ProblemGradeDistribution.recompute(course_id)
+            SequentialOpenDistribution.recompute(course_id)
+        else:
+            modified_modules = StudentModule.objects.filter(
+                course_id=course_id,
+                modified__gte=course_refresh.refreshed_up_to - cls.OVERLAP,
+                module_type__in=['problem', 'sequential'],
+            ).values_list('module_state_key', 'module_type').distinct()
+            cls._recompute_modules(course_id, modified_modules)
+            cls.recompute_stale(course_id)
+
+        course_refresh.refreshed_up_to = now
+        course_refresh.save()
+
+    @classmethod
+    def recompute_stale(cls, course_id):
+        """
+        Recompute the distributions of the modules of `course_id` whose
+        StudentModules were deleted since they were last computed.
+
+        Must run in the transaction of `refresh`.
+        """
+        stale_modules = list(ClassDashboardStaleModule.objects.filter(course_id=course_id).values_list(
+            'id', 'module_state_key', 'module_type'
+        ))
+        if not stale_modules:
+            return
+        # Deletions from now on mark their modules stale again
+        ClassDashboardStaleModule.objects.filter(id__in=[stale_id for stale_id, __, __ in stale_modules]).delete()
+        cls._recompute_modules(
+            course_id, [(module_state_key, module_type) for __, module_state_key, module_type in stale_modules]
+        )
+
+    @classmethod
+    def _recompute_modules(cls, course_id, modules):
+        """
+        Recompute the distributions of `modules`, (module_state_key, module_type) pairs.
+        """
+        usage_keys = {'problem': [], 'sequential': []}
+        for module_state_key, module_type in modules:
+            usage_keys[module_type].append(course_id.make_usage_key_from_deprecated_string(module_state_key))
+
+        for distribution, module_type in [(ProblemGradeDistribution, 'problem'),
+                                          (SequentialOpenDistribution, 'sequential')]:
+            keys = usage_keys[module_type]
+            for start in xrange(0, len(keys), cls.CHUNK_SIZE):
+                distribution.recompute(course_id, keys[start:start + cls.CHUNK_SIZE])
+
+
+class ClassDashboardStaleModule(models.Model):
+    """
+    A problem or subsection of a course whose StudentModules were deleted
+    since its class dashboard distribution was last computed.
+
+    Deleted StudentModules don't show up as modified, so their modules are
+    recorded here, and their distributions recomputed from StudentModule by
+    `ClassDashboardRefresh.recompute_stale`.
+    """
+    class Meta:
+        unique_together = (('course_id', 'module_state_key'),)
+
+    course_id = CourseKeyField(max_length=255, db_index=True)
+    module_state_key = LocationKeyField(max_length=255, db_column='module_id')
+    module_type = models.CharField(max_length=32)
+
+
+@receiver(post_delete, sender=StudentModule)
+def mark_deleted_module_stale(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Deleted StudentModules don't show up as modified, so mark the class
+    dashboard distribution they were counted in for recomputing.
+    """
+    if instance.module_type not in ('problem', 'sequential'):
+        return
+    ClassDashboardStaleModule.objects.get_or_create(
+        course_id=instance.course_id,
+        module_state_key=instance.module_state_key,
+        defaults={'module_type': instance.module_type},
+    )
+
+
 class XModuleUserStateSummaryField(models.Model):
     """
     Stores data set in the Scope.user_state_summary scope by an xmodule field
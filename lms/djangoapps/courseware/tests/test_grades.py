@@ -5,16 +5,21 @@ from django.http import Http404
 from django.test.utils import override_settings
 from mock import patch
 
+from django.test.client import RequestFactory
+
+from courseware.tests.factories import StudentModuleFactory
 from courseware.tests.modulestore_config import TEST_DATA_MIXED_MODULESTORE
 from student.tests.factories import UserFactory
-from xmodule.modulestore.tests.factories import CourseFactory
+from xmodule.modulestore.django import modulestore
+from xmodule.modulestore.tests.factories import CourseFactory, ItemFactory
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
 from opaque_keys.edx.locations import SlashSeparatedCourseKey
 
-from courseware.grades import grade, iterate_grades_for
+from courseware.grades import grade, iterate_grades_for, prefetch_student_modules
 
 
-def _grade_with_errors(student, request, course, keep_raw_scores=False):
+def _grade_with_errors(student, request, course, keep_raw_scores=False, student_module_cache=None,
+                       persisted_grades=None):
     """This fake grade method will throw exceptions for student3 and
     student4, but allow any other students to go through normal grading.
 
@@ -25,7 +30,10 @@ def _grade_with_errors(student, request, course, keep_raw_scores=False):
     if student.username in ['student3', 'student4']:
         raise Exception("I don't like {}".format(student.username))
 
-    return grade(student, request, course, keep_raw_scores=keep_raw_scores)
+    return grade(
+        student, request, course, keep_raw_scores=keep_raw_scores, student_module_cache=student_module_cache,
+        persisted_grades=persisted_grades
+    )
 
 
 @override_settings(MODULESTORE=TEST_DATA_MIXED_MODULESTORE)
@@ -121,3 +129,50 @@ class TestGradeIteration(ModuleStoreTestCase):
                 students_to_errors[student] = err_msg
 
         return students_to_gradesets, students_to_errors
+
+
+@override_settings(MODULESTORE=TEST_DATA_MIXED_MODULESTORE)
+class TestPrefetchedGrading(ModuleStoreTestCase):
+    """
+    Test grading students in bulk with prefetched StudentModules.
+    """
+    def setUp(self):
+        """
+        Create a course with one graded problem, answered by some students
+        """
+        self.course = CourseFactory.create()
+        chapter = ItemFactory.create(parent_location=self.course.location, category='chapter')
+        section = ItemFactory.create(
+            parent_location=chapter.location,
+            category='sequential',
+            metadata={'graded': True, 'format': 'Homework'}
+        )
+        self.problem = ItemFactory.create(parent_location=section.location, category='problem')
+        self.course = modulestore().get_course(self.course.id)
+
+        self.students = [UserFactory.create() for __ in range(4)]
+        for student, grade_value in zip(self.students, [0.0, 1.0]):
+            StudentModuleFactory.create(
+                student=student,
+                course_id=self.course.id,
+                module_state_key=self.problem.location,
+                grade=grade_value,
+                max_grade=1.0,
+            )
+
+    def test_prefetch_student_modules(self):
+        """Each student gets their own StudentModules, and only those."""
+        student_module_caches = prefetch_student_modules(self.course, self.students)
+        self.assertEqual(set(student_module_caches.keys()), set(student.id for student in self.students))
+        self.assertEqual(student_module_caches[self.students[0].id][self.problem.location].grade, 0.0)
+        self.assertEqual(student_module_caches[self.students[1].id][self.problem.location].grade, 1.0)
+        self.assertEqual(student_module_caches[self.students[2].id], {})
+
+    def test_prefetched_grades_match(self):
+        """Grading in chunks gives the same gradesets as grading one student at a time."""
+        request = RequestFactory().get('/')
+        request.session = {}
+        for student, gradeset, err_msg in iterate_grades_for(self.course.id, self.students, chunk_size=3):
+            self.assertEqual(err_msg, "")
+            request.user = student
+            self.assertEqual(gradeset, grade(student, request, self.course))
@@ -6,7 +6,7 @@ from mock import Mock, patch
 from functools import partial
 
 from courseware.model_data import DjangoKeyValueStore
-from courseware.model_data import InvalidScopeError, FieldDataCache
+from courseware.model_data import InvalidScopeError, FieldDataCache, MultiUserFieldDataCache
 from courseware.models import StudentModule
 from courseware.models import XModuleStudentInfoField, XModuleStudentPrefsField
 
@@ -339,3 +339,126 @@ class TestStudentInfoStorage(OtherUserFailureTestMixin, StorageTestBase, TestCas
     storage_class = XModuleStudentInfoField
     other_key_factory = partial(DjangoKeyValueStore.Key, Scope.user_info, 2, 'mock_problem')  # user_id=2, not 1
     existing_field_name = "existing_field"
+
+
+class TestWriteBehind(TestCase):
+    """Tests for coalescing the writes of a FieldDataCache"""
+
+    def setUp(self):
+        student_module = StudentModuleFactory(state=json.dumps({'a_field': 'a_value', 'b_field': 'b_value'}))
+        self.user = student_module.student
+        self.assertEqual(self.user.id, 1)   # check our assumption hard-coded in the key functions above.
+        self.field_data_cache = FieldDataCache([mock_descriptor([mock_field(Scope.user_state, 'a_field')])], course_id, self.user)
+        self.kvs = DjangoKeyValueStore(self.field_data_cache)
+
+    def test_saves_coalesced(self):
+        "Test that several saves of the same StudentModule are written with a single query"
+        # A single UPDATE of the row, plus the StudentModuleHistory entry of the problem
+        with self.assertNumQueries(2):
+            with self.field_data_cache.write_behind():
+                self.kvs.set(user_state_key('a_field'), 'new_value')
+                self.kvs.set(user_state_key('b_field'), 'other_value')
+                self.kvs.set_many({user_state_key('c_field'): 'new_field'})
+
+        self.assertEquals(
+            {'a_field': 'new_value', 'b_field': 'other_value', 'c_field': 'new_field'},
+            json.loads(StudentModule.objects.get().state)
+        )
+
+    def test_saves_written_at_end_of_block(self):
+        "Test that the saves are written once the write_behind block ends"
+        with self.field_data_cache.write_behind():
+            self.kvs.set(user_state_key('a_field'), 'new_value')
+            self.assertEquals('a_value', json.loads(StudentModule.objects.get().state)['a_field'])
+            # reads see the unwritten value
+            self.assertEquals('new_value', self.kvs.get(user_state_key('a_field')))
+
+        self.assertEquals('new_value', json.loads(StudentModule.objects.get().state)['a_field'])
+
+    def test_only_changed_columns_written(self):
+        "Test that flushing doesn't overwrite columns that weren't changed"
+        with self.field_data_cache.write_behind():
+            self.kvs.set(user_state_key('a_field'), 'new_value')
+            StudentModule.objects.update(grade=1)
+
+        student_module = StudentModule.objects.get()
+        self.assertEquals(1, student_module.grade)
+        self.assertEquals('new_value', json.loads(student_module.state)['a_field'])
+
+    def test_flush_failure(self):
+        "Test that a failed write is reported with the fields that were saved"
+        with patch('django.db.models.query.QuerySet.update', side_effect=DatabaseError):
+            with self.assertRaises(KeyValueMultiSaveError) as exception_context:
+                with self.field_data_cache.write_behind():
+                    self.kvs.set(user_state_key('a_field'), 'new_value')
+        self.assertEquals(len(exception_context.exception.saved_field_names), 0)
+
+    def test_state_decoded_once(self):
+        "Test that the state of a StudentModule is only decoded once"
+        with patch('courseware.model_data.json.loads', wraps=json.loads) as mock_loads:
+            self.kvs.get(user_state_key('a_field'))
+            self.kvs.get(user_state_key('b_field'))
+            self.kvs.has(user_state_key('c_field'))
+            self.kvs.set(user_state_key('c_field'), 'new_value')
+        self.assertEquals(mock_loads.call_count, 1)
+
+
+class TestMultiUserFieldDataCache(TestCase):
+    """Tests for loading the field data of several users at once"""
+
+    def setUp(self):
+        self.users = []
+        for index in range(3):
+            student_module = StudentModuleFactory(state=json.dumps({'a_field': 'value{}'.format(index)}))
+            self.users.append(student_module.student)
+            StudentPrefsFactory(student=student_module.student, value=json.dumps('pref{}'.format(index)))
+            StudentInfoFactory(student=student_module.student, value=json.dumps('info{}'.format(index)))
+        self.descriptor = mock_descriptor([
+            mock_field(Scope.user_state, 'a_field'),
+            mock_field(Scope.preferences, 'existing_field'),
+            mock_field(Scope.user_info, 'existing_field'),
+        ])
+
+    def test_queries_shared_by_users(self):
+        "Test that the data of all the users is loaded with a query per scope"
+        with self.assertNumQueries(3):
+            field_data_caches = MultiUserFieldDataCache([self.descriptor], course_id, self.users)
+
+        for index, user in enumerate(self.users):
+            kvs = DjangoKeyValueStore(field_data_caches.for_user(user))
+            with self.assertNumQueries(0):
+                self.assertEquals(
+                    'value{}'.format(index),
+                    kvs.get(DjangoKeyValueStore.Key(Scope.user_state, user.id, location('usage_id'), 'a_field'))
+                )
+                self.assertEquals(
+                    'pref{}'.format(index),
+                    kvs.get(DjangoKeyValueStore.Key(Scope.preferences, user.id, 'mock_problem', 'existing_field'))
+                )
+                self.assertEquals(
+                    'info{}'.format(index),
+                    kvs.get(DjangoKeyValueStore.Key(Scope.user_info, user.id, None, 'existing_field'))
+                )
+
+    def test_queries_chunked_across_users(self):
+        "Test that users are queried in chunks"
+        with patch.object(MultiUserFieldDataCache, 'user_chunk_size', 2):
+            with self.assertNumQueries(6):
+                MultiUserFieldDataCache([self.descriptor], course_id, self.users)
+
+    def test_user_without_data(self):
+        "Test that the cache of a user without any data is empty"
+        user = UserFactory.create()
+        field_data_caches = MultiUserFieldDataCache([self.descriptor], course_id, self.users + [user])
+        self.assertEquals({}, field_data_caches.for_user(user).cache)
+
+    def test_write_through_user_cache(self):
+        "Test that the cache of a user stores new field data like any FieldDataCache"
+        user = UserFactory.create()
+        field_data_caches = MultiUserFieldDataCache([self.descriptor], course_id, self.users + [user])
+        kvs = DjangoKeyValueStore(field_data_caches.for_user(user))
+        kvs.set(DjangoKeyValueStore.Key(Scope.user_state, user.id, location('usage_id'), 'a_field'), 'new_value')
+        self.assertEquals(
+            {'a_field': 'new_value'},
+            json.loads(StudentModule.objects.get(student=user, module_state_key=location('usage_id')).state)
+        )
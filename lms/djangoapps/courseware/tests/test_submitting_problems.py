@@ -17,7 +17,7 @@ from django.test.utils import override_settings
 
 # Need access to internal func to put users in the right group
 from courseware import grades
-from courseware.models import StudentModule
+from courseware.models import StudentModule, StudentSubsectionGrade
 
 from xmodule.modulestore.django import modulestore
 
@@ -598,6 +598,135 @@ class TestCourseGrader(TestSubmittingProblems):
         self.assertEqual(self.score_for_hw('homework3'), [1.0, 1.0])
 
 
+@patch.dict(settings.FEATURES, {'ENABLE_PERSISTENT_GRADES': True})
+class TestPersistentGrades(TestCourseGrader):
+    """
+    Run the course grader suite against persisted subsection grades, and
+    check that the persisted scores are used and invalidated correctly.
+    """
+
+    def persisted_grade(self, section):
+        """
+        Return the StudentSubsectionGrade of the current user for `section`, or None.
+        """
+        try:
+            return StudentSubsectionGrade.objects.get(
+                student=self.student_user, course_id=self.course.id, usage_key=section.location
+            )
+        except StudentSubsectionGrade.DoesNotExist:
+            return None
+
+    def test_scores_are_persisted(self):
+        """
+        Grading a section persists the score of each of its problems.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+
+        persisted_grade = self.persisted_grade(self.homework)
+        self.assertIsNotNone(persisted_grade)
+        self.assertEqual(
+            persisted_grade.get_scores(),
+            [[unicode(self.problem_location(name)), earned, 1.0] for name, earned in [('p1', 1.0), ('p2', 0.0), ('p3', 0.0)]]
+        )
+
+    def test_persisted_scores_skip_module_instantiation(self):
+        """
+        Persisted scores are graded without instantiating any module.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+
+        with patch('courseware.grades.get_module_for_descriptor') as mock_get_module:
+            self.check_grade_percent(0.33)
+            self.assertFalse(mock_get_module.called)
+
+    def test_persisted_scores_skip_student_state(self):
+        """
+        Persisted scores are graded without reading the student state.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+
+        with patch('courseware.grades.StudentModule') as mock_student_module:
+            self.check_grade_percent(0.33)
+            self.assertEqual(mock_student_module.mock_calls, [])
+
+    def test_grade_event_invalidates_section(self):
+        """
+        Answering a problem discards the persisted scores of its section.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+
+        version = self.persisted_grade(self.homework).version
+        self.submit_question_answer('p2', {'2_1': 'Correct'})
+        self.assertFalse(self.persisted_grade(self.homework).has_scores_for(version))
+        self.check_grade_percent(0.67)
+
+    def test_state_deletion_invalidates_section(self):
+        """
+        Deleting problem state discards the persisted scores.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+
+        version = self.persisted_grade(self.homework).version
+        StudentModule.objects.get(student=self.student_user, module_state_key=self.problem_location('p1')).delete()
+        self.assertFalse(self.persisted_grade(self.homework).has_scores_for(version))
+        self.check_grade_percent(0)
+
+    def test_scores_computed_before_invalidation_not_saved(self):
+        """
+        Scores computed from student state read before a concurrent submission are not saved.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+        persisted_grade = self.persisted_grade(self.homework)
+
+        # Grading read the row, then the submission invalidated it before the scores were saved
+        self.submit_question_answer('p2', {'2_1': 'Correct'})
+        StudentSubsectionGrade.save_scores(
+            self.student_user, self.course.id, self.homework.location, persisted_grade.version,
+            persisted_grade.get_scores(), persisted_grade.state_version
+        )
+        self.assertFalse(self.persisted_grade(self.homework).has_scores_for(persisted_grade.version))
+        self.check_grade_percent(0.67)
+
+    def test_first_scores_computed_before_invalidation_not_saved(self):
+        """
+        Scores computed before a concurrent submission are not saved, even if there was no row to invalidate.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.assertIsNotNone(self.persisted_grade(self.homework))
+
+        # Grading found no row, then the submission created one before the scores were saved
+        StudentSubsectionGrade.save_scores(
+            self.student_user, self.course.id, self.homework.location, 'version', [], None
+        )
+        self.assertFalse(self.persisted_grade(self.homework).has_scores_for('version'))
+        self.check_grade_percent(0.33)
+
+    def test_content_change_invalidates_section(self):
+        """
+        Adding a problem to a section makes its persisted scores stale.
+        """
+        self.basic_setup()
+        self.submit_question_answer('p1', {'2_1': 'Correct'})
+        self.check_grade_percent(0.33)
+
+        # A fourth problem changes the subsection's grading version
+        self.add_dropdown_to_section(self.homework.location, 'p4', 1)
+        self.check_grade_percent(0.25)
+
+
 class ProblemWithUploadedFilesTest(TestSubmittingProblems):
     """Tests of problems with uploaded files."""
 
@@ -0,0 +1,114 @@
+"""
+A Django command that measures the peak memory of storing a large synthetic
+grade report in the ReportStore, with its rows built in memory first, as grade
+reports did before, and with its rows streamed through `rows_writer()`.
+
+Each way runs in its own forked process, whose peak resident size is reported
+along with that of a process only generating the rows, e.g.:
+
+    ./manage.py lms benchmark_report_store --rows 200000 --settings devstack
+
+Reports go to a temporary LocalFSReportStore, unless --configured-store is
+given to use the store configured by GRADES_DOWNLOAD (e.g. S3).
+"""
+
+import os
+import shutil
+import tempfile
+from optparse import make_option
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+
+from instructor_task.models import ReportStore, LocalFSReportStore
+from opaque_keys.edx.locations import SlashSeparatedCourseKey
+
+COURSE_ID = SlashSeparatedCourseKey('edX', 'report_benchmark', 'synthetic')
+
+# The number of graded sections of the synthetic report
+NUM_SECTIONS = 20
+
+
+def report_rows(num_rows):
+    """
+    Yield the header and `num_rows` rows of a synthetic grade report.
+    """
+    yield ["id", "email", "username", "grade"] + ["HW {0:02d}".format(index) for index in range(NUM_SECTIONS)]
+    for index in xrange(num_rows):
+        username = "learner{0}".format(index)
+        yield [index, username + "@example.com", username, 0.5] + [0.25 * (index % 5)] * NUM_SECTIONS
+
+
+def generate_only(report_store, num_rows):
+    """Generate the rows without storing them."""
+    for __ in report_rows(num_rows):
+        pass
+
+
+def store_in_memory(report_store, num_rows):
+    """Build the list of rows, then store it."""
+    report_store.store_rows(COURSE_ID, "in_memory.csv", list(report_rows(num_rows)))
+
+
+def store_streamed(report_store, num_rows):
+    """Stream the rows to the store as they are generated."""
+    with report_store.rows_writer(COURSE_ID, "streamed.csv") as writer:
+        for row in report_rows(num_rows):
+            writer.writerow(row)
+
+
+def peak_memory(run, report_store, num_rows):
+    """
+    Return the peak resident size in MB of a forked process calling
+    `run(report_store, num_rows)`.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run(report_store, num_rows)
+        except Exception:  # pylint: disable=broad-except
+            status = 1
+        os._exit(status)  # pylint: disable=protected-access
+
+    __, status, rusage = os.wait4(pid, 0)
+    if status != 0:
+        raise CommandError("{0} failed".format(run.__name__))
+    # ru_maxrss is in kilobytes on Linux
+    return rusage.ru_maxrss / 1024.0
+
+
+class Command(BaseCommand):
+    """
+    Measure the peak memory of storing a large grade report with its rows in
+    memory and streamed.
+    """
+    help = dedent(__doc__).strip()
+    option_list = BaseCommand.option_list + (
+        make_option('--rows',
+                    action='store',
+                    type='int',
+                    default=200000,
+                    help='How many rows the report has'),
+        make_option('--configured-store',
+                    action='store_true',
+                    default=False,
+                    help='Store the reports in the configured ReportStore'),
+    )
+
+    def handle(self, *args, **options):
+        root_path = None
+        if options['configured_store']:
+            report_store = ReportStore.from_config()
+        else:
+            root_path = tempfile.mkdtemp()
+            report_store = LocalFSReportStore(root_path)
+
+        try:
+            for run in [generate_only, store_in_memory, store_streamed]:
+                self.stdout.write(u"{0}: {1:.1f} MB peak\n".format(
+                    run.__doc__.rstrip('.'), peak_memory(run, report_store, options['rows'])
+                ))
+        finally:
+            if root_path is not None:
+                shutil.rmtree(root_path)
@@ -12,6 +12,7 @@ file and check it in at the same time as your model changes. To do that,
 ASSUMPTIONS: modules have unique IDs, even across different module_types
 
 """
+from contextlib import contextmanager
 from cStringIO import StringIO
 from gzip import GzipFile
 from uuid import uuid4
@@ -193,10 +194,16 @@ class InstructorTask(models.Model):
 class ReportStore(object):
     """
     Simple abstraction layer that can fetch and store CSV files for reports
-    download. Should probably refactor later to create a ReportFile object that
-    can simply be appended to for the sake of memory efficiency, rather than
-    passing in the whole dataset. Doing that for now just because it's simpler.
+    download. Large reports should be written through `rows_writer()`, which
+    streams rows to storage as they are produced instead of holding the whole
+    dataset in memory; `store_rows()` accepts any iterable (including a
+    generator) of rows and writes it the same way.
+
+    Files whose names end in `PARTIAL_SUFFIX` are pieces of a report still
+    being generated; they are not listed by `links_for()`.
     """
+    PARTIAL_SUFFIX = '.partial'
+
     @classmethod
     def from_config(cls):
         """
@@ -295,21 +302,57 @@ class S3ReportStore(ReportStore):
             }
         )
 
+    @contextmanager
+    def rows_writer(self, course_id, filename):
+        """
+        Context manager yielding a csv writer whose rows are gzip'd and
+        uploaded to the file `filename` of `course_id` as they are written,
+        using an S3 multipart upload. At most one part is buffered in memory at
+        any time, and the file only becomes visible once the block exits
+        cleanly; the upload is cancelled if it raises.
+        """
+        key = self.key_for(course_id, filename)
+        upload = self.bucket.initiate_multipart_upload(
+            key.key,
+            headers={
+                "Content-Encoding": "gzip",
+                "Content-Type": "text/csv",
+            }
+        )
+        try:
+            part_writer = MultipartUploadWriter(upload)
+            gzip_file = GzipFile(fileobj=part_writer, mode="wb")
+            yield csv.writer(gzip_file)
+            gzip_file.close()
+            part_writer.close()
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+
     def store_rows(self, course_id, filename, rows):
         """
         Given a `course_id`, `filename`, and `rows` (each row is an iterable of
-        strings), create a buffer that is a gzip'd csv file, and then `store()`
-        that buffer.
+        strings), stream the rows into a gzip'd csv file using `rows_writer()`.
 
         Even though we store it in gzip format, browsers will transparently
         download and decompress it. Filenames should end in `.csv`, not `.gz`.
         """
-        output_buffer = StringIO()
-        gzip_file = GzipFile(fileobj=output_buffer, mode="wb")
-        csv.writer(gzip_file).writerows(rows)
-        gzip_file.close()
+        with self.rows_writer(course_id, filename) as writer:
+            writer.writerows(rows)
 
-        self.store(course_id, filename, output_buffer)
+    def read_rows(self, course_id, filename):
+        """
+        Return the rows of the csv file `filename` stored by `store_rows()`
+        for `course_id`, as lists of strings.
+        """
+        key = self.key_for(course_id, filename)
+        gzip_file = GzipFile(fileobj=StringIO(key.get_contents_as_string()), mode="rb")
+        return list(csv.reader(gzip_file))
+
+    def delete(self, course_id, filename):
+        """Delete the file `filename` stored for `course_id`."""
+        self.key_for(course_id, filename).delete()
 
     def links_for(self, course_id):
         """
@@ -321,11 +364,48 @@ class S3ReportStore(ReportStore):
             [
                 (key.key.split("/")[-1], key.generate_url(expires_in=300))
                 for key in self.bucket.list(prefix=course_dir.key)
+                if not key.key.endswith(self.PARTIAL_SUFFIX)
             ],
             reverse=True
         )
 
 
+class MultipartUploadWriter(object):
+    """
+    Write-only file-like object that uploads the data written to it as the
+    parts of an S3 multipart upload, buffering only one part at a time.
+    """
+    # S3 rejects parts smaller than this, except for the last one
+    PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.part_num = 0
+        self.buff = StringIO()
+
+    def write(self, data):
+        """Buffer `data`, uploading a part whenever enough has been written."""
+        self.buff.write(data)
+        if self.buff.tell() >= self.PART_SIZE:
+            self._upload_part()
+
+    def flush(self):
+        """Parts are only uploaded once they are big enough, see `write()`."""
+        pass
+
+    def close(self):
+        """Upload whatever is left as the last part of the upload."""
+        if self.buff.tell() or not self.part_num:
+            self._upload_part()
+
+    def _upload_part(self):
+        """Upload the buffered data as the next part, and start a new buffer."""
+        self.part_num += 1
+        self.buff.seek(0)
+        self.upload.upload_part_from_file(self.buff, self.part_num)
+        self.buff = StringIO()
+
+
 class LocalFSReportStore(ReportStore):
     """
     LocalFS implementation of a ReportStore. This is meant for debugging
@@ -363,29 +443,65 @@ class LocalFSReportStore(ReportStore):
         """Return the full path to a given file for a given course."""
         return os.path.join(self.root_path, urllib.quote(course_id.to_deprecated_string(), safe=''), filename)
 
-    def store(self, course_id, filename, buff):
+    def _prepare_path(self, course_id, filename):
         """
-        Given the `course_id` and `filename`, store the contents of `buff` in
-        that file. Overwrite anything that was there previously. `buff` is
-        assumed to be a StringIO objecd (or anything that can flush its contents
-        to string using `.getvalue()`).
+        Return the full path to `filename` for `course_id`, creating the
+        course directory if it doesn't exist yet.
         """
         full_path = self.path_to(course_id, filename)
         directory = os.path.dirname(full_path)
         if not os.path.exists(directory):
             os.mkdir(directory)
+        return full_path
 
+    def store(self, course_id, filename, buff):
+        """
+        Given the `course_id` and `filename`, store the contents of `buff` in
+        that file. Overwrite anything that was there previously. `buff` is
+        assumed to be a StringIO objecd (or anything that can flush its contents
+        to string using `.getvalue()`).
+        """
+        full_path = self._prepare_path(course_id, filename)
         with open(full_path, "wb") as f:
             f.write(buff.getvalue())
 
+    @contextmanager
+    def rows_writer(self, course_id, filename):
+        """
+        Context manager yielding a csv writer that appends rows to the file
+        `filename` of `course_id` as they are written. Rows go to a partial
+        file that is renamed into place once the block exits cleanly, and
+        removed if it raises.
+        """
+        full_path = self._prepare_path(course_id, filename)
+        partial_path = full_path + self.PARTIAL_SUFFIX
+        try:
+            with open(partial_path, "wb") as f:
+                yield csv.writer(f)
+        except Exception:
+            os.remove(partial_path)
+            raise
+        os.rename(partial_path, full_path)
+
     def store_rows(self, course_id, filename, rows):
         """
         Given a course_id, filename, and rows (each row is an iterable of strings),
         write this data out.
         """
-        output_buffer = StringIO()
-        csv.writer(output_buffer).writerows(rows)
-        self.store(course_id, filename, output_buffer)
+        with self.rows_writer(course_id, filename) as writer:
+            writer.writerows(rows)
+
+    def read_rows(self, course_id, filename):
+        """
+        Return the rows of the csv file `filename` stored by `store_rows()`
+        for `course_id`, as lists of strings.
+        """
+        with open(self.path_to(course_id, filename), "rb") as f:
+            return list(csv.reader(f))
+
+    def delete(self, course_id, filename):
+        """Delete the file `filename` stored for `course_id`."""
+        os.remove(self.path_to(course_id, filename))
 
     def links_for(self, course_id):
         """
@@ -402,6 +518,7 @@ class LocalFSReportStore(ReportStore):
             [
                 (filename, ("file://" + urllib.quote(os.path.join(course_dir, filename))))
                 for filename in os.listdir(course_dir)
+                if not filename.endswith(self.PARTIAL_SUFFIX)
             ],
             reverse=True
         )
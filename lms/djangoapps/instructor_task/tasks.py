@@ -28,9 +28,13 @@ from instructor_task.tasks_helper import (
     BaseInstructorTask,
     perform_module_state_update,
     rescore_problem_module_state,
+    rescore_problem_module_states,
+    delegate_rescore_shards,
+    perform_rescore_shard,
     reset_attempts_module_state,
     delete_problem_module_state,
     push_grades_to_s3,
+    generate_grade_report_shard,
 )
 from bulk_email.tasks import perform_delegate_email_batches
 
@@ -53,6 +57,11 @@ def rescore_problem(entry_id, xmodule_instance_args):
 
     `xmodule_instance_args` provides information needed by _get_module_instance_for_task()
     to instantiate an xmodule instance.
+
+    Submissions are rescored in batches, without instantiating an xmodule instance per
+    student where possible (see BulkProblemRescorer).  If there are more than
+    `settings.MODULE_STATE_UPDATE_STUDENTS_PER_TASK` of them, they are rescored in
+    parallel by `rescore_problem_shard` subtasks.
     """
     # Translators: This is a past-tense verb that is inserted into task progress messages as {action}.
     action_name = ugettext_noop('rescored')
@@ -62,10 +71,26 @@ def rescore_problem(entry_id, xmodule_instance_args):
         """Filter that matches problems which are marked as being done"""
         return modules_to_update.filter(state__contains='"done": true')
 
-    visit_fcn = partial(perform_module_state_update, update_fcn, filter_fcn)
+    visit_fcn = partial(
+        perform_module_state_update, update_fcn, filter_fcn,
+        batch_update_fcn=partial(rescore_problem_module_states, xmodule_instance_args),
+        delegate_fcn=partial(delegate_rescore_shards, xmodule_instance_args),
+    )
     return run_main_task(entry_id, visit_fcn, action_name)
 
 
+@task  # pylint: disable=E1102
+def rescore_problem_shard(entry_id, xmodule_instance_args, module_ids, subtask_status_dict):
+    """
+    Rescore the submissions in the StudentModules with ids in `module_ids` as a subtask of
+    `rescore_problem`.
+
+    `entry_id` is the id of the InstructorTask entry of the parent task, to which progress is
+    reported.  `subtask_status_dict` is the initial SubtaskStatus of this subtask.
+    """
+    return perform_rescore_shard(xmodule_instance_args, entry_id, module_ids, subtask_status_dict)
+
+
 @task(base=BaseInstructorTask)  # pylint: disable=E1102
 def reset_problem_attempts(entry_id, xmodule_instance_args):
     """Resets problem attempts to zero for a particular problem for all students in a course.
@@ -139,3 +164,18 @@ def calculate_grades_csv(entry_id, xmodule_instance_args):
     action_name = ugettext_noop('graded')
     task_fn = partial(push_grades_to_s3, xmodule_instance_args)
     return run_main_task(entry_id, task_fn, action_name)
+
+
+@task(routing_key=settings.GRADES_DOWNLOAD_ROUTING_KEY)  # pylint: disable=E1102
+def calculate_grades_csv_shard(entry_id, shard_index, student_ids, report_filename, err_filename, subtask_status_dict):
+    """
+    Grade one range of the students of a course as a subtask of `calculate_grades_csv`.
+
+    `entry_id` is the id of the InstructorTask entry of the parent task, to which progress is
+    reported.  The rows of the students with ids in `student_ids` are stored as partial file
+    `shard_index` of `report_filename` (and `err_filename`), and merged into the final report
+    once all shards are done.  `subtask_status_dict` is the initial SubtaskStatus of this subtask.
+    """
+    return generate_grade_report_shard(
+        entry_id, shard_index, student_ids, report_filename, err_filename, subtask_status_dict
+    )
@@ -3,28 +3,43 @@ This file contains tasks that are designed to perform background operations on t
 running state of a course.
 
 """
+import copy
 import json
+import traceback
 import urllib
 from datetime import datetime
+from itertools import count, islice
 from time import time
 
 from celery import Task, current_task
 from celery.utils.log import get_task_logger
 from celery.states import SUCCESS, FAILURE
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import transaction, reset_queries
+from django.db import connection, transaction, reset_queries, DatabaseError
 from dogapi import dog_stats_api
 from pytz import UTC
 
-from xmodule.modulestore.django import modulestore
+from capa.capa_problem import LoncapaProblem, LoncapaSystem
+from capa.responsetypes import StudentInputError, ResponseError, LoncapaProblemError
+from xmodule.capa_base import PROBLEM_TEMPLATE_CACHE, unmask_event
+from xmodule.modulestore.django import modulestore, ModuleI18nService
 from track.views import task_track
 
-from courseware.grades import iterate_grades_for
-from courseware.models import StudentModule
-from courseware.model_data import FieldDataCache
-from courseware.module_render import get_module_for_descriptor_internal
+from courseware.grades import iterate_grades_for, invalidate_subsection_grades_for_students
+from courseware.models import StudentModule, StudentModuleHistory
+from courseware.model_data import FieldDataCache, MultiUserFieldDataCache
+from courseware.module_render import get_module_for_descriptor_internal, get_score_bucket
+from edxmako.shortcuts import render_to_string
 from instructor_task.models import ReportStore, InstructorTask, PROGRESS
-from student.models import CourseEnrollment
+from instructor_task.subtasks import (
+    SubtaskStatus,
+    queue_subtasks_for_query,
+    check_subtask_is_valid,
+    update_subtask_status,
+)
+from student.models import CourseEnrollment, anonymous_id_for_user
+from util.sandboxing import can_execute_unsafe_code, get_safe_exec_cache
 
 # define different loggers for use within tasks and on client side
 TASK_LOG = get_task_logger(__name__)
@@ -207,7 +222,20 @@ def run_main_task(entry_id, task_fcn, action_name):
     return task_progress
 
 
-def perform_module_state_update(update_fcn, filter_fcn, _entry_id, course_id, task_input, action_name):
+def _batches(iterable, batch_size):
+    """
+    Yields the values from iterable in lists of size batch_size, without loading them all at once.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def perform_module_state_update(update_fcn, filter_fcn, entry_id, course_id, task_input, action_name,
+                                prefetch_field_data=False, batch_update_fcn=None, delegate_fcn=None):
     """
     Performs generic update by visiting StudentModule instances with the update_fcn provided.
 
@@ -225,6 +253,17 @@ def perform_module_state_update(update_fcn, filter_fcn, _entry_id, course_id, ta
     the update is successful; False indicates the update on the particular student module failed.
     A raised exception indicates a fatal condition -- that no other student modules should be considered.
 
+    If `prefetch_field_data` is True, the field data of the students is loaded for a whole batch of
+    StudentModules at once, and the `update_fcn` is passed the FieldDataCache of the student as
+    the `field_data_cache` keyword argument.
+
+    If `batch_update_fcn` is not None, it is called instead of the `update_fcn` with the module_descriptor
+    and a whole batch of StudentModules, and returns the list of their update statuses, in order.
+
+    If `delegate_fcn` is not None and there are more than `settings.MODULE_STATE_UPDATE_STUDENTS_PER_TASK`
+    StudentModules to update for all students, the update is split into subtasks instead: `delegate_fcn` is
+    called with `entry_id`, the query for the StudentModules and `action_name`, and queues them.
+
     The return value is a dict containing the task's results, with the following keys:
 
           'attempted': number of attempts made
@@ -277,6 +316,9 @@ def perform_module_state_update(update_fcn, filter_fcn, _entry_id, course_id, ta
     num_failed = 0
     num_total = modules_to_update.count()
 
+    if delegate_fcn is not None and student is None and num_total > settings.MODULE_STATE_UPDATE_STUDENTS_PER_TASK:
+        return delegate_fcn(entry_id, modules_to_update, action_name)
+
     def get_task_progress():
         """Return a dict containing info about current task"""
         current_time = time()
@@ -290,14 +332,39 @@ def perform_module_state_update(update_fcn, filter_fcn, _entry_id, course_id, ta
                     }
         return progress
 
+    def update_each(modules_batch):
+        """Yields the update status of each StudentModule of the batch, as it is updated."""
+        if prefetch_field_data:
+            field_data_caches = MultiUserFieldDataCache.cache_for_descriptor_descendents(
+                course_id, [module_to_update.student for module_to_update in modules_batch], module_descriptor
+            )
+
+        for module_to_update in modules_batch:
+            # There is no try here:  if there's an error, we let it throw, and the task will
+            # be marked as FAILED, with a stack trace.
+            with dog_stats_api.timer('instructor_tasks.module.time.step', tags=[u'action:{name}'.format(name=action_name)]):
+                if prefetch_field_data:
+                    update_status = update_fcn(
+                        module_descriptor, module_to_update,
+                        field_data_cache=field_data_caches.for_user(module_to_update.student)
+                    )
+                else:
+                    update_status = update_fcn(module_descriptor, module_to_update)
+            yield update_status
+
     task_progress = get_task_progress()
     _get_current_task().update_state(state=PROGRESS, meta=task_progress)
-    for module_to_update in modules_to_update:
-        num_attempted += 1
-        # There is no try here:  if there's an error, we let it throw, and the task will
-        # be marked as FAILED, with a stack trace.
-        with dog_stats_api.timer('instructor_tasks.module.time.step', tags=[u'action:{name}'.format(name=action_name)]):
-            update_status = update_fcn(module_descriptor, module_to_update)
+    modules_to_update = modules_to_update.select_related('student').iterator()
+    for modules_batch in _batches(modules_to_update, settings.MODULE_STATE_UPDATE_BATCH_SIZE):
+        if batch_update_fcn is not None:
+            batch_tags = [u'action:{name}'.format(name=action_name)]
+            with dog_stats_api.timer('instructor_tasks.module.time.batch', tags=batch_tags):
+                update_statuses = batch_update_fcn(module_descriptor, modules_batch)
+        else:
+            update_statuses = update_each(modules_batch)
+
+        for update_status in update_statuses:
+            num_attempted += 1
             if update_status == UPDATE_STATUS_SUCCEEDED:
                 # If the update_fcn returns true, then it performed some kind of work.
                 # Logging of failures is left to the update_fcn itself.
@@ -309,9 +376,14 @@ def perform_module_state_update(update_fcn, filter_fcn, _entry_id, course_id, ta
             else:
                 raise UpdateProblemModuleStateError("Unexpected update_status returned: {}".format(update_status))
 
-        # update task status:
-        task_progress = get_task_progress()
-        _get_current_task().update_state(state=PROGRESS, meta=task_progress)
+            # update task status (once per batch when updating whole batches):
+            if batch_update_fcn is None:
+                task_progress = get_task_progress()
+                _get_current_task().update_state(state=PROGRESS, meta=task_progress)
+
+        if batch_update_fcn is not None:
+            task_progress = get_task_progress()
+            _get_current_task().update_state(state=PROGRESS, meta=task_progress)
 
     return task_progress
 
@@ -343,16 +415,19 @@ def _get_track_function_for_task(student, xmodule_instance_args=None, source_pag
 
 
 def _get_module_instance_for_task(course_id, student, module_descriptor, xmodule_instance_args=None,
-                                  grade_bucket_type=None):
+                                  grade_bucket_type=None, field_data_cache=None):
     """
     Fetches a StudentModule instance for a given `course_id`, `student` object, and `module_descriptor`.
 
     `xmodule_instance_args` is used to provide information for creating a track function and an XQueue callback.
     These are passed, along with `grade_bucket_type`, to get_module_for_descriptor_internal, which sidesteps
     the need for a Request object when instantiating an xmodule instance.
+
+    `field_data_cache` is the FieldDataCache of the student, if it has already been loaded.
     """
     # reconstitute the problem's corresponding XModule:
-    field_data_cache = FieldDataCache.cache_for_descriptor_descendents(course_id, student, module_descriptor)
+    if field_data_cache is None:
+        field_data_cache = FieldDataCache.cache_for_descriptor_descendents(course_id, student, module_descriptor)
 
     # get request-related tracking information from args passthrough, and supplement with task-specific
     # information:
@@ -378,10 +453,11 @@ def _get_module_instance_for_task(course_id, student, module_descriptor, xmodule
 
 
 @transaction.autocommit
-def rescore_problem_module_state(xmodule_instance_args, module_descriptor, student_module):
+def rescore_problem_module_state(xmodule_instance_args, module_descriptor, student_module, field_data_cache=None):
     '''
     Takes an XModule descriptor and a corresponding StudentModule object, and
-    performs rescoring on the student's problem submission.
+    performs rescoring on the student's problem submission. `field_data_cache` is
+    the FieldDataCache of the student, if it has already been loaded.
 
     Throws exceptions if the rescoring is fatal and should be aborted if in a loop.
     In particular, raises UpdateProblemModuleStateError if module fails to instantiate,
@@ -394,7 +470,8 @@ def rescore_problem_module_state(xmodule_instance_args, module_descriptor, stude
     course_id = student_module.course_id
     student = student_module.student
     usage_key = student_module.module_state_key
-    instance = _get_module_instance_for_task(course_id, student, module_descriptor, xmodule_instance_args, grade_bucket_type='rescore')
+    instance = _get_module_instance_for_task(course_id, student, module_descriptor, xmodule_instance_args,
+                                             grade_bucket_type='rescore', field_data_cache=field_data_cache)
 
     if instance is None:
         # Either permissions just changed, or someone is trying to be clever
@@ -427,6 +504,334 @@ def rescore_problem_module_state(xmodule_instance_args, module_descriptor, stude
         return UPDATE_STATUS_SUCCEEDED
 
 
+class BulkProblemRescorer(object):
+    """
+    Rescores the submissions of many students to a capa problem, without
+    instantiating the XModule of each student: that loads the field data of
+    the student, and saves the StudentModule once for its state and once for
+    its grade.
+
+    The problem is built from its definition and the stored state alone, and
+    the students sharing a seed share the problem parsed (and the scripts run)
+    for the first of them, through the problem template cache of capa.  The
+    new states and grades of a batch of students are saved all at once, but
+    for those whose StudentModule changed in the meantime, which are rescored
+    again like the submissions below.
+
+    Submissions this can't rescore the way the XModule would, e.g. those
+    without a seed or to problems that don't support rescoring, are rescored
+    by `rescore_problem_module_state` instead, which reports any problem.
+    """
+    def __init__(self, module_descriptor, xmodule_instance_args=None):
+        self.descriptor = module_descriptor
+        self.xmodule_instance_args = xmodule_instance_args
+        # Looking up the anonymous id of a student costs a query, so it's only
+        # done for problems whose scripts may use it.
+        data = module_descriptor.data
+        self.uses_anonymous_id = 'anonymous_student_id' in data or '<include' in data
+
+    def rescore(self, student_modules):
+        """
+        Rescores the `student_modules`, then saves them at once.  Returns the
+        update status of each of them, in order.
+        """
+        states = {
+            student_module.id: json.loads(student_module.state) if student_module.state else {}
+            for student_module in student_modules
+        }
+        update_statuses = {}
+        rescored = []
+        try:
+            # Rescore the students with the same seed one after the other,
+            # while the problem they share is cached.
+            for student_module in sorted(student_modules, key=lambda module: states[module.id].get('seed')):
+                update_status = self._rescore_module(student_module, states[student_module.id])
+                if update_status is None:
+                    update_status = rescore_problem_module_state(
+                        self.xmodule_instance_args, self.descriptor, student_module
+                    )
+                elif update_status == UPDATE_STATUS_SUCCEEDED:
+                    rescored.append(student_module)
+                update_statuses[student_module.id] = update_status
+        finally:
+            # Even if a submission couldn't be rescored, keep the new scores
+            # of the others, as the XModules would have.
+            lost = save_rescored_modules(rescored)
+
+        # The submissions that changed while they were rescored are rescored
+        # again from their current state, one at a time.
+        for student_module in lost:
+            try:
+                current_module = StudentModule.objects.select_related('student').get(pk=student_module.pk)
+            except StudentModule.DoesNotExist:
+                update_statuses[student_module.id] = UPDATE_STATUS_SKIPPED
+                continue
+            update_statuses[student_module.id] = rescore_problem_module_state(
+                self.xmodule_instance_args, self.descriptor, current_module
+            )
+        return [update_statuses[student_module.id] for student_module in student_modules]
+
+    def _new_lcp(self, student, state):
+        """
+        Builds the problem of `student`, in the given `state`.
+        """
+        course_id = self.descriptor.location.course_key
+        capa_system = LoncapaSystem(
+            ajax_url=None,
+            anonymous_student_id=anonymous_id_for_user(student, None) if self.uses_anonymous_id else None,
+            cache=get_safe_exec_cache(),
+            can_execute_unsafe_code=lambda: can_execute_unsafe_code(course_id),
+            DEBUG=settings.DEBUG,
+            filestore=self.descriptor.runtime.resources_fs,
+            i18n=ModuleI18nService(),
+            node_path=settings.NODE_PATH,
+            render_template=render_to_string,
+            seed=student.id,
+            STATIC_URL=settings.STATIC_URL,
+            xqueue=None,
+            matlab_api_key=self.descriptor.matlab_api_key,
+            problem_cache=PROBLEM_TEMPLATE_CACHE,
+        )
+        return LoncapaProblem(
+            problem_text=self.descriptor.data,
+            id=self.descriptor.location.html_id(),
+            state=state,
+            seed=state['seed'],
+            capa_system=capa_system,
+        )
+
+    def _rescore_module(self, student_module, state):
+        """
+        Rescores the submission stored in `student_module`, as the
+        `rescore_problem` of the XModule does, and updates its state and
+        grade without saving them.
+
+        Returns the update status, or None if the XModule must rescore it.
+        """
+        if state.get('seed') is None or not state.get('done'):
+            return None
+        if settings.FEATURES.get('ENABLE_PSYCHOMETRICS'):
+            # Only the XModule updates the psychometrics data.
+            return None
+
+        student = student_module.student
+        try:
+            lcp = self._new_lcp(student, state)
+        except Exception:  # pylint: disable=broad-except
+            # e.g. the problem needs an XQueue, which can't be rescored
+            return None
+        if not lcp.supports_rescoring():
+            return None
+
+        track_function = _get_track_function_for_task(student, self.xmodule_instance_args)
+
+        def track_function_unmask(event_type, event_info):
+            """Tracks a copy of the event_info, with the choice names unmasked."""
+            event_unmasked = copy.deepcopy(event_info)
+            unmask_event(lcp, event_unmasked)
+            track_function(event_type, event_unmasked)
+
+        course_id = student_module.course_id
+        usage_key = student_module.module_state_key
+        event_info = {'state': lcp.get_state(), 'problem_id': usage_key.to_deprecated_string()}
+        orig_score = lcp.get_score()
+        event_info['orig_score'] = orig_score['score']
+        event_info['orig_total'] = orig_score['total']
+
+        try:
+            correct_map = lcp.rescore_existing_answers()
+        except (StudentInputError, ResponseError, LoncapaProblemError) as inst:
+            event_info['failure'] = 'input_error'
+            track_function_unmask('problem_rescore_fail', event_info)
+            TASK_LOG.warning(u"error processing rescore call for course {course}, problem {loc} and student {student}: "
+                             u"{msg}".format(msg=inst.message, course=course_id, loc=usage_key, student=student))
+            return UPDATE_STATUS_FAILED
+        except Exception:
+            event_info['failure'] = 'unexpected'
+            track_function_unmask('problem_rescore_fail', event_info)
+            if settings.DEBUG:
+                TASK_LOG.exception(u"error processing rescore call for course {course}, problem {loc} and student "
+                                   u"{student}".format(course=course_id, loc=usage_key, student=student))
+                return UPDATE_STATUS_FAILED
+            raise
+
+        # rescoring has no effect on attempts, nor on being done
+        state.update(lcp.get_state())
+        new_score = lcp.get_score()
+        student_module.state = json.dumps(state)
+        student_module.grade = new_score['score']
+        student_module.max_grade = new_score['total']
+
+        success = 'correct'
+        for answer_id in correct_map:
+            if not correct_map.is_correct(answer_id):
+                success = 'incorrect'
+
+        event_info['new_score'] = new_score['score']
+        event_info['new_total'] = new_score['total']
+        event_info['correct_map'] = correct_map.get_dict()
+        event_info['success'] = success
+        event_info['attempts'] = state.get('attempts', 0)
+        track_function_unmask('problem_rescore', event_info)
+
+        tags = [
+            u"org:{}".format(course_id.org),
+            u"course:{}".format(course_id),
+            u"score_bucket:{0}".format(get_score_bucket(student_module.grade, student_module.max_grade)),
+            u"type:rescore",
+        ]
+        dog_stats_api.increment("lms.courseware.question_answered", tags=tags)
+
+        TASK_LOG.debug(u"successfully processed rescore call for course {course}, problem {loc} and student {student}: "
+                       u"{msg}".format(msg=success, course=course_id, loc=usage_key, student=student))
+        return UPDATE_STATUS_SUCCEEDED
+
+
+def save_rescored_modules(student_modules):
+    """
+    Saves the new state and grade of each of the rescored `student_modules`
+    in a single transaction, records their history, and discards the
+    persisted subsection grades of their students, all at once.
+
+    A StudentModule is only saved if its row wasn't modified since it was
+    read, e.g. by the student submitting again while it was rescored.
+    Returns the StudentModules which weren't saved for that reason.
+    """
+    if not student_modules:
+        return []
+
+    modified = datetime.now(UTC)
+    modified_field = StudentModule._meta.get_field('modified')  # pylint: disable=protected-access
+    db_modified = modified_field.get_db_prep_value(modified, connection)
+    sql = (
+        "UPDATE {table} SET state = %s, grade = %s, max_grade = %s, modified = %s WHERE id = %s AND modified = %s"
+    ).format(
+        table=connection.ops.quote_name(StudentModule._meta.db_table)  # pylint: disable=protected-access
+    )
+
+    # Django doesn't update rows to different values in bulk, nor does
+    # bulk_create send the post_save signal recording the history.
+    saved = []
+    lost = []
+    with transaction.commit_on_success():
+        cursor = connection.cursor()
+        for student_module in student_modules:
+            cursor.execute(sql, (
+                student_module.state, student_module.grade, student_module.max_grade, db_modified,
+                student_module.id, modified_field.get_db_prep_value(student_module.modified, connection),
+            ))
+            if cursor.rowcount == 1:
+                saved.append(student_module)
+            else:
+                lost.append(student_module)
+
+        history_entries = []
+        for student_module in saved:
+            student_module.modified = modified
+            if student_module.module_type in StudentModuleHistory.HISTORY_SAVING_TYPES:
+                history_entries.append(StudentModuleHistory(
+                    student_module=student_module,
+                    version=None,
+                    created=modified,
+                    state=student_module.state,
+                    grade=student_module.grade,
+                    max_grade=student_module.max_grade,
+                ))
+        StudentModuleHistory.objects.bulk_create(history_entries)
+
+    if saved:
+        first_module = saved[0]
+        invalidate_subsection_grades_for_students(
+            [student_module.student_id for student_module in saved],
+            first_module.course_id,
+            first_module.module_state_key,
+        )
+    return lost
+
+
+def rescore_problem_module_states(xmodule_instance_args, module_descriptor, student_modules):
+    """
+    Rescores the submissions stored in a batch of `student_modules` to the
+    problem `module_descriptor` at once (see `BulkProblemRescorer`).
+
+    Returns the update status of each StudentModule, in order.  Raises
+    exceptions in the same cases as `rescore_problem_module_state`.
+    """
+    return BulkProblemRescorer(module_descriptor, xmodule_instance_args).rescore(student_modules)
+
+
+def delegate_rescore_shards(xmodule_instance_args, entry_id, modules_to_update, action_name):
+    """
+    Split the rescoring of the StudentModules in `modules_to_update` into
+    subtasks (shards) that each rescore at most
+    `settings.MODULE_STATE_UPDATE_STUDENTS_PER_TASK` of them, and queue them.
+
+    Progress is accumulated across shards in the InstructorTask by the
+    subtask machinery.
+    """
+    # Imported here to avoid a circular import: tasks imports this module
+    from instructor_task.tasks import rescore_problem_shard
+
+    entry = InstructorTask.objects.get(pk=entry_id)
+
+    # As with bulk email, if shards have already been queued for this entry
+    # (the task was requeued), don't queue them again.
+    if len(entry.subtasks) > 0 and len(entry.task_output) > 0:
+        TASK_LOG.warning(u"Task %s has already been sharded for course %s!", entry.task_id, entry.course_id)
+        return json.loads(entry.task_output)
+
+    def _create_rescore_subtask(module_list, initial_subtask_status):
+        """Creates a subtask rescoring the StudentModules in `module_list`."""
+        return rescore_problem_shard.subtask(
+            (
+                entry_id,
+                xmodule_instance_args,
+                [module['pk'] for module in module_list],
+                initial_subtask_status.to_dict(),
+            ),
+            task_id=initial_subtask_status.task_id,
+        )
+
+    return queue_subtasks_for_query(
+        entry,
+        action_name,
+        _create_rescore_subtask,
+        modules_to_update.order_by('id'),
+        [],
+        settings.MODULE_STATE_UPDATE_STUDENTS_PER_TASK,
+    )
+
+
+def perform_rescore_shard(xmodule_instance_args, entry_id, module_ids, subtask_status_dict):
+    """
+    Rescore the StudentModules with ids in `module_ids` to the problem of
+    InstructorTask `entry_id`, in batches, as a subtask of it.
+    """
+    subtask_status = SubtaskStatus.from_dict(subtask_status_dict)
+    current_task_id = subtask_status.task_id
+    check_subtask_is_valid(entry_id, current_task_id, subtask_status)
+
+    entry = InstructorTask.objects.get(pk=entry_id)
+    usage_key = entry.course_id.make_usage_key_from_deprecated_string(json.loads(entry.task_input)['problem_url'])
+    try:
+        module_descriptor = modulestore().get_item(usage_key)
+        modules_to_update = StudentModule.objects.filter(id__in=module_ids).select_related('student').iterator()
+        for modules_batch in _batches(modules_to_update, settings.MODULE_STATE_UPDATE_BATCH_SIZE):
+            for update_status in rescore_problem_module_states(xmodule_instance_args, module_descriptor, modules_batch):
+                subtask_status.increment(**{update_status: 1})
+    except Exception:
+        TASK_LOG.exception(u"Rescoring shard %s of instructor task %s failed unexpectedly!", current_task_id, entry_id)
+        # The submissions that weren't rescored count as failed.
+        not_attempted = len(module_ids) - subtask_status.attempted - subtask_status.skipped
+        subtask_status.increment(failed=not_attempted, state=FAILURE)
+        update_subtask_status(entry_id, current_task_id, subtask_status)
+        raise
+
+    subtask_status.increment(state=SUCCESS)
+    update_subtask_status(entry_id, current_task_id, subtask_status)
+    return subtask_status.to_dict()
+
+
 @transaction.autocommit
 def reset_attempts_module_state(xmodule_instance_args, _module_descriptor, student_module):
     """
@@ -469,14 +874,59 @@ def delete_problem_module_state(xmodule_instance_args, _module_descriptor, stude
     return UPDATE_STATUS_SUCCEEDED
 
 
-def push_grades_to_s3(_xmodule_instance_args, _entry_id, course_id, _task_input, action_name):
+def _grade_report_header(gradeset):
+    """Return the section labels of `gradeset`, which head the grade report columns."""
+    # Encode the header row in utf-8 encoding in case there are unicode characters
+    return [section['label'].encode('utf-8') for section in gradeset[u'section_breakdown']]
+
+
+def _grade_report_row(student, gradeset, header):
+    """Return the grade report row of `student`, whose grades are `gradeset`."""
+    percents = {
+        section['label']: section.get('percent', 0.0)
+        for section in gradeset[u'section_breakdown']
+        if 'label' in section
+    }
+
+    # Not everybody has the same gradable items. If the item is not
+    # found in the user's gradeset, just assume it's a 0. The aggregated
+    # grades for their sections and overall course will be calculated
+    # without regard for the item they didn't have access to, so it's
+    # possible for a student to have a 0.0 show up in their row but
+    # still have 100% for the course.
+    row_percents = [percents.get(label, 0.0) for label in header]
+    return [student.id, student.email, student.username, gradeset['percent']] + row_percents
+
+
+def _grade_report_filenames(course_id, start_time):
+    """Return the names of the grade report and of its error report, for a report started at `start_time`."""
+    # Generate parts of the file name
+    timestamp_str = start_time.strftime("%Y-%m-%d-%H%M")
+    course_id_prefix = urllib.quote(course_id.to_deprecated_string().replace("/", "_"))
+
+    report_filename = u"{}_grade_report_{}.csv".format(course_id_prefix, timestamp_str)
+    err_filename = u"{}_grade_report_{}_err.csv".format(course_id_prefix, timestamp_str)
+    return report_filename, err_filename
+
+
+def _grade_report_shard_filename(filename, shard_index):
+    """Return the name of the partial file holding shard `shard_index` of the report `filename`."""
+    return u"{}.{:05d}{}".format(filename, shard_index, ReportStore.PARTIAL_SUFFIX)
+
+
+def push_grades_to_s3(_xmodule_instance_args, entry_id, course_id, _task_input, action_name):
     """
     For a given `course_id`, generate a grades CSV file for all students that
     are enrolled, and store using a `ReportStore`. Once created, the files can
     be accessed by instantiating another `ReportStore` (via
-    `ReportStore.from_config()`) and calling `link_for()` on it. Writes are
-    buffered, so we'll never write part of a CSV file to S3 -- i.e. any files
-    that are visible in ReportStore will be complete ones.
+    `ReportStore.from_config()`) and calling `link_for()` on it. Rows are
+    streamed to the store as students are graded, but files only become
+    visible once complete -- i.e. any files that are visible in ReportStore
+    will be complete ones.
+
+    Courses with more than `settings.GRADES_DOWNLOAD_STUDENTS_PER_TASK`
+    enrolled students are graded in parallel by subtasks instead; see
+    `delegate_grade_report_shards`.
 
     As we start to add more CSV downloads, it will probably be worthwhile to
     make a more general CSVDoc class instead of building out the rows like we
@@ -487,6 +937,9 @@ def push_grades_to_s3(_xmodule_instance_args, _entry_id, course_id, _task_input,
 
     enrolled_students = CourseEnrollment.users_enrolled_in(course_id)
     num_total = enrolled_students.count()
+    if num_total > settings.GRADES_DOWNLOAD_STUDENTS_PER_TASK:
+        return delegate_grade_report_shards(entry_id, course_id, enrolled_students, action_name, start_time)
+
     num_attempted = 0
     num_succeeded = 0
     num_failed = 0
@@ -508,66 +961,233 @@ def push_grades_to_s3(_xmodule_instance_args, _entry_id, course_id, _task_input,
 
         return progress
 
-    # Loop over all our students and build our CSV lists in memory
+    report_filename, err_filename = _grade_report_filenames(course_id, start_time)
+    report_store = ReportStore.from_config()
+
+    # Loop over all our students, streaming their rows into the report as we
+    # go. Only the error rows, which are few, are kept in memory.
     header = None
-    rows = []
     err_rows = [["id", "username", "error_msg"]]
-    for student, gradeset, err_msg in iterate_grades_for(course_id, enrolled_students):
-        # Periodically update task status (this is a cache write)
-        if num_attempted % status_interval == 0:
-            update_task_progress()
-        num_attempted += 1
-
-        if gradeset:
-            # We were able to successfully grade this student for this course.
-            num_succeeded += 1
-            if not header:
-                # Encode the header row in utf-8 encoding in case there are unicode characters
-                header = [section['label'].encode('utf-8') for section in gradeset[u'section_breakdown']]
-                rows.append(["id", "email", "username", "grade"] + header)
-
-            percents = {
-                section['label']: section.get('percent', 0.0)
-                for section in gradeset[u'section_breakdown']
-                if 'label' in section
-            }
-
-            # Not everybody has the same gradable items. If the item is not
-            # found in the user's gradeset, just assume it's a 0. The aggregated
-            # grades for their sections and overall course will be calculated
-            # without regard for the item they didn't have access to, so it's
-            # possible for a student to have a 0.0 show up in their row but
-            # still have 100% for the course.
-            row_percents = [percents.get(label, 0.0) for label in header]
-            rows.append([student.id, student.email, student.username, gradeset['percent']] + row_percents)
-        else:
-            # An empty gradeset means we failed to grade a student.
-            num_failed += 1
-            err_rows.append([student.id, student.username, err_msg])
+    with report_store.rows_writer(course_id, report_filename) as report_writer:
+        for student, gradeset, err_msg in iterate_grades_for(course_id, enrolled_students):
+            # Periodically update task status (this is a cache write)
+            if num_attempted % status_interval == 0:
+                update_task_progress()
+            num_attempted += 1
+
+            if gradeset:
+                # We were able to successfully grade this student for this course.
+                num_succeeded += 1
+                if not header:
+                    header = _grade_report_header(gradeset)
+                    report_writer.writerow(["id", "email", "username", "grade"] + header)
+                report_writer.writerow(_grade_report_row(student, gradeset, header))
+            else:
+                # An empty gradeset means we failed to grade a student.
+                num_failed += 1
+                err_rows.append([student.id, student.username, err_msg])
 
-    # By this point, we've got the rows we're going to stuff into our CSV files.
-    curr_step = "Uploading CSVs"
-    update_task_progress()
+        # The report becomes visible once its last rows are uploaded, on
+        # leaving this block.
+        curr_step = "Uploading CSVs"
+        update_task_progress()
 
-    # Generate parts of the file name
-    timestamp_str = start_time.strftime("%Y-%m-%d-%H%M")
-    course_id_prefix = urllib.quote(course_id.to_deprecated_string().replace("/", "_"))
+    # If there are any error rows (don't count the header), write them out as well
+    if len(err_rows) > 1:
+        report_store.store_rows(course_id, err_filename, err_rows)
 
-    # Perform the actual upload
-    report_store = ReportStore.from_config()
-    report_store.store_rows(
-        course_id,
-        u"{}_grade_report_{}.csv".format(course_id_prefix, timestamp_str),
-        rows
+    # One last update before we close out...
+    return update_task_progress()
+
+
+def delegate_grade_report_shards(entry_id, course_id, enrolled_students, action_name, start_time):
+    """
+    Split the grade report of `course_id` into subtasks (shards) that each
+    grade a range of `enrolled_students` of at most
+    `settings.GRADES_DOWNLOAD_STUDENTS_PER_TASK`, and queue them.
+
+    Each shard stores its rows as a partial file in the `ReportStore`, and the
+    last shard to complete merges them into the grade report (see
+    `merge_grade_report_shards`). Progress is accumulated across shards in the
+    InstructorTask by the subtask machinery.
+    """
+    # Imported here to avoid a circular import: tasks imports this module
+    from instructor_task.tasks import calculate_grades_csv_shard
+
+    entry = InstructorTask.objects.get(pk=entry_id)
+
+    # As with bulk email, if shards have already been queued for this entry
+    # (the task was requeued), don't queue them again.
+    if len(entry.subtasks) > 0 and len(entry.task_output) > 0:
+        TASK_LOG.warning(u"Task %s has already been sharded for course %s!", entry.task_id, course_id)
+        return json.loads(entry.task_output)
+
+    report_filename, err_filename = _grade_report_filenames(course_id, start_time)
+    shard_indexes = count()
+
+    def _create_grade_report_subtask(student_list, initial_subtask_status):
+        """Creates a subtask grading the students in `student_list`."""
+        return calculate_grades_csv_shard.subtask(
+            (
+                entry_id,
+                next(shard_indexes),
+                [student['pk'] for student in student_list],
+                report_filename,
+                err_filename,
+                initial_subtask_status.to_dict(),
+            ),
+            task_id=initial_subtask_status.task_id,
+            routing_key=settings.GRADES_DOWNLOAD_ROUTING_KEY,
+        )
+
+    return queue_subtasks_for_query(
+        entry,
+        action_name,
+        _create_grade_report_subtask,
+        enrolled_students.order_by('id'),
+        [],
+        settings.GRADES_DOWNLOAD_STUDENTS_PER_TASK,
     )
 
+
+def generate_grade_report_shard(entry_id, shard_index, student_ids, report_filename, err_filename,
+                                subtask_status_dict):
+    """
+    Grade the students with ids in `student_ids`, and store their rows of the
+    grade report `report_filename` (and of its error report `err_filename`)
+    as partial files numbered `shard_index` in the `ReportStore`.
+
+    Once every shard of the report has completed, the shard completing last
+    merges the partial files into the final report (see
+    `_complete_grade_report_shard`).
+    """
+    subtask_status = SubtaskStatus.from_dict(subtask_status_dict)
+    current_task_id = subtask_status.task_id
+    check_subtask_is_valid(entry_id, current_task_id, subtask_status)
+
+    course_id = InstructorTask.objects.get(pk=entry_id).course_id
+    try:
+        header = None
+        err_rows = []
+        report_store = ReportStore.from_config()
+        shard_filename = _grade_report_shard_filename(report_filename, shard_index)
+        with report_store.rows_writer(course_id, shard_filename) as report_writer:
+            students = User.objects.filter(id__in=student_ids).order_by('id')
+            for student, gradeset, err_msg in iterate_grades_for(course_id, students):
+                if gradeset:
+                    if not header:
+                        header = _grade_report_header(gradeset)
+                        report_writer.writerow(["id", "email", "username", "grade"] + header)
+                    report_writer.writerow(_grade_report_row(student, gradeset, header))
+                    subtask_status.increment(succeeded=1)
+                else:
+                    err_rows.append([student.id, student.username, err_msg])
+                    subtask_status.increment(failed=1)
+
+        report_store.store_rows(course_id, _grade_report_shard_filename(err_filename, shard_index), err_rows)
+    except Exception:
+        TASK_LOG.exception(u"Grade report shard %s of instructor task %s failed unexpectedly!", shard_index, entry_id)
+        # We don't know how far grading got, so count the whole shard as failed.
+        subtask_status = SubtaskStatus.create(current_task_id, failed=len(student_ids), state=FAILURE)
+        _complete_grade_report_shard(entry_id, subtask_status, report_filename, err_filename)
+        raise
+
+    subtask_status.increment(state=SUCCESS)
+    _complete_grade_report_shard(entry_id, subtask_status, report_filename, err_filename)
+    return subtask_status.to_dict()
+
+
+def _complete_grade_report_shard(entry_id, subtask_status, report_filename, err_filename):
+    """
+    Record the final `subtask_status` of a grade report shard of InstructorTask
+    `entry_id`, and merge the report if it is the last shard to complete.
+
+    The InstructorTask is kept in PROGRESS until the merge marks it as
+    completed. If the status of the shard can't be recorded, the count of
+    running shards never drops to zero, so the shard merges the report when
+    every other shard has completed.
+    """
+    current_task_id = subtask_status.task_id
+    try:
+        num_remaining = update_subtask_status(entry_id, current_task_id, subtask_status, complete_parent=False)
+    except DatabaseError:
+        subtask_dict = json.loads(InstructorTask.objects.get(pk=entry_id).subtasks)
+        num_remaining = subtask_dict['total'] - subtask_dict['succeeded'] - subtask_dict['failed'] - 1
+        TASK_LOG.warning(
+            u"Could not record the status of grade report shard %s of instructor task %s, %d shards remain",
+            current_task_id, entry_id, num_remaining
+        )
+    if num_remaining <= 0:
+        merge_grade_report_shards(entry_id, report_filename, err_filename)
+
+
+def merge_grade_report_shards(entry_id, report_filename, err_filename):
+    """
+    Stitch the partial files written by the shards of InstructorTask
+    `entry_id` into the grade report `report_filename` and its error report
+    `err_filename`, then delete the partial files.
+
+    Shards that failed left no partial files; their students are missing from
+    the report and counted as failed in the task progress.
+
+    The InstructorTask is marked SUCCESS once the report is stored, or
+    FAILURE if it can't be merged.
+    """
+    try:
+        _merge_grade_report_shards(entry_id, report_filename, err_filename)
+    except Exception as exc:
+        TASK_LOG.exception(u"Merging the grade report of instructor task %s failed unexpectedly!", entry_id)
+        entry = InstructorTask.objects.get(pk=entry_id)
+        entry.task_state = FAILURE
+        entry.task_output = InstructorTask.create_output_for_failure(exc, traceback.format_exc())
+        entry.save_now()
+        raise
+
+    entry = InstructorTask.objects.get(pk=entry_id)
+    entry.task_state = SUCCESS
+    entry.save_now()
+
+
+def _merge_grade_report_shards(entry_id, report_filename, err_filename):
+    """
+    Unwrapped version of `merge_grade_report_shards`, which merges the report
+    without updating the state of the InstructorTask.
+    """
+    entry = InstructorTask.objects.get(pk=entry_id)
+    course_id = entry.course_id
+    num_shards = json.loads(entry.subtasks)['total']
+
+    report_store = ReportStore.from_config()
+    merged_filenames = []
+
+    def _read_shard_rows(filename, shard_index):
+        """Return the rows of shard `shard_index` of `filename`, or None if that shard is missing."""
+        shard_filename = _grade_report_shard_filename(filename, shard_index)
+        try:
+            shard_rows = report_store.read_rows(course_id, shard_filename)
+        except Exception:  # pylint: disable=broad-except
+            TASK_LOG.warning(u"Grade report shard %s of instructor task %s is missing", shard_filename, entry_id)
+            return None
+        merged_filenames.append(shard_filename)
+        return shard_rows
+
+    # Only one shard is held in memory at a time: its rows are streamed into
+    # the report before the next shard is read.
+    header_written = False
+    err_rows = [["id", "username", "error_msg"]]
+    with report_store.rows_writer(course_id, report_filename) as report_writer:
+        for shard_index in xrange(num_shards):
+            shard_rows = _read_shard_rows(report_filename, shard_index)
+            if shard_rows:
+                # Keep the header row of the first shard only
+                report_writer.writerows(shard_rows[1:] if header_written else shard_rows)
+                header_written = True
+            err_rows.extend(_read_shard_rows(err_filename, shard_index) or [])
+
     # If there are any error rows (don't count the header), write them out as well
     if len(err_rows) > 1:
-        report_store.store_rows(
-            course_id,
-            u"{}_grade_report_{}_err.csv".format(course_id_prefix, timestamp_str),
-            err_rows
-        )
+        report_store.store_rows(course_id, err_filename, err_rows)
 
-    # One last update before we close out...
-    return update_task_progress()
+    # Only delete the partial files once the report is safely stored
+    for shard_filename in merged_filenames:
+        report_store.delete(course_id, shard_filename)
@@ -7,24 +7,28 @@ paths actually work.
 """
 import logging
 import json
+from datetime import timedelta
 from mock import patch
 import textwrap
 
 from celery.states import SUCCESS, FAILURE
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 
 from capa.tests.response_xml_factory import (CodeResponseXMLFactory,
                                              CustomResponseXMLFactory)
 from xmodule.modulestore.tests.factories import ItemFactory
 
 from courseware.model_data import StudentModule
+from courseware.models import StudentModuleHistory
 
 from instructor_task.api import (submit_rescore_problem_for_all_students,
                                  submit_rescore_problem_for_student,
                                  submit_reset_problem_attempts_for_all_students,
                                  submit_delete_problem_state_for_all_students)
 from instructor_task.models import InstructorTask
+from instructor_task.tasks_helper import rescore_problem_module_state, save_rescored_modules
 from instructor_task.tests.test_base import (InstructorTaskModuleTestCase, TEST_COURSE_ORG, TEST_COURSE_NUMBER,
                                              OPTION_1, OPTION_2)
 from capa.responsetypes import StudentInputError
@@ -193,6 +197,98 @@ class TestRescoringTask(TestIntegrationTask):
         self.check_state('u3', descriptor, 1, 2, 1)
         self.check_state('u4', descriptor, 2, 2, 1)
 
+    def _submit_and_redefine_option_problem(self, problem_url_name):
+        """
+        Store answers of each student to an option problem, then change its
+        definition so the correct answer is Option 2.  Returns its descriptor.
+        """
+        self.define_option_problem(problem_url_name)
+        for username, responses in [('u1', [OPTION_1, OPTION_1]), ('u2', [OPTION_1, OPTION_2]),
+                                    ('u3', [OPTION_2, OPTION_1]), ('u4', [OPTION_2, OPTION_2])]:
+            self.render_problem(username, problem_url_name)
+            self.submit_student_answer(username, problem_url_name, responses)
+        self.redefine_option_problem(problem_url_name)
+        return self.module_store.get_item(InstructorTaskModuleTestCase.problem_location(problem_url_name))
+
+    def test_bulk_rescoring(self):
+        """Rescoring all students doesn't instantiate their xmodules, but saves the same state"""
+        problem_url_name = 'H1P1'
+        descriptor = self._submit_and_redefine_option_problem(problem_url_name)
+        history_counts = {
+            username: StudentModuleHistory.objects.filter(
+                student_module=self.get_student_module(username, descriptor)
+            ).count()
+            for username in ['u1', 'u2', 'u3', 'u4']
+        }
+
+        with patch('instructor_task.tasks_helper.rescore_problem_module_state') as mock_rescore_module:
+            instructor_task = self.submit_rescore_all_student_answers('instructor', problem_url_name)
+        self.assertFalse(mock_rescore_module.called)
+
+        status = json.loads(InstructorTask.objects.get(id=instructor_task.id).task_output)
+        self.assertEqual(status['succeeded'], 4)
+        self.check_state('u1', descriptor, 0, 2, 1)
+        self.check_state('u2', descriptor, 1, 2, 1)
+        self.check_state('u3', descriptor, 1, 2, 1)
+        self.check_state('u4', descriptor, 2, 2, 1)
+
+        # Each rescore is recorded in the history, once
+        for username, count in history_counts.items():
+            module = self.get_student_module(username, descriptor)
+            history = StudentModuleHistory.objects.filter(student_module=module)
+            self.assertEqual(history.count(), count + 1)
+            latest = history.latest()
+            self.assertEqual(latest.state, module.state)
+            self.assertEqual(latest.grade, module.grade)
+
+    def test_bulk_rescoring_concurrent_submission(self):
+        """A submission changed while its batch is rescored is rescored again instead of overwritten"""
+        problem_url_name = 'H1P1'
+        descriptor = self._submit_and_redefine_option_problem(problem_url_name)
+        module = self.get_student_module('u1', descriptor)
+
+        def submit_concurrently(student_modules):
+            """Changes the state of u1 before the rescored states are saved."""
+            state = json.loads(module.state)
+            state['attempts'] = 2
+            StudentModule.objects.filter(pk=module.pk).update(
+                state=json.dumps(state), modified=module.modified + timedelta(seconds=1)
+            )
+            return save_rescored_modules(student_modules)
+
+        with patch('instructor_task.tasks_helper.save_rescored_modules', side_effect=submit_concurrently):
+            with patch(
+                'instructor_task.tasks_helper.rescore_problem_module_state', wraps=rescore_problem_module_state
+            ) as mock_rescore_module:
+                instructor_task = self.submit_rescore_all_student_answers('instructor', problem_url_name)
+        self.assertEqual(mock_rescore_module.call_count, 1)
+        self.assertEqual(mock_rescore_module.call_args[0][2].pk, module.pk)
+
+        status = json.loads(InstructorTask.objects.get(id=instructor_task.id).task_output)
+        self.assertEqual(status['succeeded'], 4)
+        self.check_state('u1', descriptor, 0, 2, 2)
+        self.check_state('u2', descriptor, 1, 2, 1)
+
+    def test_sharded_rescoring(self):
+        """Rescoring many students is split across subtasks"""
+        problem_url_name = 'H1P1'
+        descriptor = self._submit_and_redefine_option_problem(problem_url_name)
+
+        with override_settings(MODULE_STATE_UPDATE_STUDENTS_PER_TASK=3):
+            instructor_task = self.submit_rescore_all_student_answers('instructor', problem_url_name)
+
+        instructor_task = InstructorTask.objects.get(id=instructor_task.id)
+        self.assertEqual(instructor_task.task_state, SUCCESS)
+        self.assertEqual(json.loads(instructor_task.subtasks)['total'], 2)
+        status = json.loads(instructor_task.task_output)
+        self.assertEqual(status['attempted'], 4)
+        self.assertEqual(status['succeeded'], 4)
+        self.assertEqual(status['total'], 4)
+        self.check_state('u1', descriptor, 0, 2, 1)
+        self.check_state('u2', descriptor, 1, 2, 1)
+        self.check_state('u3', descriptor, 1, 2, 1)
+        self.check_state('u4', descriptor, 2, 2, 1)
+
     def test_rescoring_failure(self):
         """Simulate a failure in rescoring a problem"""
         problem_url_name = 'H1P1'
@@ -0,0 +1,95 @@
+"""
+Unit tests for the report stores of instructor_task.
+"""
+import os
+import shutil
+import tempfile
+from gzip import GzipFile
+from cStringIO import StringIO
+from unittest import TestCase
+
+from mock import Mock
+from opaque_keys.edx.locations import SlashSeparatedCourseKey
+
+from instructor_task.models import LocalFSReportStore, MultipartUploadWriter
+
+
+class TestLocalFSReportStore(TestCase):
+    """
+    Test streaming rows into a `LocalFSReportStore`.
+    """
+    def setUp(self):
+        super(TestLocalFSReportStore, self).setUp()
+        root_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root_path)
+        self.report_store = LocalFSReportStore(root_path)
+        self.course_id = SlashSeparatedCourseKey('edX', 'report_store', 'Run')
+
+    def test_store_rows_from_generator(self):
+        """Rows can be stored straight from a generator."""
+        rows = ([str(index), 'student{}'.format(index)] for index in xrange(1000))
+        self.report_store.store_rows(self.course_id, 'report.csv', rows)
+
+        stored_rows = self.report_store.read_rows(self.course_id, 'report.csv')
+        self.assertEqual(len(stored_rows), 1000)
+        self.assertEqual(stored_rows[-1], ['999', 'student999'])
+
+    def test_file_hidden_until_complete(self):
+        """A report isn't listed until all of its rows are written."""
+        with self.report_store.rows_writer(self.course_id, 'report.csv') as writer:
+            writer.writerow(['id', 'username'])
+            self.assertEqual(self.report_store.links_for(self.course_id), [])
+
+        self.assertEqual([filename for filename, __ in self.report_store.links_for(self.course_id)], ['report.csv'])
+
+    def test_failed_write_leaves_no_file(self):
+        """A report whose rows fail to be written leaves no file behind."""
+        with self.assertRaises(ValueError):
+            with self.report_store.rows_writer(self.course_id, 'report.csv') as writer:
+                writer.writerow(['id', 'username'])
+                raise ValueError()
+
+        self.assertEqual(os.listdir(self.report_store.path_to(self.course_id, '')), [])
+
+
+class TestMultipartUploadWriter(TestCase):
+    """
+    Test splitting gzip'd report data into the parts of an S3 multipart upload.
+    """
+    def setUp(self):
+        super(TestMultipartUploadWriter, self).setUp()
+        self.parts = []
+        self.upload = Mock()
+        self.upload.upload_part_from_file.side_effect = lambda fp, part_num: self.parts.append((part_num, fp.read()))
+
+    def test_parts(self):
+        """Data is uploaded in parts of at least PART_SIZE bytes, with whatever is left in the last one."""
+        writer = MultipartUploadWriter(self.upload)
+        writer.PART_SIZE = 10
+        writer.write('a' * 6)
+        self.assertEqual(self.parts, [])
+        writer.write('b' * 6)
+        writer.write('c' * 3)
+        writer.close()
+
+        self.assertEqual(self.parts, [(1, 'a' * 6 + 'b' * 6), (2, 'c' * 3)])
+
+    def test_gzip_stream(self):
+        """A gzip stream written across several parts uploads intact."""
+        writer = MultipartUploadWriter(self.upload)
+        writer.PART_SIZE = 1024
+        gzip_file = GzipFile(fileobj=writer, mode='wb')
+        data = os.urandom(10 * 1024)
+        gzip_file.write(data)
+        gzip_file.close()
+        writer.close()
+
+        self.assertGreater(len(self.parts), 1)
+        uploaded = ''.join(part for __, part in self.parts)
+        self.assertEqual(GzipFile(fileobj=StringIO(uploaded), mode='rb').read(), data)
+
+    def test_empty_upload(self):
+        """An empty upload still has one part, as S3 needs one to complete it."""
+        writer = MultipartUploadWriter(self.upload)
+        writer.close()
+        self.assertEqual(self.parts, [(1, '')])
@@ -0,0 +1,135 @@
+"""
+Unit tests for grade report generation in instructor_task.tasks_helper.
+"""
+import json
+import os
+import shutil
+import tempfile
+from uuid import uuid4
+
+from celery.states import SUCCESS, FAILURE, PROGRESS
+from django.conf import settings
+from django.db import DatabaseError
+from django.test.utils import override_settings
+from mock import patch
+
+from instructor_task.models import InstructorTask, ReportStore
+from instructor_task.subtasks import update_subtask_status
+from instructor_task.tasks_helper import push_grades_to_s3, _merge_grade_report_shards
+from instructor_task.tests.factories import InstructorTaskFactory
+from instructor_task.tests.test_base import InstructorTaskCourseTestCase
+
+
+class TestGradeReport(InstructorTaskCourseTestCase):
+    """
+    Test generating grade reports, in one task or sharded across subtasks.
+    """
+    def setUp(self):
+        super(TestGradeReport, self).setUp()
+        self.initialize_course()
+        self.students = [self.create_student('student{}'.format(index)) for index in range(5)]
+
+        self.report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.report_dir)
+        grades_download = dict(settings.GRADES_DOWNLOAD, STORAGE_TYPE='localfs', ROOT_PATH=self.report_dir)
+        patcher = override_settings(GRADES_DOWNLOAD=grades_download)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def _run_grade_report(self):
+        """
+        Generate the grade report of the course, and return its InstructorTask
+        entry along with the rows of each stored report file.
+        """
+        entry = InstructorTaskFactory.create(
+            course_id=self.course.id,
+            task_type='grade_course',
+            task_key='',
+            task_id=str(uuid4()),
+        )
+        with patch('instructor_task.tasks_helper._get_current_task'):
+            push_grades_to_s3(None, entry.id, self.course.id, {}, 'graded')
+
+        report_store = ReportStore.from_config()
+        reports = {
+            filename: report_store.read_rows(self.course.id, filename)
+            for filename, __ in report_store.links_for(self.course.id)
+        }
+        return InstructorTask.objects.get(pk=entry.id), reports
+
+    def test_unsharded_report(self):
+        """Small courses get a single report from a single task."""
+        _entry, reports = self._run_grade_report()
+        self.assertEqual(len(reports), 1)
+        rows = reports.values()[0]
+        self.assertEqual(rows[0][:4], ["id", "email", "username", "grade"])
+        self.assertItemsEqual([row[2] for row in rows[1:]], [student.username for student in self.students])
+
+    def test_sharded_report_matches_unsharded(self):
+        """Grading in shards stores the same report as grading in one task."""
+        _entry, reports = self._run_grade_report()
+        unsharded_rows = reports.values()[0]
+        os.remove(ReportStore.from_config().path_to(self.course.id, reports.keys()[0]))
+
+        with override_settings(GRADES_DOWNLOAD_STUDENTS_PER_TASK=2):
+            entry, reports = self._run_grade_report()
+
+        # Shards are graded in parallel, but stitched back in a single report
+        self.assertEqual(len(reports), 1)
+        sharded_rows = reports.values()[0]
+        self.assertEqual(sharded_rows[0], unsharded_rows[0])
+        self.assertItemsEqual(sharded_rows[1:], unsharded_rows[1:])
+
+        # No partial files are left behind once the shards are merged
+        course_dir = ReportStore.from_config().path_to(self.course.id, '')
+        self.assertEqual(os.listdir(course_dir), reports.keys())
+
+        # Progress is accumulated across all the shards
+        self.assertEqual(entry.task_state, SUCCESS)
+        self.assertEqual(json.loads(entry.subtasks)['total'], 3)
+        task_output = json.loads(entry.task_output)
+        self.assertEqual(task_output['succeeded'], len(self.students))
+        self.assertEqual(task_output['failed'], 0)
+
+    def test_sharded_report_completes_on_merge(self):
+        """The task stays in progress until the shards are merged into the report."""
+        task_states = []
+
+        def merge(entry_id, *args):
+            """Record the state of the task when the merge starts."""
+            task_states.append(InstructorTask.objects.get(pk=entry_id).task_state)
+            _merge_grade_report_shards(entry_id, *args)
+
+        with override_settings(GRADES_DOWNLOAD_STUDENTS_PER_TASK=2):
+            with patch('instructor_task.tasks_helper._merge_grade_report_shards', side_effect=merge):
+                entry, reports = self._run_grade_report()
+        self.assertEqual(task_states, [PROGRESS])
+        self.assertEqual(entry.task_state, SUCCESS)
+        self.assertEqual(len(reports), 1)
+
+    def test_sharded_report_merge_failure(self):
+        """The task fails if the shards can't be merged into the report."""
+        with override_settings(GRADES_DOWNLOAD_STUDENTS_PER_TASK=2):
+            with patch('instructor_task.tasks_helper._merge_grade_report_shards', side_effect=IOError("disk full")):
+                entry, reports = self._run_grade_report()
+        self.assertEqual(entry.task_state, FAILURE)
+        self.assertEqual(json.loads(entry.task_output)['message'], "disk full")
+        self.assertEqual(reports, {})
+
+    def test_sharded_report_status_update_failure(self):
+        """The last shard merges the report even if its status can't be recorded."""
+        calls = []
+
+        def flaky_update(*args, **kwargs):
+            """Fail to record the status of the last shard."""
+            calls.append(args)
+            if len(calls) == 3:
+                raise DatabaseError("lock wait timeout")
+            return update_subtask_status(*args, **kwargs)
+
+        with override_settings(GRADES_DOWNLOAD_STUDENTS_PER_TASK=2):
+            with patch('instructor_task.tasks_helper.update_subtask_status', side_effect=flaky_update):
+                entry, reports = self._run_grade_report()
+        self.assertEqual(entry.task_state, SUCCESS)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(len(reports.values()[0]), len(self.students) + 1)
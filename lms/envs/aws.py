@@ -162,6 +162,14 @@ if 'loc_cache' not in CACHES:
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'edx_location_mem_cache',
     }
+# Cache of the published blocks of courses. It must be shared by the LMS and Studio, like the cache
+# holding the structure versions of the courses, whose backend it uses unless configured on its own.
+if 'course_structure_cache' not in CACHES:
+    CACHES['course_structure_cache'] = dict(
+        CACHES.get('mongo_metadata_inheritance', CACHES['default']),
+        KEY_PREFIX=ENV_TOKENS.get('COURSE_STRUCTURE_CACHE_KEY_PREFIX', COURSE_STRUCTURE_CACHE_KEY_PREFIX),
+        TIMEOUT=ENV_TOKENS.get('COURSE_STRUCTURE_CACHE_TIMEOUT', COURSE_STRUCTURE_CACHE_TIMEOUT),
+    )
 
 # Email overrides
 DEFAULT_FROM_EMAIL = ENV_TOKENS.get('DEFAULT_FROM_EMAIL', DEFAULT_FROM_EMAIL)
@@ -251,6 +259,8 @@ for name, value in ENV_TOKENS.get("CODE_JAIL", {}).items():
         CODE_JAIL[name] = value
 
 COURSES_WITH_UNSAFE_CODE = ENV_TOKENS.get("COURSES_WITH_UNSAFE_CODE", [])
+SAFE_EXEC_CACHE.update(ENV_TOKENS.get("SAFE_EXEC_CACHE", {}))
+SAFE_EXEC_POOL.update(ENV_TOKENS.get("SAFE_EXEC_POOL", {}))
 
 # Event Tracking
 if "TRACKING_IGNORE_URL_PATTERNS" in ENV_TOKENS:
@@ -381,6 +391,11 @@ VERIFY_STUDENT = AUTH_TOKENS.get("VERIFY_STUDENT", VERIFY_STUDENT)
 GRADES_DOWNLOAD_ROUTING_KEY = HIGH_MEM_QUEUE
 
 GRADES_DOWNLOAD = ENV_TOKENS.get("GRADES_DOWNLOAD", GRADES_DOWNLOAD)
+GRADES_DOWNLOAD_STUDENTS_PER_TASK = ENV_TOKENS.get('GRADES_DOWNLOAD_STUDENTS_PER_TASK', GRADES_DOWNLOAD_STUDENTS_PER_TASK)
+MODULE_STATE_UPDATE_BATCH_SIZE = ENV_TOKENS.get('MODULE_STATE_UPDATE_BATCH_SIZE', MODULE_STATE_UPDATE_BATCH_SIZE)
+MODULE_STATE_UPDATE_STUDENTS_PER_TASK = ENV_TOKENS.get(
+    'MODULE_STATE_UPDATE_STUDENTS_PER_TASK', MODULE_STATE_UPDATE_STUDENTS_PER_TASK
+)
 
 ##### ORA2 ######
 # Prefix for uploads of example-based assessment AI classifiers
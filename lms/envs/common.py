@@ -213,6 +213,11 @@ FEATURES = {
     # grades CSV files to S3 and give links for downloads.
     'ENABLE_S3_GRADE_DOWNLOADS': False,
 
+    # Persist per-subsection scores as students are graded, so that grading
+    # (progress page, grade reports, certificates) does not have to
+    # instantiate every problem in the course each time.
+    'ENABLE_PERSISTENT_GRADES': False,
+
     # whether to use password policy enforcement or not
     'ENFORCE_PASSWORD_POLICY': False,
 
@@ -477,6 +482,11 @@ XBLOCK_SELECT_FUNCTION = prefer_xmodules
 
 MODULESTORE_BRANCH = 'published-only'
 CONTENTSTORE = None
+# The cache of the published blocks of courses, one entry per block, from which the LMS serves its
+# modulestore reads. Deployments which don't configure a 'course_structure_cache' in CACHES get one
+# on the backend of the 'mongo_metadata_inheritance' cache, with these settings (see aws.py).
+COURSE_STRUCTURE_CACHE_KEY_PREFIX = 'course_structure'
+COURSE_STRUCTURE_CACHE_TIMEOUT = 24 * 60 * 60
 DOC_STORE_CONFIG = {
     'host': 'localhost',
     'db': 'xmodule',
@@ -537,6 +547,29 @@ CODE_JAIL = {
 #   ]
 COURSES_WITH_UNSAFE_CODE = []
 
+# Results of sandboxed code are cached, keyed by the code, its random seed and
+# the globals it uses.
+SAFE_EXEC_CACHE = {
+    # The Django cache shared by all the processes.
+    'CACHE_NAME': 'default',
+    # How many results each process also keeps in memory.  0 disables this tier.
+    'LOCAL_SIZE': 1000,
+}
+
+# Sandboxed code can run in a pool of long-lived sandboxed Pythons, which have
+# already imported the modules problems use.  A SIZE of 0 starts a new
+# sandboxed Python for every execution instead.
+SAFE_EXEC_POOL = {
+    # How many sandboxed Pythons each process keeps.
+    'SIZE': 0,
+    # How many executions a sandboxed Python runs before it's replaced.
+    'MAX_EXECUTIONS': 100,
+    # How many seconds an execution may take.
+    'TIMEOUT': 5,
+    # Regexes of slugs (e.g. problem ids) mapped to their own timeouts.
+    'SLUG_TIMEOUTS': {},
+}
+
 ############################### DJANGO BUILT-INS ###############################
 # Change DEBUG/TEMPLATE_DEBUG in your environment settings files, not here
 DEBUG = False
@@ -1362,6 +1395,18 @@ GRADES_DOWNLOAD = {
     'ROOT_PATH': '/tmp/edx-s3/grades',
 }
 
+# Grade reports for courses with more enrolled students than this are split
+# into subtasks grading this many students each, run in parallel.
+GRADES_DOWNLOAD_STUDENTS_PER_TASK = 2000
+
+# Instructor tasks updating the state of a problem (e.g. rescoring) load the
+# field data of this many students at once.
+MODULE_STATE_UPDATE_BATCH_SIZE = 1000
+
+# Rescoring a problem submitted by more students than this is split into
+# subtasks rescoring this many students each, run in parallel.
+MODULE_STATE_UPDATE_STUDENTS_PER_TASK = 10000
+
 ######################## PROGRESS SUCCESS BUTTON ##############################
 # The following fields are available in the URL: {course_id} {student_id}
 PROGRESS_SUCCESS_BUTTON_URL = 'http://<domain>/<path>/{course_id}'
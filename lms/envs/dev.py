@@ -85,6 +85,14 @@ CACHES = {
         'TIMEOUT': 300,
         'KEY_FUNCTION': 'util.memcache.safe_key',
     },
+    # The published blocks of courses, from which the LMS serves its modulestore
+    # reads
+    'course_structure_cache': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/course_structure_cache',
+        'TIMEOUT': 3600,
+        'KEY_FUNCTION': 'util.memcache.safe_key',
+    },
     'loc_cache': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'edx_location_mem_cache',
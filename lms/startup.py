@@ -29,6 +29,9 @@ def run():
     if settings.FEATURES.get('ENABLE_THIRD_PARTY_AUTH', False):
         enable_third_party_auth()
 
+    if settings.SAFE_EXEC_POOL.get('SIZE'):
+        enable_safe_exec_pool()
+
 
 def enable_theme():
     """
@@ -111,3 +114,21 @@ def enable_third_party_auth():
 
     from third_party_auth import settings as auth_settings
     auth_settings.apply_settings(settings.THIRD_PARTY_AUTH, settings)
+
+
+def enable_safe_exec_pool():
+    """
+    Run the code of problems in a pool of long-lived sandboxed Pythons.
+
+    The workers are started by each process on first use, so that forked
+    processes don't share them.
+    """
+    from capa.safe_exec import configure_pool, SafeExecPool
+
+    config = settings.SAFE_EXEC_POOL
+    configure_pool(SafeExecPool(
+        size=config['SIZE'],
+        max_executions=config.get('MAX_EXECUTIONS', 100),
+        timeout=config.get('TIMEOUT', 5),
+        slug_timeouts=config.get('SLUG_TIMEOUTS'),
+    ))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Compare the time FormulaResponse spends evaluating answers with calc, when
+every sample parses the answer again (as calc.evaluator used to), when the
+compiled answer is evaluated one sample at a time, and with
+calc.evaluate_samples, which evaluates all the samples at once.
+
+Each check evaluates the student and the instructor answer of a problem for
+the variable samples of its `samples` attribute, as check_formula does.
+
+    python scripts/calc_benchmark.py --checks 200
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from calc import calc
+
+# (samples, answer) of typical formularesponse problems
+PROBLEMS = [
+    ('x@-5:5#11', '2*x^2 + 3*x - 1'),
+    ('R_1,R_2,V@1,1,1:10,10,10#20', 'V*R_2/(R_1+R_2)'),
+    ('R_1,R_2@1,1:10,10#20', 'R_1||R_2'),
+    ('m,g,h,v@0.1,9,1,1:10,10,100,50#20', 'm*g*h + 1/2*m*v^2'),
+    ('t,w@0,1:10,10#20', 'sin(w*t) + cos(w*t)^2'),
+    ('k,T,E@1,200,0.1:2,400,1#20', 'exp(-E/(k*T))/sqrt(T)'),
+]
+
+
+def randomize_variables(samples):
+    """
+    Return the list of variable dictionaries a formularesponse `samples`
+    attribute stands for, like FormulaResponse.randomize_variables.
+    """
+    variables = samples.split('@')[0].split(',')
+    numsamples = int(samples.split('@')[1].split('#')[1])
+    sranges = zip(*map(lambda x: map(float, x.split(",")),
+                       samples.split('@')[1].split('#')[0].split(':')))
+    ranges = dict(zip(variables, sranges))
+    return [
+        dict((str(var), random.uniform(*ranges[var])) for var in ranges)
+        for __ in range(numsamples)
+    ]
+
+
+def parse_and_evaluate(variables, math_expr):
+    """
+    Parse `math_expr` and evaluate it by reducing its tree, as calc.evaluator
+    did for every call before expressions were compiled.
+    """
+    math_interpreter = calc.ParseAugmenter(math_expr)
+    math_interpreter.parse_algebra()
+    all_variables, all_functions = calc.add_defaults(variables, {}, False)
+    math_interpreter.check_variables(all_variables, all_functions)
+    evaluate_actions = {
+        'number': calc.eval_number,
+        'variable': lambda x: all_variables[x[0].lower()],
+        'function': lambda x: all_functions[x[0].lower()](x[1]),
+        'atom': calc.eval_atom,
+        'power': calc.eval_power,
+        'parallel': calc.eval_parallel,
+        'product': calc.eval_product,
+        'sum': calc.eval_sum
+    }
+    return math_interpreter.reduce_tree(evaluate_actions)
+
+
+def parse_per_sample(samples, math_expr):
+    """
+    Evaluate the answer for each sample, parsing it every time.
+    """
+    return [parse_and_evaluate(variables, math_expr) for variables in samples]
+
+
+def compiled_per_sample(samples, math_expr):
+    """
+    Evaluate the compiled answer for each sample.
+    """
+    return [calc.evaluator(variables, {}, math_expr) for variables in samples]
+
+
+def compiled_samples(samples, math_expr):
+    """
+    Evaluate the compiled answer for all the samples at once.
+    """
+    return calc.evaluate_samples(samples, {}, math_expr)
+
+
+def run(evaluate, checks):
+    """
+    Runs `checks` answer checks, cycling through the problems, evaluating the
+    answers with `evaluate`. Returns the number of checks per second.
+    """
+    random.seed(0)
+    checks_samples = [
+        (randomize_variables(PROBLEMS[check % len(PROBLEMS)][0]), PROBLEMS[check % len(PROBLEMS)][1])
+        for check in range(checks)
+    ]
+
+    start = time.time()
+    for samples, answer in checks_samples:
+        # the student's and the instructor's answer
+        evaluate(samples, answer)
+        evaluate(samples, answer)
+    return checks / (time.time() - start)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation of formularesponse answers")
+    parser.add_argument('--checks', type=int, default=100, help="How many answers to check")
+    args = parser.parse_args(argv)
+
+    for name, evaluate in [
+            ('parse per sample', parse_per_sample),
+            ('compiled, per sample', compiled_per_sample),
+            ('compiled, evaluate_samples', compiled_samples)]:
+        print '{0}: {1:.1f} checks/s'.format(name, run(evaluate, args.checks))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
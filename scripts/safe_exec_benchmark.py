@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Compare the throughput of safe_exec with a new Python per execution, and with
+a pool of long-lived workers.
+
+Without --sandboxed, the workers are unsandboxed Pythons, as with `unsafely`.
+A new Python per execution is a pool whose workers run a single execution.
+
+    python scripts/safe_exec_benchmark.py --executions 200 --threads 4
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from capa.safe_exec import safe_exec, configure_pool, SafeExecPool
+
+# A typical randomized problem script
+CODE = """\
+x = random.randint(1, 100)
+y = numpy.sqrt(x) + math.sin(x)
+answer = calc.evaluator({'x': x}, {}, '2*x^2 + sin(x)')
+"""
+
+
+def run(pool, executions, threads):
+    """
+    Runs the code `executions` times from `threads` threads, returning the
+    number of executions per second.
+    """
+    configure_pool(pool)
+    pool.warm()
+    remaining = [executions]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                seed = remaining[0]
+            safe_exec(CODE, {}, random_seed=seed)
+
+    start = time.time()
+    workers = [threading.Thread(target=work) for __ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    pool.stop()
+    configure_pool(None)
+    return executions / elapsed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the safe_exec worker pool")
+    parser.add_argument('--executions', type=int, default=100, help="How many times to run the code")
+    parser.add_argument('--threads', type=int, default=4, help="How many executions to run at once")
+    parser.add_argument('--max-executions', type=int, default=100,
+                        help="How many executions a pool worker runs before it's replaced")
+    parser.add_argument('--sandboxed', action='store_true',
+                        help="Run the code in codejail's sandbox, which must be configured")
+    args = parser.parse_args(argv)
+
+    for name, max_executions in [('new Python per execution', 1), ('worker pool', args.max_executions)]:
+        pool = SafeExecPool(size=args.threads, max_executions=max_executions, sandboxed=args.sandboxed)
+        print '{0}: {1:.1f} executions/s'.format(name, run(pool, args.executions, args.threads))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])